@@ -0,0 +1,230 @@
+# Copyright (c) 2009 Entertainer Developers - See COPYING - GPLv2
+'''Album art service that searches album art in a pool of worker threads.'''
+
+import os
+import socket
+import threading
+import time
+import urllib
+import urlparse
+
+from pysqlite2 import dbapi2 as sqlite
+
+from entertainerlib.configuration import Configuration
+from entertainerlib.download import AlbumArtDownloader
+from entertainerlib.logger import Logger
+from entertainerlib.worker_pool import WorkerPool
+
+
+def get_album_art_file(artist, album):
+    '''Return the path where the album art of an album is stored.'''
+    # base64 encode artist and album so there can be a '/' in the artist or
+    # album
+    artist_album = (artist + " - " + album).encode("base64")
+    return os.path.join(Configuration().ALBUM_ART_DIR, artist_album + ".jpg")
+
+
+class AlbumArtJob(object):
+    '''A requested album art search. Works like a future for the result.'''
+
+    def __init__(self, artist, album):
+        self.artist = artist
+        self.album = album
+        self.art_file = get_album_art_file(artist, album)
+        self.found = False
+        self._callbacks = []
+        self._done = threading.Event()
+
+    def ready(self):
+        '''Return True if the search has finished.'''
+        return self._done.isSet()
+
+    def wait(self, timeout=None):
+        '''Wait for the search and return True if album art was found.'''
+        self._done.wait(timeout)
+        return self.found
+
+    def add_callback(self, callback):
+        '''Call the callback with this job when the search has finished.'''
+        if callback is not None:
+            self._callbacks.append(callback)
+
+    def finish(self, found):
+        '''Mark the job as finished and call the callbacks.'''
+        self.found = found
+        self._done.set()
+        for callback in self._callbacks:
+            callback(self)
+
+
+class HostRateLimiter(object):
+    '''Spaces the requests to each host by at least interval seconds, so
+    that a big import doesn't flood a web service.'''
+
+    def __init__(self, interval):
+        self.interval = interval
+        # Host -> earliest time of its next request
+        self._next_request = {}
+        self._lock = threading.Lock()
+
+    def wait(self, url):
+        '''Wait until a request to the host of the URL is allowed.'''
+        host = urlparse.urlsplit(url)[1]
+        self._lock.acquire()
+        try:
+            now = time.time()
+            request_time = max(now, self._next_request.get(host, 0))
+            self._next_request[host] = request_time + self.interval
+        finally:
+            self._lock.release()
+        if request_time > now:
+            time.sleep(request_time - now)
+
+    def urlopen(self, url):
+        '''Open the URL when the rate limit of its host allows it.'''
+        self.wait(url)
+        return urllib.urlopen(url)
+
+
+class AlbumArtService(object):
+    '''Searches and downloads album art in a fixed pool of worker threads.
+
+    Every album is searched only once at a time. Requesting an album that is
+    already being searched returns the same job, so indexing the tracks of
+    an album starts one search instead of one per track. Requests to each
+    host are rate limited. Albums whose art wasn't found aren't searched
+    again before the retry interval has passed, also after a restart,
+    because the misses are stored in the media database.
+
+    AlbumArtService shares its state like Configuration, so all users get
+    the same pool.'''
+
+    _shared_state = {}
+
+    def __init__(self, workers=None, host_interval=None, retry_interval=None):
+        self.__dict__ = self._shared_state
+
+        if not self._shared_state:
+            self.logger = Logger().getLogger('AlbumArtService')
+            config = Configuration()
+            if workers is None:
+                workers = config.album_art_workers
+            if host_interval is None:
+                host_interval = config.album_art_host_interval
+            self.limiter = HostRateLimiter(host_interval)
+            if retry_interval is None:
+                retry_interval = config.album_art_retry_interval * 60 * 60
+            self.retry_interval = retry_interval
+            self.media_db = config.MEDIA_DB
+
+            # (artist, album) -> AlbumArtJob that is queued or running
+            self._jobs = {}
+            self._lock = threading.Lock()
+            self._pool = WorkerPool("AlbumArt Downloader", workers,
+                self._handle, self.logger)
+
+            cursor = self.media_db.get_connection().cursor()
+            cursor.execute("""CREATE TABLE IF NOT EXISTS album_art_miss(
+                              artist TEXT,
+                              album TEXT,
+                              retry_after REAL,
+                              PRIMARY KEY(artist, album))""")
+            self.media_db.get_connection().commit()
+
+    def fetch(self, artist, album, callback=None):
+        '''Search and download the album art of an album unless it exists,
+        is being searched already or wasn't found recently. Returns an
+        AlbumArtJob.
+        @param artist: Artist name
+        @param album: Album title
+        @param callback: Function called with the finished AlbumArtJob'''
+        key = (artist, album)
+        self._lock.acquire()
+        try:
+            job = self._jobs.get(key)
+            if job is not None:
+                job.add_callback(callback)
+                return job
+            job = AlbumArtJob(artist, album)
+            job.add_callback(callback)
+            queued = (not os.path.exists(job.art_file) and
+                not self._is_missing(artist, album))
+            if queued:
+                self._jobs[key] = job
+                self._pool.put(job)
+        finally:
+            self._lock.release()
+
+        if not queued:
+            job.finish(os.path.exists(job.art_file))
+        return job
+
+    def _handle(self, job):
+        '''Search the album art of a job and finish it. Called in a worker
+        thread.'''
+        found = False
+        try:
+            try:
+                found = self._search(job)
+                if not found:
+                    self._record_miss(job.artist, job.album)
+            except (IOError, socket.error), e:
+                # Network problems aren't misses, try again next time
+                self.logger.warning("Couldn't search album art of %s - "
+                    "%s: %s" % (job.artist, job.album, e))
+            except Exception, e:
+                # Any other error would happen again, so it is a miss. The
+                # job has to finish anyway, or its waiters wait forever.
+                self.logger.error("Album art search failed for %s - "
+                    "%s: %s" % (job.artist, job.album, e))
+                self._record_miss(job.artist, job.album)
+        finally:
+            self._lock.acquire()
+            try:
+                del self._jobs[(job.artist, job.album)]
+            finally:
+                self._lock.release()
+            job.finish(found)
+
+    def _search(self, job):
+        '''Search and download the album art of a job. Return True if it
+        was found.'''
+        AlbumArtDownloader(job.album, job.artist,
+            os.path.dirname(job.art_file),
+            urlopen=self.limiter.urlopen).search()
+        return os.path.exists(job.art_file)
+
+    def _is_missing(self, artist, album):
+        '''Return True if the album art wasn't found before and shouldn't
+        be searched again yet.'''
+        cursor = self.media_db.get_connection().cursor()
+        cursor.execute("""SELECT retry_after
+                          FROM album_art_miss
+                          WHERE artist=? AND album=?""",
+                          self._get_row_key(artist, album))
+        row = cursor.fetchone()
+        return row is not None and row[0] > time.time()
+
+    def _record_miss(self, artist, album):
+        '''Remember that album art wasn't found.'''
+        connection = self.media_db.get_connection()
+        retry_after = time.time() + self.retry_interval
+        try:
+            connection.cursor().execute("""INSERT OR REPLACE INTO
+                                           album_art_miss(artist, album,
+                                           retry_after)
+                                           VALUES(?,?,?)""",
+                                           self._get_row_key(artist, album) +
+                                           (retry_after,))
+            connection.commit()
+        except sqlite.Error, e:
+            self.logger.error("Couldn't record album art miss: %s" % e)
+
+    def _get_row_key(self, artist, album):
+        '''Return artist and album as they are stored in the database.'''
+        key = []
+        for value in (artist, album):
+            if not isinstance(value, unicode):
+                value = value.decode('utf8', 'replace')
+            key.append(value)
+        return tuple(key)
@@ -3,6 +3,8 @@
 
 import gobject
 
+from entertainerlib.backend.components.mediacache.file_system_observer import (
+    FileSystemObserver)
 from entertainerlib.backend.components.mediacache.media_cache_manager import (
     MediaCacheManager)
 from entertainerlib.backend.core.message_bus import MessageBus
@@ -10,6 +12,7 @@ from entertainerlib.backend.core.message_scheduler import MessageScheduler
 from entertainerlib.backend.core.connection_server import ConnectionServer
 from entertainerlib.backend.core.message_type_priority import (
     MessageType, MessagePriority)
+from entertainerlib.cache_budget import CacheBudget
 from entertainerlib.configuration import Configuration
 from entertainerlib.logger import Logger
 
@@ -29,14 +32,23 @@ class BackendServer:
 
         self.scheduler = None
         self.media_manager = None
+        self.file_system_observer = None
+        self.cache_budget = None
 
         # The order of the initialize method calls is significant! Don't change
         # the order unless you know what you are doing!
         self.initialize_configuration()
         self.initialize_media_cache_manager()
+        self.initialize_file_system_observer()
+        self.initialize_cache_budget()
         self.initialize_connection_server()
         self.initialize_scheduler()
 
+    def stop(self):
+        """Stop indexing, so that buffered cache rows are written"""
+        self.media_manager.stop()
+        self.logger.debug("Backend stopped")
+
     def initialize_configuration(self):
         """Initialize configuration"""
         cfg_dict = {
@@ -58,13 +70,32 @@ class BackendServer:
 
     def initialize_media_cache_manager(self):
         '''Initialize the media cache manager'''
-        self.media_manager = MediaCacheManager()
+        self.media_manager = MediaCacheManager(self.message_bus)
         media_dict = {
             MessageType.CONTENT_CONF_UPDATED : MessagePriority.VERY_LOW,
             MessageType.REBUILD_IMAGE_CACHE : MessagePriority.HIGH,
             MessageType.REBUILD_MUSIC_CACHE : MessagePriority.HIGH,
-            MessageType.REBUILD_VIDEO_CACHE : MessagePriority.HIGH
+            MessageType.REBUILD_VIDEO_CACHE : MessagePriority.HIGH,
+            MessageType.CLEAR_INDEX_FAILURES : MessagePriority.HIGH,
+            MessageType.PRIORITIZE_INDEXING : MessagePriority.HIGH
             }
         self.message_bus.registerMessageHandler(self.media_manager, media_dict)
         self.logger.debug("Media Manager intialized successfully")
 
+
+    def initialize_file_system_observer(self):
+        '''Initialize the file system observer'''
+        self.file_system_observer = FileSystemObserver()
+        observer_dict = {
+            MessageType.CONTENT_CONF_UPDATED : MessagePriority.VERY_LOW,
+            }
+        self.message_bus.registerMessageHandler(self.file_system_observer,
+            observer_dict)
+        self.file_system_observer.start()
+        self.logger.debug("File system observer intialized successfully")
+
+    def initialize_cache_budget(self):
+        '''Initialize the thumbnail and art cache size limits'''
+        self.cache_budget = CacheBudget()
+        self.cache_budget.start()
+        self.logger.debug("Cache budget intialized successfully")
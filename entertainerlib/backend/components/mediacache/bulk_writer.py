@@ -0,0 +1,156 @@
+# Copyright (c) 2009 Entertainer Developers - See COPYING - GPLv2
+'''BulkWriter - Buffers cache rows and writes them in batched transactions.'''
+
+import threading
+import time
+
+from pysqlite2 import dbapi2 as sqlite
+
+from entertainerlib.configuration import Configuration
+from entertainerlib.logger import Logger
+
+
+class BulkWriter(object):
+    """
+    BulkWriter buffers INSERT rows of a cache database and writes them with
+    executemany inside one transaction when batch_size rows have been
+    buffered or the oldest buffered row is older than max_delay milliseconds.
+
+    Rows are only written by the thread that owns the connection, so the
+    indexer calls flushIfDue() after every file to write rows of caches that
+    haven't got new rows for a while, and flushes all writers when it is
+    stopped.
+
+    This replaces a commit (and a fsync) per file with a commit per batch.
+    Rows of a batch are committed atomically, so a crash loses at most the
+    rows buffered since the last flush and never leaves half written files
+    in the cache. Lost files are not in the cache, so the next indexing run
+    finds and adds them again.
+    """
+
+    def __init__(self, db_conn, batch_size=None, max_delay=None):
+        """
+        Create a new BulkWriter. Values that are not given are read from the
+        configuration.
+        @param db_conn: SQLite connection of the cache database
+        @param batch_size: Maximum number of buffered rows
+        @param max_delay: Maximum age of a buffered row in milliseconds
+        """
+        config = Configuration()
+        self.logger = Logger().getLogger(
+            'backend.components.mediacache.BulkWriter')
+        self.db_conn = db_conn
+        if batch_size is None:
+            batch_size = config.bulk_ingest_rows
+        self.batch_size = batch_size
+        if max_delay is None:
+            max_delay = config.bulk_ingest_interval
+        self.max_delay = max_delay
+
+        self._lock = threading.RLock()
+        # Statements in the order they were first buffered
+        self._statements = []
+        # Statement -> list of (row, callback) tuples
+        self._rows = {}
+        self._count = 0
+        self._keys = set()
+        self._oldest = None
+
+    def add(self, statement, row, key=None, callback=None):
+        """
+        Buffer a row. Flushes if the batch is full or too old.
+        @param statement: INSERT statement with ? placeholders
+        @param row: Tuple of values for the statement
+        @param key: Key (usually filename) that isPending() can check
+        @param callback: Function that is called after the row is committed.
+            It isn't called if the row couldn't be written.
+        """
+        self._lock.acquire()
+        try:
+            if statement not in self._rows:
+                self._statements.append(statement)
+                self._rows[statement] = []
+            self._rows[statement].append((row, callback))
+            self._count += 1
+            if key is not None:
+                self._keys.add(key)
+            if self._oldest is None:
+                self._oldest = time.time()
+
+            full = self._count >= self.batch_size
+            old = (time.time() - self._oldest) * 1000 >= self.max_delay
+        finally:
+            self._lock.release()
+
+        if full or old:
+            self.flush()
+
+    def isPending(self, key):
+        """Return True if a row with the given key is buffered."""
+        return key in self._keys
+
+    def isDue(self):
+        """Return True if the oldest buffered row is older than max_delay."""
+        oldest = self._oldest
+        return (oldest is not None and
+            (time.time() - oldest) * 1000 >= self.max_delay)
+
+    def flushIfDue(self):
+        """Write the buffered rows if the oldest of them is too old."""
+        if self.isDue():
+            self.flush()
+
+    def flush(self):
+        """Write all buffered rows in one transaction."""
+        self._lock.acquire()
+        try:
+            if self._count == 0:
+                return
+            statements = self._statements
+            rows = self._rows
+            self._statements = []
+            self._rows = {}
+            self._count = 0
+            self._keys = set()
+            self._oldest = None
+
+            cursor = self.db_conn.cursor()
+            try:
+                for statement in statements:
+                    cursor.executemany(statement,
+                        [row for row, callback in rows[statement]])
+                self.db_conn.commit()
+                callbacks = [callback for statement in statements
+                    for row, callback in rows[statement]
+                    if callback is not None]
+            except sqlite.Error, e:
+                # One bad row shouldn't lose the whole batch
+                self.db_conn.rollback()
+                self.logger.warning("Batch insert failed (%s), retrying "
+                    "rows one by one" % e)
+                callbacks = self._write_rows_one_by_one(statements, rows)
+        finally:
+            self._lock.release()
+
+        for callback in callbacks:
+            callback()
+
+    def _write_rows_one_by_one(self, statements, rows):
+        '''
+        Write rows separately and skip the ones that fail. Return the
+        callbacks of the written rows.
+        '''
+        callbacks = []
+        cursor = self.db_conn.cursor()
+        for statement in statements:
+            for row, callback in rows[statement]:
+                try:
+                    cursor.execute(statement, row)
+                except sqlite.Error, e:
+                    self.logger.error("Couldn't insert row %s: %s" %
+                        (repr(row[0]), e))
+                    continue
+                if callback is not None:
+                    callbacks.append(callback)
+        self.db_conn.commit()
+        return callbacks
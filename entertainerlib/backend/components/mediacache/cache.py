@@ -1,6 +1,19 @@
 # Copyright (c) 2009 Entertainer Developers - See COPYING - GPLv2
 '''Interface for media caches'''
 
+import hashlib
+import os
+import time
+
+from entertainerlib.backend.components.mediacache.bulk_writer import (
+    BulkWriter)
+from entertainerlib.backend.components.mediacache.failure_table import (
+    FailureTable)
+from entertainerlib.backend.components.mediacache.fingerprint_table import (
+    FingerprintTable)
+from entertainerlib.backend.components.mediacache.io_throttle import (
+    IOThrottle)
+
 class Cache:
     """
     Cache interface. Defines interface for cache handling. This
@@ -8,8 +21,28 @@ class Cache:
     ImageCache classes.
     """
 
-    #How many millisecons we should wait between files when adding to cache.
-    SLEEP_TIME_BETWEEN_FILES = 2000
+    # IOThrottle that paces adding files. Created on first use if not set.
+    throttle = None
+
+    # True while new rows are buffered into a BulkWriter
+    bulk_ingest = False
+    bulk_writer = None
+
+    # FailureTable of files that couldn't be indexed. Created on first use.
+    failure_table = None
+
+    # FingerprintTable of the content of cached files. Created on first use.
+    fingerprint_table = None
+
+    # Number of failures recorded by this cache object
+    failure_count = 0
+
+    # True if files in the FailureTable are not added until they may be
+    # retried
+    SKIP_FAILED_FILES = True
+
+    # Lower case file extensions that deriving classes can handle
+    SUPPORTED_FILE_EXTENSIONS = []
 
     def clearCache(self):
         """
@@ -102,3 +135,283 @@ class Cache:
         """
         pass
 
+
+    def acceptsFile(self, filename):
+        """
+        Returns true if the file should be indexed into this cache when it is
+        found by a directory walk. Deriving classes may override this to skip
+        files (for example hidden ones) that are supported but not wanted.
+        """
+        return self.isSupportedFormat(filename)
+
+    def getCachedFiles(self):
+        """
+        Implement this method in deriving classes.
+
+        This method returns a dictionary that maps every filename in the cache
+        to a (size, mtime) tuple that was recorded when the file was indexed.
+        Files that were cached before the sizes were recorded map to None.
+        """
+        return {}
+
+    def setFileStats(self, filename, stats):
+        """
+        Implement this method in deriving classes.
+
+        This method records a (size, mtime) tuple for a file that is already
+        in the cache without indexing the file again.
+        """
+        pass
+
+    def synchronize(self, files, directories, roots=None, unavailable=(),
+        unchanged=()):
+        """
+        Reconcile cache with the filesystem without rebuilding it.
+
+        Compares files found by a directory walk against the cached sizes and
+        modification times and only adds, updates or removes the files that
+        have actually changed since they were indexed. See prepareSynchronize
+        for the parameters.
+        """
+        changed = self.prepareSynchronize(files, directories, roots,
+            unavailable, unchanged)
+        self.beginBulkIngest()
+        try:
+            for filename, cached in changed:
+                self.indexFile(filename, cached)
+        finally:
+            self.endBulkIngest()
+
+    def prepareSynchronize(self, files, directories, roots=None,
+        unavailable=(), unchanged=()):
+        """
+        Remove cached files that weren't found by a directory walk and return
+        the files that have to be indexed as a list of (filename, cached)
+        tuples. cached is True if the file is in the cache and has changed.
+        Files are indexed with indexFile, so that an IndexerThread can decide
+        their order.
+        @param files: Dictionary of filename -> (size, mtime) of found files
+        @param directories: List of directories that were walked
+        @param roots: Only cached files under these folders are compared. If
+            None, every cached file is compared and files that were not found
+            are removed.
+        @param unavailable: Folders that couldn't be walked (for example
+            unmounted drives). Cached files under them are left untouched.
+        @param unchanged: Directories that weren't listed, because they
+            haven't changed since the last walk. Cached files directly in
+            them are left untouched and failed files in them are tried again
+            when their retry time has passed.
+        """
+        # pylint: disable-msg=W0613
+        cached = self.getCachedFiles()
+        if unchanged:
+            unchanged = set(unchanged)
+            files = files.copy()
+            files.update(self._getRetriedFiles(unchanged))
+            for filename in cached.keys():
+                if (os.path.dirname(filename) in unchanged and
+                    filename not in files):
+                    del cached[filename]
+        if roots is not None:
+            prefixes = [os.path.join(root, '') for root in roots]
+            for filename in cached.keys():
+                if not [p for p in prefixes if filename.startswith(p)]:
+                    del cached[filename]
+        if unavailable:
+            prefixes = [os.path.join(folder, '') for folder in unavailable]
+            for filename in cached.keys():
+                if [p for p in prefixes if filename.startswith(p)]:
+                    del cached[filename]
+
+        for filename in cached.keys():
+            if filename not in files:
+                self.removeFile(filename)
+
+        changed = []
+        for filename, stats in files.iteritems():
+            if (self.SKIP_FAILED_FILES and cached.get(filename) != stats
+                and self.getFailureTable().isFailed(filename, stats)):
+                # Skipped, nothing is read from the file
+                continue
+            if filename not in cached:
+                changed.append((filename, False))
+            elif cached[filename] is None:
+                self.setFileStats(filename, stats)
+            elif cached[filename] != stats:
+                changed.append((filename, True))
+        return changed
+
+    def indexFile(self, filename, cached, paced=True):
+        """
+        Add or update a file returned by prepareSynchronize.
+        @param filename: Absolute path of the file
+        @param cached: True if the file is in the cache and has changed
+        @param paced: Wait after the file as the throttle requires
+        """
+        if cached:
+            self.updateFile(filename)
+        else:
+            self.addFile(filename)
+        if paced:
+            self._throttle(filename)
+
+    def _getRetriedFiles(self, directories):
+        """
+        Return filename -> (size, mtime) of the failed files in the given
+        directories that may be tried again.
+        """
+        # pylint: disable-msg=W0612
+        now = time.time()
+        retried = {}
+        for filename, reason, failures, retry_after in (
+            self.getFailureTable().getFailures()):
+            if (retry_after > now or
+                os.path.dirname(filename) not in directories or
+                not self.acceptsFile(filename)):
+                continue
+            try:
+                stats = os.stat(filename)
+            except OSError:
+                continue
+            retried[filename] = (stats.st_size, int(stats.st_mtime))
+        return retried
+
+    def beginBulkIngest(self):
+        """
+        Start bulk ingest mode. New rows are buffered and written in batched
+        transactions instead of committing every file separately.
+        """
+        self.bulk_ingest = True
+
+    def endBulkIngest(self):
+        """End bulk ingest mode and write all buffered rows."""
+        self.bulk_ingest = False
+        self.flushBulkIngest()
+
+    def flushBulkIngest(self):
+        """Write rows that are buffered in bulk ingest mode."""
+        if self.bulk_writer is not None:
+            self.bulk_writer.flush()
+
+    def flushBulkIngestIfDue(self):
+        """Write buffered rows if they have waited longer than allowed."""
+        if self.bulk_writer is not None:
+            self.bulk_writer.flushIfDue()
+
+    def _insert(self, db_conn, statement, row, key=None, callback=None):
+        """
+        Insert a row to the cache database. In bulk ingest mode the row is
+        buffered, otherwise it is committed immediately.
+        @param db_conn: Connection of the cache database
+        @param statement: INSERT statement with ? placeholders
+        @param row: Tuple of values for the statement
+        @param key: Filename or path the row belongs to
+        @param callback: Function to call after the row has been committed
+        """
+        if self.bulk_ingest:
+            if self.bulk_writer is None:
+                self.bulk_writer = BulkWriter(db_conn)
+            self.bulk_writer.add(statement, row, key, callback)
+        else:
+            db_conn.cursor().execute(statement, row)
+            db_conn.commit()
+            if callback is not None:
+                callback()
+
+    def _flushIfPending(self, key):
+        """
+        Write buffered rows if one of them belongs to the given filename or
+        path, so that it can be queried from the database.
+        """
+        if self.bulk_writer is not None and self.bulk_writer.isPending(key):
+            self.bulk_writer.flush()
+
+    def setThrottle(self, throttle):
+        """
+        Set IOThrottle that paces indexing of this cache. The same throttle
+        can be shared by several caches.
+        @param throttle: IOThrottle object
+        """
+        self.throttle = throttle
+
+    def _throttle(self, filename):
+        """Wait after a file has been indexed as the throttle requires."""
+        if self.throttle is None:
+            self.throttle = IOThrottle()
+        try:
+            size = os.path.getsize(filename)
+        except OSError:
+            size = 0
+        self.throttle.wait(size)
+
+    def _getSubtreeRange(self, path):
+        """
+        Return (low, high) bounds of the paths under a directory. A query
+        with "column >= low AND column < high" selects the whole subtree
+        with an index seek on column, and unlike a LIKE pattern the bounds
+        need no quoting or escaping. The directory itself is not included.
+        @param path: Absolute path of the directory
+        """
+        low = os.path.join(path, '')
+        # The separator is replaced by the next character, so the range ends
+        # right after the last path that starts with low.
+        return low, low[:-1] + chr(ord(os.sep) + 1)
+
+    def getFailureTable(self):
+        """Return the FailureTable of files that couldn't be indexed."""
+        if self.failure_table is None:
+            self.failure_table = FailureTable()
+        return self.failure_table
+
+    def getFingerprintTable(self):
+        """Return the FingerprintTable of the content of cached files."""
+        if self.fingerprint_table is None:
+            self.fingerprint_table = FingerprintTable()
+        return self.fingerprint_table
+
+    def _getContentKey(self, filename, stats=None):
+        """
+        Return the content key that names the thumbnails of a file, so that
+        copies of a file share their thumbnails. The hash of the filename is
+        returned if the file can't be read.
+        @param filename: Absolute path of the file
+        @param stats: (size, mtime) of the file. Read from disk if None.
+        """
+        try:
+            return self.getFingerprintTable().getContentKey(filename, stats)
+        except (IOError, OSError), e:
+            self.logger.warning("Couldn't fingerprint %s: %s" % (filename, e))
+            # Like Thumbnailer.hash_filename
+            return hashlib.md5(filename).hexdigest()
+
+    def _isFailed(self, filename):
+        """
+        Return True if the file failed to index before and shouldn't be
+        tried again yet.
+        """
+        return (self.SKIP_FAILED_FILES and
+            self.getFailureTable().isFailed(filename))
+
+    def _recordFailure(self, filename, reason):
+        """
+        Record that a file couldn't be indexed, so that it is skipped until
+        it changes or its retry time has passed.
+        """
+        self.logger.error("Couldn't index %s: %s" % (filename, reason))
+        self.failure_count += 1
+        self.getFailureTable().record(filename, reason)
+
+    def _addMissingColumns(self, db_cursor, table, columns):
+        """
+        Upgrade an existing cache table by adding columns that were introduced
+        after the database was created.
+        @param db_cursor: Cursor of the cache database
+        @param table: Name of the table
+        @param columns: List of (name, type) tuples
+        """
+        db_cursor.execute("PRAGMA table_info(%s)" % table)
+        existing = [row[1] for row in db_cursor.fetchall()]
+        for name, column_type in columns:
+            if name not in existing:
+                db_cursor.execute("ALTER TABLE %s ADD COLUMN %s %s" %
+                    (table, name, column_type))
@@ -0,0 +1,124 @@
+# Copyright (c) 2009 Entertainer Developers - See COPYING - GPLv2
+'''DirectoryTable - Remembers directories that have been walked.'''
+
+import os
+
+from entertainerlib.configuration import Configuration
+
+
+class DirectoryTable:
+    """
+    Persistent table of directories walked by the indexer.
+
+    A directory is stored with its modification time, the number of its
+    entries, the cache types it was walked for and its parent directory.
+    Adding, removing or renaming an entry updates the modification time of
+    a directory, so a directory with an unchanged modification time has the
+    same files and subdirectories as when it was walked. The indexer
+    doesn't list such a directory again, it only checks the subdirectories
+    that are stored here.
+
+    Paths are byte strings like the paths of os.walk. Paths that aren't
+    valid UTF-8 aren't stored, so those directories are always walked.
+
+    The table is in the media database and changes are committed with
+    commit(), so a walk of many directories is one transaction.
+    """
+
+    def __init__(self):
+        """
+        Create a new DirectoryTable. Creates the table in the media database
+        if it doesn't exist.
+        """
+        self.db_conn = Configuration().MEDIA_DB.get_connection()
+        cursor = self.db_conn.cursor()
+        cursor.execute("""CREATE TABLE IF NOT EXISTS directory(
+                          path TEXT PRIMARY KEY,
+                          parent TEXT,
+                          mtime REAL,
+                          entries INTEGER,
+                          cache_types TEXT)""")
+        cursor.execute("""CREATE INDEX IF NOT EXISTS directory_parent
+                          ON directory(parent)""")
+        self.db_conn.commit()
+
+    def getDirectory(self, path):
+        """
+        Return (mtime, entries, cache_types) of a walked directory or None if
+        it hasn't been walked. cache_types is a set of cache type names.
+        mtime is None if the directory has to be walked again.
+        @param path: Absolute path of the directory
+        """
+        key = self._getKey(path)
+        if key is None:
+            return None
+        cursor = self.db_conn.cursor()
+        cursor.execute("""SELECT mtime, entries, cache_types
+                          FROM directory
+                          WHERE path=?""", (key,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return row[0], row[1], set(row[2].split(','))
+
+    def getSubdirectories(self, path):
+        """Return the stored subdirectories of a directory."""
+        key = self._getKey(path)
+        if key is None:
+            return []
+        cursor = self.db_conn.cursor()
+        cursor.execute("""SELECT path
+                          FROM directory
+                          WHERE parent=?""", (key,))
+        return [row[0].encode('utf8') for row in cursor.fetchall()]
+
+    def record(self, path, mtime, entries, cache_types):
+        """
+        Store a walked directory. Not committed.
+        @param path: Absolute path of the directory
+        @param mtime: Modification time of the directory before it was
+            listed. None if it must be walked again next time.
+        @param entries: Number of entries in the directory
+        @param cache_types: Cache types that the directory was walked for
+        """
+        key = self._getKey(path)
+        parent = self._getKey(os.path.dirname(path))
+        if key is None or parent is None:
+            return
+        self.db_conn.cursor().execute("""INSERT OR REPLACE INTO directory(
+                                         path, parent, mtime, entries,
+                                         cache_types)
+                                         VALUES(?,?,?,?,?)""", (key, parent,
+                                         mtime, entries,
+                                         ','.join(sorted(cache_types))))
+
+    def removeDirectory(self, path):
+        """Forget a directory and its subdirectories. Not committed."""
+        key = self._getKey(path)
+        if key is None:
+            return
+        low = os.path.join(key, u'')
+        high = low[:-1] + unichr(ord(os.sep) + 1)
+        self.db_conn.cursor().execute("""DELETE FROM directory
+                                         WHERE path = ?
+                                         OR (path >= ? AND path < ?)""",
+                                         (key, low, high))
+
+    def commit(self):
+        """Commit the recorded directories."""
+        self.db_conn.commit()
+
+    def clear(self):
+        """Forget all directories, so that everything is walked again."""
+        self.db_conn.cursor().execute("DELETE FROM directory")
+        self.db_conn.commit()
+
+    def _getKey(self, path):
+        """Return the path as stored in the table or None if it can't be
+        stored."""
+        if isinstance(path, unicode):
+            return path
+        try:
+            return path.decode('utf8')
+        except UnicodeDecodeError:
+            return None
@@ -0,0 +1,131 @@
+# Copyright (c) 2009 Entertainer Developers - See COPYING - GPLv2
+'''FailureTable - Remembers files that couldn't be indexed.'''
+
+import os
+import time
+
+from pysqlite2 import dbapi2 as sqlite
+
+from entertainerlib.configuration import Configuration
+
+
+class FailureTable:
+    """
+    Persistent table of files that failed to index.
+
+    A failure is stored with the size and modification time of the file,
+    the reason of the failure and the time after which the file may be tried
+    again. Caches skip failed files until the file changes or its retry time
+    has passed, so broken files aren't processed again on every walk. Every
+    failure of an unchanged file doubles its retry interval up to
+    MAX_RETRY_INTERVAL.
+
+    SQLite connections can only be used in the thread that created them, so
+    every thread needs its own FailureTable. All of them share the database.
+    """
+
+    # Longest time in seconds that a file is skipped
+    MAX_RETRY_INTERVAL = 30 * 24 * 60 * 60
+
+    def __init__(self, retry_interval=None):
+        """
+        Create a new FailureTable.
+        @param retry_interval: Seconds to skip a file after its first
+            failure. Read from the configuration if None.
+        """
+        config = Configuration()
+        if retry_interval is None:
+            retry_interval = config.index_retry_interval * 60 * 60
+        self.retry_interval = retry_interval
+
+        self.db_conn = sqlite.connect(config.INDEX_FAILURE_DB)
+        self.db_conn.text_factory = str
+        cursor = self.db_conn.cursor()
+        cursor.execute("""CREATE TABLE IF NOT EXISTS failure(
+                          filename TEXT PRIMARY KEY,
+                          filesize INTEGER,
+                          mtime INTEGER,
+                          reason TEXT,
+                          failures INTEGER,
+                          retry_after INTEGER)""")
+        self.db_conn.commit()
+
+    def isFailed(self, filename, stats=None):
+        """
+        Return True if the file should be skipped. A failure of a file that
+        has changed since is removed.
+        @param filename: Absolute path of the file
+        @param stats: (size, mtime) of the file. Read from disk if None.
+        """
+        cursor = self.db_conn.cursor()
+        cursor.execute("""SELECT filesize, mtime, retry_after
+                          FROM failure
+                          WHERE filename=?""", (filename,))
+        row = cursor.fetchone()
+        if row is None:
+            return False
+
+        if stats is None:
+            stats = self._getStats(filename)
+        if stats != (row[0], row[1]):
+            self.remove(filename)
+            return False
+        return time.time() < row[2]
+
+    def record(self, filename, reason):
+        """
+        Record a failure of a file.
+        @param filename: Absolute path of the file
+        @param reason: Human readable reason of the failure
+        """
+        stats = self._getStats(filename)
+        if stats is None:
+            return
+
+        cursor = self.db_conn.cursor()
+        cursor.execute("""SELECT filesize, mtime, failures
+                          FROM failure
+                          WHERE filename=?""", (filename,))
+        row = cursor.fetchone()
+        failures = 1
+        if row is not None and (row[0], row[1]) == stats:
+            failures = row[2] + 1
+
+        interval = min(self.retry_interval * 2 ** (failures - 1),
+            self.MAX_RETRY_INTERVAL)
+        cursor.execute("""INSERT OR REPLACE INTO failure(filename, filesize,
+                          mtime, reason, failures, retry_after)
+                          VALUES(?,?,?,?,?,?)""", (filename, stats[0],
+                          stats[1], reason, failures,
+                          int(time.time() + interval)))
+        self.db_conn.commit()
+
+    def remove(self, filename):
+        """Forget the failure of a file."""
+        self.db_conn.cursor().execute("DELETE FROM failure WHERE filename=?",
+            (filename,))
+        self.db_conn.commit()
+
+    def clear(self):
+        """Forget all failures, so that every file is tried again."""
+        self.db_conn.cursor().execute("DELETE FROM failure")
+        self.db_conn.commit()
+
+    def getFailures(self):
+        """
+        Return all failures as a list of (filename, reason, failures,
+        retry_after) tuples sorted by filename.
+        """
+        cursor = self.db_conn.cursor()
+        cursor.execute("""SELECT filename, reason, failures, retry_after
+                          FROM failure
+                          ORDER BY filename""")
+        return cursor.fetchall()
+
+    def _getStats(self, filename):
+        """Return (size, mtime) of a file or None if it doesn't exist."""
+        try:
+            stats = os.stat(filename)
+        except OSError:
+            return None
+        return (stats.st_size, int(stats.st_mtime))
@@ -0,0 +1,332 @@
+# Copyright (c) 2009 Entertainer Developers - See COPYING - GPLv2
+'''FileSystemObserver - Keeps media caches up-to-date when files change.'''
+
+import os
+import Queue
+import threading
+import time
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+from entertainerlib.configuration import Configuration
+from entertainerlib.logger import Logger
+
+from entertainerlib.backend.core.message_handler import MessageHandler
+from entertainerlib.backend.core.message_type_priority import MessageType
+from entertainerlib.backend.components.mediacache.io_throttle import (
+    IOThrottle)
+from entertainerlib.backend.components.mediacache.image_cache import ImageCache
+from entertainerlib.backend.components.mediacache.music_cache import MusicCache
+from entertainerlib.backend.components.mediacache.video_cache import VideoCache
+
+
+class FileSystemObserver(threading.Thread, MessageHandler):
+    """
+    FileSystemObserver watches media folders and updates media caches when
+    files are added, changed or removed.
+
+    Folders are watched with inotify when pyinotify is available and the
+    folder supports it. Other folders (for example network mounts) are polled
+    periodically. Changes from both sources are collected into a pending set
+    and dispatched to the caches only after no new changes have arrived for
+    QUIET_PERIOD seconds, so a burst of events (like copying a whole album)
+    is handled in one go and each path is processed only once.
+    """
+
+    # Seconds to wait for a burst of changes to settle before dispatching
+    QUIET_PERIOD = 2.0
+
+    # Maximum seconds to hold changes back while new events keep arriving
+    MAX_DELAY = 30.0
+
+    def __init__(self):
+        """Create a new FileSystemObserver."""
+        threading.Thread.__init__(self)
+        MessageHandler.__init__(self)
+        self.setName("FileSystemObserver")
+        self.setDaemon(True)
+        self.logger = Logger().getLogger(
+            'backend.components.mediacache.FileSystemObserver')
+        self.config = Configuration()
+
+        # Incoming (path, is_dir) changes and None for folder updates
+        self._events = Queue.Queue()
+        # Path -> is_dir of changes waiting for dispatch
+        self._pending = {}
+        self._pending_since = None
+        self._caches = []
+
+        self._inotify = None
+        self._polling = None
+        # Folder -> watch that currently watches it
+        self._watches = {}
+        self.active = True
+
+    def queueChange(self, path, is_dir):
+        """
+        Queue a changed path for dispatch. This is called by the watches.
+        @param path: Absolute path that was added, changed or removed
+        @param is_dir: True if the path is a directory
+        """
+        self._events.put((path, is_dir))
+
+    def stop(self):
+        """Stop watching folders."""
+        self.active = False
+        self._events.put(None)
+
+    # Implements MessageHandler interface
+    def handleMessage(self, message):
+        '''Handles messages'''
+        if message.get_type() == MessageType.CONTENT_CONF_UPDATED:
+            # Watches are updated in the observer thread, so that adding
+            # recursive watches to big folders doesn't block the message bus.
+            self._events.put(None)
+
+    def run(self):
+        """Watch media folders and dispatch changes to the media caches."""
+        # Caches have to be created in this thread. SQLite connections can
+        # only be used in the thread that created them.
+        self._caches = [ImageCache(), MusicCache(), VideoCache()]
+        throttle = IOThrottle()
+        for cache in self._caches:
+            cache.setThrottle(throttle)
+        self._update_watches()
+
+        while self.active:
+            try:
+                event = self._events.get(True, self.QUIET_PERIOD)
+            except Queue.Empty:
+                self._dispatch()
+                continue
+
+            if event is None:
+                if self.active:
+                    self._update_watches()
+                continue
+
+            path, is_dir = event
+            if not self._pending:
+                self._pending_since = time.time()
+            self._pending[path] = is_dir
+            if time.time() - self._pending_since > self.MAX_DELAY:
+                self._dispatch()
+
+        self._remove_watches(self._watches.keys())
+        if self._inotify is not None:
+            self._inotify.stop()
+        if self._polling is not None:
+            self._polling.stop()
+
+    def _update_watches(self):
+        """Add watches for new media folders and remove deleted ones."""
+        folders = set([folder for folder in self.config.media_folders
+            if os.path.isdir(folder)])
+        current = set(self._watches.keys())
+        self._remove_watches(current - folders)
+        for folder in folders - current:
+            self._add_watch(folder)
+
+    def _add_watch(self, folder):
+        """Watch a folder with inotify if possible, otherwise poll it."""
+        method = self.config.watch_method
+        if method != "poll" and pyinotify is not None:
+            if self._inotify is None:
+                self._inotify = _InotifyWatch(self)
+            if self._inotify.add(folder):
+                self._watches[folder] = self._inotify
+                self.logger.debug("Watching folder with inotify: " + folder)
+                return
+            self.logger.warning("Inotify watch failed for: " + folder)
+        elif method == "inotify":
+            self.logger.warning("pyinotify is not available")
+
+        if self._polling is None:
+            self._polling = _PollingWatch(self,
+                self.config.watch_poll_interval)
+            self._polling.start()
+        self._polling.add(folder)
+        self._watches[folder] = self._polling
+        self.logger.debug("Polling folder for changes: " + folder)
+
+    def _remove_watches(self, folders):
+        """Stop watching given folders."""
+        for folder in folders:
+            self._watches.pop(folder).remove(folder)
+            self.logger.debug("Stopped watching folder: " + folder)
+
+    def _dispatch(self):
+        """Dispatch pending changes to the media caches."""
+        if not self._pending:
+            return
+        pending = self._pending
+        self._pending = {}
+
+        # Sorting puts directories before their contents. Anything under an
+        # added or removed directory is handled by the directory itself.
+        handled_dir = None
+        for path in sorted(pending.keys()):
+            if handled_dir is not None and path.startswith(handled_dir):
+                continue
+            is_dir = pending[path]
+            try:
+                if is_dir:
+                    self._dispatch_directory(path)
+                    handled_dir = os.path.join(path, '')
+                else:
+                    self._dispatch_file(path)
+            except Exception, e:
+                self.logger.error("Couldn't update cache for %s: %s" %
+                    (path, e))
+
+    def _dispatch_directory(self, path):
+        """Add or remove a directory to/from every cache."""
+        exists = os.path.isdir(path)
+        for cache in self._caches:
+            if exists:
+                cache.addDirectory(path)
+            else:
+                cache.removeDirectory(path)
+
+    def _dispatch_file(self, path):
+        """Add, update or remove a file in the cache that accepts it."""
+        exists = os.path.isfile(path)
+        for cache in self._caches:
+            if not cache.acceptsFile(path):
+                continue
+            if not exists:
+                cache.removeFile(path)
+            elif cache.isFileInCache(path):
+                cache.updateFile(path)
+            else:
+                cache.addFile(path)
+
+
+if pyinotify is not None:
+
+    class _InotifyEventHandler(pyinotify.ProcessEvent):
+        '''Forwards inotify events to the FileSystemObserver.'''
+
+        def my_init(self, observer=None):
+            '''See pyinotify.ProcessEvent'''
+            self.observer = observer
+
+        def process_default(self, event):
+            '''Queue every event that affects media files.'''
+            self.observer.queueChange(event.pathname, event.dir)
+
+
+class _InotifyWatch(object):
+    '''Watches folders recursively with inotify.'''
+
+    def __init__(self, observer):
+        self.manager = pyinotify.WatchManager()
+        self.mask = (pyinotify.IN_CLOSE_WRITE | pyinotify.IN_CREATE |
+            pyinotify.IN_DELETE | pyinotify.IN_MOVED_FROM |
+            pyinotify.IN_MOVED_TO)
+        self.notifier = pyinotify.ThreadedNotifier(self.manager,
+            _InotifyEventHandler(observer=observer))
+        self.notifier.setDaemon(True)
+        self.notifier.start()
+        # Folder -> list of watch descriptors
+        self.descriptors = {}
+
+    def add(self, folder):
+        '''Watch a folder. Returns False if inotify couldn't watch it.'''
+        result = self.manager.add_watch(folder, self.mask, rec=True,
+            auto_add=True)
+        descriptors = result.values()
+        if not descriptors or [wd for wd in descriptors if wd < 0]:
+            self.manager.rm_watch([wd for wd in descriptors if wd >= 0])
+            return False
+        self.descriptors[folder] = descriptors
+        return True
+
+    def remove(self, folder):
+        '''Stop watching a folder.'''
+        self.manager.rm_watch(self.descriptors.pop(folder, []), quiet=True)
+
+    def stop(self):
+        '''Stop the notifier thread.'''
+        self.notifier.stop()
+
+
+class _PollingWatch(threading.Thread):
+    '''Watches folders by comparing periodic snapshots of them.'''
+
+    def __init__(self, observer, interval):
+        threading.Thread.__init__(self)
+        self.setName("FileSystemObserver polling")
+        self.setDaemon(True)
+        self.observer = observer
+        self.interval = interval
+        self.lock = threading.Lock()
+        # Folder -> snapshot (path -> (is_dir, size, mtime))
+        self.snapshots = {}
+        self.stopped = threading.Event()
+
+    def add(self, folder):
+        '''Start polling a folder.'''
+        snapshot = self._snapshot(folder)
+        self.lock.acquire()
+        self.snapshots[folder] = snapshot
+        self.lock.release()
+
+    def remove(self, folder):
+        '''Stop polling a folder.'''
+        self.lock.acquire()
+        self.snapshots.pop(folder, None)
+        self.lock.release()
+
+    def stop(self):
+        '''Stop polling.'''
+        self.stopped.set()
+
+    def run(self):
+        '''Poll folders every interval seconds.'''
+        while True:
+            self.stopped.wait(self.interval)
+            if self.stopped.isSet():
+                return
+            self.lock.acquire()
+            folders = self.snapshots.keys()
+            self.lock.release()
+            for folder in folders:
+                self._poll(folder)
+
+    def _poll(self, folder):
+        '''Queue every path that differs from the previous snapshot.'''
+        snapshot = self._snapshot(folder)
+        self.lock.acquire()
+        previous = self.snapshots.get(folder)
+        if previous is not None:
+            self.snapshots[folder] = snapshot
+        self.lock.release()
+        if previous is None:
+            return # Folder was removed while it was scanned
+
+        for path, stats in snapshot.iteritems():
+            if previous.get(path) != stats:
+                self.observer.queueChange(path, stats[0])
+        for path, stats in previous.iteritems():
+            if path not in snapshot:
+                self.observer.queueChange(path, stats[0])
+
+    def _snapshot(self, folder):
+        '''Return path -> (is_dir, size, mtime) of everything in a folder.'''
+        # pylint: disable-msg=W0612
+        snapshot = {}
+        for root, dirs, files in os.walk(folder):
+            for name in dirs:
+                snapshot[os.path.join(root, name)] = (True, 0, 0)
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stats = os.stat(path)
+                except OSError:
+                    continue
+                snapshot[path] = (False, stats.st_size, int(stats.st_mtime))
+        return snapshot
@@ -0,0 +1,180 @@
+# Copyright (c) 2009 Entertainer Developers - See COPYING - GPLv2
+'''FingerprintTable - Identifies files by their content.'''
+
+import hashlib
+import os
+import shutil
+
+from entertainerlib.configuration import Configuration
+
+
+class FingerprintTable:
+    """
+    Persistent table of content fingerprints of cached files.
+
+    The partial fingerprint of a file is a hash of its size and its first
+    and last PARTIAL_BYTES bytes, so it's cheap even for large videos. Only
+    when two files have the same partial fingerprint are the files hashed
+    completely to tell whether they really have the same content.
+
+    The content key of a file is the same for all the files with the same
+    content. Caches name thumbnails by content key, so a photo or a video
+    that is stored in several folders is thumbnailed only once, and files
+    with the same content key are duplicates. The key of the first file
+    with some content is its partial fingerprint and later copies get the
+    same key, so keys never change when copies are added.
+
+    Rows are written with the database connection of the thread and are
+    committed together with the cache rows.
+    """
+
+    # Bytes read from the start and from the end of a file
+    PARTIAL_BYTES = 64 * 1024
+
+    def __init__(self):
+        """
+        Create a new FingerprintTable. Creates the table in the media
+        database if it doesn't exist.
+        """
+        self.db_conn = Configuration().MEDIA_DB.get_connection()
+        cursor = self.db_conn.cursor()
+        cursor.execute("""CREATE TABLE IF NOT EXISTS fingerprint(
+                          filename TEXT PRIMARY KEY,
+                          filesize INTEGER,
+                          mtime INTEGER,
+                          partial VARCHAR(32),
+                          full VARCHAR(32),
+                          content_key VARCHAR(32))""")
+        cursor.execute("""CREATE INDEX IF NOT EXISTS fingerprint_partial
+                          ON fingerprint(partial)""")
+        self.db_conn.commit()
+
+    def getContentKey(self, filename, stats=None):
+        """
+        Return the content key of a file and store its fingerprint. Not
+        committed. Raises IOError or OSError if the file can't be read.
+        @param filename: Absolute path of the file
+        @param stats: (size, mtime) of the file. Read from disk if None.
+        """
+        if stats is None:
+            file_stats = os.stat(filename)
+            stats = (file_stats.st_size, int(file_stats.st_mtime))
+        cursor = self.db_conn.cursor()
+        cursor.execute("""SELECT filesize, mtime, content_key
+                          FROM fingerprint
+                          WHERE filename=?""", (filename,))
+        row = cursor.fetchone()
+        if row is not None and (row[0], row[1]) == tuple(stats):
+            return str(row[2])
+
+        partial = self._hashPartial(filename, stats[0])
+        full = None
+        if stats[0] <= 2 * self.PARTIAL_BYTES:
+            # The whole file was hashed
+            full = partial
+        content_key = partial
+
+        cursor.execute("""SELECT filename, full, content_key
+                          FROM fingerprint
+                          WHERE partial=? AND filename!=?""",
+                          (partial, filename))
+        candidates = cursor.fetchall()
+        if candidates:
+            # Same size, start and end. Only the whole content tells.
+            if full is None:
+                full = self._hashFull(filename)
+            content_key = full
+            for other, other_full, other_key in candidates:
+                if other_full is None:
+                    try:
+                        other_full = self._hashFull(other)
+                    except (IOError, OSError):
+                        continue
+                    cursor.execute("""UPDATE fingerprint
+                                      SET full=?
+                                      WHERE filename=?""", (other_full, other))
+                if other_full == full:
+                    content_key = str(other_key)
+                    break
+
+        cursor.execute("""INSERT OR REPLACE INTO fingerprint(filename,
+                          filesize, mtime, partial, full, content_key)
+                          VALUES(?,?,?,?,?,?)""", (filename, stats[0],
+                          stats[1], partial, full, content_key))
+        return content_key
+
+    def getFiles(self, content_key):
+        """Return the files that have the given content key."""
+        cursor = self.db_conn.cursor()
+        cursor.execute("""SELECT filename
+                          FROM fingerprint
+                          WHERE content_key=?""", (content_key,))
+        return [row[0].encode('utf8') for row in cursor.fetchall()]
+
+    def removeFile(self, filename):
+        """Forget the fingerprint of a file. Not committed."""
+        self.db_conn.cursor().execute("""DELETE FROM fingerprint
+                                         WHERE filename=?""", (filename,))
+
+    def removeRange(self, low, high):
+        """
+        Forget the fingerprints of the files in a subtree. Not committed.
+        See Cache._getSubtreeRange.
+        """
+        self.db_conn.cursor().execute("""DELETE FROM fingerprint
+                                         WHERE filename >= ?
+                                         AND filename < ?""", (low, high))
+
+    def storeFile(self, source, destination):
+        """
+        Copy a file to a store directory, for example album art. If a file
+        with the same content has been stored in the same directory before,
+        the copy is a hard link to it and takes no space. Commits.
+        @param source: Absolute path of the file to copy
+        @param destination: Absolute path of the copy
+        """
+        content_key = self.getContentKey(source)
+        directory = os.path.dirname(destination)
+        for stored in self.getFiles(content_key):
+            if (os.path.dirname(stored) != directory or
+                not os.path.exists(stored)):
+                continue
+            try:
+                os.link(stored, destination)
+                break
+            except (OSError, AttributeError):
+                # Not supported by the filesystem or the platform
+                pass
+        else:
+            shutil.copyfile(source, destination)
+        self.getContentKey(destination)
+        self.db_conn.commit()
+
+    def _hashPartial(self, filename, size):
+        """Return the partial fingerprint of a file."""
+        digest = hashlib.md5(str(size))
+        source = open(filename, 'rb')
+        try:
+            if size <= 2 * self.PARTIAL_BYTES:
+                digest.update(source.read())
+            else:
+                digest.update(source.read(self.PARTIAL_BYTES))
+                source.seek(-self.PARTIAL_BYTES, 2)
+                digest.update(source.read(self.PARTIAL_BYTES))
+        finally:
+            source.close()
+        return digest.hexdigest()
+
+    def _hashFull(self, filename):
+        """Return the hash of the whole content of a file."""
+        digest = hashlib.md5(str(os.path.getsize(filename)))
+        source = open(filename, 'rb')
+        try:
+            while True:
+                data = source.read(1024 * 1024)
+                if not data:
+                    break
+                digest.update(data)
+        finally:
+            source.close()
+        return digest.hexdigest()
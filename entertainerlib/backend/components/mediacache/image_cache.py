@@ -2,12 +2,12 @@
 '''ImageCache - Handles image file caching.'''
 
 import os
-import time
 import Image
 import datetime
-from pysqlite2 import dbapi2 as sqlite
+import Queue
 
-from entertainerlib.thumbnailer import ImageThumbnailer
+from entertainerlib.thumbnail_service import ThumbnailService
+from entertainerlib.thumbnailer import Thumbnailer
 from entertainerlib.configuration import Configuration
 from entertainerlib.logger import Logger
 
@@ -27,21 +27,29 @@ class ImageCache(Cache):
     # Supported file formats
     SUPPORTED_FILE_EXTENSIONS = ['jpg', 'jpeg', 'png']
 
+    # Tables of the legacy image.db -> tables in the media database
+    LEGACY_TABLES = { 'image' : 'image', 'album' : 'album' }
+
     def __init__(self):
         """
         Create a new ImageCache.
 
-        Creates a new database if not already exists and opens a connection
-        to it.
+        Creates the cache tables in the media database if they don't exist.
         """
         self.logger = Logger().getLogger(
             'backend.components.mediacache.ImageCache')
         self.config = Configuration()
 
-        if not os.path.exists(self.config.IMAGE_DB):
-            self._createImageCacheDatabase()
-        self.db_conn = sqlite.connect(self.config.IMAGE_DB)
+        self.db_conn = self.config.MEDIA_DB.get_connection()
         self.db_cursor = self.db_conn.cursor()
+        self._createImageCacheTables()
+        self.thumbnails = ThumbnailService()
+        # (filename, error) of failed thumbnail jobs. Jobs finish in the
+        # thread of the thumbnail service, but the failures are handled in
+        # the thread that owns the database connection.
+        self._thumbnail_failures = Queue.Queue()
+        self._addMissingColumns(self.db_cursor, 'image',
+            [('mtime', 'INTEGER')])
 
     def clearCache(self):
         """
@@ -58,8 +66,9 @@ class ImageCache(Cache):
                 self.logger.error(
                     "Media manager couldn't remove thumbnail : %s"
                     % thumb_file)
-        os.remove(self.config.IMAGE_DB)
-        self._createImageCacheDatabase()
+        self.db_cursor.execute("DELETE FROM image")
+        self.db_cursor.execute("DELETE FROM album")
+        self.db_conn.commit()
 
 
     def addFile(self, filename):
@@ -67,8 +76,10 @@ class ImageCache(Cache):
         Add image file to the cache. Do nothing if file is already cached.
         """
         filename = filename.encode('utf8')
+        self._handleThumbnailFailures()
         if (not self.isFileInCache(filename) and
-            self.isSupportedFormat(filename)):
+            self.isSupportedFormat(filename) and
+            not self._isFailed(filename)):
             # Do not add album thumbnail to images
             if (filename[filename.rfind('/') +1:filename.rfind('.')] ==
                 ".entertainer_album"):
@@ -87,17 +98,13 @@ class ImageCache(Cache):
                                         { "fn" : filename})
             result = self.db_cursor.fetchall()
             if len(result) > 0:
-                name = result[0][0] + '.jpg'
-                thumb = os.path.join(self.config.IMAGE_THUMB_DIR, name)
-                try:
-                    os.remove(thumb)
-                except OSError:
-                    self.logger.error("Couldn't remove thumbnail: " + thumb)
                 self.db_cursor.execute("""DELETE
                                             FROM image
                                             WHERE filename=:fn""",
                                             { "fn" : filename })
+                self.getFingerprintTable().removeFile(filename)
                 self.db_conn.commit()
+                self._removeUnusedThumbnails([result[0][0]])
 
     def updateFile(self, filename):
         """Update image file that is already in the cache."""
@@ -127,7 +134,7 @@ class ImageCache(Cache):
                         continue
                     if self.isSupportedFormat(name):
                         self.addFile(os.path.join(root, name))
-                        time.sleep(float(self.SLEEP_TIME_BETWEEN_FILES) / 1000)
+                        self._throttle(os.path.join(root, name))
 
     def removeDirectory(self, path):
         """
@@ -136,28 +143,37 @@ class ImageCache(Cache):
 
         @param path - Absolute path
         """
-        # Remove image file thumbnails
-        self.db_cursor.execute("""SELECT hash
+        low, high = self._getSubtreeRange(path)
+
+        # Image file thumbnails are removed after the images, if no copy of
+        # an image is left elsewhere
+        self.db_cursor.execute("""SELECT DISTINCT hash
                                     FROM image
-                                    WHERE filename LIKE '""" + path + "%'")
-        for row in self.db_cursor:
-            thumb_file = row[0] + ".jpg"
-            os.remove(os.path.join(self.config.IMAGE_THUMB_DIR, thumb_file))
+                                    WHERE filename >= ? AND filename < ?""",
+                                    (low, high))
+        image_hashes = [row[0] for row in self.db_cursor.fetchall()]
 
         # Remove folder thumbnails
         self.db_cursor.execute("""SELECT hash
                                     FROM album
-                                    WHERE path LIKE '""" + path + "%'")
-        for row in self.db_cursor:
-            thumb_file = row[0] + ".jpg"
-            os.remove(os.path.join(self.config.IMAGE_THUMB_DIR, thumb_file))
-
-        # Clean cache database
-        self.db_cursor.execute(
-            "DELETE FROM album WHERE path LIKE '" + path + "%'")
-        self.db_cursor.execute(
-            "DELETE FROM image WHERE album_path LIKE '" + path + "%'")
+                                    WHERE path = ?
+                                    OR (path >= ? AND path < ?)""",
+                                    (path, low, high))
+        for row in self.db_cursor.fetchall():
+            self._removeThumbnails(row[0])
+
+        # Clean cache database. Images of the subtree are selected by
+        # filename, which is indexed, instead of album_path.
+        self.db_cursor.execute("""DELETE FROM album
+                                    WHERE path = ?
+                                    OR (path >= ? AND path < ?)""",
+                                    (path, low, high))
+        self.db_cursor.execute("""DELETE FROM image
+                                    WHERE filename >= ? AND filename < ?""",
+                                    (low, high))
+        self.getFingerprintTable().removeRange(low, high)
         self.db_conn.commit()
+        self._removeUnusedThumbnails(image_hashes)
 
     def updateDirectory(self, path):
         """
@@ -168,6 +184,7 @@ class ImageCache(Cache):
 
     def isFileInCache(self, filename):
         """Check if file is already in cache. Returns boolean value."""
+        self._flushIfPending(filename)
         self.db_cursor.execute("""SELECT *
                                     FROM image
                                     WHERE filename=:fn""", { "fn" : filename })
@@ -179,6 +196,7 @@ class ImageCache(Cache):
 
     def isDirectoryInCache(self, path):
         """Check if album is already in cache. Returns boolean value."""
+        self._flushIfPending(path)
         self.db_cursor.execute("""SELECT *
                                     FROM album
                                     WHERE path=:p""", { "p" : path})
@@ -196,13 +214,125 @@ class ImageCache(Cache):
         else:
             return False
 
-    def _createImageCacheDatabase(self):
-        """Creates a image cache database file."""
-        db_conn = sqlite.connect(self.config.IMAGE_DB)
-        db_cursor = db_conn.cursor()
+    def acceptsFile(self, filename):
+        """
+        Check if file should be indexed. Hidden files, files in hidden folders
+        and album thumbnails are skipped like in addDirectory.
+        """
+        folder, name = os.path.split(filename)
+        if name.startswith('.') or os.path.split(folder)[-1].startswith('.'):
+            return False
+        return self.isSupportedFormat(filename)
+
+    def getCachedFiles(self):
+        """Return a dictionary of cached filename -> (size, mtime)."""
+        self.db_cursor.execute("""SELECT filename, filesize, mtime
+                                  FROM image""")
+        cached = {}
+        for filename, filesize, mtime in self.db_cursor.fetchall():
+            if filesize is None or mtime is None:
+                cached[filename.encode('utf8')] = None
+            else:
+                cached[filename.encode('utf8')] = (filesize, mtime)
+        return cached
+
+    def setFileStats(self, filename, stats):
+        """Record size and mtime of an image that is already cached."""
+        self.db_cursor.execute("""UPDATE image
+                                  SET filesize=:size, mtime=:mtime
+                                  WHERE filename=:fn""",
+                                  { "size" : stats[0], "mtime" : stats[1],
+                                    "fn" : filename })
+        self.db_conn.commit()
+
+    def prepareSynchronize(self, files, directories, roots=None,
+        unavailable=(), unchanged=()):
+        """
+        Reconcile albums with the filesystem and return the image files that
+        have to be indexed. Albums are added before their images. See
+        Cache.prepareSynchronize.
+        """
+        changed = Cache.prepareSynchronize(self, files, directories, roots,
+            unavailable, unchanged)
+
+        albums = set([path for path in directories
+            if not os.path.split(path)[-1].startswith('.')])
+        self.db_cursor.execute("SELECT path FROM album")
+        cached_albums = set([row[0].encode('utf8')
+            for row in self.db_cursor.fetchall()])
+        if roots is not None:
+            prefixes = [os.path.join(root, '') for root in roots]
+            cached_albums = set([path for path in cached_albums
+                if path in roots or
+                [p for p in prefixes if path.startswith(p)]])
+        if unavailable:
+            prefixes = [os.path.join(folder, '') for folder in unavailable]
+            cached_albums = set([path for path in cached_albums
+                if path not in unavailable and
+                not [p for p in prefixes if path.startswith(p)]])
+
+        for path in cached_albums - albums:
+            self._removeAlbum(path)
+        self.beginBulkIngest()
+        try:
+            for path in albums - cached_albums:
+                self._addAlbum(path)
+        finally:
+            self.endBulkIngest()
+        return changed
+
+    def endBulkIngest(self):
+        """See Cache.endBulkIngest. Also handles failed thumbnail jobs."""
+        Cache.endBulkIngest(self)
+        self._handleThumbnailFailures()
+
+    def flushBulkIngestIfDue(self):
+        """See Cache.flushBulkIngestIfDue. Also handles failed thumbnail
+        jobs."""
+        Cache.flushBulkIngestIfDue(self)
+        self._handleThumbnailFailures()
+
+    def _thumbnailFinished(self, job):
+        """
+        Queue the failure of a thumbnail job. Called from the threads of the
+        thumbnail service.
+        @param job: Finished ThumbnailJob
+        """
+        if job.error is not None:
+            self._thumbnail_failures.put((job.filename, job.error))
+
+    def _handleThumbnailFailures(self):
+        """
+        Remove images whose thumbnails couldn't be created and record them
+        as failed, so that they aren't shown without a thumbnail and are
+        skipped until they change. An album whose thumbnail failed is kept
+        without a thumbnail.
+        """
+        while True:
+            try:
+                filename, error = self._thumbnail_failures.get_nowait()
+            except Queue.Empty:
+                return
+            path, name = os.path.split(filename)
+            if name == ".entertainer_album.jpg":
+                self.logger.error("Couldn't create album thumbnail %s: %s" %
+                    (filename, error))
+                self._flushIfPending(path)
+                self.db_cursor.execute("""UPDATE album
+                                          SET hash=''
+                                          WHERE path=:p""", { "p" : path })
+                self.db_conn.commit()
+            else:
+                self.removeFile(filename)
+                self._recordFailure(filename,
+                    "Couldn't create thumbnail: %s" % error)
+
+    def _createImageCacheTables(self):
+        """Creates the image cache tables if they don't exist."""
+        db_cursor = self.db_cursor
         db_cursor.execute(
             """
-            CREATE TABLE image(
+            CREATE TABLE IF NOT EXISTS image(
                 filename TEXT,
                 album_path TEXT,
                 title TEXT,
@@ -212,20 +342,22 @@ class ImageCache(Cache):
                 width INTEGER,
                 height INTEGER,
                 filesize LONG,
+                mtime INTEGER,
                 hash VARCHAR(32),
                 PRIMARY KEY(filename))""")
+        # Thumbnails are shared by images with the same hash
+        db_cursor.execute(
+            "CREATE INDEX IF NOT EXISTS image_hash ON image(hash)")
 
         db_cursor.execute(
             """
-            CREATE TABLE album(
+            CREATE TABLE IF NOT EXISTS album(
                 path TEXT,
                 title TEXT,
                 description TEXT,
                 hash VARCHAR(32),
                 PRIMARY KEY(path))""")
-        db_conn.commit()
-        db_conn.close()
-        self.logger.debug("ImageCache database created successfully")
+        self.db_conn.commit()
 
     def _addAlbum(self, path):
         """
@@ -250,21 +382,55 @@ class ImageCache(Cache):
             a_description = ""
 
         if os.path.exists(album_thumb):
-            thumbnailer = ImageThumbnailer(album_thumb)
-            thumbnailer.create_thumbnail()
-            a_hash = thumbnailer.get_hash()
+            a_hash = self.thumbnails.submit(album_thumb,
+                self._thumbnailFinished).hash
         else:
             a_hash = ""
 
         album_row = (path, a_title, a_description, a_hash)
-        self.db_cursor.execute(
+        self._insert(self.db_conn,
             """
             INSERT INTO album(path, title, description, hash)
             VALUES(?,?,?,?)
-            """, album_row)
-        self.db_conn.commit()
+            """, album_row, path)
         #print "Album added to cache: " + a_title
 
+    def _removeAlbum(self, path):
+        """Remove a single album and its thumbnail from the image cache."""
+        self.db_cursor.execute("""SELECT hash
+                                  FROM album
+                                  WHERE path=:p""", { "p" : path })
+        for row in self.db_cursor.fetchall():
+            if row[0]:
+                self._removeThumbnails(row[0])
+        self.db_cursor.execute("DELETE FROM album WHERE path=:p",
+            { "p" : path })
+        self.db_conn.commit()
+
+    def _removeUnusedThumbnails(self, thumb_hashes):
+        """Remove the thumbnails of the given hashes that no image in the
+        cache uses anymore."""
+        # Buffered images may use them too
+        self.flushBulkIngest()
+        for thumb_hash in thumb_hashes:
+            self.db_cursor.execute("""SELECT filename
+                                      FROM image
+                                      WHERE hash=:hash
+                                      LIMIT 1""", { "hash" : thumb_hash })
+            if not self.db_cursor.fetchall():
+                self._removeThumbnails(thumb_hash)
+
+    def _removeThumbnails(self, thumb_hash):
+        """Remove all thumbnail sizes that exist for the given hash."""
+        for thumb in Thumbnailer.get_thumbnail_paths(
+            self.config.IMAGE_THUMB_DIR, thumb_hash):
+            if not os.path.exists(thumb):
+                continue
+            try:
+                os.remove(thumb)
+            except OSError:
+                self.logger.error("Couldn't remove thumbnail: " + thumb)
+
     def _addJPEGfile(self, filename):
         """
         Add JPEG image to the image cache. Raises exception if adding fails.
@@ -277,7 +443,8 @@ class ImageCache(Cache):
             - Generate thumbnail / get hash from thumbnailer
             - Insert data to image cache database
         """
-        tmp = datetime.datetime.fromtimestamp(os.stat(filename)[-1])
+        stats = os.stat(filename)
+        tmp = datetime.datetime.fromtimestamp(stats[-1])
         timestamp = [str(tmp.year) + "-" + str(tmp.month) + "-" +
             str(tmp.day), str(tmp.hour) + ":" + str(tmp.minute) + ":" +
             str(tmp.second)]
@@ -291,14 +458,18 @@ class ImageCache(Cache):
             im = Image.open(filename)
             width, height = im.size
         except IOError:
-            self.logger.error("Couldn't identify image file: " + filename)
+            self._recordFailure(filename, "Couldn't identify image file")
             return
 
-        # Create thumbnail and return hash
-        thumbnailer = ImageThumbnailer(filename)
-        thumbnailer.create_thumbnail()
-        thumb_hash = thumbnailer.get_hash()
-        del thumbnailer
+        # Thumbnails are named by the content of the image, so copies of an
+        # image share them and only the first copy is thumbnailed. The
+        # thumbnails are created in the background.
+        thumb_hash = self._getContentKey(filename,
+            (stats.st_size, int(stats.st_mtime)))
+        if not os.path.exists(Thumbnailer.get_thumbnail_path(
+            self.config.IMAGE_THUMB_DIR, thumb_hash, Thumbnailer.MAX_SIZE)):
+            self.thumbnails.submit(filename, self._thumbnailFinished,
+                thumb_hash)
         album_path = filename[:filename.rfind('/')]
 
         db_row = (filename, # Filename (full path)
@@ -308,11 +479,12 @@ class ImageCache(Cache):
                   timestamp[1], # Image's taken time
                   width,  # Image's width
                   height, # Image's height
-                  os.path.getsize(filename), # Image file size in bytes
-                  thumb_hash, # Thumbnail hash (hash of the filename)
+                  stats.st_size, # Image file size in bytes
+                  int(stats.st_mtime), # Modification time of the file
+                  thumb_hash, # Thumbnail hash (content key of the file)
                   album_path) # Path of the album (folder of this image)
 
-        self.db_cursor.execute(
+        self._insert(self.db_conn,
             """
             INSERT INTO image(filename,
                 title,
@@ -322,8 +494,8 @@ class ImageCache(Cache):
                 width,
                 height,
                 filesize,
+                mtime,
                 hash,
                 album_path)
-                VALUES(?,?,?,?,?,?,?,?,?,?)""", db_row)
-        self.db_conn.commit()
+                VALUES(?,?,?,?,?,?,?,?,?,?,?)""", db_row, filename)
 
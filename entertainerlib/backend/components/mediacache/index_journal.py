@@ -0,0 +1,294 @@
+# Copyright (c) 2009 Entertainer Developers - See COPYING - GPLv2
+'''IndexJournal - Lets an interrupted indexing run continue where it was.'''
+
+import time
+
+from pysqlite2 import dbapi2 as sqlite
+
+from entertainerlib.configuration import Configuration
+
+
+class IndexJournal:
+    """
+    Persistent journal of one indexing run of an IndexerThread.
+
+    While the folders are walked, the journal holds the directories that are
+    still to be walked (the walk cursor), the directories that have been
+    walked and the files that have been found. When the walk is done, the
+    found files are replaced by the queue of new and changed files, and
+    indexed files are removed from the queue. The journal is deleted when
+    the run has finished.
+
+    Changes are buffered and written at checkpoints, every interval files.
+    The journal shares the database connection of the thread with the
+    caches and the DirectoryTable, so a checkpoint commits the journal
+    together with the directories recorded by the walk. If the backend is
+    stopped in the middle of a run, MediaCacheManager finds the journal on
+    the next start and the run continues from the last checkpoint.
+
+    Paths are stored as BLOBs, so paths that aren't valid UTF-8 are kept.
+    """
+
+    WALKING = 'walking'
+    INDEXING = 'indexing'
+
+    def __init__(self, interval=None):
+        """
+        Create a new IndexJournal. Creates the tables in the media database
+        if they don't exist. Use begin() or load() before anything else.
+        @param interval: Number of files between checkpoints. Read from the
+            configuration if None.
+        """
+        if interval is None:
+            interval = Configuration().index_checkpoint_interval
+        self.interval = max(interval, 1)
+        self.journal_id = None
+        self.folders = []
+        self.cache_types = []
+        self.reconcile = False
+        self.full_speed = False
+        self.state = None
+
+        # Changes since the last checkpoint
+        self._directories = []
+        self._files = []
+        self._indexed = []
+
+        self.db_conn = Configuration().MEDIA_DB.get_connection()
+        cursor = self.db_conn.cursor()
+        cursor.execute("""CREATE TABLE IF NOT EXISTS index_journal(
+                          id INTEGER PRIMARY KEY AUTOINCREMENT,
+                          folders BLOB,
+                          cache_types TEXT,
+                          reconcile INTEGER,
+                          full_speed INTEGER,
+                          state TEXT,
+                          started REAL,
+                          checkpointed REAL)""")
+        cursor.execute("""CREATE TABLE IF NOT EXISTS index_journal_directory(
+                          journal INTEGER,
+                          path BLOB,
+                          state TEXT)""")
+        cursor.execute("""CREATE TABLE IF NOT EXISTS index_journal_file(
+                          journal INTEGER,
+                          filename BLOB,
+                          filesize INTEGER,
+                          mtime INTEGER,
+                          queued INTEGER,
+                          cached INTEGER)""")
+        cursor.execute("""CREATE INDEX IF NOT EXISTS index_journal_file_name
+                          ON index_journal_file(journal, filename)""")
+        self.db_conn.commit()
+
+    def getUnfinished(self):
+        """Return the ids of the journals of unfinished runs, oldest first."""
+        cursor = self.db_conn.cursor()
+        cursor.execute("SELECT id FROM index_journal ORDER BY id")
+        return [row[0] for row in cursor.fetchall()]
+
+    def begin(self, folders, cache_types, reconcile, full_speed):
+        """
+        Start the journal of a new run. The folders are the walk cursor.
+        @param folders: Root folders of the run
+        @param cache_types: Cache types of the run
+        @param reconcile: Reconcile mode of the run
+        @param full_speed: True if the run isn't paced
+        """
+        self.folders = list(folders)
+        self.cache_types = list(cache_types)
+        self.reconcile = reconcile
+        self.full_speed = full_speed
+        self.state = self.WALKING
+        now = time.time()
+        cursor = self.db_conn.cursor()
+        cursor.execute("""INSERT INTO index_journal(folders, cache_types,
+                          reconcile, full_speed, state, started,
+                          checkpointed)
+                          VALUES(?,?,?,?,?,?,?)""",
+                          (sqlite.Binary('\0'.join(self.folders)),
+                          ','.join(self.cache_types), int(reconcile),
+                          int(full_speed), self.state, now, now))
+        self.journal_id = cursor.lastrowid
+        self._setPendingDirectories(cursor, reversed(self.folders))
+        self.db_conn.commit()
+
+    def load(self, journal_id):
+        """
+        Load the journal of an unfinished run. Return False if it doesn't
+        exist.
+        """
+        cursor = self.db_conn.cursor()
+        cursor.execute("""SELECT folders, cache_types, reconcile, full_speed,
+                          state
+                          FROM index_journal
+                          WHERE id=?""", (journal_id,))
+        row = cursor.fetchone()
+        if row is None:
+            return False
+        self.journal_id = journal_id
+        self.folders = [folder for folder in str(row[0]).split('\0')
+            if folder]
+        self.cache_types = [str(cache_type)
+            for cache_type in row[1].split(',') if cache_type]
+        self.reconcile = bool(row[2])
+        self.full_speed = bool(row[3])
+        self.state = str(row[4])
+        return True
+
+    def getPendingDirectories(self):
+        """Return the directories that are still to be walked in the order
+        of the walk stack."""
+        cursor = self.db_conn.cursor()
+        cursor.execute("""SELECT path
+                          FROM index_journal_directory
+                          WHERE journal=? AND state='pending'
+                          ORDER BY rowid""", (self.journal_id,))
+        return [str(row[0]) for row in cursor.fetchall()]
+
+    def getWalkedDirectories(self):
+        """Return (walked, unchanged) lists of the directories that have
+        been walked. See IndexerThread._walk."""
+        cursor = self.db_conn.cursor()
+        cursor.execute("""SELECT path, state
+                          FROM index_journal_directory
+                          WHERE journal=? AND state!='pending'
+                          ORDER BY rowid""", (self.journal_id,))
+        walked = []
+        unchanged = []
+        for path, state in cursor.fetchall():
+            walked.append(str(path))
+            if state == 'unchanged':
+                unchanged.append(str(path))
+        return walked, unchanged
+
+    def getFoundFiles(self):
+        """Return filename -> (size, mtime) of the files found by the
+        walk."""
+        cursor = self.db_conn.cursor()
+        cursor.execute("""SELECT filename, filesize, mtime
+                          FROM index_journal_file
+                          WHERE journal=? AND queued=0""", (self.journal_id,))
+        return dict([(str(row[0]), (row[1], row[2]))
+            for row in cursor.fetchall()])
+
+    def getQueue(self):
+        """Return (filename, cached, size) of the files that are still to be
+        indexed."""
+        cursor = self.db_conn.cursor()
+        cursor.execute("""SELECT filename, cached, filesize
+                          FROM index_journal_file
+                          WHERE journal=? AND queued=1
+                          ORDER BY rowid""", (self.journal_id,))
+        return [(str(row[0]), bool(row[1]), row[2])
+            for row in cursor.fetchall()]
+
+    def addDirectory(self, path, unchanged=False):
+        """Record a walked directory at the next checkpoint."""
+        if unchanged:
+            self._directories.append((path, 'unchanged'))
+        else:
+            self._directories.append((path, 'walked'))
+
+    def addFile(self, filename, stats):
+        """
+        Record a found file at the next checkpoint.
+        @param filename: Absolute path of the file
+        @param stats: (size, mtime) of the file
+        """
+        self._files.append((filename, stats))
+
+    def fileIndexed(self, filename):
+        """Remove an indexed file from the queue at the next checkpoint."""
+        self._indexed.append(filename)
+
+    def isCheckpointDue(self):
+        """Return True if interval files have changed since the last
+        checkpoint."""
+        return len(self._files) + len(self._indexed) >= self.interval
+
+    def checkpointWalk(self, pending):
+        """
+        Write the walked directories and found files and replace the walk
+        cursor. Commits.
+        @param pending: Directories that are still to be walked, in the order
+            of the walk stack
+        """
+        cursor = self.db_conn.cursor()
+        cursor.executemany("""INSERT INTO index_journal_directory(journal,
+                              path, state)
+                              VALUES(?,?,?)""", [(self.journal_id,
+                              sqlite.Binary(path), state)
+                              for path, state in self._directories])
+        cursor.executemany("""INSERT INTO index_journal_file(journal,
+                              filename, filesize, mtime, queued, cached)
+                              VALUES(?,?,?,?,0,0)""", [(self.journal_id,
+                              sqlite.Binary(filename), size, mtime)
+                              for filename, (size, mtime) in self._files])
+        cursor.execute("""DELETE FROM index_journal_directory
+                          WHERE journal=? AND state='pending'""",
+                          (self.journal_id,))
+        self._setPendingDirectories(cursor, pending)
+        self._directories = []
+        self._files = []
+        self._commit(cursor)
+
+    def setQueue(self, queue):
+        """
+        End the walk and store the files to index instead of the found
+        files. Commits.
+        @param queue: List of (filename, cached, size) tuples
+        """
+        self.state = self.INDEXING
+        cursor = self.db_conn.cursor()
+        cursor.execute("DELETE FROM index_journal_directory WHERE journal=?",
+            (self.journal_id,))
+        cursor.execute("DELETE FROM index_journal_file WHERE journal=?",
+            (self.journal_id,))
+        cursor.executemany("""INSERT INTO index_journal_file(journal,
+                              filename, filesize, mtime, queued, cached)
+                              VALUES(?,?,?,0,1,?)""", [(self.journal_id,
+                              sqlite.Binary(filename), size, int(cached))
+                              for filename, cached, size in queue])
+        cursor.execute("UPDATE index_journal SET state=? WHERE id=?",
+            (self.state, self.journal_id))
+        self._directories = []
+        self._files = []
+        self._commit(cursor)
+
+    def checkpoint(self):
+        """Remove the files that have been indexed since the last checkpoint
+        from the queue. Commits, so the caches must have written their
+        rows of those files first."""
+        cursor = self.db_conn.cursor()
+        cursor.executemany("""DELETE FROM index_journal_file
+                              WHERE journal=? AND filename=?""",
+                              [(self.journal_id, sqlite.Binary(filename))
+                              for filename in self._indexed])
+        self._indexed = []
+        self._commit(cursor)
+
+    def finish(self):
+        """Delete the journal of a finished run. Commits."""
+        cursor = self.db_conn.cursor()
+        for table, column in (('index_journal_directory', 'journal'),
+            ('index_journal_file', 'journal'), ('index_journal', 'id')):
+            cursor.execute("DELETE FROM %s WHERE %s=?" % (table, column),
+                (self.journal_id,))
+        self.db_conn.commit()
+        self._directories = []
+        self._files = []
+        self._indexed = []
+        self.journal_id = None
+
+    def _setPendingDirectories(self, cursor, pending):
+        """Store the walk cursor. Not committed."""
+        cursor.executemany("""INSERT INTO index_journal_directory(journal,
+                              path, state)
+                              VALUES(?,?,'pending')""", [(self.journal_id,
+                              sqlite.Binary(path)) for path in pending])
+
+    def _commit(self, cursor):
+        """Update the checkpoint time and commit."""
+        cursor.execute("UPDATE index_journal SET checkpointed=? WHERE id=?",
+            (time.time(), self.journal_id))
+        self.db_conn.commit()
@@ -0,0 +1,138 @@
+# Copyright (c) 2009 Entertainer Developers - See COPYING - GPLv2
+'''IndexProgress - Counts and publishes the progress of an indexer.'''
+
+import time
+
+from entertainerlib.backend.core.message_type_priority import MessageType
+from entertainerlib.configuration import Configuration
+
+
+class IndexProgress:
+    """
+    Progress of one IndexerThread.
+
+    The indexer reports found files, the time spent in its stages and every
+    file that it has indexed. The progress is published as an
+    INDEXING_PROGRESS message at most once per interval, however often it is
+    updated, so that clients can't slow indexing down. INDEXING_FINISHED is
+    always published at the end.
+
+    The data of the messages is a dictionary:
+        folders: Folders that are indexed
+        state: 'walking', 'indexing' or 'finished'
+        discovered: Number of supported files found
+        queued: Number of new and changed files to index
+        processed: Number of indexed files
+        failed: Number of files that couldn't be indexed
+        bytes: Bytes of the indexed files
+        files_per_second: Indexed files per second
+        eta: Seconds until indexing is done or None if unknown
+        elapsed: Seconds since indexing started
+        stage_latency: Dictionary of stage -> seconds. 'walk' and 'compare'
+            are the durations of those stages, 'index' is the mean time
+            that indexing one file takes.
+    """
+
+    def __init__(self, folders, publish, interval=None):
+        """
+        Create a new IndexProgress.
+        @param folders: Folders that are indexed
+        @param publish: Function that is called with a message type and data
+        @param interval: Minimum number of seconds between progress messages.
+            Read from the configuration if None. 0 means that only the
+            finished message is published.
+        """
+        if interval is None:
+            interval = Configuration().indexing_progress_interval
+        self.interval = interval
+        self.publish = publish
+        self.folders = list(folders)
+
+        self.state = 'walking'
+        self.discovered = 0
+        self.queued = 0
+        self.processed = 0
+        self.failed = 0
+        self.bytes = 0
+        self.started = time.time()
+        # Time when indexing of the queued files started
+        self.indexing_started = None
+        # Stage -> seconds spent in it
+        self.stage_time = {}
+        self._published = self.started
+
+    def addDiscovered(self, count):
+        """Count supported files that were found."""
+        self.discovered += count
+
+    def addStageTime(self, stage, seconds):
+        """Count time that was spent in a stage."""
+        self.stage_time[stage] = self.stage_time.get(stage, 0) + seconds
+
+    def startIndexing(self, queued):
+        """
+        Start the indexing stage.
+        @param queued: Number of files to index
+        """
+        self.state = 'indexing'
+        self.queued = queued
+        self.indexing_started = time.time()
+
+    def fileIndexed(self, size, seconds, failed=False):
+        """
+        Count an indexed file.
+        @param size: Size of the file in bytes
+        @param seconds: Time that indexing the file took
+        @param failed: True if the file couldn't be indexed
+        """
+        self.processed += 1
+        self.bytes += size
+        if failed:
+            self.failed += 1
+        self.addStageTime('index', seconds)
+
+    def update(self):
+        """Publish the progress if the interval has passed."""
+        now = time.time()
+        if self.interval > 0 and now - self._published >= self.interval:
+            self._published = now
+            self.publish(MessageType.INDEXING_PROGRESS, self.getData())
+
+    def finish(self):
+        """Publish the final progress."""
+        self.state = 'finished'
+        self.publish(MessageType.INDEXING_FINISHED, self.getData())
+
+    def getData(self):
+        """Return the progress as a dictionary. See the class."""
+        now = time.time()
+        rate = 0.0
+        eta = None
+        if self.indexing_started is not None:
+            elapsed = now - self.indexing_started
+            if elapsed > 0:
+                rate = self.processed / elapsed
+            if rate > 0:
+                eta = int((self.queued - self.processed) / rate)
+        if self.state == 'finished':
+            eta = 0
+
+        latency = {}
+        for stage, seconds in self.stage_time.iteritems():
+            if stage == 'index':
+                seconds = seconds / max(self.processed, 1)
+            latency[stage] = seconds
+
+        return {
+            'folders' : self.folders,
+            'state' : self.state,
+            'discovered' : self.discovered,
+            'queued' : self.queued,
+            'processed' : self.processed,
+            'failed' : self.failed,
+            'bytes' : self.bytes,
+            'files_per_second' : rate,
+            'eta' : eta,
+            'elapsed' : now - self.started,
+            'stage_latency' : latency,
+            }
@@ -0,0 +1,130 @@
+# Copyright (c) 2009 Entertainer Developers - See COPYING - GPLv2
+'''IndexQueue - Files waiting to be indexed, with priority lanes.'''
+
+import os
+import threading
+import time
+
+from collections import deque
+
+
+class IndexQueue:
+    """
+    Queue of files that an IndexerThread has to index.
+
+    Files are taken in the order they were put, except for prioritized
+    files. A client can prioritize a cache type ('image', 'music' or
+    'video') or a path, for example the folder the user is browsing. Pending
+    and future files of that type or under that path are moved to a lane
+    that is served before the normal lane. The most recently prioritized
+    lane is served first. Only MAX_PRIORITIES targets are remembered, the
+    files of older ones go back to the front of the normal lane.
+
+    Files are taken one at a time, so a new priority takes effect when the
+    file that is being indexed is done. The queue is used by the indexer
+    thread and the thread that delivers messages, so it is locked.
+    """
+
+    # Number of prioritized targets that are remembered
+    MAX_PRIORITIES = 8
+
+    def __init__(self):
+        """Create a new empty IndexQueue."""
+        self._lock = threading.Lock()
+        self._normal = deque()
+        # Prioritized targets, the most recent first
+        self._targets = []
+        # Target -> deque of its files
+        self._lanes = {}
+        # Target -> time when it was prioritized
+        self._prioritized = {}
+
+    def __len__(self):
+        self._lock.acquire()
+        try:
+            return len(self._normal) + sum([len(lane)
+                for lane in self._lanes.itervalues()])
+        finally:
+            self._lock.release()
+
+    def put(self, cache_type, filename, item):
+        """
+        Add a file to the queue.
+        @param cache_type: Type of the cache that indexes the file
+        @param filename: Absolute path of the file
+        @param item: Object that get() returns for the file
+        """
+        self._lock.acquire()
+        try:
+            entry = (cache_type, filename, item)
+            for target in self._targets:
+                if self._matches(target, entry):
+                    self._lanes[target].append(entry)
+                    return
+            self._normal.append(entry)
+        finally:
+            self._lock.release()
+
+    def get(self):
+        """
+        Remove and return (target, item) of the next file or None if the
+        queue is empty. target is the prioritized target that the file
+        matched or None if the file wasn't prioritized.
+        """
+        self._lock.acquire()
+        try:
+            for target in self._targets:
+                if self._lanes[target]:
+                    return target, self._lanes[target].popleft()[2]
+            if self._normal:
+                return None, self._normal.popleft()[2]
+            return None
+        finally:
+            self._lock.release()
+
+    def prioritize(self, target):
+        """
+        Serve the files of a cache type or under a path before other files.
+        @param target: Cache type or absolute path
+        """
+        self._lock.acquire()
+        try:
+            if target in self._targets:
+                self._targets.remove(target)
+            else:
+                self._lanes[target] = deque()
+            self._targets.insert(0, target)
+            self._prioritized[target] = time.time()
+
+            # Take the files of the target from the other lanes
+            for lane in [self._lanes[other] for other in self._targets[1:]
+                ] + [self._normal]:
+                remaining = deque()
+                for entry in lane:
+                    if self._matches(target, entry):
+                        self._lanes[target].append(entry)
+                    else:
+                        remaining.append(entry)
+                lane.clear()
+                lane.extend(remaining)
+
+            while len(self._targets) > self.MAX_PRIORITIES:
+                oldest = self._targets.pop()
+                self._normal.extendleft(reversed(self._lanes.pop(oldest)))
+                del self._prioritized[oldest]
+        finally:
+            self._lock.release()
+
+    def getPrioritizedTime(self, target):
+        """Return the time when a target was prioritized or None."""
+        self._lock.acquire()
+        try:
+            return self._prioritized.get(target)
+        finally:
+            self._lock.release()
+
+    def _matches(self, target, entry):
+        """Return True if a queued file belongs to a prioritized target."""
+        cache_type, filename = entry[:2]
+        return (target == cache_type or target == filename or
+            filename.startswith(os.path.join(target, '')))
@@ -1,8 +1,25 @@
 # Copyright (c) 2009 Entertainer Developers - See COPYING - GPLv2
 '''IndexerThread - Walks directories recursively and adds files to cache.'''
 
+import os
+import stat
 import threading
+import time
 
+from entertainerlib.backend.core.message import Message
+from entertainerlib.configuration import Configuration
+from entertainerlib.logger import Logger
+
+from entertainerlib.backend.components.mediacache.directory_table import (
+    DirectoryTable)
+from entertainerlib.backend.components.mediacache.index_journal import (
+    IndexJournal)
+from entertainerlib.backend.components.mediacache.index_progress import (
+    IndexProgress)
+from entertainerlib.backend.components.mediacache.index_queue import (
+    IndexQueue)
+from entertainerlib.backend.components.mediacache.io_throttle import (
+    IOThrottle)
 from entertainerlib.backend.components.mediacache.image_cache import ImageCache
 from entertainerlib.backend.components.mediacache.music_cache import MusicCache
 from entertainerlib.backend.components.mediacache.video_cache import VideoCache
@@ -11,21 +28,84 @@ class IndexerThread(threading.Thread):
     """
     IndexerThread
 
-    This is a thread that indexes all the media into media cache. Each media
-    type has it's own indexing thread. Each thread therefore has a media type
-    which is set with setCacheType() -method.
+    This is a thread that indexes all the media into media cache. One thread
+    can index several media types. Media types are set with setCacheTypes()
+    -method. Root folders are walked only once and each found file is routed
+    to the cache that handles its file extension.
+
+    Indexing doesn't rebuild the cache. Root folders are walked and only the
+    size and modification time of each found file is compared with the values
+    stored in the cache, so only new, changed and removed files are processed.
+
+    Directories are recorded in a DirectoryTable. On later walks a directory
+    whose modification time hasn't changed isn't listed and its files aren't
+    stat'ed, only its recorded subdirectories are checked. Changes to the
+    contents of files in such directories are noticed by the
+    FileSystemObserver, not by the walk. If the filesystem doesn't update
+    directory modification times reliably, trust_directory_mtimes should be
+    turned off in the configuration.
+
+    Found files are indexed one at a time from an IndexQueue. Clients can
+    prioritize a cache type or a path with prioritize(), for example the
+    album the user is browsing. Prioritized files are indexed next, without
+    pacing, and are written to the cache right away.
+
+    Every run keeps an IndexJournal with its walk cursor and its queue. If
+    the backend is stopped in the middle of a run, the run is continued
+    from its last checkpoint when the next indexer starts. See
+    setResumedJournals().
+
+    stop() ends the run after the file that is being indexed. Buffered rows
+    are written to the caches and the journal is kept, so the run continues
+    on the next start.
+
+    If a MessageBus is set, the progress of indexing is published on it with
+    INDEXING_PROGRESS and INDEXING_FINISHED messages. See IndexProgress.
     """
 
+    # Seconds before the walk started in which a directory modification time
+    # isn't trusted. A directory can change again within the resolution of
+    # its modification time without the time changing.
+    MTIME_RESOLUTION = 2
+
+    # Cache classes of the allowed cache types
+    CACHE_CLASSES = {
+        "image" : ImageCache,
+        "music" : MusicCache,
+        "video" : VideoCache,
+        }
+
     def __init__(self):
         """
         Create a new indexer thread.
         """
         threading.Thread.__init__(self)
         self.setName("IndexerThread")
-        self.cache_type = None
+        self.logger = Logger().getLogger(
+            'backend.components.mediacache.IndexerThread')
+        self.cache_types = []
         # Root folders (Root folders that should be indexed.
         # Get from content.conf)
         self.root_folders = None
+        # Reconcile the whole cache instead of the root folders only
+        self.reconcile = False
+        # Throttle shared by all the caches of this indexer
+        self.throttle = IOThrottle()
+        self.full_speed = False
+        # Skip directories whose modification time hasn't changed
+        self.trust_directory_mtimes = Configuration().trust_directory_mtimes
+        # Files waiting to be indexed
+        self.queue = IndexQueue()
+        # MessageBus where progress is published
+        self.message_bus = None
+        # IndexProgress of the current run
+        self.progress = None
+        # IndexJournal of the current run
+        self.journal = None
+        # Ids of journals of unfinished runs to continue first
+        self.resumed_journals = []
+        # Set when the backend is stopped
+        self.stopping = threading.Event()
 
     def setCacheType(self, cache_type):
         """
@@ -33,12 +113,18 @@ class IndexerThread(threading.Thread):
         'video'
         @param cache_type: Cache type (String)
         """
-        if (cache_type != "image" and
-            cache_type != "music" and
-            cache_type != "video"):
-            raise Exception("Illegal cache type.")
-        else:
-            self.cache_type = cache_type
+        self.setCacheTypes([cache_type])
+
+    def setCacheTypes(self, cache_types):
+        """
+        Set cache types for this indexer. Allowed values are 'image', 'music'
+        and 'video'
+        @param cache_types: List of cache types (Strings)
+        """
+        for cache_type in cache_types:
+            if cache_type not in self.CACHE_CLASSES:
+                raise Exception("Illegal cache type.")
+        self.cache_types = cache_types
 
     def setFolders(self, folders):
         """
@@ -47,20 +133,347 @@ class IndexerThread(threading.Thread):
         """
         self.root_folders = folders
 
+    def setReconcile(self, reconcile):
+        """
+        Set reconcile mode. In reconcile mode the root folders are expected to
+        be all the media folders, so cached files outside of them are removed.
+        @param reconcile: Boolean
+        """
+        self.reconcile = reconcile
+
+    def setFullSpeed(self, full_speed):
+        """
+        Index without pacing. This should be used for initial imports, while
+        maintenance indexing should be paced to stay unobtrusive.
+        @param full_speed: Boolean
+        """
+        self.full_speed = full_speed
+
+    def setResumedJournals(self, journal_ids):
+        """
+        Continue unfinished runs before this indexer's own run.
+        @param journal_ids: Ids of IndexJournals, see
+            IndexJournal.getUnfinished()
+        """
+        self.resumed_journals = journal_ids
+
+    def setMessageBus(self, message_bus):
+        """
+        Set MessageBus where the progress of indexing is published.
+        @param message_bus: MessageBus object
+        """
+        self.message_bus = message_bus
+
+    def prioritize(self, target):
+        """
+        Index files of a cache type or under a path before other files. Can
+        be called from any thread, also before the files have been found.
+        @param target: Cache type or absolute path
+        """
+        self.queue.prioritize(target)
+
+    def stop(self):
+        """
+        Stop indexing after the current file. Can be called from any thread.
+        Wait for the thread with join() to be sure that the indexed files
+        have been written.
+        """
+        self.stopping.set()
+
     def run(self):
         """
-        Walk root directories recursively and add all found files to the cache.
+        Continue the unfinished runs that have been set with
+        setResumedJournals(), then walk root directories recursively and
+        synchronize the caches with the found files.
+        """
+        for journal_id in self.resumed_journals:
+            if self.stopping.isSet():
+                return
+            journal = IndexJournal()
+            try:
+                if journal.load(journal_id):
+                    self.logger.info("Resuming indexing of %s" %
+                        ", ".join(journal.folders))
+                    self._run(journal)
+            except Exception, e:
+                # A run that can't be continued would fail again on every
+                # start and keep the folders from being indexed, so it is
+                # dropped. The next full run indexes its folders again.
+                self.logger.error("Couldn't resume indexing run %s: %s" %
+                    (journal_id, e))
+                self._discardJournal(journal, journal_id)
+        if self.root_folders == None or self.stopping.isSet():
+            return
+        journal = IndexJournal()
+        journal.begin(self.root_folders, self.cache_types, self.reconcile,
+            self.full_speed)
+        self._run(journal)
+
+    def _run(self, journal):
+        """
+        Index the folders of a journal from its last checkpoint.
+        @param journal: IndexJournal of the run
+        """
+        started = time.time()
+        self.journal = journal
+        self.throttle.setFullSpeed(journal.full_speed)
+        self.progress = IndexProgress(journal.folders, self._publish)
+
+        # Caches have to be created in this thread. SQLite connections can
+        # only be used in the thread that created them.
+        caches = [self.CACHE_CLASSES[cache_type]()
+            for cache_type in journal.cache_types]
+        extensions = {}
+        for cache in caches:
+            cache.setThrottle(self.throttle)
+            for extension in cache.SUPPORTED_FILE_EXTENSIONS:
+                extensions[extension] = cache
+
+        try:
+            if journal.state == IndexJournal.WALKING:
+                self._walkAndCompare(journal, caches, extensions, started)
+            else:
+                for filename, cached, size in journal.getQueue():
+                    cache = self._getCache(filename, extensions)
+                    if cache is None:
+                        continue
+                    cache_type = journal.cache_types[caches.index(cache)]
+                    self.queue.put(cache_type, filename, (cache, cache_type,
+                        filename, cached, size))
+                self.progress.addDiscovered(len(self.queue))
+            self.progress.startIndexing(len(self.queue))
+            self._indexQueue(caches, started)
+            if self.stopping.isSet():
+                # The caches have written their rows, so the indexed files
+                # can be removed from the journal. The rest is indexed on
+                # the next start.
+                journal.checkpoint()
+                self.logger.info("Indexing stopped, %d files left" %
+                    len(self.queue))
+            else:
+                journal.finish()
+        finally:
+            self.progress.finish()
+            self.journal = None
+
+    def _discardJournal(self, journal, journal_id):
+        """
+        Delete the journal of a run that failed and the files that the run
+        left in the queue.
+        @param journal: IndexJournal of the run
+        @param journal_id: Id of the journal
+        """
+        while self.queue.get() is not None:
+            pass
+        journal.journal_id = journal_id
+        try:
+            journal.finish()
+        except Exception, e:
+            self.logger.error("Couldn't delete indexing run %s: %s" %
+                (journal_id, e))
+
+    def _walkAndCompare(self, journal, caches, extensions, started):
+        """
+        Walk the folders of a journal from its walk cursor, compare the found
+        files with the caches and put the files to index to the queue.
+        @param journal: IndexJournal of the run
+        @param caches: Caches of the run
+        @param extensions: Dictionary of file extension -> Cache
+        @param started: Time when the run started
         """
-        if self.cache_type == "image":
-            cache = ImageCache()
-        elif self.cache_type == "music":
-            cache = MusicCache()
-        elif self.cache_type == "video":
-            cache = VideoCache()
+        files = dict([(cache, {}) for cache in caches])
+        for filename, stats in journal.getFoundFiles().iteritems():
+            cache = self._getCache(filename, extensions)
+            if cache is not None:
+                files[cache][filename] = stats
+        directories, unchanged = journal.getWalkedDirectories()
+        self.progress.addDiscovered(
+            sum([len(found) for found in files.values()]))
 
-        if self.root_folders == None:
+        unavailable = []
+        for element in journal.folders:
+            if not os.path.isdir(element):
+                self.logger.error(
+                    "Indexing a directory failed. Path doesn't exist: " +
+                    element)
+                unavailable.append(element)
+        pending = [path for path in journal.getPendingDirectories()
+            if path not in unavailable]
+        self._walk(pending, journal.cache_types, extensions, files,
+            directories, unchanged, DirectoryTable())
+        # Also commits the directories recorded by the walk
+        journal.checkpointWalk([])
+        self.progress.addStageTime('walk', time.time() - started)
+        self.logger.debug("Walked %d directories, %d of them unchanged" %
+            (len(directories), len(unchanged)))
+
+        if journal.reconcile:
+            roots = None
+        else:
+            roots = journal.folders
+        compare_started = time.time()
+        queue = []
+        for cache, cache_type in zip(caches, journal.cache_types):
+            changed = cache.prepareSynchronize(files[cache], directories,
+                roots, unavailable, unchanged)
+            # Sorted, so that folders are completed one at a time
+            changed.sort()
+            for filename, cached in changed:
+                size = files[cache].get(filename, (0, 0))[0]
+                self.queue.put(cache_type, filename, (cache, cache_type,
+                    filename, cached, size))
+                queue.append((filename, cached, size))
+        journal.setQueue(queue)
+        self.progress.addStageTime('compare', time.time() - compare_started)
+
+    def _getCache(self, filename, extensions):
+        """Return the cache of a file by its extension or None."""
+        return extensions.get(filename[filename.rfind('.') + 1:].lower())
+
+    def _indexQueue(self, caches, started):
+        """
+        Index the files in the queue until it is empty.
+        @param caches: Caches of this indexer
+        @param started: Time when indexing started
+        """
+        for cache in caches:
+            cache.beginBulkIngest()
+        try:
+            # Cache types and targets whose first file has been logged
+            reported_types = set()
+            reported_targets = set()
+            while not self.stopping.isSet():
+                entry = self.queue.get()
+                if entry is None:
+                    break
+                target, (cache, cache_type, filename, cached, size) = entry
+                failures = cache.failure_count
+                file_started = time.time()
+                cache.indexFile(filename, cached, paced=target is None)
+                if target is not None:
+                    # The user is waiting for it
+                    cache.flushBulkIngest()
+                self.progress.fileIndexed(size, time.time() - file_started,
+                    cache.failure_count > failures)
+                self.progress.update()
+                if self.journal is not None:
+                    self.journal.fileIndexed(filename)
+                    if self.journal.isCheckpointDue():
+                        # The journal mustn't be ahead of the caches
+                        for indexed_cache in caches:
+                            indexed_cache.flushBulkIngest()
+                        self.journal.checkpoint()
+                # Rows of caches that got no new files for a while
+                for indexed_cache in caches:
+                    indexed_cache.flushBulkIngestIfDue()
+
+                # Time to the first file, for example to the first thumbnail
+                # of a new folder
+                if cache_type not in reported_types:
+                    reported_types.add(cache_type)
+                    self.logger.info("First %s file indexed in %.2f s" %
+                        (cache_type, time.time() - started))
+                prioritized = self.queue.getPrioritizedTime(target)
+                if prioritized is not None and target not in reported_targets:
+                    reported_targets.add(target)
+                    self.logger.info("First file of %s indexed %.2f s after "
+                        "it was prioritized" % (target,
+                        time.time() - prioritized))
+        finally:
+            for cache in caches:
+                cache.endBulkIngest()
+
+    def _publish(self, message_type, data):
+        """Publish progress on the message bus if one is set."""
+        if self.message_bus is None:
             return
+        self.message_bus.notifyMessage(Message(message_type, data))
+
+    def _walk(self, pending, cache_types, extensions, files, directories,
+        unchanged, directory_table):
+        """
+        Walk directories once and collect sizes and modification times of
+        files for the caches that accept them. Like os.walk, symbolic links
+        to directories are not followed. If the indexer has a journal, found
+        files and the walk cursor are checkpointed in it.
+        @param pending: Stack of directories to walk, the last one first
+        @param cache_types: Cache types the directories are walked for
+        @param extensions: Dictionary of file extension -> Cache
+        @param files: Dictionary of Cache -> found files of that cache
+        @param directories: List where walked directories are appended
+        @param unchanged: List where directories that weren't listed,
+            because they haven't changed since the last walk, are appended
+        @param directory_table: DirectoryTable of the walked directories
+        """
+        cache_types = set(cache_types)
+        started = time.time()
+        pending = list(pending)
+        while pending:
+            root = pending.pop()
+            try:
+                mtime = os.stat(root).st_mtime
+            except OSError:
+                continue
+            directories.append(root)
+
+            recorded = directory_table.getDirectory(root)
+            if (self.trust_directory_mtimes and recorded is not None and
+                recorded[0] == mtime and cache_types <= recorded[2]):
+                unchanged.append(root)
+                pending.extend(directory_table.getSubdirectories(root))
+                if self.journal is not None:
+                    self.journal.addDirectory(root, unchanged=True)
+                continue
+
+            try:
+                names = os.listdir(root)
+            except OSError, e:
+                self.logger.error("Couldn't list %s: %s" % (root, e))
+                continue
+
+            subdirectories = []
+            found = 0
+            for name in names:
+                filename = os.path.join(root, name)
+                try:
+                    stats = os.lstat(filename)
+                    if stat.S_ISDIR(stats.st_mode):
+                        subdirectories.append(filename)
+                        continue
+                    cache = extensions.get(name[name.rfind('.') + 1:].lower())
+                    if cache is None or not cache.acceptsFile(filename):
+                        continue
+                    if stat.S_ISLNK(stats.st_mode):
+                        stats = os.stat(filename)
+                except OSError:
+                    continue
+                if stat.S_ISREG(stats.st_mode):
+                    files[cache][filename] = (stats.st_size,
+                        int(stats.st_mtime))
+                    found += 1
+                    if self.journal is not None:
+                        self.journal.addFile(filename, files[cache][filename])
 
-        for element in self.root_folders:
-            cache.addDirectory(element)
+            if self.progress is not None:
+                self.progress.addDiscovered(found)
+                self.progress.update()
 
+            walked_types = cache_types
+            if recorded is not None:
+                found = set(subdirectories)
+                for subdirectory in directory_table.getSubdirectories(root):
+                    if subdirectory not in found:
+                        directory_table.removeDirectory(subdirectory)
+                if recorded[0] == mtime:
+                    # Still valid for the types it was walked for before
+                    walked_types = cache_types | recorded[2]
+            if mtime > started - self.MTIME_RESOLUTION:
+                mtime = None
+            directory_table.record(root, mtime, len(names), walked_types)
+            # Subdirectories are walked in alphabetical order
+            subdirectories.sort(reverse=True)
+            pending.extend(subdirectories)
+            if self.journal is not None:
+                self.journal.addDirectory(root)
+                if self.journal.isCheckpointDue():
+                    self.journal.checkpointWalk(pending)
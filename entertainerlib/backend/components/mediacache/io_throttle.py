@@ -0,0 +1,266 @@
+# Copyright (c) 2009 Entertainer Developers - See COPYING - GPLv2
+'''IOThrottle - Paces indexing so that it adapts to the system load.'''
+
+import os
+import threading
+import time
+
+from entertainerlib.configuration import Configuration
+
+
+class IOThrottle(object):
+    """
+    IOThrottle paces media indexers.
+
+    Indexers call wait() after each processed file. The throttle sleeps long
+    enough to keep indexing within a budget, which is either files per second
+    ('files'), bytes per second ('bytes') or a share of time ('utilization').
+    In utilization mode the indexer works at most target_utilization of the
+    time: after a file that took t seconds to process, the throttle sleeps
+    t * (1 - u) / u seconds. The budget is scaled up while the system is idle
+    and scaled down while disks are busy or the CPU load is high, so indexing
+    is fast on an idle machine and unobtrusive when the machine is used. Only
+    the load of other processes counts: the bytes that the indexer has read
+    are subtracted from the disk activity, and the indexer's busy threads
+    and the thumbnail worker processes from the load average. Mode
+    'none' or full speed disables pacing, which is used for initial imports.
+    The throttle is thread safe and can be shared by several caches.
+    """
+
+    # Throttle modes
+    MODES = ['files', 'bytes', 'utilization', 'none']
+
+    # Seconds between system load samples
+    SAMPLE_INTERVAL = 1.0
+
+    # Limits of the budget scale factor
+    MIN_FACTOR = 0.125
+    MAX_FACTOR = 16.0
+
+    # Weight of the latest sample in the measured rates
+    RATE_SMOOTHING = 0.2
+
+    # Longest time counted as work on one file in utilization mode, so an
+    # idle period between runs doesn't count as work
+    MAX_WORK_TIME = 10.0
+
+    def __init__(self, mode=None, files_per_second=None,
+        bytes_per_second=None, target_utilization=None, workers=None):
+        """
+        Create a new IOThrottle. Values that are not given are read from the
+        configuration.
+        @param workers: Number of thumbnail worker processes
+        """
+        config = Configuration()
+        if mode is None:
+            mode = config.throttle_mode
+        if mode not in self.MODES:
+            raise ValueError("Unknown throttle mode: %s" % mode)
+        self.mode = mode
+        if files_per_second is None:
+            files_per_second = config.throttle_files_per_second
+        self.files_per_second = float(files_per_second)
+        if bytes_per_second is None:
+            bytes_per_second = config.throttle_bytes_per_second
+        self.bytes_per_second = float(bytes_per_second)
+        if target_utilization is None:
+            target_utilization = config.throttle_target_utilization
+        self.target_utilization = float(target_utilization)
+        self._cpus = self._count_cpus()
+        if workers is None:
+            workers = config.thumbnail_workers
+        if workers <= 0:
+            workers = self._cpus
+        self.workers = workers
+
+        self.full_speed = False
+        self.factor = 1.0
+        self.utilization = 0.0
+        self._lock = threading.Lock()
+        self._next_time = time.time()
+        # Time when wait() last returned in each thread
+        self._resumed = threading.local()
+        self._last_sample = 0
+        self._disk_stats = None
+        # Work of the indexer since the last sample
+        self._busy_time = 0.0
+        self._own_bytes = 0
+
+        # Measured rates
+        self._files_rate = 0.0
+        self._bytes_rate = 0.0
+        self._last_file = None
+
+    def setFullSpeed(self, full_speed):
+        """
+        Disable or enable pacing. Full speed is meant for initial imports.
+        @param full_speed: Boolean
+        """
+        self.full_speed = full_speed
+
+    @property
+    def rate(self):
+        '''Measured indexing rate in files per second.'''
+        return self._files_rate
+
+    @property
+    def bytes_rate(self):
+        '''Measured indexing rate in bytes per second.'''
+        return self._bytes_rate
+
+    @property
+    def allowed_rate(self):
+        '''Current budget in files or bytes per second, or share of time in
+        utilization mode. None if unlimited.'''
+        if self.full_speed or self.mode == 'none':
+            return None
+        if self.mode == 'bytes':
+            return self.bytes_per_second * self.factor
+        if self.mode == 'utilization':
+            return min(1.0, self.target_utilization * self.factor)
+        return self.files_per_second * self.factor
+
+    def wait(self, size=0):
+        """
+        Record a processed file and sleep as long as the budget requires.
+        @param size: Number of bytes read for the file
+        """
+        now = time.time()
+        work_time = now - getattr(self._resumed, 'time', now)
+        self._lock.acquire()
+        try:
+            self._measure(now, size)
+            self._busy_time += min(work_time, self.MAX_WORK_TIME)
+            self._own_bytes += size
+            if now - self._last_sample >= self.SAMPLE_INTERVAL:
+                self._adapt(now)
+            delay = self._getDelay(now, size, work_time)
+        finally:
+            self._lock.release()
+
+        if delay > 0:
+            time.sleep(delay)
+        self._resumed.time = time.time()
+
+    def _getDelay(self, now, size, work_time):
+        '''
+        Return the seconds to sleep after a file. Called with the lock.
+        @param now: Current time
+        @param size: Number of bytes read for the file
+        @param work_time: Seconds spent on the file since the last wait()
+        '''
+        allowed = self.allowed_rate
+        if allowed is None or allowed <= 0:
+            self._next_time = now
+            return 0
+        if self.mode == 'utilization':
+            work_time = min(work_time, self.MAX_WORK_TIME)
+            return work_time * (1 - allowed) / allowed
+        if self.mode == 'bytes':
+            cost = max(size, 1)
+        else:
+            cost = 1
+        self._next_time = max(now, self._next_time) + cost / allowed
+        return self._next_time - now
+
+    def _measure(self, now, size):
+        '''Update the measured files and bytes rates.'''
+        if self._last_file is not None:
+            elapsed = max(now - self._last_file, 0.001)
+            alpha = self.RATE_SMOOTHING
+            self._files_rate = ((1 - alpha) * self._files_rate +
+                alpha / elapsed)
+            self._bytes_rate = ((1 - alpha) * self._bytes_rate +
+                alpha * size / elapsed)
+        self._last_file = now
+
+    def _adapt(self, now):
+        '''Scale the budget by the disk utilisation and CPU load of other
+        processes.'''
+        elapsed = now - self._last_sample
+        self._last_sample = now
+        # Number of indexer threads that were busy on average
+        busy_threads = 0.0
+        if elapsed > 0:
+            busy_threads = self._busy_time / elapsed
+        self.utilization = self._disk_utilization(elapsed, self._own_bytes)
+        load = self._load(busy_threads + self.workers)
+        self._busy_time = 0.0
+        self._own_bytes = 0
+
+        if self.utilization > self.target_utilization or load > 1.0:
+            self.factor = max(self.MIN_FACTOR, self.factor / 2)
+        elif self.utilization < self.target_utilization / 2 and load < 0.5:
+            self.factor = min(self.MAX_FACTOR, self.factor * 1.5)
+
+    def _load(self, own_load):
+        '''
+        Return the CPU load average per CPU without the indexer's own load.
+        @param own_load: Number of processes and threads of the indexer that
+            may be running
+        '''
+        try:
+            load = self._load_average()
+        except OSError:
+            return 0.0
+        return max(0.0, load - own_load) / self._cpus
+
+    def _load_average(self):
+        '''Return the load average of the last minute.'''
+        return os.getloadavg()[0]
+
+    def _disk_utilization(self, elapsed, own_bytes):
+        '''
+        Return the utilisation (0.0 - 1.0) of the busiest disk by other
+        processes since the last sample. The busy time of a disk is scaled
+        by the share of its transferred bytes that the indexer didn't read.
+        Returns 0.0 where /proc/diskstats is not available.
+        @param elapsed: Seconds since the last sample
+        @param own_bytes: Bytes that the indexer has read since the last
+            sample
+        '''
+        try:
+            stats = self._read_disk_stats()
+        except (IOError, OSError, IndexError, ValueError):
+            return 0.0
+
+        previous = self._disk_stats
+        self._disk_stats = stats
+        if previous is None or elapsed <= 0:
+            return 0.0
+        busiest = 0.0
+        for name, (ticks, transferred) in stats.iteritems():
+            last_ticks, last_transferred = previous.get(name,
+                (ticks, transferred))
+            busy = ticks - last_ticks
+            transferred -= last_transferred
+            if transferred > 0:
+                busy *= max(0, transferred - own_bytes) / float(transferred)
+            busiest = max(busiest, busy)
+        return min(1.0, busiest / (elapsed * 1000.0))
+
+    def _read_disk_stats(self):
+        '''Return a dictionary of disk name -> (milliseconds spent doing
+        I/O, bytes read and written).'''
+        disks = set(os.listdir('/sys/block'))
+        stats = open('/proc/diskstats')
+        try:
+            disk_stats = {}
+            for line in stats:
+                fields = line.split()
+                name = fields[2]
+                if (name in disks and not name.startswith('loop') and
+                    not name.startswith('ram')):
+                    # Sectors of 512 bytes read and written
+                    transferred = (int(fields[5]) + int(fields[9])) * 512
+                    disk_stats[name] = (int(fields[12]), transferred)
+        finally:
+            stats.close()
+        return disk_stats
+
+    def _count_cpus(self):
+        '''Return the number of CPUs, 1 if it can't be determined.'''
+        try:
+            return max(1, os.sysconf('SC_NPROCESSORS_ONLN'))
+        except (ValueError, OSError, AttributeError):
+            return 1
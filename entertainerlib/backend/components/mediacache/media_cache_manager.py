@@ -1,65 +1,161 @@
 # Copyright (c) 2009 Entertainer Developers - See COPYING - GPLv2
 '''MediaCacheManager - Downloads metadata and keeps media cache up-to-date'''
 
+from pysqlite2 import dbapi2 as sqlite
+
 from entertainerlib.configuration import Configuration
+from entertainerlib.db.migrator import LegacyMigrator
 from entertainerlib.logger import Logger
 
 from entertainerlib.backend.core.message_type_priority import MessageType
 from entertainerlib.backend.core.message_handler import MessageHandler
+from entertainerlib.backend.components.mediacache.directory_table import (
+    DirectoryTable)
+from entertainerlib.backend.components.mediacache.failure_table import (
+    FailureTable)
+from entertainerlib.backend.components.mediacache.index_journal import (
+    IndexJournal)
 from entertainerlib.backend.components.mediacache.indexer_thread import (
     IndexerThread)
 from entertainerlib.backend.components.mediacache.image_cache import ImageCache
 from entertainerlib.backend.components.mediacache.music_cache import MusicCache
 from entertainerlib.backend.components.mediacache.video_cache import VideoCache
+from entertainerlib.backend.components.mediacache.video_metadata_queue import (
+    VideoMetadataQueue)
 
 class MediaCacheManager(MessageHandler):
     """Makes sure that client has all the data available."""
 
-    def __init__(self):
+    # Cache types that are indexed from media folders
+    CACHE_TYPES = ["image", "music", "video"]
+
+    # Seconds to wait for each indexer when backend is stopped
+    STOP_TIMEOUT = 10
+
+    def __init__(self, message_bus=None):
         """
         Create a new MediaCacheManager object
+        @param message_bus: MessageBus where indexers publish their progress
         """
         MessageHandler.__init__(self)
+        self.message_bus = message_bus
         self.logger = Logger().getLogger(
             'backend.components.mediacache.MediaCacheManager')
         self.config = Configuration()
-        self.video_folders = self.config.media_folders
-        self._index_videos(self.video_folders)
-        self.music_folders = self.config.media_folders
-        self._index_music(self.music_folders)
-        self.image_folders = self.config.media_folders
-        self._index_images(self.image_folders)
-
-        # Should we rebuild to detect files that were removed while backend was
-        # not running?! THERE HAS TO BE A BETTER SOLUTION FOR THIS PROBLEM
-        #self.rebuildAllMediaCaches()
+        # IndexerThreads that have been started
+        self.indexers = []
+
+        self._migrateLegacyCaches()
+
+        # If the caches are still empty, this is the initial import and it
+        # can run at full speed.
+        initial_import = not [table for table in ('image', 'track', 'video')
+            if self.config.MEDIA_DB.has_rows(table)]
+
+        # Runs that were interrupted when backend was stopped continue from
+        # their last checkpoint before anything else.
+        resumed_journals = IndexJournal().getUnfinished()
+        if resumed_journals:
+            self.logger.info("Resuming %d unfinished indexing runs" %
+                len(resumed_journals))
+
+        # Metadata searches that were queued when backend was stopped
+        if self.config.download_metadata:
+            resumed_searches = VideoMetadataQueue().resume()
+            if resumed_searches:
+                self.logger.info("Resuming metadata search of %d videos" %
+                    resumed_searches)
+
+        # Reconcile caches with the filesystem to detect files that were
+        # added, changed or removed while backend was not running.
+        self.media_folders = self.config.media_folders
+        self._index(self.media_folders, self.CACHE_TYPES, reconcile=True,
+            full_speed=initial_import, resumed_journals=resumed_journals)
+
+    def _migrateLegacyCaches(self):
+        """Move the separate cache databases of older versions into the
+        media database."""
+        migrator = LegacyMigrator(self.config.MEDIA_DB)
+        for cache_class, legacy_file in ((ImageCache, self.config.IMAGE_DB),
+            (MusicCache, self.config.MUSIC_DB),
+            (VideoCache, self.config.VIDEO_DB)):
+            if not migrator.needs_migration(legacy_file):
+                continue
+            # Creates the cache tables
+            cache_class()
+            try:
+                copied = migrator.migrate(legacy_file,
+                    cache_class.LEGACY_TABLES)
+            except sqlite.Error, e:
+                self.logger.error("Couldn't migrate %s: %s" % (legacy_file, e))
+                continue
+            self.logger.info("Migrated %d rows from %s" % (copied,
+                legacy_file))
+
+    def stop(self):
+        """
+        Stop the indexers. Files that have been indexed are written to the
+        caches and unfinished runs continue on the next start.
+        """
+        for indexer in self.indexers:
+            indexer.stop()
+        for indexer in self.indexers:
+            indexer.join(self.STOP_TIMEOUT)
 
     def rebuildAllMediaCaches(self):
         """Rebuilds all media caches."""
-        self.rebuildImageCache()
-        self.rebuildMusicCache()
-        self.rebuildVideoCache()
+        self.logger.info("Rebuilding of all media caches requested")
+        ImageCache().clearCache()
+        MusicCache().clearCache()
+        VideoCache().clearCache()
+        DirectoryTable().clear()
+        self._index(self.media_folders, self.CACHE_TYPES, full_speed=True)
 
     def rebuildVideoCache(self):
         """Destroy all current data and index everything from the scratch."""
         self.logger.info("Video cache rebuilding requested")
         video_cache = VideoCache()
         video_cache.clearCache()
-        self._index_videos(self.video_folders)
+        DirectoryTable().clear()
+        self._index(self.media_folders, ["video"], full_speed=True)
 
     def rebuildMusicCache(self):
         """Destroy all current data and index everything from the scratch."""
         self.logger.info("Music cache rebuilding requested")
         music_cache = MusicCache()
         music_cache.clearCache()
-        self._index_music(self.music_folders)
+        DirectoryTable().clear()
+        self._index(self.media_folders, ["music"], full_speed=True)
 
     def rebuildImageCache(self):
         """Destroy all current data and index everything from the scratch."""
         self.logger.info("Image cache rebuilding requested")
         image_cache = ImageCache()
         image_cache.clearCache()
-        self._index_images(self.image_folders)
+        DirectoryTable().clear()
+        self._index(self.media_folders, ["image"], full_speed=True)
+
+    def clearIndexFailures(self):
+        """Forget files that failed to index and index them again."""
+        self.logger.info("Clearing of index failures requested")
+        FailureTable().clear()
+        # Failed files are only found again if their directories are listed
+        DirectoryTable().clear()
+        self._index(self.media_folders, self.CACHE_TYPES, full_speed=True)
+
+    def prioritizeIndexing(self, target):
+        """
+        Index files of a cache type or under a path before other files in
+        all running indexers.
+        @param target: Cache type or absolute path
+        """
+        if isinstance(target, unicode):
+            # Indexers use the byte string paths of the filesystem
+            target = target.encode('utf8')
+        self.indexers = [indexer for indexer in self.indexers
+            if indexer.isAlive()]
+        for indexer in self.indexers:
+            indexer.prioritize(target)
 
     # Implements MessageHandler interface
     def handleMessage(self, message):
@@ -72,78 +168,53 @@ class MediaCacheManager(MessageHandler):
             self.rebuildMusicCache()
         elif message.get_type() == MessageType.REBUILD_IMAGE_CACHE:
             self.rebuildImageCache()
+        elif message.get_type() == MessageType.CLEAR_INDEX_FAILURES:
+            self.clearIndexFailures()
+        elif message.get_type() == MessageType.PRIORITIZE_INDEXING:
+            self.prioritizeIndexing(message.get_data())
 
-    def _index_images(self, folders):
-        """Index images from the given folders and their subfolders"""
-        if len(folders) > 0:
-            indexer = IndexerThread()
-            indexer.setCacheType("image")
-            indexer.setFolders(folders)
-            indexer.start()
-
-    def _index_music(self, folders):
-        """Index music from the given folders and their subfolders"""
-        if len(folders) > 0:
-            indexer = IndexerThread()
-            indexer.setCacheType("music")
-            indexer.setFolders(folders)
-            indexer.start()
-
-    def _index_videos(self, folders):
-        """Index videos from the given folders and their subfolders"""
-        if len(folders) > 0:
+    def _index(self, folders, cache_types, reconcile=False, full_speed=False,
+        resumed_journals=()):
+        """
+        Index media of the given types from the given folders and their
+        subfolders. Folders are walked only once for all the types. If
+        reconcile is True, cached files outside of the given folders are
+        removed. Indexing is paced by an IOThrottle unless full_speed is True.
+        The unfinished runs of resumed_journals are continued first.
+        """
+        if len(folders) > 0 or reconcile:
             indexer = IndexerThread()
-            indexer.setCacheType("video")
+            indexer.setResumedJournals(list(resumed_journals))
+            indexer.setCacheTypes(cache_types)
             indexer.setFolders(folders)
+            indexer.setReconcile(reconcile)
+            indexer.setFullSpeed(full_speed)
+            indexer.setMessageBus(self.message_bus)
             indexer.start()
+            self.indexers.append(indexer)
 
     def _update_content_folders(self):
         """
         This updates media manager's content folders. This method is
         executed when content.conf has been updated. If folders are added
         we need to index them. If folders are removed, we need to remove
-        them from the cache and also from FileSystemObeserver.
+        them from the cache. FileSystemObserver updates its watches itself.
         """
-        updated_video_folders = self.config.media_folders
-        updated_music_folders = self.config.media_folders
-        updated_image_folders = self.config.media_folders
-
-        # Handle image folder changes
-        current_images = set(self.image_folders)
-        updated_images = set(updated_image_folders)
-        removed_images = current_images - updated_images
-        new_images = updated_images - current_images
-        self.image_folders = updated_image_folders
-
-        image_cache = ImageCache()
-        for element in removed_images:
-            image_cache.removeDirectory(element)
-
-        self._index_images(list(new_images))
-
-        # Handle music folder changes
-        current_music = set(self.music_folders)
-        updated_music = set(updated_music_folders)
-        removed_music = current_music - updated_music
-        new_music = updated_music - current_music
-        self.music_folders = updated_music_folders
-
-        music_cache = MusicCache()
-        for element in removed_music:
-            music_cache.removeDirectory(element)
-
-        self._index_music(list(new_music))
-
-        # Handle video folder changes
-        current_videos = set(self.video_folders)
-        updated_videos = set(updated_video_folders)
-        removed_videos = current_videos - updated_videos
-        new_videos = updated_videos - current_videos
-        self.video_folders = updated_video_folders
-
-        video_cache = VideoCache()
-        for element in removed_videos:
-            video_cache.removeDirectory(element)
-
-        self._index_videos(list(new_videos))
-
+        updated_folders = self.config.media_folders
+
+        current = set(self.media_folders)
+        updated = set(updated_folders)
+        removed_folders = current - updated
+        new_folders = updated - current
+        self.media_folders = updated_folders
+
+        for cache in [ImageCache(), MusicCache(), VideoCache()]:
+            for element in removed_folders:
+                cache.removeDirectory(element)
+        directory_table = DirectoryTable()
+        for element in removed_folders:
+            directory_table.removeDirectory(element)
+        directory_table.commit()
+
+        # New folders are imported by user's request, so don't pace them
+        self._index(list(new_folders), self.CACHE_TYPES, full_speed=True)
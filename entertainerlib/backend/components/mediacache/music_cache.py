@@ -2,17 +2,13 @@
 '''MusicCache - Audio file cache.'''
 
 import os
-import time
-import shutil
-
-import eyeD3
-import ogg.vorbis
-from pysqlite2 import dbapi2 as sqlite
 
+from entertainerlib.album_art_service import AlbumArtService
 from entertainerlib.backend.components.mediacache.cache import Cache
 from entertainerlib.configuration import Configuration
-from entertainerlib.download import AlbumArtDownloader
+from entertainerlib.exceptions import TagGetterException
 from entertainerlib.logger import Logger
+from entertainerlib.tag_reader import read_tags
 
 
 class MusicCache(Cache):
@@ -21,7 +17,11 @@ class MusicCache(Cache):
     """
 
     # Supported file formats
-    __SUPPORTED_FILE_EXTENSIONS = ['mp3', 'ogg']
+    SUPPORTED_FILE_EXTENSIONS = ['mp3', 'ogg']
+
+    # Tables of the legacy music.db -> tables in the media database
+    LEGACY_TABLES = { 'track' : 'track', 'playlist' : 'playlist',
+        'playlist_relation' : 'playlist_relation' }
 
     # SQLite database stuff
     __db_conn = None
@@ -39,10 +39,11 @@ class MusicCache(Cache):
             'backend.components.mediacache.MusicCache')
         self.config = Configuration()
 
-        if not os.path.exists(self.config.MUSIC_DB):
-            self.__createMusicCacheDatabase()
-        self.__db_conn = sqlite.connect(self.config.MUSIC_DB)
+        self.__db_conn = self.config.MEDIA_DB.get_connection()
         self.__db_cursor = self.__db_conn.cursor()
+        self.__createMusicCacheTables()
+        self._addMissingColumns(self.__db_cursor, 'track',
+            [('filesize', 'INTEGER'), ('mtime', 'INTEGER')])
 
     def clearCache(self):
         """
@@ -54,18 +55,18 @@ class MusicCache(Cache):
         for element in covers:
             os.remove(os.path.join(self.config.ALBUM_ART_DIR, element))
 
-        os.remove(self.config.MUSIC_DB)
-        self.__createMusicCacheDatabase()
+        self.__db_cursor.execute("DELETE FROM track")
+        self.__db_cursor.execute("DELETE FROM playlist")
+        self.__db_cursor.execute("DELETE FROM playlist_relation")
+        self.__db_conn.commit()
 
     def addFile(self, filename):
         """Add audio file to the cache."""
         filename = filename.encode('utf8')
         if (not self.isFileInCache(filename) and
-            self.isSupportedFormat(filename)):
-            if self.__getFileExtension(filename) == "mp3":
-                self.__addMP3file(filename)
-            elif self.__getFileExtension(filename) == "ogg":
-                self.__addOGGfile(filename)
+            self.isSupportedFormat(filename) and
+            not self._isFailed(filename)):
+            self.__addAudioFile(filename)
 
     def removeFile(self, filename):
         """Remove audio file from the cache."""
@@ -124,26 +125,27 @@ class MusicCache(Cache):
             for root, dirs, files in os.walk(path):
                 for name in files:
                     self.addFile(os.path.join(root, name))
-                    time.sleep(float(self.SLEEP_TIME_BETWEEN_FILES) / 1000)
+                    self._throttle(os.path.join(root, name))
 
 
     def removeDirectory(self, path):
         """Remove directory from the cache."""
+        low, high = self._getSubtreeRange(path)
+
         # Get current artist and albums that are on the removed path
-        self.__db_cursor.execute(
-            """
-            SELECT DISTINCT artist, album
-            FROM track
-            WHERE filename LIKE '
-            """ + path + "%'")
+        self.__db_cursor.execute("""SELECT DISTINCT artist, album
+                                    FROM track
+                                    WHERE filename >= ? AND filename < ?""",
+                                    (low, high))
         result = self.__db_cursor.fetchall()
 
         # Remove tracks from database
-        self.__db_cursor.execute(
-            "DELETE FROM track WHERE filename LIKE '" + path + "%'")
-        self.__db_cursor.execute(
-            "DELETE FROM playlist_relation WHERE filename LIKE '" +
-            path + "%'")
+        self.__db_cursor.execute("""DELETE FROM track
+                                    WHERE filename >= ? AND filename < ?""",
+                                    (low, high))
+        self.__db_cursor.execute("""DELETE FROM playlist_relation
+                                    WHERE filename >= ? AND filename < ?""",
+                                    (low, high))
         self.__db_conn.commit()
 
         # Check which album art we should remove
@@ -176,8 +178,10 @@ class MusicCache(Cache):
 
     def isDirectoryInCache(self, path):
         """Check if directory is in cache."""
-        self.__db_cursor.execute(
-            "SELECT * FROM track WHERE filename LIKE '" + path + "%'")
+        self.__db_cursor.execute("""SELECT filename
+                                    FROM track
+                                    WHERE filename >= ? AND filename < ?
+                                    LIMIT 1""", self._getSubtreeRange(path))
         result = self.__db_cursor.fetchall()
         if len(result) == 0:
             return False
@@ -186,6 +190,7 @@ class MusicCache(Cache):
 
     def isFileInCache(self, filename):
         """Check if file is in cache."""
+        self._flushIfPending(filename)
         self.__db_cursor.execute("""SELECT *
                                     FROM track
                                     WHERE filename=:fn""", {"fn":filename} )
@@ -198,16 +203,36 @@ class MusicCache(Cache):
     def isSupportedFormat(self, filename):
         """Check if file is supported."""
         if (self.__getFileExtension(filename) in
-            self.__SUPPORTED_FILE_EXTENSIONS):
+            self.SUPPORTED_FILE_EXTENSIONS):
             return True
         else:
             return False
 
-    def __createMusicCacheDatabase(self):
-        """Creates a music cache database file."""
-        db_conn = sqlite.connect(self.config.MUSIC_DB)
-        db_cursor = db_conn.cursor()
-        db_cursor.execute("""CREATE TABLE track(
+    def getCachedFiles(self):
+        """Return a dictionary of cached filename -> (size, mtime)."""
+        self.__db_cursor.execute("""SELECT filename, filesize, mtime
+                                    FROM track""")
+        cached = {}
+        for filename, filesize, mtime in self.__db_cursor.fetchall():
+            if filesize is None or mtime is None:
+                cached[filename.encode('utf8')] = None
+            else:
+                cached[filename.encode('utf8')] = (filesize, mtime)
+        return cached
+
+    def setFileStats(self, filename, stats):
+        """Record size and mtime of a track that is already cached."""
+        self.__db_cursor.execute("""UPDATE track
+                                    SET filesize=:size, mtime=:mtime
+                                    WHERE filename=:fn""",
+                                    { "size" : stats[0], "mtime" : stats[1],
+                                      "fn" : filename })
+        self.__db_conn.commit()
+
+    def __createMusicCacheTables(self):
+        """Creates the music cache tables if they don't exist."""
+        db_cursor = self.__db_cursor
+        db_cursor.execute("""CREATE TABLE IF NOT EXISTS track(
                              filename TEXT,
                              title VARCHAR(255),
                              artist VARCHAR(255),
@@ -220,184 +245,65 @@ class MusicCache(Cache):
                              genre VARCHAR(128),
                              comment TEXT,
                              lyrics TEXT DEFAULT "",
+                             filesize INTEGER,
+                             mtime INTEGER,
                              PRIMARY KEY(filename))""")
 
-        db_cursor.execute("""CREATE TABLE playlist(
+        db_cursor.execute("""CREATE TABLE IF NOT EXISTS playlist(
                              title TEXT,
                              PRIMARY KEY(title))""")
 
-        db_cursor.execute("""CREATE TABLE playlist_relation(
+        db_cursor.execute("""CREATE TABLE IF NOT EXISTS playlist_relation(
                              title TEXT,
                              filename TEXT,
                              PRIMARY KEY(title, filename))""")
-        db_conn.commit()
-        db_conn.close()
-        self.logger.debug("MusicCache database created successfully")
+        # Directory removal selects playlist entries by filename, which is
+        # only the second column of the primary key.
+        db_cursor.execute("""CREATE INDEX IF NOT EXISTS
+                             playlist_relation_filename
+                             ON playlist_relation(filename)""")
+        self.__db_conn.commit()
 
     def __getFileExtension(self, filename):
         """Return lower case file extension"""
         return filename[filename.rfind('.') + 1 :].lower()
 
-    def __addMP3file(self, filename):
+    def __addAudioFile(self, filename):
         """
-        Add mp3 file to the music cache
+        Add mp3 or ogg file to the music cache
 
         Process:
-            - Open file
-            - Get tags
+            - Read tags and length from the tag headers of the file
             - Insert data to the music cache database
         """
         try:
-            mp3_file = eyeD3.Mp3AudioFile(filename, eyeD3.ID3_ANY_VERSION)
-            tags = mp3_file.getTag()
-        except ValueError: # Tags are corrupt
-            self.logger.error("Couldn't read ID3tags: " + filename)
-            return
-
-        if tags is None:
-            self.logger.error("Couldn't read ID3tags: " + filename)
+            tags = read_tags(filename)
+        except TagGetterException, e:
+            self._recordFailure(filename, str(e))
             return
 
-        # Get track lenght in seconds
-        length = mp3_file.getPlayTime()
-
-        # Get avarage bitrate
-        bitrate = mp3_file.getBitRate()[1]
-
-        # Get artist name
-        artist = tags.getArtist()
-        if artist is None or len(artist) == 0:
-            artist = self.__DEFAULT['artist']
-
-        # Get album name
-        album = tags.getAlbum()
-        if album is None or len(album) == 0:
-            album = self.__DEFAULT['album']
-
-        # Get track title
-        title = tags.getTitle()
-        if title is None or len(title) == 0:
-            title = self.__DEFAULT['title']
-
-        # Get track genre
-        genre = str(tags.getGenre())
-        if genre is None or len(genre) == 0:
-            genre = self.__DEFAULT['genre']
-
-        # Get track number
-        tracknumber = tags.getTrackNum()[0]
-        if tracknumber is None:
-            tracknumber = 0
-
-        # Get track comment
-        comment = tags.getComment()
-        if comment is None or len(comment) == 0:
-            comment = ""
+        title = tags.get('title') or self.__DEFAULT['title']
+        artist = tags.get('artist') or self.__DEFAULT['artist']
+        album = tags.get('album') or self.__DEFAULT['album']
+        genre = tags.get('genre') or self.__DEFAULT['genre']
+        length = tags.get('length', 0)
+        tracknumber = tags.get('track-number', 0)
+        bitrate = tags.get('bitrate', 0)
+        comment = tags.get('comment', "")
+        lyrics = tags.get('lyrics', "")
 
         # Get track release year
-        year = tags.getYear()
-        if year is None or len(year) == 0:
-            year = 0
-
-        db_row = (filename, title, artist, album, genre, length, tracknumber,
-            bitrate, comment, year)
-        self.__db_cursor.execute("""INSERT INTO track(filename,
-                                                      title,
-                                                      artist,
-                                                      album,
-                                                      genre,
-                                                      length,
-                                                      tracknumber,
-                                                      bitrate,
-                                                      comment,
-                                                      year)
-                                    VALUES(?,?,?,?,?,?,?,?,?,?)""", db_row)
-        self.__db_conn.commit()
-
-        # Get song lyrics
-        lyrics = tags.getLyrics()
-        if len(lyrics) != 0:
-            lyrics = str(lyrics[0])
-            self.__db_cursor.execute("""UPDATE track
-                                        SET lyrics=:lyrics
-                                        WHERE filename=:fn""",
-                                        { "lyrics" : lyrics,
-                                          "fn" : filename })
-            self.__db_conn.commit()
-
-        # Get album art
-        self.__searchAlbumArt(artist, album, filename)
-
-    def __addOGGfile(self, filename):
-        """
-        Add ogg file to the music cache
-
-        Process:
-            - Open file
-            - Get tags
-            - Insert data to the music cache database
-        """
-        ogg_file = ogg.vorbis.VorbisFile(filename)
-        info = ogg_file.comment().as_dict()
-
-        # Get length
-        length = round(ogg_file.time_total(-1))
-
-        # Get avarage bitrate
-        bitrate = round(ogg_file.bitrate(-1) / 1000)
-
-        # Get album name
-        if info.has_key('ALBUM'):
-            album = info['ALBUM'][0]
-        else:
-            album = self.__DEFAULT['album']
-
-        # Get artist name
-        if info.has_key('ARTIST'):
-            artist = info['ARTIST'][0]
-        else:
-            artist = self.__DEFAULT['artist']
-
-        # Get track title
-        if info.has_key('TITLE'):
-            if info.has_key('VERSION'):
-                title = (str(info['TITLE'][0]) +
-                    " (" + str(info['VERSION'][0]) + ")")
-            else:
-                title = info['TITLE'][0]
-        else:
-            title = self.__DEFAULT['title']
-
-        # Get track number
-        if info.has_key('TRACKNUMBER'):
-            track_number = info['TRACKNUMBER'][0]
-        else:
-            track_number = 0
-
-        # Get track genre
-        if info.has_key('GENRE'):
-            genre = info['GENRE'][0]
-        else:
-            genre = self.__DEFAULT['genre']
-
-        # Get track comment
-        if info.has_key('DESCRIPTION'):
-            comment = info['DESCRIPTION'][0]
-        elif info.has_key('COMMENT'):
-            comment = info['COMMENT'][0]
-        else:
-            comment = ""
-
-        # Get track year
-        if info.has_key('DATE'):
-            date = info['DATE'][0]
-            year = date[:date.find('-')]
+        year = tags.get('date', "")[:4]
+        if year.isdigit():
+            year = int(year)
         else:
             year = 0
 
-        db_row = (filename, title, artist, album, genre, length, track_number,
-            bitrate, comment, year)
-        self.__db_cursor.execute("""INSERT INTO track(filename,
+        stats = os.stat(filename)
+        db_row = (filename, title, artist, album, genre, length, tracknumber,
+            bitrate, comment, year, lyrics, stats.st_size,
+            int(stats.st_mtime))
+        self._insert(self.__db_conn, """INSERT INTO track(filename,
                                                       title,
                                                       artist,
                                                       album,
@@ -406,15 +312,18 @@ class MusicCache(Cache):
                                                       tracknumber,
                                                       bitrate,
                                                       comment,
-                                                      year)
-                                    VALUES(?,?,?,?,?,?,?,?,?,?)""", db_row)
-        self.__db_conn.commit()
+                                                      year,
+                                                      lyrics,
+                                                      filesize,
+                                                      mtime)
+                                    VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?)""",
+                                    db_row, filename)
 
         # Get album art
         self.__searchAlbumArt(artist, album, filename)
 
     def __searchAlbumArt(self, artist, album, filename):
-        """Execute album art search thread"""
+        """Copy local album art or request it from the AlbumArtService"""
 
         # base64 encode artist and album so there can be a '/' in the artist or
         # album
@@ -424,18 +333,21 @@ class MusicCache(Cache):
         album_art_file = os.path.join(
             self.config.ALBUM_ART_DIR, artist_album + ".jpg")
         if not os.path.exists(album_art_file):
-            # Search for local albumart
+            # Search for local albumart. The same cover in several album
+            # folders is stored once.
+            art_store = self.getFingerprintTable()
             if os.path.exists(filename[:filename.rfind('/')+1]+"cover.jpg"):
-                shutil.copyfile(filename[:filename.rfind('/')+1]+"cover.jpg",
+                art_store.storeFile(
+                    filename[:filename.rfind('/')+1]+"cover.jpg",
                     album_art_file)
             elif os.path.exists(filename[:filename.rfind('/')+1]+"folder.jpg"):
-                shutil.copyfile(filename[:filename.rfind('/')+1]+"folder.jpg",
+                art_store.storeFile(
+                    filename[:filename.rfind('/')+1]+"folder.jpg",
                     album_art_file)
             # Local not found -> try internet
             else:
                 if self.config.download_album_art:
                     if album != "Unknown album" and artist != "Unknown Artist":
-                        loader_thread = AlbumArtDownloader(album, artist,
-                            self.config.ALBUM_ART_DIR)
-                        loader_thread.start()
+                        # Searched once per album, not once per track
+                        AlbumArtService().fetch(artist, album)
 
@@ -2,22 +2,22 @@
 '''VideoCache - Handles video file cache.'''
 
 import os
-import time
-from pysqlite2 import dbapi2 as sqlite
 
-from entertainerlib.thumbnailer import VideoThumbnailer
+from entertainerlib.thumbnailer import create_video_thumbnail
 from entertainerlib.configuration import Configuration
+from entertainerlib.exceptions import WorkerException
 from entertainerlib.logger import Logger
+from entertainerlib.worker_supervisor import WorkerSupervisor
 
 from entertainerlib.backend.components.mediacache.cache import Cache
-from entertainerlib.backend.components.mediacache.video_metadata_search import (
-    VideoMetadataSearch)
+from entertainerlib.backend.components.mediacache.video_metadata_queue import (
+    VideoMetadataQueue)
 
 class VideoCache(Cache):
     """Handles video file cache."""
 
     # Supported file extensions
-    __SUPPORTED_FILE_EXTENSIONS = [
+    SUPPORTED_FILE_EXTENSIONS = [
         'avi', 'mpg', 'mpeg', 'mov', 'wmv', 'ogm', 'mkv', 'mp4', 'm4v'
         ]
 
@@ -25,18 +25,24 @@ class VideoCache(Cache):
     __db_conn = None
     __db_cursor = None
 
-    # Thread lock for metadata search
-    __metadata_lock = None
+    # Tables of the legacy video.db -> tables in the media database. The
+    # media database has a different videofile table.
+    LEGACY_TABLES = { 'videofile' : 'video', 'metadata' : 'metadata' }
+
+    # Videos are cached even if their thumbnail fails
+    SKIP_FAILED_FILES = False
 
     def __init__(self):
         self.logger = Logger().getLogger(
             'backend.components.mediacache.VideoCache')
         self.config = Configuration()
+        self.video_thumbnails = WorkerSupervisor('Video thumbnailer')
 
-        if not os.path.exists(self.config.VIDEO_DB):
-            self.__createVideoCacheDatabase()
-        self.__db_conn = sqlite.connect(self.config.VIDEO_DB)
+        self.__db_conn = self.config.MEDIA_DB.get_connection()
         self.__db_cursor = self.__db_conn.cursor()
+        self.__createVideoCacheTables()
+        self._addMissingColumns(self.__db_cursor, 'video',
+            [('filesize', 'INTEGER'), ('mtime', 'INTEGER')])
 
     def clearCache(self):
         """
@@ -48,8 +54,9 @@ class VideoCache(Cache):
             if element[-3:] == "jpg":
                 os.remove(os.path.join(self.config.MOVIE_ART_DIR, element))
 
-        os.remove(self.config.VIDEO_DB)
-        self.__createVideoCacheDatabase()
+        self.__db_cursor.execute("DELETE FROM video")
+        self.__db_cursor.execute("DELETE FROM metadata")
+        self.__db_conn.commit()
 
     def addFile(self, filename):
         """
@@ -69,9 +76,9 @@ class VideoCache(Cache):
             self.__db_cursor.execute(
                 """
                 SELECT title, hash, series_title
-                FROM videofile, metadata
-                WHERE videofile.filename=:fn
-                AND videofile.filename=metadata.filename""",
+                FROM video, metadata
+                WHERE video.filename=:fn
+                AND video.filename=metadata.filename""",
                 { "fn" : filename })
             result = self.__db_cursor.fetchall()
             title = result[0][0]
@@ -88,18 +95,20 @@ class VideoCache(Cache):
                 str(thash) + ".jpg")
 
             # Remove video from video cache database
-            self.__db_cursor.execute('''DELETE FROM videofile
+            self.__db_cursor.execute('''DELETE FROM video
                                     WHERE filename=:fn''',
                                     { "fn" : filename })
             self.__db_cursor.execute('''DELETE FROM metadata
                                     WHERE filename=:fn''',
                                     { "fn" : filename })
+            self.getFingerprintTable().removeFile(filename)
             self.__db_conn.commit()
 
-            # Remove thumbnail and cover art
+            # Remove thumbnail and cover art. Copies of the video share the
+            # thumbnail.
             if os.path.exists(art) and not self.__hasSeriesEpisodes(series):
                 os.remove(art)
-            if os.path.exists(thumb):
+            if os.path.exists(thumb) and not self.__isThumbnailUsed(thash):
                 os.remove(thumb)
 
     def updateFile(self, filename):
@@ -127,7 +136,7 @@ class VideoCache(Cache):
             for root, dirs, files in os.walk(path):
                 for name in files:
                     self.addFile(os.path.join(root, name))
-                    time.sleep(float(self.SLEEP_TIME_BETWEEN_FILES) / 1000)
+                    self._throttle(os.path.join(root, name))
 
     def removeDirectory(self, path):
         """
@@ -135,8 +144,9 @@ class VideoCache(Cache):
         subdirectories and all files in them.
         """
         self.__db_cursor.execute("""SELECT filename
-                                    FROM videofile
-                                    WHERE filename LIKE '""" + path + "%'")
+                                    FROM video
+                                    WHERE filename >= ? AND filename < ?""",
+                                    self._getSubtreeRange(path))
         result = self.__db_cursor.fetchall()
         for row in result:
             self.removeFile(row[0])
@@ -154,8 +164,10 @@ class VideoCache(Cache):
         This method returns True if given directory is in cache. Otherwise
         method returns False.
         """
-        self.__db_cursor.execute("""SELECT * FROM videofile
-                                    WHERE filename LIKE '""" + path + "%'")
+        self.__db_cursor.execute("""SELECT filename
+                                    FROM video
+                                    WHERE filename >= ? AND filename < ?
+                                    LIMIT 1""", self._getSubtreeRange(path))
         result = self.__db_cursor.fetchall()
         if len(result) == 0:
             return False
@@ -167,8 +179,9 @@ class VideoCache(Cache):
         This method returns True if given file is in cache. Otherwise
         method returns False.
         """
+        self._flushIfPending(filename)
         self.__db_cursor.execute("""SELECT *
-                                    FROM videofile
+                                    FROM video
                                     WHERE filename=:fn""",
                                     { "fn" : filename})
         result = self.__db_cursor.fetchall()
@@ -180,23 +193,48 @@ class VideoCache(Cache):
     def isSupportedFormat(self, filename):
         """Check if file is supported."""
         if (self.__getFileExtension(filename) in
-            self.__SUPPORTED_FILE_EXTENSIONS):
+            self.SUPPORTED_FILE_EXTENSIONS):
             return True
         else:
             return False
 
-    def __createVideoCacheDatabase(self):
-        """Creates a video cache database file."""
-        db_conn = sqlite.connect(self.config.VIDEO_DB)
-        db_cursor = db_conn.cursor()
-        db_cursor.execute("""CREATE TABLE videofile(
+    def getCachedFiles(self):
+        """Return a dictionary of cached filename -> (size, mtime)."""
+        self.__db_cursor.execute("""SELECT filename, filesize, mtime
+                                    FROM video""")
+        cached = {}
+        for filename, filesize, mtime in self.__db_cursor.fetchall():
+            if filesize is None or mtime is None:
+                cached[filename.encode('utf8')] = None
+            else:
+                cached[filename.encode('utf8')] = (filesize, mtime)
+        return cached
+
+    def setFileStats(self, filename, stats):
+        """Record size and mtime of a video that is already cached."""
+        self.__db_cursor.execute("""UPDATE video
+                                    SET filesize=:size, mtime=:mtime
+                                    WHERE filename=:fn""",
+                                    { "size" : stats[0], "mtime" : stats[1],
+                                      "fn" : filename })
+        self.__db_conn.commit()
+
+    def __createVideoCacheTables(self):
+        """Creates the video cache tables if they don't exist."""
+        db_cursor = self.__db_cursor
+        db_cursor.execute("""CREATE TABLE IF NOT EXISTS video(
                              filename TEXT,
                              hash VARCHAR(32),
                              length INTEGER,
                              resolution VARCHAR(16),
+                             filesize INTEGER,
+                             mtime INTEGER,
                              PRIMARY KEY(filename))""")
+        # Thumbnails are shared by videos with the same hash
+        db_cursor.execute(
+            "CREATE INDEX IF NOT EXISTS video_hash ON video(hash)")
 
-        db_cursor.execute("""CREATE TABLE metadata(
+        db_cursor.execute("""CREATE TABLE IF NOT EXISTS metadata(
                              type VARCHAR(16) DEFAULT 'CLIP',
                              filename TEXT,
                              title TEXT,
@@ -219,10 +257,7 @@ class VideoCache(Cache):
                              director_1 VARCHAR(128),
                              director_2 VARCHAR(128),
                              PRIMARY KEY(filename))""")
-
-        db_conn.commit()
-        db_conn.close()
-        self.logger.debug("VideoCache database created successfully")
+        self.__db_conn.commit()
 
     def __getFileExtension(self, filename):
         """Return lower case file extension"""
@@ -230,29 +265,45 @@ class VideoCache(Cache):
 
     def _addVideoFile(self, filename):
         """Add video file to the video cache."""
-        # Generate thumbnail
-        thumbnailer = VideoThumbnailer(filename)
-        thumbnailer.create_thumbnail()
-        thash = thumbnailer.get_hash()
-        del thumbnailer
-
-        self.__db_cursor.execute("""INSERT INTO videofile(filename, hash)
-                                    VALUES (:fn, :hash)""",
-                                    { 'fn': filename, 'hash': thash, } )
-        self.__db_cursor.execute("""INSERT INTO metadata(filename)
-                                    VALUES (:fn)""",
-                                    { "fn" : filename } )
-        self.__db_conn.commit()
+        # Generate thumbnail. A video without a thumbnail is still cached,
+        # but thumbnailing isn't tried again until its retry time. The
+        # thumbnail is named by the content of the video, so copies of a
+        # video are thumbnailed only once.
+        stats = os.stat(filename)
+        thash = self._getContentKey(filename,
+            (stats.st_size, int(stats.st_mtime)))
+        thumb = os.path.join(self.config.VIDEO_THUMB_DIR, thash + ".jpg")
+        if (not os.path.exists(thumb) and
+            not self.getFailureTable().isFailed(filename)):
+            try:
+                self.video_thumbnails.call(create_video_thumbnail, filename,
+                    "video", thash)
+            except WorkerException, e:
+                self._recordFailure(filename, e.record.get_reason())
+
+        self._insert(self.__db_conn,
+            """INSERT INTO video(filename, hash, filesize, mtime)
+               VALUES (?, ?, ?, ?)""",
+            (filename, thash, stats.st_size, int(stats.st_mtime)), filename)
+
+        # Metadata search updates the metadata row, so it can be started
+        # only after the row has been committed.
+        callback = None
         if self.config.download_metadata:
-            self.__searchMetadata(filename)
-
-    def __searchMetadata(self, filename):
-        """Search metadata for video file from the Internet."""
-        search_thread = None
-        search_thread = VideoMetadataSearch(filename)
-
-        if search_thread is not None:
-            search_thread.start()
+            callback = lambda: VideoMetadataQueue().addFile(filename)
+        self._insert(self.__db_conn,
+            """INSERT INTO metadata(filename) VALUES (?)""",
+            (filename,), filename, callback)
+
+    def __isThumbnailUsed(self, thash):
+        """Return True if a video in the cache has the given thumbnail."""
+        # Buffered videos may use it too
+        self.flushBulkIngest()
+        self.__db_cursor.execute("""SELECT filename
+                                    FROM video
+                                    WHERE hash=:hash
+                                    LIMIT 1""", { "hash" : thash })
+        return len(self.__db_cursor.fetchall()) > 0
 
     def __hasSeriesEpisodes(self, series_title):
         """
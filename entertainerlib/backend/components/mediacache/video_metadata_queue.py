@@ -0,0 +1,157 @@
+# Copyright (c) 2009 Entertainer Developers - See COPYING - GPLv2
+'''VideoMetadataQueue - Searches video metadata in a pool of worker threads'''
+
+import imdb
+import socket
+import threading
+
+from pysqlite2 import dbapi2 as sqlite
+
+from entertainerlib.configuration import Configuration
+from entertainerlib.logger import Logger
+from entertainerlib.worker_pool import WorkerPool
+
+from entertainerlib.backend.components.mediacache.video_metadata_search import (
+    VideoMetadataSearch)
+
+
+class VideoMetadataQueue:
+    """
+    Searches video metadata from IMDB in a fixed pool of worker threads.
+
+    Files are searched by title. All the queued files whose filenames give
+    the same title, for example the episodes of a TV-series, share one
+    search, so adding a folder of episodes searches the series once instead
+    of once per episode. Every worker thread creates one IMDb client and
+    reuses it for all its searches.
+
+    The queue is stored in the media database. Files whose metadata wasn't
+    searched yet when backend was stopped are searched after the next start
+    when MediaCacheManager calls resume().
+
+    VideoMetadataQueue shares its state like Configuration, so all video
+    caches use the same workers.
+    """
+
+    _shared_state = {}
+
+    def __init__(self, workers=None):
+        """
+        Create a new VideoMetadataQueue. Creates the queue table in the media
+        database if it doesn't exist.
+        @param workers: Number of worker threads. Read from the configuration
+            if None. Only used by the first instance.
+        """
+        self.__dict__ = self._shared_state
+
+        if not self._shared_state:
+            self.logger = Logger().getLogger(
+                'backend.components.mediacache.VideoMetadataQueue')
+            self.config = Configuration()
+            if workers is None:
+                workers = self.config.metadata_search_workers
+
+            # Title -> VideoMetadataSearches that wait for a worker
+            self._pending = {}
+            self._lock = threading.Lock()
+            # IMDb client of each worker thread
+            self._local = threading.local()
+            self._pool = WorkerPool("Video metadata search thread", workers,
+                self._searchTitle, self.logger)
+
+            db_conn = self.config.MEDIA_DB.get_connection()
+            db_conn.cursor().execute("""CREATE TABLE IF NOT EXISTS
+                                        metadata_queue(
+                                        filename TEXT PRIMARY KEY)""")
+            db_conn.commit()
+
+    def addFile(self, filename):
+        """
+        Queue a video file for metadata search. Commits.
+        @param filename: Absolute path of the video file
+        """
+        db_conn = self.config.MEDIA_DB.get_connection()
+        db_conn.cursor().execute("""INSERT OR REPLACE INTO
+                                    metadata_queue(filename)
+                                    VALUES (?)""", (filename,))
+        db_conn.commit()
+        self._enqueue(filename)
+
+    def resume(self):
+        """
+        Search the files that were left in the queue when backend was
+        stopped. Return the number of files.
+        """
+        cursor = self.config.MEDIA_DB.get_connection().cursor()
+        cursor.execute("SELECT filename FROM metadata_queue ORDER BY rowid")
+        filenames = [row[0].encode('utf8') for row in cursor.fetchall()]
+        for filename in filenames:
+            self._enqueue(filename)
+        return len(filenames)
+
+    def _enqueue(self, filename):
+        """Add a file to the search of its title."""
+        search = VideoMetadataSearch(filename)
+        self._lock.acquire()
+        try:
+            searches = self._pending.get(search.title)
+            if searches is not None:
+                # The title is waiting for a worker already
+                searches.append(search)
+                return
+            self._pending[search.title] = [search]
+            self._pool.put(search.title)
+        finally:
+            self._lock.release()
+
+    def _createClient(self):
+        """Return a new IMDb client for a worker."""
+        return imdb.IMDb()
+
+    def _searchTitle(self, title):
+        """Search a title and update the metadata of its files. Called in a
+        worker thread."""
+        self._lock.acquire()
+        try:
+            searches = self._pending.pop(title)
+        finally:
+            self._lock.release()
+
+        try:
+            if getattr(self._local, 'imdb_client', None) is None:
+                self._local.imdb_client = self._createClient()
+            result = searches[0].search(self._local.imdb_client)
+        except (imdb.IMDbError, IOError, socket.error), e:
+            # The files stay in the stored queue and are searched again
+            # after the next start. The client is created again in case
+            # its connection is broken.
+            self.logger.warning("Couldn't search metadata for '%s': %s" %
+                (title, e))
+            self._local.imdb_client = None
+            return
+        except Exception, e:
+            # Also after an unexpected error the files stay queued
+            self.logger.error("Metadata search failed for '%s': %s" %
+                (title, e))
+            self._local.imdb_client = None
+            return
+
+        if result is not None:
+            for search in searches:
+                try:
+                    search.update(result)
+                except (KeyError, IndexError, TypeError, ValueError,
+                    IOError, sqlite.Error), e:
+                    # IMDb doesn't have everything for every title
+                    self.logger.debug("Couldn't update metadata of %s: %s" %
+                        (search.filename, e))
+        self._removeFiles([search.filename for search in searches])
+
+    def _removeFiles(self, filenames):
+        """Remove searched files from the stored queue. Commits."""
+        db_conn = self.config.MEDIA_DB.get_connection()
+        db_conn.cursor().executemany("""DELETE FROM metadata_queue
+                                        WHERE filename=?""",
+                                        [(name,) for name in filenames])
+        db_conn.commit()
+
@@ -3,20 +3,18 @@
 # pylint: disable-msg=C0301
 
 import os
-import imdb
 import re
 import urllib
-import threading
-from pysqlite2 import dbapi2 as sqlite
 
 from entertainerlib.logger import Logger
 from entertainerlib.configuration import Configuration
 
-class VideoMetadataSearch(threading.Thread):
+class VideoMetadataSearch:
     """
-    Search video file metadata from IMDB database. This class is a thread that
-    connects to IMDb website and tries to find information for video file. This
-    search finds movies and TV-Series.
+    Search video file metadata from IMDB database. This class tries to find
+    information for video file from IMDb website. This search finds movies
+    and TV-Series. Searches are run by VideoMetadataQueue, which searches
+    the title only once for all the files that have the same title.
     """
 
     # Title split keywords
@@ -31,21 +29,15 @@ class VideoMetadataSearch(threading.Thread):
 
     def __init__(self, filename):
         """
-        Initialize metadata search thread.
+        Initialize metadata search.
         @param filename: Filename as string (find metadata for this file)
         """
-        threading.Thread.__init__(self)
-        self.setName("Video metadata search thread")
         self.logger = Logger().getLogger(
             'backend.components.mediacache.VideoMetadataSearch')
         self.config = Configuration()
 
         self.filename = filename
         self.title, self.season, self.episode = self._parse_filename(filename)
-        try:
-            self.IMDb = imdb.IMDb()
-        except imdb.IMDbError:
-            raise IOError("Couldn't connect to IMDB server!")
 
     def _parse_filename(self, filename):
         """
@@ -94,20 +86,37 @@ class VideoMetadataSearch(threading.Thread):
 
         return filename, int(season), int(episode)
 
-    def run(self):
+    def search(self, imdb_client):
         """
-        Search metadata from IMDB and update video cache database.
+        Search the title from IMDB. The result can be used to update all the
+        files that have the same title.
+        @param imdb_client: IMDb object that is used for the search
+        @return: The best match with its details or None if the title wasn't
+                 identified to be a movie or a TV-series
         """
-        search_results = []
-        search_results = self.IMDb.search_movie(self.title)
+        search_results = imdb_client.search_movie(self.title)
 
         if len(search_results) == 0:
-            return # No matches for this search
+            return None # No matches for this search
+
+        # We trust that the first search result is the best
+        result = search_results[0]
+        if result['kind'] == "movie":
+            imdb_client.update(result)
+        elif result['kind'] == "tv series":
+            imdb_client.update(result)
+            imdb_client.update(result, "episodes")
+        else:
+            return None
+        return result
 
-        if search_results[0]['kind'] == "movie":
-            # We trust that the first search result is the best
-            movie = search_results[0]
-            self.IMDb.update(movie)
+    def update(self, result):
+        """
+        Update video cache database with the metadata of this file.
+        @param result: Search result returned by search()
+        """
+        if result['kind'] == "movie":
+            movie = result
 
             video_type = "MOVIE"
             title = movie['title']
@@ -138,11 +147,8 @@ class VideoMetadataSearch(threading.Thread):
             # Download and save cover art
             self._download_cover_art(movie['cover url'], title)
 
-        elif search_results[0]['kind'] == "tv series":
-            series = search_results[0]
-            # We trust that the first search result is the best
-            self.IMDb.update(series)
-            self.IMDb.update(series, "episodes")
+        elif result['kind'] == "tv series":
+            series = result
 
             video_type = "TV-SERIES"
             p = self._get_persons(series)
@@ -175,7 +181,7 @@ class VideoMetadataSearch(threading.Thread):
         @param db_row: List that contains all information we want to store into
                        cache
         """
-        db_conn = sqlite.connect(self.config.VIDEO_DB)
+        db_conn = self.config.MEDIA_DB.get_connection()
         db_cursor = db_conn.cursor()
         db_cursor.execute("""UPDATE metadata
                              SET type=?,
@@ -200,7 +206,6 @@ class VideoMetadataSearch(threading.Thread):
                                  director_2=?
                              WHERE filename=?""", db_row)
         db_conn.commit()
-        db_conn.close()
 
 
     def _get_persons(self, movie):
@@ -73,12 +73,13 @@ class MessageBus:
         from bus
         """
         if isinstance(message_handler, MessageHandler):
+            # The lists are replaced instead of changed, so a message that is
+            # on the bus is still delivered with the old list. This way a
+            # handler can unregister itself while it handles a message.
             for i in range(self.NUMBER_OF_MESSAGE_TYPES):
-                if len(self.message_handlers[i]) != 0:
-                    rules = self.message_handlers[i]
-                    for element in rules:
-                        if element[1] is message_handler:
-                            del element
+                self.message_handlers[i] = [rule
+                    for rule in self.message_handlers[i]
+                    if rule[1] is not message_handler]
         else:
             raise TypeError("Only MessageHandlers can be unregistered!")
         self.logger.debug("MessageHandler '" + str(message_handler) +
@@ -91,12 +92,21 @@ class MessageBus:
         """
         if isinstance(message, Message):
             self.lock.acquire() # Lock messagebus
-            self.logger.debug("Message bus locked. Message of type '" +
-                              str(message.get_type()) + "' is on the bus.")
-            handler_list = self.message_handlers[message.get_type()]
-            for element in handler_list:
-                element[1].handleMessage(message)
-            self.lock.release() # Release messagebus lock
+            try:
+                self.logger.debug("Message bus locked. Message of type '" +
+                    str(message.get_type()) + "' is on the bus.")
+                handler_list = self.message_handlers[message.get_type()]
+                for element in handler_list:
+                    try:
+                        element[1].handleMessage(message)
+                    except Exception, e:
+                        # One broken handler, like a client that went away,
+                        # mustn't keep the message from the others
+                        self.logger.error("MessageHandler '" +
+                            str(element[1]) + "' couldn't handle message: " +
+                            str(e))
+            finally:
+                self.lock.release() # Release messagebus lock
         else:
             message = "TypeError occured when message was notified to the bus."
             self.logger.error(message)
@@ -90,6 +90,8 @@ class MessageBusProxy(threading.Thread):
                 else:
                     raise Exception("Proxy doesn't have MessageHandler object!")
                 obj_buffer = StringIO() # Reset buffer
+            elif line == "":
+                break # Backend closed the socket connection
             else:
                 obj_buffer.write(line)
 
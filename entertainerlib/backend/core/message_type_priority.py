@@ -30,3 +30,16 @@ class MessageType:
     # Require to rebuild video cache
     REBUILD_VIDEO_CACHE = 3
 
+    # Forget files that failed to index and try them again
+    CLEAR_INDEX_FAILURES = 4
+
+    # Index files of a cache type or under a path first. Data is the cache
+    # type ('image', 'music' or 'video') or an absolute path.
+    PRIORITIZE_INDEXING = 5
+
+    # Progress of a running indexer. Data is a dictionary, see IndexProgress.
+    INDEXING_PROGRESS = 6
+
+    # An indexer has finished. Data is its final progress dictionary.
+    INDEXING_FINISHED = 7
+
@@ -0,0 +1,304 @@
+# Copyright (c) 2009 Entertainer Developers - See COPYING - GPLv2
+'''Cache budget - Keeps thumbnail and art caches within their size limits.'''
+
+import os
+import Queue
+import threading
+import time
+
+from pysqlite2 import dbapi2 as sqlite
+
+from entertainerlib.configuration import Configuration
+from entertainerlib.logger import Logger
+
+
+class AccessLog(object):
+    '''
+    Records when cached thumbnails and art files are used.
+
+    Accesses are appended to a log file, which is cheap enough to do for every
+    file that the client shows. CacheBudget folds the log into its index, so
+    file access times (which are often disabled) are never needed. A file is
+    logged at most once per RECORD_INTERVAL seconds.
+
+    AccessLog shares its state like Configuration.
+    '''
+
+    # Seconds during which repeated accesses of a file are not logged
+    RECORD_INTERVAL = 60
+
+    _shared_state = {}
+
+    def __init__(self):
+        self.__dict__ = self._shared_state
+
+        if not self._shared_state:
+            self.filename = Configuration().CACHE_ACCESS_LOG
+            self._recorded = {}
+            self._lock = threading.Lock()
+
+    def record(self, path):
+        '''
+        Record an access of a cached file.
+        @param path: Absolute path of the file
+        '''
+        if isinstance(path, unicode):
+            path = path.encode('utf8')
+        now = time.time()
+        self._lock.acquire()
+        try:
+            if now - self._recorded.get(path, 0) < self.RECORD_INTERVAL:
+                return
+            self._recorded[path] = now
+            try:
+                log = open(self.filename, 'a')
+                # Album art filenames contain newlines
+                log.write('%d\t%s\n' % (now, path.encode('string_escape')))
+                log.close()
+            except IOError:
+                pass
+        finally:
+            self._lock.release()
+
+
+class Regenerator(object):
+    '''
+    Regenerates evicted cache files in a background thread, so that the
+    client isn't blocked by slow regeneration like video thumbnailing or
+    downloads. Every key is regenerated only once at a time, and keys that
+    failed aren't tried again.
+
+    Regenerator shares its state like Configuration.
+    '''
+
+    _shared_state = {}
+
+    def __init__(self):
+        self.__dict__ = self._shared_state
+
+        if not self._shared_state:
+            self.logger = Logger().getLogger('Regenerator')
+            self._queue = Queue.Queue()
+            self._queued = set()
+            self._failed = set()
+            self._lock = threading.Lock()
+            self._thread = None
+
+    def regenerate(self, key, function):
+        '''
+        Call function in the background unless key is already queued.
+        @param key: Key of the cache file, usually its path
+        @param function: Function without arguments that recreates the file
+        '''
+        self._lock.acquire()
+        try:
+            if key in self._queued or key in self._failed:
+                return
+            self._queued.add(key)
+            self._queue.put((key, function))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                    name="Cache file regenerator")
+                self._thread.setDaemon(True)
+                self._thread.start()
+        finally:
+            self._lock.release()
+
+    def _run(self):
+        '''Regenerate queued files.'''
+        while True:
+            key, function = self._queue.get()
+            failed = False
+            try:
+                function()
+            except Exception, e:
+                self.logger.error("Couldn't regenerate %s: %s" % (key, e))
+                failed = True
+            self._lock.acquire()
+            self._queued.discard(key)
+            if failed:
+                self._failed.add(key)
+            self._lock.release()
+
+
+class CacheBudget(threading.Thread):
+    '''
+    Keeps cache directories within their size limits.
+
+    Every interval seconds the cache directories are scanned into an index
+    table together with the access log, and the least recently used files of
+    directories over their limit are removed until the directory uses
+    LOW_WATER_MARK of its limit. Files that have never been accessed count as
+    accessed when they were written. Removed files are regenerated when they
+    are needed again.
+    '''
+
+    # Part of the limit that a directory is reduced to when it's over it
+    LOW_WATER_MARK = 0.9
+
+    def __init__(self, limits=None, interval=None):
+        '''
+        Create a new CacheBudget. Values that are not given are read from the
+        configuration.
+        @param limits: Dictionary of directory -> limit in bytes, 0 is no limit
+        @param interval: Seconds between checks
+        '''
+        threading.Thread.__init__(self)
+        self.setName("Cache budget")
+        self.setDaemon(True)
+        self.logger = Logger().getLogger('CacheBudget')
+        self.config = Configuration()
+
+        if limits is None:
+            megabyte = 1024 * 1024
+            limits = {
+                self.config.THUMB_DIR :
+                    self.config.thumbnail_cache_limit * megabyte,
+                self.config.ALBUM_ART_DIR :
+                    self.config.album_art_cache_limit * megabyte,
+                self.config.MOVIE_ART_DIR :
+                    self.config.movie_art_cache_limit * megabyte,
+                }
+        self.limits = limits
+        if interval is None:
+            interval = self.config.cache_check_interval
+        self.interval = interval
+
+        self.db_conn = None
+        self.stopped = threading.Event()
+
+    def stop(self):
+        '''Stop checking the caches.'''
+        self.stopped.set()
+
+    def run(self):
+        '''Check cache sizes every interval seconds.'''
+        while not self.stopped.isSet():
+            try:
+                self.enforce()
+            except (sqlite.Error, OSError, IOError), e:
+                self.logger.error("Cache size check failed: %s" % e)
+            self.stopped.wait(self.interval)
+
+    def enforce(self):
+        '''Update the index and evict files from directories over limit.'''
+        if self.db_conn is None:
+            # SQLite connections can only be used in the thread that created
+            # them, so connect in the thread that checks the caches.
+            self.db_conn = sqlite.connect(self.config.CACHE_INDEX_DB)
+            self.db_conn.text_factory = str
+            self._create_index()
+
+        accesses = self._read_access_log()
+        for directory, limit in self.limits.iteritems():
+            self._update_index(directory, accesses)
+            if limit > 0:
+                self._evict(directory, limit)
+        self.db_conn.commit()
+
+    def get_size(self, directory):
+        '''Return the indexed size of a cache directory in bytes.'''
+        cursor = self.db_conn.cursor()
+        cursor.execute("SELECT SUM(size) FROM cache_file WHERE directory=?",
+            (directory,))
+        return cursor.fetchone()[0] or 0
+
+    def _create_index(self):
+        '''Create the index table if it doesn't exist.'''
+        cursor = self.db_conn.cursor()
+        cursor.execute("""CREATE TABLE IF NOT EXISTS cache_file(
+                          path TEXT PRIMARY KEY,
+                          directory TEXT,
+                          size INTEGER,
+                          last_access INTEGER)""")
+        cursor.execute("""CREATE INDEX IF NOT EXISTS cache_file_access
+                          ON cache_file(directory, last_access)""")
+        self.db_conn.commit()
+
+    def _read_access_log(self):
+        '''Return path -> latest access time from the access log.'''
+        log_file = self.config.CACHE_ACCESS_LOG
+        processing = log_file + '.processing'
+        # A log left over from an interrupted check is read first. Clients
+        # keep appending to a new log while this one is read.
+        if not os.path.exists(processing):
+            if not os.path.exists(log_file):
+                return {}
+            os.rename(log_file, processing)
+
+        accesses = {}
+        log = open(processing)
+        for line in log:
+            try:
+                access_time, path = line.rstrip('\n').split('\t', 1)
+                path = path.decode('string_escape')
+                access_time = int(access_time)
+            except ValueError:
+                continue
+            accesses[path] = max(access_time, accesses.get(path, 0))
+        log.close()
+        os.remove(processing)
+        return accesses
+
+    def _update_index(self, directory, accesses):
+        '''Update the index of a directory from the disk and access log.'''
+        # pylint: disable-msg=W0612
+        files = {}
+        for root, dirs, names in os.walk(directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stats = os.stat(path)
+                except OSError:
+                    continue
+                files[path] = (stats.st_size, int(stats.st_mtime))
+
+        cursor = self.db_conn.cursor()
+        cursor.execute("SELECT path, size FROM cache_file WHERE directory=?",
+            (directory,))
+        indexed = dict(cursor.fetchall())
+
+        cursor.executemany("DELETE FROM cache_file WHERE path=?",
+            [(path,) for path in indexed if path not in files])
+        cursor.executemany("""INSERT INTO cache_file(path, directory, size,
+                              last_access) VALUES(?,?,?,?)""",
+            [(path, directory, size, mtime)
+            for path, (size, mtime) in files.iteritems()
+            if path not in indexed])
+        cursor.executemany("UPDATE cache_file SET size=? WHERE path=?",
+            [(size, path) for path, (size, mtime) in files.iteritems()
+            if path in indexed and indexed[path] != size])
+        cursor.executemany("""UPDATE cache_file
+                              SET last_access=MAX(last_access, ?)
+                              WHERE path=?""",
+            [(access_time, path) for path, access_time in accesses.iteritems()
+            if path in files])
+
+    def _evict(self, directory, limit):
+        '''Remove least recently used files until the directory is small
+        enough.'''
+        size = self.get_size(directory)
+        if size <= limit:
+            return
+
+        target = limit * self.LOW_WATER_MARK
+        cursor = self.db_conn.cursor()
+        cursor.execute("""SELECT path, size
+                          FROM cache_file
+                          WHERE directory=?
+                          ORDER BY last_access""", (directory,))
+        evicted = []
+        for path, file_size in cursor.fetchall():
+            if size <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                if os.path.exists(path):
+                    continue
+            size -= file_size
+            evicted.append((path,))
+
+        cursor.executemany("DELETE FROM cache_file WHERE path=?", evicted)
+        self.logger.info("Removed %d files from %s to stay within %d bytes" %
+            (len(evicted), directory, limit))
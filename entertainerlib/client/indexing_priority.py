@@ -0,0 +1,58 @@
+# Copyright (c) 2009 Entertainer Developers - See COPYING - GPLv2
+'''IndexingPriority - Asks the backend to index what the user is browsing.'''
+
+import os
+import socket
+
+from entertainerlib.backend.core.message import Message
+from entertainerlib.backend.core.message_bus_proxy import MessageBusProxy
+from entertainerlib.backend.core.message_type_priority import MessageType
+from entertainerlib.logger import Logger
+
+
+class IndexingPriority(object):
+    '''Sends PRIORITIZE_INDEXING messages when the user opens a screen, so
+    that the backend indexes the media of that screen first. Nothing is sent
+    if the backend isn't running.'''
+
+    # Screen type -> cache type of the media on the screen
+    SCREEN_CACHE_TYPES = {
+        'album' : 'music',
+        'artist' : 'music',
+        'movie' : 'video',
+        'music' : 'music',
+        'photo_albums' : 'image',
+        'photographs' : 'image',
+        'tv_episodes' : 'video',
+        'tv_series' : 'video',
+        'video' : 'video',
+        }
+
+    def __init__(self):
+        self.logger = Logger().getLogger('client.IndexingPriority')
+
+    def prioritize_screen(self, screen_type, kwargs=None):
+        '''Prioritize the media of a screen that is opened.'''
+        cache_type = self.SCREEN_CACHE_TYPES.get(screen_type)
+        if cache_type is None:
+            return
+        targets = [cache_type]
+        if screen_type == 'photographs' and kwargs and kwargs.get('images'):
+            # The folder of the album comes after the type, so it is served
+            # first
+            targets.append(os.path.dirname(
+                kwargs['images'][0].get_filename()))
+        self.prioritize(targets)
+
+    def prioritize(self, targets):
+        '''Send the cache types or paths to the backend. The last target is
+        indexed first.'''
+        try:
+            proxy = MessageBusProxy(client_name="Indexing priority")
+            proxy.connectToMessageBus()
+            for target in targets:
+                proxy.sendMessage(Message(MessageType.PRIORITIZE_INDEXING,
+                    target))
+            proxy.disconnectFromMessageBus()
+        except socket.error, e:
+            self.logger.debug("Couldn't prioritize indexing: %s" % e)
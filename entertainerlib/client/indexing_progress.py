@@ -0,0 +1,76 @@
+# Copyright (c) 2009 Entertainer Developers - See COPYING - GPLv2
+'''IndexingProgress - Follows the progress of indexing in the backend.'''
+
+import socket
+
+import gobject
+
+from entertainerlib.backend.core.message_bus_proxy import MessageBusProxy
+from entertainerlib.backend.core.message_handler import MessageHandler
+from entertainerlib.backend.core.message_type_priority import (
+    MessagePriority, MessageType)
+from entertainerlib.logger import Logger
+
+
+class IndexingProgress(MessageHandler):
+    '''Subscribes to the INDEXING_PROGRESS and INDEXING_FINISHED messages of
+    the backend. The callback is called in the main loop with the progress
+    dictionary (see IndexProgress in the backend).'''
+
+    def __init__(self, callback, client_name="Indexing progress"):
+        MessageHandler.__init__(self)
+        self.logger = Logger().getLogger('client.IndexingProgress')
+        self.callback = callback
+        self.client_name = client_name
+        self.proxy = None
+
+    def start(self):
+        '''Start following the progress. Return False if the backend isn't
+        running.'''
+        message_types = {
+            MessageType.INDEXING_PROGRESS : MessagePriority.LOW,
+            MessageType.INDEXING_FINISHED : MessagePriority.LOW,
+            }
+        self.proxy = MessageBusProxy(message_types, self, self.client_name)
+        self.proxy.setDaemon(True)
+        try:
+            self.proxy.connectToMessageBus()
+        except socket.error, e:
+            self.logger.debug("Can't follow indexing progress: %s" % e)
+            self.proxy = None
+            return False
+        self.proxy.start()
+        return True
+
+    def stop(self):
+        '''Stop following the progress.'''
+        if self.proxy is not None:
+            try:
+                self.proxy.disconnectFromMessageBus()
+            except socket.error:
+                pass
+            self.proxy = None
+
+    # Implements MessageHandler interface
+    def handleMessage(self, message):
+        '''Pass the progress to the callback in the main loop.'''
+        gobject.idle_add(self._call_callback, message.get_data())
+
+    def _call_callback(self, progress):
+        '''Call the callback once from the main loop.'''
+        self.callback(progress)
+        return False
+
+
+def format_progress(progress):
+    '''Return the progress dictionary as a line of text for the user.'''
+    if progress['state'] == 'walking':
+        return _("Looking for media: %(discovered)d files found") % progress
+    if progress['state'] == 'finished':
+        return _("Indexed %(processed)d files, %(failed)d failed") % progress
+    text = _("Indexing: %(processed)d of %(queued)d files, "
+        "%(files_per_second).1f files/s") % progress
+    if progress['eta'] is not None:
+        minutes = (progress['eta'] + 59) / 60
+        text += ", " + _("about %d min left") % minutes
+    return text
@@ -2,9 +2,11 @@
 '''Image Library - Interface for Entertainer image library cache'''
 
 import os
-from pysqlite2 import dbapi2 as sqlite
 
+from entertainerlib.cache_budget import AccessLog, Regenerator
 from entertainerlib.configuration import Configuration
+from entertainerlib.exceptions import ThumbnailerException
+from entertainerlib.thumbnailer import ImageThumbnailer, Thumbnailer
 
 class ImageLibrary:
     """Entertainer's image cache."""
@@ -12,7 +14,7 @@ class ImageLibrary:
     def __init__(self):
         self.config = Configuration()
 
-        if not os.path.exists(self.config.IMAGE_DB):
+        if not os.path.exists(self.config.MEDIA_DB.filename):
             raise Exception("Image database doesn't exist!")
 
     def get_all_images(self):
@@ -21,7 +23,7 @@ class ImageLibrary:
         albhabetical order.
         @return: List of Image objects
         """
-        connection = sqlite.connect(self.config.IMAGE_DB)
+        connection = self.config.MEDIA_DB.get_connection()
         cursor = connection.cursor()
         cursor.execute("""SELECT filename, album_path, title, description,
                                  date, time, width, height,filesize, hash
@@ -31,7 +33,6 @@ class ImageLibrary:
         for row in cursor:
             images.append(Image(row[0], row[1], row[2], row[3], row[4],
                                 row[5], row[6], row[7], row[8], row[9]))
-        connection.close()
         return images
 
     def get_albums(self):
@@ -40,13 +41,12 @@ class ImageLibrary:
         albhabetical order.
         @return: List of ImageAlbum objects
         """
-        connection = sqlite.connect(self.config.IMAGE_DB)
+        connection = self.config.MEDIA_DB.get_connection()
         cursor = connection.cursor()
         cursor.execute("SELECT path FROM album ORDER BY title")
         albums = []
         for row in cursor:
             albums.append(ImageAlbum(row[0]))
-        connection.close()
         return albums
 
     def get_number_of_images(self):
@@ -54,25 +54,50 @@ class ImageLibrary:
         Get the number of images in image library.
         @return: Integer
         """
-        connection = sqlite.connect(self.config.IMAGE_DB)
+        connection = self.config.MEDIA_DB.get_connection()
         cursor = connection.cursor()
         cursor.execute("SELECT COUNT(filename) FROM image")
         result = cursor.fetchall()
         num = result[0][0]
-        connection.close()
         return num
 
+    def get_duplicate_groups(self):
+        """
+        Get images that have the same content, for example the same photo in
+        two albums. Copies of an image have the same thumbnail hash.
+        @return: List of lists of Image objects. Each list contains the
+            copies of one image.
+        """
+        connection = self.config.MEDIA_DB.get_connection()
+        cursor = connection.cursor()
+        cursor.execute("""SELECT filename, album_path, title, description,
+                                 date, time, width, height,filesize, hash
+                          FROM   image
+                          WHERE  hash IN (SELECT hash
+                                          FROM image
+                                          GROUP BY hash
+                                          HAVING COUNT(filename) > 1)
+                          ORDER BY hash, filename""")
+        groups = []
+        previous_hash = None
+        for row in cursor:
+            if row[9] != previous_hash:
+                groups.append([])
+                previous_hash = row[9]
+            groups[-1].append(Image(row[0], row[1], row[2], row[3], row[4],
+                                row[5], row[6], row[7], row[8], row[9]))
+        return groups
+
     def get_number_of_albums(self):
         """
         Get the number of albums in image library.
         @return: Integer
         """
-        connection = sqlite.connect(self.config.IMAGE_DB)
+        connection = self.config.MEDIA_DB.get_connection()
         cursor = connection.cursor()
         cursor.execute("SELECT COUNT(path) FROM album")
         result = cursor.fetchall()
         num = result[0][0]
-        connection.close()
         return num
 
 
@@ -87,7 +112,7 @@ class ImageAlbum:
         """Initialize album"""
         self.config = Configuration()
 
-        connection = sqlite.connect(self.config.IMAGE_DB)
+        connection = self.config.MEDIA_DB.get_connection()
         cursor = connection.cursor()
         cursor.execute(
             "SELECT path, title, description, hash FROM album WHERE path='%s'"
@@ -100,7 +125,6 @@ class ImageAlbum:
         if len(result[0][3]) > 0:
             self.__thumbnail = os.path.join(self.config.IMAGE_THUMB_DIR,
                  result[0][3] + ".jpg")
-        connection.close()
 
     def get_path(self):
         """
@@ -135,13 +159,12 @@ class ImageAlbum:
         Get the number of images in this album.
         @return: Integer
         """
-        connection = sqlite.connect(self.config.IMAGE_DB)
+        connection = self.config.MEDIA_DB.get_connection()
         cursor = connection.cursor()
         cursor.execute(
             "SELECT COUNT(filename) FROM image WHERE album_path='%s'"
             % self.__path)
         result = cursor.fetchall()
-        connection.close()
         return result[0][0]
 
     def get_preview_images(self, number=3):
@@ -151,7 +174,7 @@ class ImageAlbum:
         @param number: How many images should be returned
         @return: List of Image objects
         """
-        connection = sqlite.connect(self.config.IMAGE_DB)
+        connection = self.config.MEDIA_DB.get_connection()
         cursor = connection.cursor()
         cursor.execute("""SELECT filename, album_path, title, description,
                                  date, time, width, height,filesize, hash
@@ -164,7 +187,6 @@ class ImageAlbum:
         for row in cursor:
             images.append(Image(row[0], row[1], row[2], row[3], row[4],
                                 row[5], row[6], row[7], row[8], row[9]))
-        connection.close()
         return images
 
     def get_images(self):
@@ -172,7 +194,7 @@ class ImageAlbum:
         Get images in this album as a list of Image objects.
         @return: List of Image objects
         """
-        connection = sqlite.connect(self.config.IMAGE_DB)
+        connection = self.config.MEDIA_DB.get_connection()
         cursor = connection.cursor()
         cursor.execute("""SELECT filename, album_path, title, description,
                                  date, time, width, height,filesize, hash
@@ -183,7 +205,6 @@ class ImageAlbum:
         for row in cursor:
             images.append(Image(row[0], row[1], row[2], row[3], row[4],
                                 row[5], row[6], row[7], row[8], row[9]))
-        connection.close()
         return images
 
 
@@ -266,24 +287,90 @@ class Image(object):
         """
         return int(self.__filesize)
 
-    def get_thumbnail_url(self):
+    def get_thumbnail_url(self, width=None, height=None):
         """
-        Get the absolute path of the thumbnail of this image.
+        Get the absolute path of the thumbnail of this image. If width and
+        height are given, get the smallest thumbnail that is at least that
+        size. Missing thumbnails are created in the background, and a larger
+        thumbnail or the original image is returned meanwhile.
+        @param width: Width of the area where the thumbnail is shown
+        @param height: Height of the area where the thumbnail is shown
         @return: String
         """
-        return os.path.join(self.config.IMAGE_THUMB_DIR,
+        default = os.path.join(self.config.IMAGE_THUMB_DIR,
             self.__thumb_hash + ".jpg")
+        if not os.path.exists(default):
+            # Thumbnails have been evicted from the cache or haven't been
+            # created yet. They are created in the background, so the best
+            # existing thumbnail or the original is shown meanwhile.
+            Regenerator().regenerate(self.__filename,
+                self._create_thumbnails)
+            if width is None or height is None:
+                width = height = Thumbnailer.MAX_SIZE
+            return self.get_display_url(width, height)
+
+        thumbnail = None
+        if width is not None and height is not None:
+            thumbnail = self._find_thumbnail(width, height)
+        if thumbnail is None:
+            thumbnail = default
+        AccessLog().record(thumbnail)
+        return thumbnail
+
+    def get_display_url(self, width, height):
+        """
+        Get the absolute path of the smallest file that shows this image
+        in the given size without upscaling. This is a thumbnail if one is
+        large enough and the original image otherwise.
+        @param width: Width of the area where the image is shown
+        @param height: Height of the area where the image is shown
+        @return: String
+        """
+        thumbnail = self._find_thumbnail(width, height)
+        if thumbnail is not None:
+            AccessLog().record(thumbnail)
+            return thumbnail
+        return self.__filename
+
+    def _find_thumbnail(self, width, height):
+        """
+        Find the smallest thumbnail that is at least width x height. If the
+        right size has been evicted from the cache, it's regenerated in the
+        background and a larger thumbnail (or None) is returned meanwhile.
+        """
+        thumbnail = Thumbnailer.find_thumbnail(self.config.IMAGE_THUMB_DIR,
+            self.__thumb_hash, width, height)
+
+        # Thumbnails smaller than the original are always created
+        image_size = max(self.get_width(), self.get_height())
+        for size in Thumbnailer.get_sizes():
+            if size >= max(width, height) and (size < image_size or
+                size == Thumbnailer.MAX_SIZE):
+                expected = Thumbnailer.get_thumbnail_path(
+                    self.config.IMAGE_THUMB_DIR, self.__thumb_hash, size)
+                if thumbnail != expected:
+                    Regenerator().regenerate(self.__filename,
+                        self._create_thumbnails)
+                break
+        return thumbnail
+
+    def _create_thumbnails(self):
+        """Create thumbnails of this image again."""
+        try:
+            ImageThumbnailer(self.__filename,
+                thumb_hash=self.__thumb_hash).create_thumbnail()
+        except ThumbnailerException:
+            pass
 
     def get_album(self):
         """
         Get the ImageAlbum object. Returned album contains this image.
         @return: String
         """
-        connection = sqlite.connect(self.config.IMAGE_DB)
+        connection = self.config.MEDIA_DB.get_connection()
         cursor = connection.cursor()
         cursor.execute(
             "SELECT path FROM album WHERE path='%s'" % self.__album_path)
         result = cursor.fetchall()
-        connection.close()
         return ImageAlbum(result[0][0])
 
@@ -2,10 +2,12 @@
 '''Music Library - Interface for Entertainer music library cache'''
 
 import os
+import shutil
 
 import CDDB, DiscID
-from pysqlite2 import dbapi2 as sqlite
 
+from entertainerlib.album_art_service import AlbumArtService
+from entertainerlib.cache_budget import AccessLog, Regenerator
 from entertainerlib.client.medialibrary.playable import Playable
 from entertainerlib.configuration import Configuration
 from entertainerlib.download import LyricsDownloader
@@ -25,15 +27,11 @@ class MusicLibrary:
     def __init__(self):
         self.config = Configuration()
 
-        if not os.path.exists(self.config.MUSIC_DB):
+        if not os.path.exists(self.config.MEDIA_DB.filename):
             raise Exception("Music database doesn't exist!")
-        self.db_connection = sqlite.connect(self.config.MUSIC_DB)
+        self.db_connection = self.config.MEDIA_DB.get_connection()
         self.cursor = self.db_connection.cursor()
 
-    def __del__(self):
-        '''Close the connection when this object is destroyed.'''
-        self.db_connection.close()
-
     def get_compact_disc_information(self):
         '''Get the CompactDisc object of the current disc in drive by querying
         CD information from an Internet database (CDDB).'''
@@ -152,6 +150,9 @@ class MusicLibrary:
 class Album(object):
     '''Representation of music album which contains tracks.'''
 
+    # Seconds to wait for album art to be downloaded
+    ALBUM_ART_TIMEOUT = 60
+
     def __init__(self, artist, title, length, year, album_art_url, tracks):
         self.config = Configuration()
         self.artist = artist
@@ -163,7 +164,24 @@ class Album(object):
 
     def has_album_art(self):
         '''Test if the album has album art.'''
-        return os.path.exists(self.album_art_url)
+        if os.path.exists(self.album_art_url):
+            AccessLog().record(self.album_art_url)
+            return True
+        Regenerator().regenerate(self.album_art_url, self._find_album_art)
+        return False
+
+    def _find_album_art(self):
+        '''Get album art that may have been evicted from the cache again.'''
+        folder = os.path.dirname(self.tracks[0].filename)
+        for name in ["cover.jpg", "folder.jpg"]:
+            if os.path.exists(os.path.join(folder, name)):
+                shutil.copyfile(os.path.join(folder, name), self.album_art_url)
+                return
+        if (self.config.download_album_art and
+            self.title != "Unknown album" and self.artist != "Unknown Artist"):
+            # Wait in this thread, the regenerator is already in background
+            AlbumArtService().fetch(self.artist, self.title).wait(
+                self.ALBUM_ART_TIMEOUT)
 
 
 class Track(Playable):
@@ -3,10 +3,10 @@
 
 import os
 
-from pysqlite2 import dbapi2 as sqlite
-
+from entertainerlib.cache_budget import AccessLog, Regenerator
 from entertainerlib.client.medialibrary.playable import Playable
 from entertainerlib.configuration import Configuration
+from entertainerlib.thumbnailer import VideoThumbnailer
 
 class VideoLibrary(object):
     '''Interface for Entertainer's video cache.'''
@@ -14,22 +14,18 @@ class VideoLibrary(object):
     def __init__(self):
         self.config = Configuration()
 
-        if not os.path.exists(self.config.VIDEO_DB):
+        if not os.path.exists(self.config.MEDIA_DB.filename):
             raise Exception("Video database doesn't exist!")
 
-        self.connection = sqlite.connect(self.config.VIDEO_DB)
+        self.connection = self.config.MEDIA_DB.get_connection()
         self.cursor = self.connection.cursor()
 
-    def __del__(self):
-        '''Close the db connection when this object is deleted.'''
-        self.connection.close()
-
     def get_movies(self):
         '''Get all the movies.'''
-        self.cursor.execute("""SELECT videofile.filename
-                          FROM   videofile, metadata
+        self.cursor.execute("""SELECT video.filename
+                          FROM   video, metadata
                           WHERE  type='MOVIE'
-                          AND    videofile.filename=metadata.filename
+                          AND    video.filename=metadata.filename
                           ORDER BY title""")
         movies = []
         for row in self.cursor.fetchall():
@@ -44,9 +40,9 @@ class VideoLibrary(object):
                                  plot_outline, plot, actor_1, actor_2,
                                  actor_3, actor_4, actor_5, writer_1,
                                  writer_2, director_1, director_2
-                          FROM   videofile, metadata
+                          FROM   video, metadata
                           WHERE  metadata.filename=:fn
-                          AND    videofile.filename=metadata.filename
+                          AND    video.filename=metadata.filename
                           ORDER BY title""", { "fn" : filename })
         result = self.cursor.fetchall()
         db_movie = result[0]
@@ -119,10 +115,10 @@ class VideoLibrary(object):
     def _create_video_clip(self, filename):
         '''Factory method to create a video clip.'''
         self.cursor.execute(
-            """SELECT videofile.filename, hash, title
-                          FROM   videofile, metadata
-                          WHERE  videofile.filename=:fn
-                          AND    videofile.filename=metadata.filename
+            """SELECT video.filename, hash, title
+                          FROM   video, metadata
+                          WHERE  video.filename=:fn
+                          AND    video.filename=metadata.filename
                           ORDER BY title""", { "fn" : filename })
         result = self.cursor.fetchall()
 
@@ -132,6 +128,27 @@ class VideoLibrary(object):
         video_item.title = result[0][2]
         return video_item
 
+    def get_duplicate_groups(self):
+        '''Get videos that have the same content, for example the same clip
+        in two folders. Copies of a video have the same thumbnail hash.
+        Returns a list of lists of VideoItems, each list contains the copies
+        of one video.'''
+        self.cursor.execute("""SELECT filename, hash
+                          FROM   video
+                          WHERE  hash IN (SELECT hash
+                                          FROM video
+                                          GROUP BY hash
+                                          HAVING COUNT(filename) > 1)
+                          ORDER BY hash, filename""")
+        groups = []
+        previous_hash = None
+        for filename, art_hash in self.cursor.fetchall():
+            if art_hash != previous_hash:
+                groups.append([])
+                previous_hash = art_hash
+            groups[-1].append(self._create_video_clip(filename))
+        return groups
+
     def get_number_of_movies(self):
         '''Get the number of movies.'''
         self.cursor.execute(
@@ -170,10 +187,10 @@ class VideoLibrary(object):
     def _create_tv_episode(self, filename):
         '''Factory method to create a TV episode.'''
         self.cursor.execute(
-            """SELECT videofile.filename, hash, title, plot, episode
-                          FROM   videofile, metadata
-                          WHERE  videofile.filename=:fn
-                          AND    videofile.filename=metadata.filename
+            """SELECT video.filename, hash, title, plot, episode
+                          FROM   video, metadata
+                          WHERE  video.filename=:fn
+                          AND    video.filename=metadata.filename
                           ORDER BY title""", { "fn" : filename })
         result = self.cursor.fetchall()
         db_episode = result[0]
@@ -218,7 +235,11 @@ class VideoItem(Playable):
         '''Test if there is a thumbnail.'''
         thumb_path = os.path.join(self.config.VIDEO_THUMB_DIR,
             self.art_hash + ".jpg")
-        return os.path.exists(thumb_path)
+        if os.path.exists(thumb_path):
+            AccessLog().record(thumb_path)
+            return True
+        self._regenerate_thumbnail()
+        return False
 
     @property
     def thumbnail_url(self):
@@ -226,11 +247,20 @@ class VideoItem(Playable):
         thumb = os.path.join(self.config.VIDEO_THUMB_DIR,
             self.art_hash + ".jpg")
         if os.path.exists(thumb):
+            AccessLog().record(thumb)
             return thumb
         else:
+            self._regenerate_thumbnail()
             return os.path.join(self.config.theme_path,
                 "images/default_movie_art.png")
 
+    def _regenerate_thumbnail(self):
+        '''Create an evicted thumbnail again in the background.'''
+        if os.path.exists(self.filename):
+            Regenerator().regenerate(self.filename,
+                lambda: VideoThumbnailer(self.filename,
+                    thumb_hash=self.art_hash).create_thumbnail())
+
     # Implement playable interface
     def get_title(self):
         '''Get the title.'''
@@ -267,7 +297,10 @@ class Movie(VideoFilm):
     def has_cover_art(self):
         '''Test if there is cover art in the cache.'''
         art_path =  os.path.join(self.config.MOVIE_ART_DIR, self.title + ".jpg")
-        return os.path.exists(art_path)
+        if os.path.exists(art_path):
+            AccessLog().record(art_path)
+            return True
+        return False
 
     @property
     def cover_art_url(self):
@@ -290,7 +323,10 @@ class TVSeries(object):
     def has_cover_art(self):
         '''Test if there is cover art in the cache.'''
         art_path =  os.path.join(self.config.MOVIE_ART_DIR, self.title + ".jpg")
-        return os.path.exists(art_path)
+        if os.path.exists(art_path):
+            AccessLog().record(art_path)
+            return True
+        return False
 
     @property
     def cover_art_url(self):
@@ -38,6 +38,8 @@ class Configuration(MessageHandler):
 
             self.MEDIA_DB = Database(os.path.join(self.cache_dir, 'media'))
 
+            # Cache databases of older versions. They are migrated into
+            # MEDIA_DB when the backend starts.
             self.IMAGE_DB = os.path.join(self.cache_dir, 'image.db')
             self.MUSIC_DB = os.path.join(self.cache_dir, 'music.db')
             self.VIDEO_DB = os.path.join(self.cache_dir, 'video.db')
@@ -47,6 +49,11 @@ class Configuration(MessageHandler):
             self.VIDEO_THUMB_DIR = os.path.join(self.THUMB_DIR, 'video')
             self.ALBUM_ART_DIR = os.path.join(self.cache_dir, 'album_art')
             self.MOVIE_ART_DIR = os.path.join(self.cache_dir, 'movie_art')
+            self.CACHE_INDEX_DB = os.path.join(self.cache_dir, 'cache_index.db')
+            self.CACHE_ACCESS_LOG = os.path.join(self.cache_dir,
+                'cache_access.log')
+            self.INDEX_FAILURE_DB = os.path.join(self.cache_dir,
+                'index_failures.db')
 
             self.read_config_file()
 
@@ -157,11 +164,35 @@ class Configuration(MessageHandler):
         '''Boolean to tell if metadata should be downloaded.'''
         return self.content.getboolean("Media", "download_metadata")
 
+    @property
+    def metadata_search_workers(self):
+        '''Number of threads that search video metadata.'''
+        return self._get_optional_option(self.content.getint, "Media",
+            "metadata_search_workers", 2)
+
     @property
     def download_album_art(self):
         '''Boolean to tell if album art should be downloaded.'''
         return self.content.getboolean("Media", "download_album_art")
 
+    @property
+    def album_art_workers(self):
+        '''Number of threads that search album art.'''
+        return self._get_optional_option(self.content.getint, "Media",
+            "album_art_workers", 2)
+
+    @property
+    def album_art_host_interval(self):
+        '''Minimum seconds between album art requests to the same host.'''
+        return self._get_optional_option(self.content.getfloat, "Media",
+            "album_art_host_interval", 1.0)
+
+    @property
+    def album_art_retry_interval(self):
+        '''Hours before album art that wasn't found is searched again.'''
+        return self._get_optional_option(self.content.getint, "Media",
+            "album_art_retry_interval", 168)
+
     @property
     def download_lyrics(self):
         '''Boolean to tell if lyrics should be downloaded.'''
@@ -202,6 +233,191 @@ class Configuration(MessageHandler):
         '''Amount of seconds before the slideshow steps to the next image.'''
         return self.content.getint("Photographs", "slideshow_step")
 
+    @property
+    def watch_method(self):
+        '''How media folders are watched for changes: auto, inotify or poll.'''
+        return self._get_indexing_option(self.content.get, "watch_method",
+            "auto")
+
+    @property
+    def watch_poll_interval(self):
+        '''Seconds between scans of media folders that are polled.'''
+        return self._get_indexing_option(self.content.getint,
+            "watch_poll_interval", 300)
+
+    @property
+    def throttle_mode(self):
+        '''Indexing budget type: files, bytes, utilization or none.'''
+        return self._get_indexing_option(self.content.get, "throttle_mode",
+            "utilization")
+
+    @property
+    def throttle_files_per_second(self):
+        '''Files per second that indexers process under a normal load.'''
+        return self._get_indexing_option(self.content.getfloat,
+            "throttle_files_per_second", 2.0)
+
+    @property
+    def throttle_bytes_per_second(self):
+        '''Bytes per second that indexers read under a normal load.'''
+        return self._get_indexing_option(self.content.getint,
+            "throttle_bytes_per_second", 4194304)
+
+    @property
+    def throttle_target_utilization(self):
+        '''Disk utilisation (0.0 - 1.0) above which indexers back off.'''
+        return self._get_indexing_option(self.content.getfloat,
+            "throttle_target_utilization", 0.25)
+
+    @property
+    def bulk_ingest_rows(self):
+        '''Number of cache rows that indexers write in one transaction.'''
+        return self._get_indexing_option(self.content.getint,
+            "bulk_ingest_rows", 500)
+
+    @property
+    def bulk_ingest_interval(self):
+        '''Milliseconds that indexers may buffer cache rows before writing.'''
+        return self._get_indexing_option(self.content.getint,
+            "bulk_ingest_interval", 2000)
+
+    @property
+    def thumbnail_workers(self):
+        '''Number of thumbnailer processes. 0 means one per CPU core.'''
+        return self._get_indexing_option(self.content.getint,
+            "thumbnail_workers", 0)
+
+    @property
+    def thumbnail_timeout(self):
+        '''Seconds after which a thumbnail job has failed.'''
+        return self._get_indexing_option(self.content.getint,
+            "thumbnail_timeout", 60)
+
+    @property
+    def thumbnail_policy(self):
+        '''How JPEG thumbnails are made: quality, balanced or fast.'''
+        return self._get_indexing_option(self.content.get,
+            "thumbnail_policy", "fast")
+
+    @property
+    def video_thumbnail_pipelines(self):
+        '''Number of reusable pipelines for video thumbnails.'''
+        return self._get_indexing_option(self.content.getint,
+            "video_thumbnail_pipelines", 2)
+
+    @property
+    def video_thumbnail_timeout(self):
+        '''Seconds that creating a video thumbnail may take.'''
+        return self._get_indexing_option(self.content.getint,
+            "video_thumbnail_timeout", 30)
+
+    @property
+    def video_thumbnail_frame_selection(self):
+        '''How the video thumbnail frame is chosen: best or first.'''
+        return self._get_indexing_option(self.content.get,
+            "video_thumbnail_frame_selection", "best")
+
+    @property
+    def worker_timeout(self):
+        '''Seconds a worker process may spend on one file.'''
+        return self._get_indexing_option(self.content.getint,
+            "worker_timeout", 60)
+
+    @property
+    def index_retry_interval(self):
+        '''Hours to skip a file that failed to index before trying again.'''
+        return self._get_indexing_option(self.content.getint,
+            "index_retry_interval", 24)
+
+    @property
+    def indexer_stat_workers(self):
+        '''Number of indexer threads that stat and filter files.'''
+        return self._get_indexing_option(self.content.getint,
+            "indexer_stat_workers", 2)
+
+    @property
+    def indexer_probe_workers(self):
+        '''Number of indexer threads that read metadata of files.'''
+        return self._get_indexing_option(self.content.getint,
+            "indexer_probe_workers", 2)
+
+    @property
+    def indexer_thumbnail_workers(self):
+        '''Number of indexer threads that create thumbnails.'''
+        return self._get_indexing_option(self.content.getint,
+            "indexer_thumbnail_workers", 2)
+
+    @property
+    def indexer_queue_size(self):
+        '''Number of files that may wait for each indexer stage.'''
+        return self._get_indexing_option(self.content.getint,
+            "indexer_queue_size", 256)
+
+    @property
+    def indexer_report_interval(self):
+        '''Seconds between indexer statistics in the log. 0 means only at
+        the end.'''
+        return self._get_indexing_option(self.content.getint,
+            "indexer_report_interval", 30)
+
+    @property
+    def trust_directory_mtimes(self):
+        '''Skip directories whose modification time hasn't changed when
+        media folders are walked again.'''
+        return self._get_indexing_option(self.content.getboolean,
+            "trust_directory_mtimes", True)
+
+    @property
+    def indexing_progress_interval(self):
+        '''Minimum seconds between indexing progress messages. 0 means only
+        when indexing has finished.'''
+        return self._get_indexing_option(self.content.getint,
+            "indexing_progress_interval", 2)
+
+    @property
+    def index_checkpoint_interval(self):
+        '''Number of files between checkpoints of the indexing journal, from
+        which an interrupted indexing run continues.'''
+        return self._get_indexing_option(self.content.getint,
+            "index_checkpoint_interval", 500)
+
+    @property
+    def thumbnail_cache_limit(self):
+        '''Megabytes that thumbnails may use. 0 means no limit.'''
+        return self._get_optional_option(self.content.getint, "Cache",
+            "thumbnail_cache_limit", 512)
+
+    @property
+    def album_art_cache_limit(self):
+        '''Megabytes that album art may use. 0 means no limit.'''
+        return self._get_optional_option(self.content.getint, "Cache",
+            "album_art_cache_limit", 64)
+
+    @property
+    def movie_art_cache_limit(self):
+        '''Megabytes that movie art may use. 0 means no limit.'''
+        return self._get_optional_option(self.content.getint, "Cache",
+            "movie_art_cache_limit", 0)
+
+    @property
+    def cache_check_interval(self):
+        '''Seconds between checks of the cache size limits.'''
+        return self._get_optional_option(self.content.getint, "Cache",
+            "cache_check_interval", 600)
+
+    def _get_indexing_option(self, getter, option, default):
+        '''Read an option from the Indexing section.'''
+        return self._get_optional_option(getter, "Indexing", option, default)
+
+    def _get_optional_option(self, getter, section, option, default):
+        '''Read an option that older versions didn't have. Content
+        configurations written by older versions don't have all the options,
+        so fall back to the given default value.'''
+        try:
+            return getter(section, option)
+        except (NoSectionError, NoOptionError):
+            return default
+
     # Implements MessageHandler interface
     def handleMessage(self, message):
         """
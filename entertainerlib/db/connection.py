@@ -2,7 +2,9 @@
 '''Contains database connection wrappers'''
 
 import os
+import threading
 
+from pysqlite2 import dbapi2 as sqlite
 from storm.locals import create_database, Store
 
 SCHEMA = {
@@ -91,9 +93,27 @@ class DatabaseConnectionException(Exception):
 class Database(object):
     '''Database connection object handler
 
-    Wraps a sqlite connection and a storm Store
+    Wraps a sqlite connection and a storm Store. The media caches and
+    libraries use plain pysqlite connections to the same database through
+    get_connection().
+
+    The database is used in WAL journaling mode, so readers see a consistent
+    snapshot of the last commit while a writer is indexing, and writers
+    don't wait for readers. Writers still wait for each other for up to
+    BUSY_TIMEOUT seconds instead of failing with "database is locked".
     '''
 
+    # Seconds to wait for a lock held by another connection
+    BUSY_TIMEOUT = 30
+
+    # Pragmas for every pysqlite connection. Commits in WAL mode are durable
+    # at checkpoints with synchronous=NORMAL, which is enough for a cache.
+    PRAGMAS = [
+        'PRAGMA synchronous=NORMAL',
+        'PRAGMA temp_store=MEMORY',
+        'PRAGMA cache_size=-16384',
+        ]
+
     def __init__(self, filename, debug=False):
         if debug:
             import sys
@@ -106,11 +126,20 @@ class Database(object):
         if not os.path.exists(self._filename):
             create = True
 
-        self._db = create_database('sqlite:%s' % self._filename)
+        self._db = create_database('sqlite:%s?timeout=%d' % (self._filename,
+            self.BUSY_TIMEOUT))
+        # Thread -> pysqlite connection. SQLite connections can only be used
+        # in the thread that created them.
+        self._local = threading.local()
 
         if create:
             self._create()
 
+    @property
+    def filename(self):
+        '''Path of the database file.'''
+        return self._filename
+
     def _create(self):
         '''Create a new entertainer database
 
@@ -118,6 +147,9 @@ class Database(object):
         database based on that schema
         '''
 
+        # The journal mode is stored in the database file
+        self.get_connection()
+
         store = Store(self._db)
         store.execute("""
         CREATE TABLE `entertainer_data` (
@@ -134,3 +166,27 @@ class Database(object):
         '''Wrapper around Database.connect'''
         return self._db.connect(*args, **kwargs)
 
+    def get_connection(self):
+        '''Return the pysqlite connection of the calling thread. It is
+        created and configured on first use and stays open for the lifetime
+        of the thread, so it must not be closed by the caller.'''
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite.connect(self._filename,
+                timeout=self.BUSY_TIMEOUT)
+            cursor = connection.cursor()
+            cursor.execute('PRAGMA journal_mode=WAL')
+            for pragma in self.PRAGMAS:
+                cursor.execute(pragma)
+            self._local.connection = connection
+        return connection
+
+    def has_rows(self, table):
+        '''Return True if the table exists and has at least one row.'''
+        cursor = self.get_connection().cursor()
+        try:
+            cursor.execute('SELECT 1 FROM `%s` LIMIT 1' % table)
+        except sqlite.OperationalError:
+            return False
+        return cursor.fetchone() is not None
+
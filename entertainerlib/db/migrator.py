@@ -0,0 +1,83 @@
+# Copyright (c) 2009 Entertainer Developers - See COPYING - GPLv2
+'''Moves legacy cache databases into the media database'''
+
+import os
+
+from pysqlite2 import dbapi2 as sqlite
+
+
+class LegacyMigrator(object):
+    '''Copies the tables of a legacy cache database into the media database.
+
+    The legacy database is attached to the media database connection and
+    rows are copied with INSERT ... SELECT, so they are streamed by SQLite
+    without being loaded into Python. Only columns that exist in both tables
+    are copied, which handles legacy tables from before columns were added.
+    Each legacy database is copied in one transaction and renamed with
+    MIGRATED_SUFFIX afterwards, so the migration runs only once and an
+    interrupted migration is simply run again.
+    '''
+
+    # Suffix of migrated legacy database files
+    MIGRATED_SUFFIX = '.migrated'
+
+    def __init__(self, database):
+        '''
+        Create a new LegacyMigrator.
+        @param database: Media database (entertainerlib.db.connection.Database)
+        '''
+        self.database = database
+
+    def needs_migration(self, legacy_file):
+        '''Return True if the legacy database hasn't been migrated yet.'''
+        return os.path.exists(legacy_file)
+
+    def migrate(self, legacy_file, tables):
+        '''
+        Copy the tables of a legacy database. The tables must already exist
+        in the media database. Existing rows with the same key are kept.
+        @param legacy_file: Path of the legacy database
+        @param tables: Dictionary of legacy table -> media database table
+        @return: Number of copied rows
+        '''
+        if not self.needs_migration(legacy_file):
+            return 0
+
+        connection = self.database.get_connection()
+        # Attaching isn't allowed inside a transaction
+        connection.commit()
+        cursor = connection.cursor()
+        cursor.execute("ATTACH DATABASE ? AS legacy", (legacy_file,))
+        copied = 0
+        try:
+            try:
+                for legacy_table, table in tables.iteritems():
+                    copied += self._copy_table(cursor, legacy_table, table)
+                connection.commit()
+            except sqlite.Error:
+                connection.rollback()
+                raise
+        finally:
+            cursor.execute("DETACH DATABASE legacy")
+
+        os.rename(legacy_file, legacy_file + self.MIGRATED_SUFFIX)
+        return copied
+
+    def _copy_table(self, cursor, legacy_table, table):
+        '''Copy the rows of one table and return their number.'''
+        legacy_columns = self._get_columns(cursor, 'legacy', legacy_table)
+        columns = [column for column in self._get_columns(cursor, 'main',
+            table) if column in legacy_columns]
+        if not columns:
+            return 0
+
+        column_list = ', '.join(['`%s`' % column for column in columns])
+        cursor.execute("""INSERT OR IGNORE INTO main.`%s` (%s)
+                          SELECT %s FROM legacy.`%s`""" % (table,
+                          column_list, column_list, legacy_table))
+        return cursor.rowcount
+
+    def _get_columns(self, cursor, schema, table):
+        '''Return the column names of a table, empty if it doesn't exist.'''
+        cursor.execute("PRAGMA %s.table_info(`%s`)" % (schema, table))
+        return [row[1] for row in cursor.fetchall()]
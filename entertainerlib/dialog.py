@@ -13,6 +13,8 @@ import gtk
 from entertainerlib.backend.core.message import Message
 from entertainerlib.backend.core.message_bus_proxy import MessageBusProxy
 from entertainerlib.backend.core.message_type_priority import MessageType
+from entertainerlib.client.indexing_progress import (IndexingProgress,
+    format_progress)
 from entertainerlib.configuration import Configuration
 from entertainerlib.logger import Logger
 from entertainerlib.gui.theme import Theme
@@ -120,8 +122,22 @@ class ManagerDialog:
         column = gtk.TreeViewColumn(_("Location"), cell_renderer, text=0)
         result_list.append_column(column)
 
+        # Show the progress of indexing while the dialog is open
+        self.indexing_progress = IndexingProgress(self.on_indexing_progress,
+            "Manager GUI progress")
+        self.indexing_progress.start()
+
+    def on_indexing_progress(self, progress):
+        """
+        Show the progress of indexing in the backend
+        @param progress: Progress dictionary
+        """
+        label = self.builder.get_object("label_indexing_progress")
+        label.set_text(format_progress(progress))
+
     def on_dialog_closed(self, widget):
         """Callback function for dialog's close button"""
+        self.indexing_progress.stop()
         try:
             proxy = MessageBusProxy(client_name = "Manager GUI")
             proxy.connectToMessageBus()
@@ -35,13 +35,16 @@ class AlbumArtDownloader(threading.Thread):
     If you want better cover search, please contribute to Rhyhtmbox project.
     """
 
-    def __init__(self, album, artist, art_file_path, callback = None):
+    def __init__(self, album, artist, art_file_path, callback = None,
+        urlopen = None):
         """
         Initialize album art downloader
         @param album: Album title
         @param artist: Artist name
         @param art_file_path: Path where albumart is saved
         @param callback: Callback function that is called after search if set
+        @param urlopen: Function that opens URLs, for example to rate limit
+            the requests. urllib.urlopen if not set.
         """
         threading.Thread.__init__(self)
         self.setName("AlbumArt Downloader")
@@ -50,6 +53,9 @@ class AlbumArtDownloader(threading.Thread):
         self.artist = artist                     # Artist name
         # Album art files are in this directory
         self.path = art_file_path
+        if urlopen is None:
+            urlopen = urllib.urlopen
+        self.urlopen = urlopen
         (self.tld, self.encoding) = self.__get_locale ()
 
     def run(self):
@@ -196,7 +202,7 @@ class AlbumArtDownloader(threading.Thread):
             job += 1
 
         # Retrieve search for keyword
-        temp = urllib.urlopen(url)
+        temp = self.urlopen(url)
         search_results = temp.read()
         self.on_search_response(search_results)
         return True
@@ -264,7 +270,7 @@ class AlbumArtDownloader(threading.Thread):
         if len(image_urls) == 0:
             return
         image_url = image_urls[0]
-        image_file = urllib.urlopen(image_url)
+        image_file = self.urlopen(image_url)
         # base64 encode artist and album so there can be a '/' in the artist
         # or album
         artist_album = self.artist + " - " + self.album
@@ -18,3 +18,16 @@ class ScreenException(Exception):
     '''An exception specific to the Screen class'''
 
 
+
+
+class TagGetterException(Exception):
+    '''An exception specific to the TagGetter'''
+
+
+class WorkerException(Exception):
+    '''A task of a supervised worker process failed. The FailureRecord of the
+    failure is in the record attribute.'''
+
+    def __init__(self, record):
+        Exception.__init__(self, str(record))
+        self.record = record
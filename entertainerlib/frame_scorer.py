@@ -0,0 +1,90 @@
+# Copyright (c) 2009 Entertainer Developers - See COPYING - GPLv2
+'''FrameScorer - Rates how well video frames work as thumbnails.'''
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import Image
+import ImageFilter
+import ImageStat
+
+
+class FrameScorer(object):
+    '''
+    Scores RGB24 frame buffers by how interesting they look.
+
+    Frames are downsampled to about SAMPLE_SIZE pixels on the longest side
+    and converted to luma. Black, white and flat frames (fades, title cards)
+    score 0. Other frames score by luma standard deviation (contrast) plus
+    weighted edge energy (detail). Computation is vectorized with NumPy when
+    it is available and done with PIL otherwise. Scores of the two are close
+    but not equal, so only scores from the same scorer should be compared.
+    '''
+
+    # Longest side of the downsampled frame
+    SAMPLE_SIZE = 160
+
+    # Mean luma below or above which a frame is black or white
+    BLACK_LEVEL = 24
+    WHITE_LEVEL = 232
+
+    # Luma standard deviation below which a frame is flat
+    FLAT_DEVIATION = 10
+
+    # Weight of edge energy against standard deviation
+    EDGE_WEIGHT = 2.0
+
+    def score(self, frame, width, height):
+        '''
+        Return the score of a frame. Higher is better, 0 is unusable.
+        @param frame: RGB24 frame data, rows may be padded
+        @param width: Frame width in pixels
+        @param height: Frame height in pixels
+        '''
+        if numpy is not None:
+            mean, deviation, edges = self._measure_numpy(frame, width, height)
+        else:
+            mean, deviation, edges = self._measure_pil(frame, width, height)
+
+        if (mean < self.BLACK_LEVEL or mean > self.WHITE_LEVEL or
+            deviation < self.FLAT_DEVIATION):
+            return 0.0
+        return deviation + self.EDGE_WEIGHT * edges
+
+    def score_image(self, image):
+        '''Return the score of a PIL image.'''
+        image = image.convert('RGB')
+        width, height = image.size
+        return self.score(image.tostring(), width, height)
+
+    def _step(self, width, height):
+        '''Return the pixel step that downsamples a frame.'''
+        return max(1, max(width, height) / self.SAMPLE_SIZE)
+
+    def _measure_numpy(self, frame, width, height):
+        '''Return mean luma, luma deviation and edge energy with NumPy.'''
+        stride = len(frame) / height
+        data = numpy.frombuffer(frame, numpy.uint8, stride * height)
+        rows = data.reshape(height, stride)[:, :width * 3]
+        step = self._step(width, height)
+        pixels = rows.reshape(height, width, 3)[::step, ::step]
+        pixels = pixels.astype(numpy.float32)
+        luma = (pixels[..., 0] * 0.299 + pixels[..., 1] * 0.587 +
+            pixels[..., 2] * 0.114)
+        edges = (numpy.abs(numpy.diff(luma, axis=0)).mean() +
+            numpy.abs(numpy.diff(luma, axis=1)).mean())
+        return float(luma.mean()), float(luma.std()), float(edges)
+
+    def _measure_pil(self, frame, width, height):
+        '''Return mean luma, luma deviation and edge energy with PIL.'''
+        stride = len(frame) / height
+        image = Image.frombuffer('RGB', (width, height), frame, 'raw', 'RGB',
+            stride, 1)
+        step = self._step(width, height)
+        luma = image.convert('L').resize((max(1, width / step),
+            max(1, height / step)), Image.NEAREST)
+        stat = ImageStat.Stat(luma)
+        edges = ImageStat.Stat(luma.filter(ImageFilter.FIND_EDGES)).mean[0]
+        return stat.mean[0], stat.stddev[0], edges
@@ -41,6 +41,7 @@ class Photo(Screen):
         self.add(self.screen_title)
 
         self.texture = None
+        self.texture_is_original = False
         self._change_image(self.index)
 
     def set_animate(self, boolean):
@@ -57,7 +58,11 @@ class Photo(Screen):
         # Create a new texture and display it
         image = self.images[index]
         self.index = index
-        self.texture = Texture(image.get_filename())
+        # A stage sized thumbnail is enough until the image is zoomed
+        display_url = image.get_display_url(self.config.stage_width,
+            self.config.stage_height)
+        self.texture = Texture(display_url)
+        self.texture_is_original = display_url == image.get_filename()
         self._scale_image(self.texture)
 
         timeline = clutter.Timeline(1000)
@@ -189,5 +194,9 @@ class Photo(Screen):
             self.zoom_level = 1
         else:
             self.zoom_level = self.zoom_level + self.ZOOM_FACTOR
+            if not self.texture_is_original:
+                self.texture.set_from_file(
+                    self.images[self.index].get_filename())
+                self.texture_is_original = True
         self._scale_image(self.texture, self.zoom_level)
 
@@ -113,7 +113,8 @@ class PhotoAlbums(Screen):
         abs_max_h = self.get_abs_y(max_h)
 
         for image in images:
-            pix_buffer = gtk.gdk.pixbuf_new_from_file(image.get_thumbnail_url())
+            pix_buffer = gtk.gdk.pixbuf_new_from_file(
+                image.get_thumbnail_url(abs_max_w, abs_max_h))
             ratio = float(pix_buffer.get_width())
             ratio /= float(pix_buffer.get_height())
 
@@ -50,7 +50,10 @@ class Photographs(Screen):
         self.add(self.menu)
 
         photos = self.images
-        photos_list = [[Texture(photo.get_thumbnail_url()), photo] \
+        # Load the smallest thumbnails that fill the menu items
+        item_width = self.get_abs_x(0.12)
+        photos_list = [[Texture(
+            photo.get_thumbnail_url(item_width, item_width)), photo] \
             for photo in photos]
         self.menu.async_add(photos_list)
 
@@ -12,6 +12,7 @@ import clutter
 import gobject
 import gtk
 
+from entertainerlib.client.indexing_priority import IndexingPriority
 from entertainerlib.client.media_player import MediaPlayer
 from entertainerlib.configuration import Configuration
 from entertainerlib.gui.widgets.volume_indicator import VolumeIndicator
@@ -38,6 +39,7 @@ class UserInterface:
         self.old_height = self.config.stage_height
 
         self.logger = Logger().getLogger('client.gui.UserInterface')
+        self.indexing_priority = IndexingPriority()
 
         self.window = gtk.Window()
         self.window.connect('destroy', self.destroy_callback)
@@ -237,6 +239,7 @@ class UserInterface:
     def move_to_new_screen(self, screen_type, kwargs=None,
         transition=Transition.FORWARD):
         '''Callback method for screens and tabs to ask for new screens'''
+        self.indexing_priority.prioritize_screen(screen_type, kwargs)
         screen = self.create_screen(screen_type, kwargs)
         self.change_screen(screen, transition)
 
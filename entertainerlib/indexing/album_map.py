@@ -0,0 +1,63 @@
+'''Identity map of music albums.'''
+from entertainerlib.db import models
+
+__meta__ = type
+
+
+class AlbumMap:
+    '''Resolves the album of a track without querying the database.
+
+    All albums of the store are loaded with one query when the map is
+    created, and albums are looked up by their normalized artist and title.
+    Albums that don't exist yet are created once and added to the store, so
+    all tracks of an album share one MusicAlbum. The map lives for an
+    indexing session and must only be used from the thread that owns the
+    store.'''
+
+    def __init__(self, store):
+        '''
+        Create a new AlbumMap and load the albums of the store.
+        @param store: Storm store of the media database
+        '''
+        self.store = store
+        self._albums = {}
+        self._new_albums = []
+        for album in store.find(models.MusicAlbum):
+            self._albums.setdefault(self.get_key(album.artist, album.title),
+                album)
+
+    def __len__(self):
+        return len(self._albums)
+
+    @staticmethod
+    def get_key(artist, title):
+        '''Return the key of an album. Case and whitespace are ignored.'''
+        return (u' '.join(unicode(artist or u'').lower().split()),
+            u' '.join(unicode(title or u'').lower().split()))
+
+    def get(self, artist, title, genre=None):
+        '''
+        Return the album with the artist and title. It is created if it
+        doesn't exist.
+        @param genre: Genre of a new album
+        '''
+        key = self.get_key(artist, title)
+        album = self._albums.get(key)
+        if album is None:
+            album = models.MusicAlbum()
+            album.artist = artist
+            album.title = title
+            album.genre = genre
+            self.store.add(album)
+            self._albums[key] = album
+            self._new_albums.append(album)
+        return album
+
+    def flush(self):
+        '''Write the new albums to the database in one batch and return
+        them. The store isn't committed.'''
+        new_albums = self._new_albums
+        self._new_albums = []
+        if new_albums:
+            self.store.flush()
+        return new_albums
@@ -1,144 +1,207 @@
 '''File handlers for the indexer.'''
+import os
+import threading
+
 from storm.locals import Store
 
 from entertainerlib.configuration import Configuration
 from entertainerlib.db import models
+from entertainerlib.exceptions import TagGetterException, WorkerException
+from entertainerlib.indexing.album_map import AlbumMap
 from entertainerlib.indexing.utilities import TagGetter
-from entertainerlib.thumbnailer import ImageThumbnailer, VideoThumbnailer
+from entertainerlib.thumbnail_service import ThumbnailService
+from entertainerlib.thumbnailer import Thumbnailer, create_video_thumbnail
+from entertainerlib.worker_supervisor import WorkerSupervisor
 
 __meta__ = type
 
 
 class FileHandler:
-    '''Abstract class for all file handlers.'''
+    '''Abstract class for all file handlers.
+
+    A file is indexed in three steps, so that the indexer can run them in
+    separate pipeline stages: probe reads the metadata of the file,
+    thumbnail creates its thumbnail and persist writes it to a store. Probe
+    and thumbnail may be called from several threads at once. Persist is
+    only called from the thread that owns the store.'''
+
+    # Model of the indexed files
+    model = None
 
     def __init__(self):
         self.configuration = Configuration()
         self._store = Store(self.configuration.MEDIA_DB)
+        # Worker supervisors of the calling thread by name, so threads run
+        # their tasks in parallel
+        self._supervisors = threading.local()
 
     def __call__(self, filename):
+        info = self.probe(filename)
+        if info is None:
+            return self.find(self._store, filename)
+        self.thumbnail(filename, info)
+        indexed = self.persist(self._store, filename, info)
+        self.flush(self._store)
+        self._store.commit()
+        return indexed
+
+    def probe(self, filename):
+        '''Return the metadata of the file, or None if the file
+        can't be read.'''
+        return {}
+
+    def thumbnail(self, filename, info):
+        '''Create the thumbnail of the file.'''
+
+    def persist(self, store, filename, info):
+        '''Add the file to the store or update it and return its model
+        object. The store isn't committed.'''
         raise NotImplementedError
 
+    def flush(self, store):
+        '''Write what persist has buffered for the store. Called before the
+        store is committed.'''
 
-class AviHandler(FileHandler):
-    '''Handler for avi files.'''
+    def release(self, store):
+        '''Forget the state kept for a store that isn't used anymore.'''
 
-    def __call__(self, filename):
-        if self._store.find(models.VideoFile,
-            models.VideoFile.filename == filename).one():
-            return self._update_file(filename)
-        else:
-            return self._add_file(filename)
+    def find(self, store, filename):
+        '''Return the model object of the file, None if it isn't indexed.'''
+        return store.find(self.model, self.model.filename == filename).one()
 
-    def _add_file(self, filename):
-        '''Add a video.'''
-        video_file = models.VideoFile()
-        video_file.filename = unicode(filename)
-        thumbnailer = VideoThumbnailer(filename)
-        thumbnailer.create_thumbnail()
-        video_file.thumbnail = thumbnailer.filename
+    def _get_supervisor(self, name):
+        '''Return the worker supervisor with the given name of the calling
+        thread.'''
+        supervisor = getattr(self._supervisors, name, None)
+        if supervisor is None:
+            supervisor = WorkerSupervisor(name)
+            setattr(self._supervisors, name, supervisor)
+        return supervisor
 
-        self._store.add(video_file)
-        self._store.commit()
 
+class AviHandler(FileHandler):
+    '''Handler for video files.'''
+
+    model = models.VideoFile
+
+    def thumbnail(self, filename, info):
+        '''See FileHandler.thumbnail.'''
+        try:
+            info['thumbnail_hash'] = self._get_supervisor(
+                'Video thumbnailer').call(create_video_thumbnail, filename)
+        except WorkerException:
+            # The failure is recorded by the supervisor. The video is still
+            # added and its thumbnail is regenerated when it's needed.
+            pass
+
+    def persist(self, store, filename, info):
+        '''See FileHandler.persist.'''
+        video_file = self.find(store, filename)
+        if video_file is not None:
+            # TODO: There's no metadata currently, so just return the
+            # existing object.
+            return video_file
+
+        thumb_hash = info.get('thumbnail_hash')
+        if thumb_hash is None:
+            thumb_hash = Thumbnailer.hash_filename(filename)
+        video_file = models.VideoFile()
+        video_file.filename = unicode(filename)
+        video_file.thumbnail = unicode(Thumbnailer.get_thumbnail_path(
+            os.path.join(self.configuration.THUMB_DIR, 'video'), thumb_hash,
+            Thumbnailer.MAX_SIZE))
+        store.add(video_file)
         return video_file
 
-    def _update_file(self, filename):
-        '''Update on existing video.'''
-        # TODO: There's no metadata currently, so just return the existing
-        # object.
-        return self._store.find(models.VideoFile,
-            models.VideoFile.filename == filename).one()
-
 
 class JpegHandler(FileHandler):
-    '''Handler for jpg/jpeg files.'''
+    '''Handler for jpg/jpeg and png files.'''
 
-    def __call__(self, filename):
-        if self._store.find(models.PhotoImage,
-            models.PhotoImage.filename == filename).one():
-            return self._update_file(filename)
-        else:
-            return self._add_file(filename)
+    model = models.PhotoImage
 
-    def _add_file(self, filename):
-        '''Add an image to the store.'''
+    def __init__(self):
+        FileHandler.__init__(self)
+        self.thumbnails = ThumbnailService()
+
+    def thumbnail(self, filename, info):
+        '''See FileHandler.thumbnail.'''
+        # Thumbnail is created in the background by the thumbnail service
+        info['thumbnail_job'] = self.thumbnails.submit(filename)
+
+    def persist(self, store, filename, info):
+        '''See FileHandler.persist.'''
+        photo_file = self.find(store, filename)
+        if photo_file is not None:
+            # TODO: There's no metadata currently, so just return the
+            # existing object.
+            return photo_file
+
+        # The hash names the thumbnail before it has been created
+        job = info.get('thumbnail_job')
+        if job is not None:
+            thumb_hash = job.hash
+        else:
+            thumb_hash = Thumbnailer.hash_filename(filename)
         photo_file = models.PhotoImage()
         photo_file.filename = unicode(filename)
-
-        thumbnailer = ImageThumbnailer(filename)
-        thumbnailer.create_thumbnail()
-        photo_file.thumbnail = unicode(thumbnailer.filename)
-
-        self._store.add(photo_file)
-        self._store.commit()
-
+        photo_file.thumbnail = unicode(Thumbnailer.get_thumbnail_path(
+            os.path.join(self.configuration.THUMB_DIR, 'image'), thumb_hash,
+            Thumbnailer.MAX_SIZE))
+        store.add(photo_file)
         return photo_file
 
-    def _update_file(self, filename):
-        '''Update an existing image in the store.'''
-        # TODO: There's no metadata currently, so just return the existing
-        # object.
-        return self._store.find(models.PhotoImage,
-            models.PhotoImage.filename == filename).one()
-
 
 class Mp3Handler(FileHandler):
-    '''Handler for mp3 files.'''
-
-    def __call__(self, filename):
-        if self._store.find(models.MusicTrack,
-            models.MusicTrack.filename == filename).one():
-            return self._update_file(filename)
-        else:
-            return self._add_file(filename)
-
-    def _add_file(self, filename):
-        '''Add a file to the store.'''
-        music_file = models.MusicTrack()
-        album = models.MusicAlbum()
-
-        music_file.filename = filename
-
-        tags = TagGetter(filename)
-
-        music_file.comment = tags.comment
-        music_file.lyrics = u''
-        music_file.title = tags.title
-        music_file.tracknumber = tags.track_number
-        album.artist = tags.artist
-        album.title = tags.album
-        album.genre = tags.genre
-        music_file.album = album
+    '''Handler for mp3 and ogg files.'''
 
-        self._store.add(album)
-        self._store.add(music_file)
-        self._store.commit()
+    model = models.MusicTrack
 
-        # TODO: get album art
-        return music_file
-
-    def _update_file(self, filename):
-        '''Update a file already in the store.'''
-        music_file = self._store.find(models.MusicTrack,
-            models.MusicTrack.filename == filename).one()
-        album = music_file.album
-
-        tags = TagGetter(filename)
+    def __init__(self):
+        FileHandler.__init__(self)
+        # Store -> AlbumMap of the store
+        self._album_maps = {}
+
+    def probe(self, filename):
+        '''See FileHandler.probe.'''
+        try:
+            return TagGetter(filename)
+        except TagGetterException:
+            return None
+
+    def persist(self, store, filename, tags):
+        '''See FileHandler.persist.'''
+        music_file = self.find(store, filename)
+        if music_file is None:
+            music_file = models.MusicTrack()
+            music_file.filename = filename
 
         music_file.comment = tags.comment
         music_file.lyrics = u''
         music_file.title = tags.title
         music_file.tracknumber = tags.track_number
-        album.artist = tags.artist
-        album.title = tags.album
-        album.genre = tags.genre
-        music_file.album = album
+        # Albums are shared by their tracks, so a track that moves to
+        # another album gets that album instead of renaming its old one.
+        music_file.album = self._get_album_map(store).get(tags.artist,
+            tags.album, tags.genre)
 
-        self._store.add(album)
-        self._store.add(music_file)
-        self._store.commit()
+        store.add(music_file)
 
         # TODO: get album art
         return music_file
 
+    def flush(self, store):
+        '''See FileHandler.flush.'''
+        if store in self._album_maps:
+            self._album_maps[store].flush()
+
+    def release(self, store):
+        '''See FileHandler.release.'''
+        self._album_maps.pop(store, None)
+
+    def _get_album_map(self, store):
+        '''Return the AlbumMap of a store. It is loaded on first use.'''
+        album_map = self._album_maps.get(store)
+        if album_map is None:
+            album_map = AlbumMap(store)
+            self._album_maps[store] = album_map
+        return album_map
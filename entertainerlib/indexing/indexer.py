@@ -1,45 +1,81 @@
 '''Indexer module.'''
+import os
+import stat
+
+from storm.locals import Store
 
-# Pylint thinks that handlers isn't being used when it clearly is. Ignore it.
-# pylint: disable-msg=W0611
 from entertainerlib.indexing import handlers
+from entertainerlib.indexing.pipeline import Pipeline, Stage
 from entertainerlib.configuration import Configuration
 from entertainerlib.logger import Logger
 
 __meta__ = type
 
+_video_handler = handlers.AviHandler()
+_image_handler = handlers.JpegHandler()
+_music_handler = handlers.Mp3Handler()
+
 
 class Indexer:
     '''Indexer class for indexing media.'''
 
     handlers = {
-        'avi': handlers.AviHandler(),
-        'jpg': handlers.JpegHandler(),
-        'jpeg': handlers.JpegHandler(),
-        'm4v': None,
-        'mkv': None,
-        'mov': None,
-        'mp3': handlers.Mp3Handler(),
-        'mp4': None,
-        'mpeg': None,
-        'mpg': None,
-        'ogg': None,
-        'ogm': None,
-        'png': None,
-        'wmv': None,
+        'avi': _video_handler,
+        'jpg': _image_handler,
+        'jpeg': _image_handler,
+        'm4v': _video_handler,
+        'mkv': _video_handler,
+        'mov': _video_handler,
+        'mp3': _music_handler,
+        'mp4': _video_handler,
+        'mpeg': _video_handler,
+        'mpg': _video_handler,
+        'ogg': _music_handler,
+        'ogm': _video_handler,
+        'png': _image_handler,
+        'wmv': _video_handler,
         }
 
+    # Number of files that are persisted in one transaction
+    COMMIT_INTERVAL = 100
+
     def __init__(self):
         self.configuration = Configuration()
         self.logger = Logger().getLogger(
             'entertainerlib.indexer.indexing.Indexer')
+        self.pipeline = None
+
+        # Store of the persist stage and the number of uncommitted files
+        self._store = None
+        self._uncommitted = 0
 
     def run(self):
         '''Run the indexer.
 
         The Indexer will iterate through media folders and find media that is
-        supported by Entertainer.
+        supported by Entertainer. Files go through a pipeline of stages:
+        discover walks the media folders, stat filters out unsupported and
+        empty files, probe reads metadata, thumbnail creates thumbnails and
+        persist writes the files to the media database. Persist has a
+        single thread, because the store can only be used in one thread.
         '''
+        config = self.configuration
+        queue_size = config.indexer_queue_size
+        self._store = None
+        self._uncommitted = 0
+        self.pipeline = Pipeline([
+            Stage('stat', self._stat, config.indexer_stat_workers,
+                queue_size),
+            Stage('probe', self._probe, config.indexer_probe_workers,
+                queue_size),
+            Stage('thumbnail', self._thumbnail,
+                config.indexer_thumbnail_workers, queue_size),
+            Stage('persist', self._persist, 1, queue_size,
+                finish=self._finish),
+            ], config.indexer_report_interval)
+
+        self.logger.info("Indexing %s" % ', '.join(config.media_folders))
+        self.pipeline.run(self._discover(config.media_folders))
 
     @property
     def supported_filetypes(self):
@@ -55,6 +91,77 @@ class Indexer:
 
     def is_supported_filetype(self, filename):
         '''Return whether or not a file is supported by the indexer.'''
-        extension = filename.split('.')[-1]
-        return extension in self.supported_filetypes
+        return self._get_extension(filename) in self.supported_filetypes
+
+    def _get_extension(self, filename):
+        '''Return the lower case extension of a filename.'''
+        return filename.split('.')[-1].lower()
+
+    def _discover(self, folders):
+        '''Generate the paths of all files in the folders.'''
+        for folder in folders:
+            for root, dirs, names in os.walk(folder):
+                for name in names:
+                    yield os.path.join(root, name)
+
+    def _stat(self, filename):
+        '''Stat stage: return (filename, handler) of a supported, non-empty
+        regular file.'''
+        handler = self.get_filetype_handler(self._get_extension(filename))
+        if handler is None:
+            return None
+        try:
+            stats = os.stat(filename)
+        except OSError:
+            return None
+        if not stat.S_ISREG(stats.st_mode) or stats.st_size == 0:
+            return None
+        return filename, handler
+
+    def _probe(self, item):
+        '''Probe stage: read the metadata of a file.'''
+        filename, handler = item
+        info = handler.probe(filename)
+        if info is None:
+            return None
+        return filename, handler, info
+
+    def _thumbnail(self, item):
+        '''Thumbnail stage: create the thumbnail of a file.'''
+        filename, handler, info = item
+        handler.thumbnail(filename, info)
+        return item
+
+    def _persist(self, item):
+        '''Persist stage: write a file to the media database.'''
+        filename, handler, info = item
+        if self._store is None:
+            self._store = Store(self.configuration.MEDIA_DB)
+        handler.persist(self._store, filename, info)
+        self._uncommitted += 1
+        if self._uncommitted >= self.COMMIT_INTERVAL:
+            self._commit()
+
+    def _commit(self):
+        '''Commit the files persisted since the last commit.'''
+        if self._store is not None:
+            for handler in self._get_handlers():
+                handler.flush(self._store)
+            self._store.commit()
+        self._uncommitted = 0
+
+    def _finish(self):
+        '''Commit the last files and release the store of the run.'''
+        self._commit()
+        if self._store is not None:
+            for handler in self._get_handlers():
+                handler.release(self._store)
+            self._store = None
 
+    def _get_handlers(self):
+        '''Return the distinct file handlers.'''
+        found = []
+        for handler in self.handlers.itervalues():
+            if handler not in found:
+                found.append(handler)
+        return found
@@ -0,0 +1,217 @@
+'''Staged pipeline used by the indexer.'''
+import Queue
+import threading
+import time
+
+from entertainerlib.logger import Logger
+
+__meta__ = type
+
+# Put to the queue of a stage once per worker to stop it
+_END = object()
+
+
+class Stage:
+    '''One stage of a Pipeline.
+
+    Worker threads take items from the queue of the stage and run
+    function(item) on them. The result is put to the queue of the next
+    stage, None drops the item. Queues are bounded, so a slow stage makes
+    the stages before it wait instead of buffering the whole library in
+    memory.'''
+
+    def __init__(self, name, function, workers=1, queue_size=100,
+        finish=None):
+        '''
+        Create a new Stage.
+        @param name: Name of the stage, used in reports and thread names
+        @param function: Function that processes one item
+        @param workers: Number of worker threads
+        @param queue_size: Maximum number of items waiting in the queue
+        @param finish: Function that is called in a worker thread after
+            the last item has been processed
+        '''
+        self.name = name
+        self.function = function
+        self.workers = max(1, workers)
+        self.finish = finish
+        self.queue = Queue.Queue(queue_size)
+        self.next_stage = None
+        self.logger = Logger().getLogger('entertainerlib.indexing.pipeline')
+
+        # Statistics
+        self.processed = 0
+        self.dropped = 0
+        self.errors = 0
+        self.busy_time = 0.0
+
+        self._threads = []
+        self._running = 0
+        self._lock = threading.Lock()
+
+    def start(self):
+        '''Start the worker threads.'''
+        self._running = self.workers
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._work,
+                name='%s-%d' % (self.name, number))
+            thread.setDaemon(True)
+            thread.start()
+            self._threads.append(thread)
+
+    def put(self, item):
+        '''Queue an item. Blocks while the queue is full.'''
+        self.queue.put(item)
+
+    def close(self):
+        '''Stop the workers after the queued items have been processed.'''
+        for _ in range(self.workers):
+            self.queue.put(_END)
+
+    def join(self, timeout=None):
+        '''Wait for the workers to stop. Return True if they have.'''
+        for thread in self._threads:
+            thread.join(timeout)
+            if thread.isAlive():
+                return False
+        return True
+
+    def get_queue_depth(self):
+        '''Return the number of items waiting in the queue.'''
+        return self.queue.qsize()
+
+    def _work(self):
+        '''Process items until the stage is closed.'''
+        while True:
+            item = self.queue.get()
+            if item is _END:
+                break
+
+            start = time.time()
+            failed = False
+            try:
+                result = self.function(item)
+            except Exception, e:
+                # One bad file mustn't stop the pipeline
+                self.logger.error("%s failed for %s: %s" % (self.name,
+                    repr(item), e))
+                result = None
+                failed = True
+
+            self._lock.acquire()
+            try:
+                self.processed += 1
+                self.busy_time += time.time() - start
+                if failed:
+                    self.errors += 1
+                elif result is None and self.next_stage is not None:
+                    self.dropped += 1
+            finally:
+                self._lock.release()
+
+            if result is not None and self.next_stage is not None:
+                self.next_stage.put(result)
+
+        self._lock.acquire()
+        try:
+            self._running -= 1
+            last = self._running == 0
+        finally:
+            self._lock.release()
+
+        if last:
+            try:
+                if self.finish is not None:
+                    self.finish()
+            finally:
+                if self.next_stage is not None:
+                    self.next_stage.close()
+
+
+class Pipeline:
+    '''A chain of stages that items flow through.
+
+    Items come from a source iterable that is consumed in the calling
+    thread. Each stage runs in its own worker threads, so a file can be
+    thumbnailed while the next one is probed. Throughput and queue depth of
+    every stage are logged every report_interval seconds and at the end, so
+    it can be seen which stage limits indexing.'''
+
+    def __init__(self, stages, report_interval=30):
+        '''
+        Create a new Pipeline.
+        @param stages: List of Stage objects in processing order
+        @param report_interval: Seconds between statistics in the log, 0
+            to log them only at the end
+        '''
+        self.stages = stages
+        self.report_interval = report_interval
+        self.logger = Logger().getLogger('entertainerlib.indexing.pipeline')
+        for stage, next_stage in zip(stages, stages[1:]):
+            stage.next_stage = next_stage
+
+        self.discovered = 0
+        self._start_time = None
+        self._last_report = None
+
+    def run(self, source):
+        '''
+        Feed the items of source through the stages and return when all of
+        them have been processed.
+        @param source: Iterable of items for the first stage
+        '''
+        self._start_time = time.time()
+        self._last_report = self._start_time
+        for stage in self.stages:
+            stage.start()
+
+        first = self.stages[0]
+        try:
+            for item in source:
+                self.discovered += 1
+                first.put(item)
+                self._report_if_due()
+        finally:
+            first.close()
+
+        for stage in self.stages:
+            while not stage.join(self.report_interval or None):
+                self._report_if_due()
+        self.report()
+
+    def get_statistics(self):
+        '''
+        Return statistics of the stages as a list of (name, processed,
+        items per second, utilization, queue depth) tuples. Utilization is
+        the fraction of time that the workers of the stage were busy.
+        '''
+        elapsed = max(time.time() - (self._start_time or time.time()), 1e-6)
+        statistics = [('discover', self.discovered,
+            self.discovered / elapsed, None, None)]
+        for stage in self.stages:
+            statistics.append((stage.name, stage.processed,
+                stage.processed / elapsed,
+                stage.busy_time / (elapsed * stage.workers),
+                stage.get_queue_depth()))
+        return statistics
+
+    def report(self):
+        '''Log the statistics of the stages.'''
+        for name, processed, rate, utilization, depth in \
+            self.get_statistics():
+            if utilization is None:
+                self.logger.info("%-10s %8d items %8.1f/s" % (name,
+                    processed, rate))
+            else:
+                self.logger.info("%-10s %8d items %8.1f/s %3d%% busy "
+                    "%5d queued" % (name, processed, rate,
+                    utilization * 100, depth))
+
+    def _report_if_due(self):
+        '''Log the statistics if report_interval has passed.'''
+        if not self.report_interval:
+            return
+        now = time.time()
+        if now - self._last_report >= self.report_interval:
+            self._last_report = now
+            self.report()
@@ -1,37 +1,17 @@
 '''Utilities used specifically by the indexer.'''
-import gst
+from entertainerlib.tag_reader import read_tags
+
 
 class TagGetter:
-    '''A utility class for getting metadata from mp3 files.'''
+    '''A utility class for getting metadata from mp3 and ogg files.'''
 
     def __init__(self, filename):
-        self.tags = {}
-
-        self.pipeline = gst.parse_launch(
-            'filesrc location=%(filename)s ! id3demux ! fakesink' % {
-                'filename': filename})
-        bus = self.pipeline.get_bus()
-        bus.add_signal_watch()
-        bus.connect('message::tag', self.handle_bus_message_tag)
-        self.pipeline.set_state(gst.STATE_PAUSED)
-
-        while True:
-            message = bus.pop()
-            if not message:
-                continue
-            if message.type == gst.MESSAGE_TAG:
-                for key in message.parse_tag().keys():
-                    self.tags[key] = message.parse_tag()[key]
-                break
-
-    def handle_bus_message_tag(self, message):
-        '''Handle the 'message::tag' bus message.'''
-        taglist = message.parse_tag()
-
-        for key in taglist.keys():
-            self.tags[key] = taglist[key]
-
-        #self.looping = False
+        '''
+        Read the tags of a file. Raises TagGetterException if the file has
+        no readable tags.
+        @param filename: Absolute path of the file
+        '''
+        self.tags = read_tags(filename)
 
     def __getattr__(self, attr):
         #TODO: handle types better
@@ -46,4 +26,3 @@ class TagGetter:
         if type(val) == str:
             val = unicode(val)
         return val
-
@@ -0,0 +1,512 @@
+# Copyright (c) 2009 Entertainer Developers - See COPYING - GPLv2
+'''Reads tags and the length of audio files without decoding them.'''
+
+import re
+import struct
+
+from entertainerlib.exceptions import TagGetterException
+
+# Genres of ID3v1 and the Winamp extensions, by genre number
+ID3V1_GENRES = [
+    'Blues', 'Classic Rock', 'Country', 'Dance', 'Disco', 'Funk', 'Grunge',
+    'Hip-Hop', 'Jazz', 'Metal', 'New Age', 'Oldies', 'Other', 'Pop', 'R&B',
+    'Rap', 'Reggae', 'Rock', 'Techno', 'Industrial', 'Alternative', 'Ska',
+    'Death Metal', 'Pranks', 'Soundtrack', 'Euro-Techno', 'Ambient',
+    'Trip-Hop', 'Vocal', 'Jazz+Funk', 'Fusion', 'Trance', 'Classical',
+    'Instrumental', 'Acid', 'House', 'Game', 'Sound Clip', 'Gospel', 'Noise',
+    'AlternRock', 'Bass', 'Soul', 'Punk', 'Space', 'Meditative',
+    'Instrumental Pop', 'Instrumental Rock', 'Ethnic', 'Gothic', 'Darkwave',
+    'Techno-Industrial', 'Electronic', 'Pop-Folk', 'Eurodance', 'Dream',
+    'Southern Rock', 'Comedy', 'Cult', 'Gangsta', 'Top 40', 'Christian Rap',
+    'Pop/Funk', 'Jungle', 'Native American', 'Cabaret', 'New Wave',
+    'Psychadelic', 'Rave', 'Showtunes', 'Trailer', 'Lo-Fi', 'Tribal',
+    'Acid Punk', 'Acid Jazz', 'Polka', 'Retro', 'Musical', 'Rock & Roll',
+    'Hard Rock', 'Folk', 'Folk-Rock', 'National Folk', 'Swing', 'Fast Fusion',
+    'Bebob', 'Latin', 'Revival', 'Celtic', 'Bluegrass', 'Avantgarde',
+    'Gothic Rock', 'Progressive Rock', 'Psychedelic Rock', 'Symphonic Rock',
+    'Slow Rock', 'Big Band', 'Chorus', 'Easy Listening', 'Acoustic', 'Humour',
+    'Speech', 'Chanson', 'Opera', 'Chamber Music', 'Sonata', 'Symphony',
+    'Booty Bass', 'Primus', 'Porn Groove', 'Satire', 'Slow Jam', 'Club',
+    'Tango', 'Samba', 'Folklore', 'Ballad', 'Power Ballad', 'Rhythmic Soul',
+    'Freestyle', 'Duet', 'Punk Rock', 'Drum Solo', 'A capella', 'Euro-House',
+    'Dance Hall', 'Goa', 'Drum & Bass', 'Club-House', 'Hardcore', 'Terror',
+    'Indie', 'BritPop', 'Negerpunk', 'Polsk Punk', 'Beat',
+    'Christian Gangsta Rap', 'Heavy Metal', 'Black Metal', 'Crossover',
+    'Contemporary Christian', 'Christian Rock', 'Merengue', 'Salsa',
+    'Thrash Metal', 'Anime', 'JPop', 'Synthpop',
+    ]
+
+# ID3v2 frame -> tag. Version 2.2 has three character frame names.
+ID3V2_TEXT_FRAMES = {
+    'TIT2': 'title', 'TT2': 'title',
+    'TPE1': 'artist', 'TP1': 'artist',
+    'TALB': 'album', 'TAL': 'album',
+    'TCON': 'genre', 'TCO': 'genre',
+    'TRCK': 'track-number', 'TRK': 'track-number',
+    'TPOS': 'album-disc-number', 'TPA': 'album-disc-number',
+    'TDRC': 'date', 'TYER': 'date', 'TYE': 'date',
+    'TLEN': 'length', 'TLE': 'length',
+    }
+ID3V2_COMMENT_FRAMES = ('COMM', 'COM')
+ID3V2_LYRICS_FRAMES = ('USLT', 'ULT')
+
+# Vorbis comment field -> tag
+VORBIS_FIELDS = {
+    'TITLE': 'title',
+    'ARTIST': 'artist',
+    'ALBUM': 'album',
+    'GENRE': 'genre',
+    'TRACKNUMBER': 'track-number',
+    'DISCNUMBER': 'album-disc-number',
+    'DATE': 'date',
+    'COMMENT': 'comment',
+    'LYRICS': 'lyrics',
+    }
+
+# Bitrates in kbit/s by (MPEG version, layer) and bitrate index
+MPEG_BITRATES = {
+    (1, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416,
+        448],
+    (1, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320,
+        384],
+    (1, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256,
+        320],
+    (2, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224,
+        256],
+    (2, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (2, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    }
+
+# Sample rates by MPEG version and sample rate index. Version 2.5 is 3.
+MPEG_SAMPLE_RATES = {
+    1: [44100, 48000, 32000],
+    2: [22050, 24000, 16000],
+    3: [11025, 12000, 8000],
+    }
+
+# Bytes after the ID3v2 tag that are searched for the first MPEG frame
+MPEG_SYNC_SEARCH = 64 * 1024
+
+# Bytes at the end of an Ogg file that are searched for the last page
+OGG_LAST_PAGE_SEARCH = 64 * 1024
+
+_NUMBERED_GENRE = re.compile(r'^\((\d+)\)(.*)$')
+
+
+def read_tags(filename):
+    '''
+    Read the tags of an mp3 or Ogg Vorbis file. Only the tag headers and
+    the first and last frames are read, so this is fast enough to be run
+    for every file of a large library.
+
+    Returns a dictionary of tag name -> value with the tags title, artist,
+    album, genre, comment, lyrics and date as unicode, track-number and
+    album-disc-number as int, and length (seconds) and bitrate (kbit/s) as
+    int. Tags that the file doesn't have are missing. Raises
+    TagGetterException if the file isn't an mp3 or Ogg Vorbis file.
+    '''
+    try:
+        audio_file = open(filename, 'rb')
+    except IOError, e:
+        raise TagGetterException('%s : %s' % (e.strerror, filename))
+    try:
+        audio_file.seek(0, 2)
+        file_size = audio_file.tell()
+        audio_file.seek(0)
+        if audio_file.read(4) == 'OggS':
+            tags = _read_ogg(audio_file, file_size)
+        else:
+            tags = _read_mp3(audio_file, file_size)
+    finally:
+        audio_file.close()
+
+    if not tags:
+        raise TagGetterException('No tags or audio found : %s' % filename)
+    return tags
+
+
+def _read_mp3(audio_file, file_size):
+    '''Read the ID3 tags and the length of an mp3 file.'''
+    tags = {}
+    audio_start = 0
+    audio_file.seek(0)
+    header = audio_file.read(10)
+    if len(header) == 10 and header[:3] == 'ID3':
+        version = ord(header[3])
+        flags = ord(header[5])
+        size = _syncsafe(header[6:10])
+        audio_start = 10 + size
+        if flags & 0x10:
+            # Footer
+            audio_start += 10
+        if version in (2, 3, 4):
+            _parse_id3v2(audio_file.read(size), version, flags, tags)
+
+    audio_end = file_size
+    if file_size - audio_start >= 128:
+        audio_file.seek(-128, 2)
+        data = audio_file.read(128)
+        if data[:3] == 'TAG':
+            audio_end -= 128
+            _parse_id3v1(data, tags)
+
+    audio_file.seek(audio_start)
+    length, bitrate = _parse_mpeg_length(
+        audio_file.read(MPEG_SYNC_SEARCH), audio_end - audio_start)
+    if length is not None:
+        tags['length'] = int(round(length))
+        tags['bitrate'] = int(round(bitrate))
+    elif 'length' in tags:
+        # TLEN is in milliseconds
+        tags['length'] = int(round(tags['length'] / 1000.0))
+    return tags
+
+
+def _syncsafe(data):
+    '''Return the integer of four syncsafe bytes.'''
+    value = 0
+    for byte in data:
+        value = (value << 7) | (ord(byte) & 0x7f)
+    return value
+
+
+def _parse_id3v2(data, version, flags, tags):
+    '''Parse the frames of an ID3v2 tag to tags.'''
+    if flags & 0x80 and version < 4:
+        # The whole tag is unsynchronised
+        data = data.replace('\xff\x00', '\xff')
+
+    position = 0
+    if flags & 0x40:
+        # Skip the extended header
+        if version == 3:
+            position = 4 + struct.unpack('>I', data[:4])[0]
+        elif version == 4:
+            position = _syncsafe(data[:4])
+
+    if version == 2:
+        header_size = 6
+    else:
+        header_size = 10
+
+    comment = None
+    while position + header_size <= len(data):
+        if version == 2:
+            frame_id = data[position:position + 3]
+            size = struct.unpack('>I', '\x00' + data[position + 3:
+                position + 6])[0]
+            frame_flags = 0
+        else:
+            frame_id = data[position:position + 4]
+            if version == 3:
+                size = struct.unpack('>I', data[position + 4:
+                    position + 8])[0]
+            else:
+                size = _syncsafe(data[position + 4:position + 8])
+            frame_flags = struct.unpack('>H', data[position + 8:
+                position + 10])[0]
+        if not frame_id.isalnum():
+            # Padding
+            break
+        position += header_size
+        body = data[position:position + size]
+        position += size
+
+        if version == 3 and frame_flags & 0x00c0:
+            # Compressed or encrypted
+            continue
+        if version == 4:
+            if frame_flags & 0x000c:
+                continue
+            if frame_flags & 0x0002:
+                body = body.replace('\xff\x00', '\xff')
+            if frame_flags & 0x0001:
+                # Data length indicator
+                body = body[4:]
+        if not body:
+            continue
+
+        if frame_id in ID3V2_TEXT_FRAMES:
+            tag = ID3V2_TEXT_FRAMES[frame_id]
+            if tag not in tags:
+                _set_tag(tags, tag, _decode_text(body[1:], ord(body[0])))
+        elif frame_id in ID3V2_COMMENT_FRAMES + ID3V2_LYRICS_FRAMES:
+            encoding = ord(body[0])
+            description, text = _split_text(body[4:], encoding)
+            description = _decode_text(description, encoding)
+            text = _decode_text(text, encoding)
+            if frame_id in ID3V2_LYRICS_FRAMES:
+                tags.setdefault('lyrics', text)
+            elif comment is None or (comment[0] and not description):
+                # Prefer comments without a description. Players store
+                # their own data in comments with a description.
+                if not description.startswith('iTun'):
+                    comment = (description, text)
+    if comment is not None:
+        tags['comment'] = comment[1]
+
+
+def _split_text(data, encoding):
+    '''Split data at the first string terminator of the encoding.'''
+    if encoding in (1, 2):
+        position = data.find('\x00\x00')
+        while position != -1 and position % 2:
+            position = data.find('\x00\x00', position + 1)
+        if position == -1:
+            return data, ''
+        return data[:position], data[position + 2:]
+    position = data.find('\x00')
+    if position == -1:
+        return data, ''
+    return data[:position], data[position + 1:]
+
+
+def _decode_text(data, encoding):
+    '''Decode an ID3v2 string. Only the first of several values is
+    returned.'''
+    codec = {0: 'latin-1', 1: 'utf-16', 2: 'utf-16-be', 3: 'utf-8'}.get(
+        encoding, 'latin-1')
+    try:
+        text = data.decode(codec)
+    except UnicodeDecodeError:
+        text = data.decode(codec, 'replace')
+    return text.split(u'\x00')[0].strip()
+
+
+def _parse_id3v1(data, tags):
+    '''Parse an ID3v1 tag to the tags that the ID3v2 tag didn't have.'''
+    def field(start, end):
+        '''Return a string field of the tag.'''
+        return data[start:end].split('\x00')[0].strip().decode('latin-1')
+
+    values = {
+        'title': field(3, 33),
+        'artist': field(33, 63),
+        'album': field(63, 93),
+        'date': field(93, 97),
+        'comment': field(97, 127),
+        }
+    if data[125] == '\x00' and data[126] != '\x00':
+        # ID3v1.1 stores the track number at the end of the comment
+        values['comment'] = field(97, 125)
+        values['track-number'] = ord(data[126])
+    genre = ord(data[127])
+    if genre < len(ID3V1_GENRES):
+        values['genre'] = unicode(ID3V1_GENRES[genre])
+
+    for tag, value in values.iteritems():
+        if tag not in tags and value:
+            tags[tag] = value
+
+
+def _set_tag(tags, tag, value):
+    '''Convert a text value to the type of the tag and set it.'''
+    if not value:
+        return
+    if tag in ('track-number', 'album-disc-number', 'length'):
+        # Track numbers may be stored as "3/12"
+        match = re.match(r'\s*(\d+)', value)
+        if match is None:
+            return
+        value = int(match.group(1))
+    elif tag == 'genre':
+        match = _NUMBERED_GENRE.match(value)
+        if match is not None and match.group(2):
+            value = match.group(2)
+        else:
+            if match is not None:
+                value = match.group(1)
+            if value.isdigit():
+                if int(value) >= len(ID3V1_GENRES):
+                    return
+                value = unicode(ID3V1_GENRES[int(value)])
+    tags[tag] = value
+
+
+def _parse_mpeg_header(data, position):
+    '''
+    Return (version, layer, bitrate, sample rate, frame size, samples per
+    frame, channel mode) of the MPEG audio frame header at position, or
+    None if there's no valid header.
+    '''
+    if position + 4 > len(data):
+        return None
+    header = struct.unpack('>I', data[position:position + 4])[0]
+    if header >> 21 != 0x7ff:
+        return None
+    version = {0: 3, 2: 2, 3: 1}.get((header >> 19) & 3)
+    layer = 4 - ((header >> 17) & 3)
+    bitrate_index = (header >> 12) & 0xf
+    sample_rate_index = (header >> 10) & 3
+    if (version is None or layer == 4 or bitrate_index in (0, 15) or
+        sample_rate_index == 3):
+        return None
+
+    bitrate = MPEG_BITRATES[(min(version, 2), layer)][bitrate_index]
+    sample_rate = MPEG_SAMPLE_RATES[version][sample_rate_index]
+    padding = (header >> 9) & 1
+    channel_mode = (header >> 6) & 3
+    if layer == 1:
+        samples = 384
+        frame_size = (12000 * bitrate / sample_rate + padding) * 4
+    elif layer == 2 or version == 1:
+        samples = 1152
+        frame_size = 144000 * bitrate / sample_rate + padding
+    else:
+        samples = 576
+        frame_size = 72000 * bitrate / sample_rate + padding
+    return (version, layer, bitrate, sample_rate, frame_size, samples,
+        channel_mode)
+
+
+def _parse_mpeg_length(data, audio_size):
+    '''
+    Return (length in seconds, bitrate in kbit/s) of MPEG audio that starts
+    with data and is audio_size bytes long, or (None, None) if no frames are
+    found. The length of VBR files comes from the Xing or VBRI header of
+    the first frame. Files without one are CBR and the length is computed
+    from the bitrate.
+    '''
+    position = data.find('\xff')
+    while position != -1:
+        frame = _parse_mpeg_header(data, position)
+        if frame is not None:
+            # A random sync is unlikely to be followed by another frame
+            following = _parse_mpeg_header(data, position + frame[4])
+            if (following is None and position + frame[4] + 4 <= len(data)
+                or following is not None and following[:2] != frame[:2]):
+                frame = None
+        if frame is not None:
+            break
+        position = data.find('\xff', position + 1)
+    else:
+        return None, None
+
+    (version, layer, bitrate, sample_rate, frame_size, samples,
+        channel_mode) = frame
+    audio_size -= position
+
+    # Xing header follows the side information of the first frame
+    if version == 1:
+        side_info = channel_mode == 3 and 17 or 32
+    else:
+        side_info = channel_mode == 3 and 9 or 17
+    xing = position + 4 + side_info
+    frames = None
+    stream_size = None
+    if data[xing:xing + 4] in ('Xing', 'Info'):
+        flags = struct.unpack('>I', data[xing + 4:xing + 8])[0]
+        offset = xing + 8
+        if flags & 1:
+            frames = struct.unpack('>I', data[offset:offset + 4])[0]
+            offset += 4
+        if flags & 2:
+            stream_size = struct.unpack('>I', data[offset:offset + 4])[0]
+    elif data[position + 36:position + 40] == 'VBRI':
+        stream_size, frames = struct.unpack('>II',
+            data[position + 46:position + 54])
+
+    if frames:
+        length = frames * samples / float(sample_rate)
+        bitrate = (stream_size or audio_size) * 8 / length / 1000
+    else:
+        length = audio_size * 8 / (bitrate * 1000.0)
+    return length, bitrate
+
+
+def _read_ogg(audio_file, file_size):
+    '''Read the Vorbis comments and the length of an Ogg Vorbis file.'''
+    audio_file.seek(0)
+    packets = _read_ogg_packets(audio_file, 2)
+    if len(packets) < 2 or not packets[0].startswith('\x01vorbis'):
+        raise TagGetterException('Not an Ogg Vorbis file : %s' %
+            audio_file.name)
+    identification, comments = packets
+    sample_rate = struct.unpack('<I', identification[12:16])[0]
+    nominal_bitrate = struct.unpack('<i', identification[20:24])[0]
+
+    tags = {}
+    if comments.startswith('\x03vorbis'):
+        _parse_vorbis_comments(comments[7:], tags)
+
+    granule = _read_last_ogg_granule(audio_file, file_size)
+    if granule is not None and sample_rate:
+        length = granule / float(sample_rate)
+        tags['length'] = int(round(length))
+        if nominal_bitrate > 0:
+            tags['bitrate'] = int(round(nominal_bitrate / 1000.0))
+        elif length:
+            tags['bitrate'] = int(round(file_size * 8 / length / 1000))
+    return tags
+
+
+def _read_ogg_packets(audio_file, count):
+    '''Return the first count packets of an Ogg stream.'''
+    packets = []
+    packet = []
+    while len(packets) < count:
+        header = audio_file.read(27)
+        if len(header) < 27 or header[:4] != 'OggS':
+            break
+        segments = audio_file.read(ord(header[26]))
+        body = audio_file.read(sum([ord(size) for size in segments]))
+        offset = 0
+        for size in segments:
+            size = ord(size)
+            packet.append(body[offset:offset + size])
+            offset += size
+            if size < 255:
+                packets.append(''.join(packet))
+                packet = []
+                if len(packets) == count:
+                    break
+    return packets
+
+
+def _read_last_ogg_granule(audio_file, file_size):
+    '''Return the granule position of the last Ogg page, which is the number
+    of samples in a Vorbis stream.'''
+    start = max(0, file_size - OGG_LAST_PAGE_SEARCH)
+    audio_file.seek(start)
+    data = audio_file.read()
+    position = data.rfind('OggS')
+    while position != -1:
+        if position + 14 <= len(data) and data[position + 4] == '\x00':
+            granule = struct.unpack('<q', data[position + 6:
+                position + 14])[0]
+            if granule >= 0:
+                return granule
+        position = data.rfind('OggS', 0, position)
+    return None
+
+
+def _parse_vorbis_comments(data, tags):
+    '''Parse a Vorbis comment header to tags.'''
+    try:
+        vendor_length = struct.unpack('<I', data[:4])[0]
+        position = 4 + vendor_length
+        count = struct.unpack('<I', data[position:position + 4])[0]
+    except struct.error:
+        return
+    position += 4
+
+    fields = {}
+    for _ in xrange(count):
+        if position + 4 > len(data):
+            break
+        length = struct.unpack('<I', data[position:position + 4])[0]
+        position += 4
+        comment = data[position:position + length].decode('utf-8', 'replace')
+        position += length
+        if u'=' not in comment:
+            continue
+        name, value = comment.split(u'=', 1)
+        fields.setdefault(name.upper(), value.strip())
+
+    for name, tag in VORBIS_FIELDS.iteritems():
+        if name in fields:
+            _set_tag(tags, tag, fields[name])
+    if 'DESCRIPTION' in fields:
+        tags['comment'] = fields['DESCRIPTION']
+    if 'title' in tags and fields.get('VERSION'):
+        tags['title'] = u'%s (%s)' % (tags['title'], fields['VERSION'])
@@ -36,10 +36,14 @@ class MockImage(Image):
         self._Image__filename = filename
         self._Image__title = 'A title'
 
-    def get_thumbnail_url(self):
+    def get_thumbnail_url(self, width=None, height=None):
         '''See `Image.get_thumbnail_url`.'''
         return THIS_DIR + '/data/ImageThumbnailer/test.jpg'
 
+    def get_display_url(self, width, height):
+        '''See `Image.get_display_url`.'''
+        return self._Image__filename
+
 
 class MockImageLibrary(ImageLibrary):
     '''Mock entertainerlib.client.medialibrary.images.ImageLibrary'''
@@ -0,0 +1,99 @@
+# Copyright (c) 2009 Entertainer Developers - See COPYING - GPLv2
+'''Tests AlbumArtService'''
+# pylint: disable-msg=W0212
+
+import threading
+import time
+
+from entertainerlib.album_art_service import (AlbumArtService,
+    HostRateLimiter)
+from entertainerlib.tests import EntertainerTest
+
+
+class SearchCounter(AlbumArtService):
+    '''AlbumArtService that counts searches instead of using the network.'''
+
+    _shared_state = {}
+
+    def _search(self, job):
+        '''Count the search and wait until the test allows it to finish.'''
+        self.searches.append((job.artist, job.album))
+        self.allow_search.wait()
+        if self.error is not None:
+            raise self.error
+        return False
+
+
+class AlbumArtServiceTest(EntertainerTest):
+    '''Test the album art service'''
+
+    def setUp(self):
+        '''See unittest.TestCase'''
+        EntertainerTest.setUp(self)
+        SearchCounter._shared_state.clear()
+        self.service = SearchCounter(workers=2, host_interval=0,
+            retry_interval=3600)
+        self.service.searches = []
+        self.service.allow_search = threading.Event()
+        self.service.error = None
+        self.artist = 'Artist %s' % time.time()
+
+    def tearDown(self):
+        '''See unittest.TestCase'''
+        self.service.allow_search.set()
+        EntertainerTest.tearDown(self)
+
+    def testShared(self):
+        '''Test that all instances share the same pool'''
+        self.assertEqual(SearchCounter()._pool.workers, 2)
+
+    def testDeduplicate(self):
+        '''Test that an album that is being searched is searched once'''
+        finished = []
+        first = self.service.fetch(self.artist, 'Album', finished.append)
+        second = self.service.fetch(self.artist, 'Album', finished.append)
+        self.assertTrue(first is second)
+        self.service.allow_search.set()
+        self.assertFalse(first.wait(5))
+        self.assertTrue(first.ready())
+        self.assertEqual(finished, [first, first])
+        self.assertEqual(self.service.searches, [(self.artist, 'Album')])
+
+    def testMiss(self):
+        '''Test that an album whose art wasn't found isn't searched again'''
+        self.service.allow_search.set()
+        self.service.fetch(self.artist, 'Album').wait(5)
+        job = self.service.fetch(self.artist, 'Album')
+        self.assertTrue(job.ready())
+        self.assertEqual(len(self.service.searches), 1)
+
+        self.service.retry_interval = -1
+        self.service.fetch(self.artist, 'Other').wait(5)
+        self.service.fetch(self.artist, 'Other').wait(5)
+        self.assertEqual(len(self.service.searches), 3)
+
+    def testSearchError(self):
+        '''Test that a failing search is a miss and doesn't kill workers'''
+        self.service.allow_search.set()
+        self.service.error = ValueError('Unexpected response')
+        job = self.service.fetch(self.artist, 'Broken')
+        self.assertFalse(job.wait(5))
+        self.assertTrue(job.ready())
+        self.assertTrue(self.service.fetch(self.artist, 'Broken').ready())
+
+        self.service.error = None
+        self.service.fetch(self.artist, 'Working').wait(5)
+        self.assertEqual(self.service.searches, [(self.artist, 'Broken'),
+            (self.artist, 'Working')])
+        self.assertEqual(self.service._pool.get_thread_count(), 2)
+
+    def testHostRateLimiter(self):
+        '''Test that requests to the same host are spaced'''
+        limiter = HostRateLimiter(0.2)
+        start = time.time()
+        limiter.wait('http://example.com/first')
+        limiter.wait('http://example.org/other')
+        self.assertTrue(time.time() - start < 0.1)
+        limiter.wait('http://example.com/second')
+        self.assertTrue(time.time() - start >= 0.19)
+
@@ -0,0 +1,48 @@
+# Copyright (c) 2009 Entertainer Developers - See COPYING - GPLv2
+'''Tests the album identity map'''
+
+from storm.locals import Store
+
+from entertainerlib.db import models
+from entertainerlib.indexing.album_map import AlbumMap
+from entertainerlib.tests import EntertainerTestWithDatabase
+
+
+class AlbumMapTest(EntertainerTestWithDatabase):
+    '''Test resolving albums by artist and title'''
+
+    def setUp(self):
+        EntertainerTestWithDatabase.setUp(self)
+        self.store = Store(self.db)
+        album = models.MusicAlbum()
+        album.artist = u'Iron and Wine'
+        album.title = u'The Shephard\'s Dog'
+        self.store.add(album)
+        self.store.commit()
+        self.album = album
+
+    def testPreload(self):
+        '''Test that existing albums are found'''
+        album_map = AlbumMap(self.store)
+        self.assertEqual(len(album_map), 1)
+        self.assertTrue(album_map.get(u'Iron and Wine',
+            u'The Shephard\'s Dog') is self.album)
+
+    def testNormalizedKey(self):
+        '''Test that case and whitespace don't make another album'''
+        album_map = AlbumMap(self.store)
+        self.assertTrue(album_map.get(u'  iron AND  wine',
+            u'the shephard\'s dog ') is self.album)
+        self.assertEqual(album_map.flush(), [])
+
+    def testNewAlbum(self):
+        '''Test that a new album is created once and flushed'''
+        album_map = AlbumMap(self.store)
+        album = album_map.get(u'Prince', u'Purple Rain', u'Pop')
+        self.assertTrue(album_map.get(u'prince', u'purple rain') is album)
+        self.assertEqual(album.genre, u'Pop')
+        self.assertEqual(album_map.flush(), [album])
+        self.assertEqual(album_map.flush(), [])
+        self.store.commit()
+        self.assertEqual(self.store.find(models.MusicAlbum).count(), 2)
+
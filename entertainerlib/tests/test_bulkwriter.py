@@ -0,0 +1,78 @@
+# Copyright (c) 2009 Entertainer Developers - See COPYING - GPLv2
+'''Tests BulkWriter'''
+# pylint: disable-msg=W0212
+
+from pysqlite2 import dbapi2 as sqlite
+
+from entertainerlib.backend.components.mediacache.bulk_writer import (
+    BulkWriter)
+from entertainerlib.tests import EntertainerTest
+
+
+class BulkWriterTest(EntertainerTest):
+    '''Test batched writing of cache rows'''
+
+    INSERT = "INSERT INTO track(filename) VALUES (?)"
+
+    def setUp(self):
+        '''See unittest.TestCase'''
+        EntertainerTest.setUp(self)
+        filename = self.get_temp_file()
+        self.db_conn = sqlite.connect(filename)
+        self.db_conn.execute("CREATE TABLE track(filename TEXT UNIQUE)")
+        self.db_conn.commit()
+        # A second connection only sees committed rows
+        self.reader = sqlite.connect(filename)
+
+    def _getWritten(self):
+        '''Return the number of committed rows.'''
+        return self.reader.execute("SELECT COUNT(*) FROM track").fetchone()[0]
+
+    def testBatchSize(self):
+        '''Test that rows are written when the batch is full'''
+        committed = []
+        writer = BulkWriter(self.db_conn, batch_size=3, max_delay=60000)
+        writer.add(self.INSERT, ('/a.mp3',), '/a.mp3')
+        writer.add(self.INSERT, ('/b.mp3',), '/b.mp3',
+            lambda: committed.append('/b.mp3'))
+        self.assertEqual(self._getWritten(), 0)
+        self.assertTrue(writer.isPending('/a.mp3'))
+        self.assertEqual(committed, [])
+
+        writer.add(self.INSERT, ('/c.mp3',), '/c.mp3')
+        self.assertEqual(self._getWritten(), 3)
+        self.assertFalse(writer.isPending('/a.mp3'))
+        self.assertEqual(committed, ['/b.mp3'])
+
+    def testMaxDelay(self):
+        '''Test that rows are written when the oldest one is too old'''
+        writer = BulkWriter(self.db_conn, batch_size=100, max_delay=1000)
+        writer.add(self.INSERT, ('/a.mp3',), '/a.mp3')
+        writer.flushIfDue()
+        self.assertFalse(writer.isDue())
+        self.assertEqual(self._getWritten(), 0)
+
+        # The row was buffered two seconds ago
+        writer._oldest -= 2
+        self.assertTrue(writer.isDue())
+        writer.flushIfDue()
+        self.assertEqual(self._getWritten(), 1)
+        self.assertFalse(writer.isDue())
+
+        writer.add(self.INSERT, ('/b.mp3',), '/b.mp3')
+        writer._oldest -= 2
+        writer.add(self.INSERT, ('/c.mp3',), '/c.mp3')
+        self.assertEqual(self._getWritten(), 3)
+
+    def testBadRow(self):
+        '''Test that one bad row doesn't lose the batch'''
+        committed = []
+        writer = BulkWriter(self.db_conn, batch_size=100, max_delay=60000)
+        for filename in ['/a.mp3', '/a.mp3', '/b.mp3']:
+            writer.add(self.INSERT, (filename,), filename,
+                lambda filename=filename: committed.append(filename))
+        writer.flush()
+        self.assertEqual(self._getWritten(), 2)
+        # The callback of the duplicate row isn't called
+        self.assertEqual(committed, ['/a.mp3', '/b.mp3'])
+
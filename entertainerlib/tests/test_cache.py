@@ -0,0 +1,38 @@
+# Copyright (c) 2009 Entertainer Developers - See COPYING - GPLv2
+'''Tests Cache'''
+# pylint: disable-msg=W0212
+
+from entertainerlib.backend.components.mediacache.cache import Cache
+from entertainerlib.tests import EntertainerTest
+
+
+class CacheTest(EntertainerTest):
+    '''Test the common parts of the media caches'''
+
+    def setUp(self):
+        '''See unittest.TestCase'''
+        EntertainerTest.setUp(self)
+        self.cache = Cache()
+
+    def _inSubtree(self, path, directory):
+        '''Return True if path is in the subtree range of directory.'''
+        low, high = self.cache._getSubtreeRange(directory)
+        return low <= path < high
+
+    def testSubtreeRange(self):
+        '''Test that the range has the files of a directory and its
+        subdirectories'''
+        self.assertTrue(self._inSubtree('/music/a.mp3', '/music'))
+        self.assertTrue(self._inSubtree('/music/rock/b.mp3', '/music'))
+        self.assertTrue(self._inSubtree('/music/rock/b.mp3', '/music/'))
+        self.assertFalse(self._inSubtree('/music', '/music'))
+        self.assertFalse(self._inSubtree('/music2/c.mp3', '/music'))
+        self.assertFalse(self._inSubtree('/music.mp3', '/music'))
+        self.assertFalse(self._inSubtree('/musi/d.mp3', '/music'))
+
+    def testSubtreeRangeSpecialCharacters(self):
+        '''Test that quotes and LIKE wildcards are matched literally'''
+        directory = "/media/It's 100%_done"
+        self.assertTrue(self._inSubtree(directory + '/e.avi', directory))
+        self.assertFalse(self._inSubtree("/media/Its 100a_done/f.avi",
+            directory))
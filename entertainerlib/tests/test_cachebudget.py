@@ -0,0 +1,70 @@
+# Copyright (c) 2009 Entertainer Developers - See COPYING - GPLv2
+'''Tests CacheBudget'''
+# pylint: disable-msg=W0212
+
+import os
+import time
+
+from entertainerlib.cache_budget import AccessLog, CacheBudget
+from entertainerlib.tests import EntertainerTest
+
+
+class CacheBudgetTest(EntertainerTest):
+    '''Test the thumbnail and art cache size limits'''
+
+    def setUp(self):
+        '''See unittest.TestCase'''
+        EntertainerTest.setUp(self)
+        self.cache_dir = os.path.join(self.test_dir, 'cache')
+        os.mkdir(self.cache_dir)
+        self.budget = CacheBudget({self.cache_dir : 300}, 0)
+        self.access_log = AccessLog()
+        self.access_log.filename = self.config.CACHE_ACCESS_LOG
+        self.access_log._recorded = {}
+
+    def _write_file(self, name, size, age):
+        '''Write a cache file that was created age seconds ago.'''
+        path = os.path.join(self.cache_dir, name)
+        cache_file = open(path, 'w')
+        cache_file.write('x' * size)
+        cache_file.close()
+        created = time.time() - age
+        os.utime(path, (created, created))
+        return path
+
+    def testUnderLimit(self):
+        '''Test that nothing is removed while the cache is small enough'''
+        first = self._write_file('first', 100, 30)
+        second = self._write_file('second', 100, 20)
+        self.budget.enforce()
+        self.assertTrue(os.path.exists(first))
+        self.assertTrue(os.path.exists(second))
+        self.assertEqual(self.budget.get_size(self.cache_dir), 200)
+
+    def testEvictLeastRecentlyUsed(self):
+        '''Test that the least recently used files are removed'''
+        oldest = self._write_file('oldest', 100, 40)
+        accessed = self._write_file('accessed', 100, 30)
+        newer = self._write_file('newer', 100, 20)
+        newest = self._write_file('newest', 100, 10)
+        self.access_log.record(accessed)
+        self.budget.enforce()
+        self.assertFalse(os.path.exists(oldest))
+        self.assertTrue(os.path.exists(accessed))
+        self.assertFalse(os.path.exists(newer))
+        self.assertTrue(os.path.exists(newest))
+        self.assertEqual(self.budget.get_size(self.cache_dir), 200)
+
+    def testAccessLogIsConsumed(self):
+        '''Test that the access log is removed after it has been read'''
+        path = self._write_file('file', 100, 0)
+        self.access_log.record(path)
+        self.assertTrue(os.path.exists(self.config.CACHE_ACCESS_LOG))
+        self.budget.enforce()
+        self.assertFalse(os.path.exists(self.config.CACHE_ACCESS_LOG))
+
+    def testEscapedPath(self):
+        '''Test that paths with newlines survive the access log'''
+        path = os.path.join(self.cache_dir, 'art\nwork')
+        self.access_log.record(path)
+        self.assertEqual(self.budget._read_access_log().keys(), [path])
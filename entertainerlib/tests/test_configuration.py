@@ -29,7 +29,11 @@ class ConfigurationTest(EntertainerTest):
         self.assertEqual(self.configuration.weather_location, 'Bath,England')
         self.assertTrue(self.configuration.display_weather_in_client)
         self.assertTrue(self.configuration.download_metadata)
+        self.assertEqual(self.configuration.metadata_search_workers, 2)
         self.assertTrue(self.configuration.download_album_art)
+        self.assertEqual(self.configuration.album_art_workers, 2)
+        self.assertEqual(self.configuration.album_art_host_interval, 1.0)
+        self.assertEqual(self.configuration.album_art_retry_interval, 168)
         self.assertFalse(self.configuration.download_lyrics)
         self.assertTrue(self.configuration.show_effects)
         self.assertEqual(self.configuration.transition_effect, 'Slide')
@@ -38,6 +42,37 @@ class ConfigurationTest(EntertainerTest):
         self.assertTrue(self.configuration.start_auto_server)
         self.assertEqual(self.configuration.history_size, 8)
         self.assertEqual(self.configuration.slideshow_step, 5)
+        self.assertEqual(self.configuration.watch_method, 'auto')
+        self.assertEqual(self.configuration.watch_poll_interval, 300)
+        self.assertEqual(self.configuration.throttle_mode, 'utilization')
+        self.assertEqual(self.configuration.throttle_files_per_second, 2.0)
+        self.assertEqual(self.configuration.throttle_bytes_per_second,
+            4194304)
+        self.assertEqual(self.configuration.throttle_target_utilization,
+            0.25)
+        self.assertEqual(self.configuration.bulk_ingest_rows, 500)
+        self.assertEqual(self.configuration.bulk_ingest_interval, 2000)
+        self.assertEqual(self.configuration.thumbnail_workers, 0)
+        self.assertEqual(self.configuration.thumbnail_timeout, 60)
+        self.assertEqual(self.configuration.thumbnail_policy, 'fast')
+        self.assertEqual(self.configuration.video_thumbnail_pipelines, 2)
+        self.assertEqual(self.configuration.video_thumbnail_timeout, 30)
+        self.assertEqual(
+            self.configuration.video_thumbnail_frame_selection, 'best')
+        self.assertEqual(self.configuration.worker_timeout, 60)
+        self.assertEqual(self.configuration.index_retry_interval, 24)
+        self.assertEqual(self.configuration.indexer_stat_workers, 2)
+        self.assertEqual(self.configuration.indexer_probe_workers, 2)
+        self.assertEqual(self.configuration.indexer_thumbnail_workers, 2)
+        self.assertEqual(self.configuration.indexer_queue_size, 256)
+        self.assertEqual(self.configuration.indexer_report_interval, 30)
+        self.assertEqual(self.configuration.trust_directory_mtimes, True)
+        self.assertEqual(self.configuration.indexing_progress_interval, 2)
+        self.assertEqual(self.configuration.index_checkpoint_interval, 500)
+        self.assertEqual(self.configuration.thumbnail_cache_limit, 512)
+        self.assertEqual(self.configuration.album_art_cache_limit, 64)
+        self.assertEqual(self.configuration.movie_art_cache_limit, 0)
+        self.assertEqual(self.configuration.cache_check_interval, 600)
 
     def test_create_dir(self):
         '''Test Configuration object directory creation'''
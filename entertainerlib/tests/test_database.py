@@ -2,6 +2,7 @@
 '''Test for backend.core.db.connection'''
 
 import os
+import threading
 
 from storm.locals import Store
 
@@ -40,3 +41,31 @@ class DatabaseTest(EntertainerTestWithDatabase):
         storage = Database(storage_file)
         self.assertTrue(self._checkValidDatabase(storage))
 
+
+    def testGetConnection(self):
+        '''Test that every thread gets its own connection'''
+        connection = self.db.get_connection()
+        self.assertTrue(self.db.get_connection() is connection)
+
+        connections = []
+        thread = threading.Thread(
+            target=lambda: connections.append(self.db.get_connection()))
+        thread.start()
+        thread.join()
+        self.assertFalse(connections[0] is connection)
+
+    def testJournalMode(self):
+        '''Test that a new database uses write-ahead logging'''
+        cursor = self.db.get_connection().cursor()
+        cursor.execute('PRAGMA journal_mode')
+        self.assertEqual(cursor.fetchone()[0], 'wal')
+
+    def testHasRows(self):
+        '''Test checking if a table has rows'''
+        self.assertFalse(self.db.has_rows('missing'))
+        self.assertFalse(self.db.has_rows('videofile'))
+        connection = self.db.get_connection()
+        connection.execute(
+            "INSERT INTO videofile(filename) VALUES ('/foo.avi')")
+        connection.commit()
+        self.assertTrue(self.db.has_rows('videofile'))
@@ -0,0 +1,51 @@
+# Copyright (c) 2009 Entertainer Developers - See COPYING - GPLv2
+'''Tests DirectoryTable'''
+
+from entertainerlib.backend.components.mediacache.directory_table import (
+    DirectoryTable)
+from entertainerlib.tests import EntertainerTest
+
+
+class DirectoryTableTest(EntertainerTest):
+    '''Test the table of walked directories'''
+
+    def setUp(self):
+        '''See unittest.TestCase'''
+        EntertainerTest.setUp(self)
+        self.table = DirectoryTable()
+        self.table.clear()
+
+    def testRecord(self):
+        '''Test that a recorded directory is found with its cache types'''
+        self.assertEqual(self.table.getDirectory('/music'), None)
+        self.table.record('/music', 100.5, 3, ['music', 'image'])
+        self.table.commit()
+        self.assertEqual(self.table.getDirectory('/music'),
+            (100.5, 3, set(['image', 'music'])))
+
+    def testSubdirectories(self):
+        '''Test that only direct subdirectories are returned'''
+        self.table.record('/music', 1, 2, ['music'])
+        self.table.record('/music/rock', 1, 2, ['music'])
+        self.table.record('/music/rock/live', 1, 2, ['music'])
+        self.table.record('/music2', 1, 2, ['music'])
+        self.assertEqual(self.table.getSubdirectories('/music'),
+            ['/music/rock'])
+        self.assertEqual(self.table.getSubdirectories('/music/rock/live'),
+            [])
+
+    def testRemoveDirectory(self):
+        '''Test that a directory is removed with its subdirectories'''
+        self.table.record('/music', 1, 2, ['music'])
+        self.table.record('/music/rock', 1, 2, ['music'])
+        self.table.record('/music2', 1, 2, ['music'])
+        self.table.removeDirectory('/music')
+        self.assertEqual(self.table.getDirectory('/music'), None)
+        self.assertEqual(self.table.getDirectory('/music/rock'), None)
+        self.assertNotEqual(self.table.getDirectory('/music2'), None)
+
+    def testInvalidPath(self):
+        '''Test that paths that aren't UTF-8 are never recorded'''
+        self.table.record('/music/\xff', 1, 2, ['music'])
+        self.assertEqual(self.table.getDirectory('/music/\xff'), None)
+
@@ -0,0 +1,81 @@
+# Copyright (c) 2009 Entertainer Developers - See COPYING - GPLv2
+'''Tests FailureTable'''
+
+import os
+import time
+
+from entertainerlib.backend.components.mediacache.failure_table import (
+    FailureTable)
+from entertainerlib.tests import EntertainerTest
+
+
+class FailureTableTest(EntertainerTest):
+    '''Test the table of files that failed to index'''
+
+    def setUp(self):
+        '''See unittest.TestCase'''
+        EntertainerTest.setUp(self)
+        self.table = FailureTable(retry_interval=100)
+        self.filename = os.path.join(self.test_dir, 'broken.mp3')
+        self._write(self.filename, 'broken')
+
+    def _write(self, filename, data):
+        '''Write data to a file.'''
+        broken = open(filename, 'w')
+        broken.write(data)
+        broken.close()
+
+    def testUnknownFile(self):
+        '''Test that files without failures are not skipped'''
+        self.assertFalse(self.table.isFailed(self.filename))
+
+    def testRecord(self):
+        '''Test that a failed file is skipped and listed'''
+        self.table.record(self.filename, 'No tags')
+        self.assertTrue(self.table.isFailed(self.filename))
+        failures = self.table.getFailures()
+        self.assertEqual(len(failures), 1)
+        self.assertEqual(failures[0][:3], (self.filename, 'No tags', 1))
+
+    def testShared(self):
+        '''Test that failures are seen by other tables'''
+        self.table.record(self.filename, 'No tags')
+        self.assertTrue(FailureTable().isFailed(self.filename))
+
+    def testChangedFile(self):
+        '''Test that a changed file is tried again'''
+        self.table.record(self.filename, 'No tags')
+        self._write(self.filename, 'fixed tags')
+        self.assertFalse(self.table.isFailed(self.filename))
+        self.assertEqual(self.table.getFailures(), [])
+
+    def testStats(self):
+        '''Test that given stats are compared instead of the file'''
+        self.table.record(self.filename, 'No tags')
+        stats = os.stat(self.filename)
+        self.assertTrue(self.table.isFailed(self.filename,
+            (stats.st_size, int(stats.st_mtime))))
+        self.assertFalse(self.table.isFailed(self.filename,
+            (stats.st_size + 1, int(stats.st_mtime))))
+
+    def testRetryWindow(self):
+        '''Test that a file is tried again when its retry time passes'''
+        table = FailureTable(retry_interval=0)
+        table.record(self.filename, 'No tags')
+        self.assertFalse(table.isFailed(self.filename))
+
+    def testBackoff(self):
+        '''Test that repeated failures double the retry interval'''
+        now = time.time()
+        self.table.record(self.filename, 'No tags')
+        self.table.record(self.filename, 'No tags')
+        count, retry_after = self.table.getFailures()[0][2:]
+        self.assertEqual(count, 2)
+        self.assertTrue(now + 199 <= retry_after <= time.time() + 200)
+
+    def testClear(self):
+        '''Test that cleared files are tried again'''
+        self.table.record(self.filename, 'No tags')
+        self.table.clear()
+        self.assertFalse(self.table.isFailed(self.filename))
+        self.assertEqual(self.table.getFailures(), [])
@@ -1,6 +1,8 @@
 '''Tests for entertainerlib.indexing.handlers.'''
 # pylint: disable-msg=W0212
 import os
+import shutil
+import time
 
 from storm.locals import Store
 
@@ -41,10 +43,9 @@ class TestAviHandler(TestFileHandler):
         '''See `TestFileHandler.test_callable`.'''
         handler = self.handler()
         video = handler(self.filename)
-        self.assertTrue(os.path.exists(
-            os.path.join(
-                handler.configuration.THUMB_DIR,
-                video.thumbnail)))
+        self.assertEqual(os.path.dirname(video.thumbnail),
+            os.path.join(handler.configuration.THUMB_DIR, 'video'))
+        self.assertTrue(os.path.exists(video.thumbnail))
         self.assertEqual(video.filename, self.filename)
 
     def test_update_existing_record(self):
@@ -66,10 +67,9 @@ class TestAviHandler(TestFileHandler):
         _video = handler(self.filename)
         video = Store.of(_video).find(models.VideoFile,
             models.VideoFile.filename == self.filename).one()
-        self.assertTrue(os.path.exists(
-            os.path.join(
-                handler.configuration.THUMB_DIR,
-                video.thumbnail)))
+        self.assertEqual(os.path.dirname(video.thumbnail),
+            os.path.join(handler.configuration.THUMB_DIR, 'video'))
+        self.assertTrue(os.path.exists(video.thumbnail))
         self.assertEqual(video.filename, self.filename)
 
 
@@ -79,14 +79,22 @@ class TestJpegHandler(TestFileHandler):
     handler = handlers.JpegHandler
     filename = 'ImageThumbnailer/test.jpg'
 
+    def _assert_thumbnail(self, handler, image):
+        '''Assert that the thumbnail of the image is created.'''
+        self.assertEqual(os.path.dirname(image.thumbnail),
+            os.path.join(handler.configuration.THUMB_DIR, 'image'))
+        # The thumbnail service creates the thumbnail in the background
+        for i in range(100):
+            if os.path.exists(image.thumbnail):
+                break
+            time.sleep(0.1)
+        self.assertTrue(os.path.exists(image.thumbnail))
+
     def test_callable(self):
         '''See `TestFileHandler.test_callable`.'''
         handler = self.handler()
         image = handler(self.filename)
-        self.assertTrue(os.path.exists(
-            os.path.join(
-                handler.configuration.THUMB_DIR,
-                image.thumbnail)))
+        self._assert_thumbnail(handler, image)
         self.assertEqual(image.filename, self.filename)
 
     def test_update_existing_record(self):
@@ -108,10 +116,7 @@ class TestJpegHandler(TestFileHandler):
         _image = handler(self.filename)
         image = Store.of(_image).find(models.PhotoImage,
             models.PhotoImage.filename == self.filename).one()
-        self.assertTrue(os.path.exists(
-            os.path.join(
-                handler.configuration.THUMB_DIR,
-                image.thumbnail)))
+        self._assert_thumbnail(handler, image)
         self.assertEqual(image.filename, self.filename)
 
 
@@ -164,3 +169,19 @@ class TestMp3Handler(TestFileHandler):
         self.assertEqual(mp3.album.artist, u'Iron and Wine')
         self.assertEqual(mp3.album.genre, u'Gangster Rap')
 
+    def test_shared_album(self):
+        '''Tracks of the same album should share one album.'''
+        handler = self.handler()
+        # A copy is another track with the same artist and album tags
+        other_filename = unicode(os.path.join(self.test_dir, 'other.mp3'))
+        shutil.copy(self.filename, other_filename)
+        track = handler(self.filename)
+        other_track = handler(other_filename)
+        self.assertTrue(track.album is other_track.album)
+        store = Store.of(track)
+        albums = store.find(models.MusicAlbum,
+            models.MusicAlbum.title == u'The Shephard\'s Dog')
+        self.assertEqual(albums.count(), 1)
+        tracks = store.find(models.MusicTrack,
+            models.MusicTrack.album == albums.one())
+        self.assertEqual(tracks.count(), 2)
@@ -0,0 +1,68 @@
+# Copyright (c) 2009 Entertainer Developers - See COPYING - GPLv2
+'''Tests FingerprintTable'''
+
+import os
+
+from entertainerlib.backend.components.mediacache.fingerprint_table import (
+    FingerprintTable)
+from entertainerlib.tests import EntertainerTest
+
+
+class FingerprintTableTest(EntertainerTest):
+    '''Test identifying files by their content'''
+
+    def setUp(self):
+        '''See unittest.TestCase'''
+        EntertainerTest.setUp(self)
+        self.table = FingerprintTable()
+
+    def _write(self, name, data):
+        '''Write a file in the test directory and return its path.'''
+        filename = os.path.join(self.test_dir, name)
+        data_file = open(filename, 'wb')
+        data_file.write(data)
+        data_file.close()
+        return filename
+
+    def testCopies(self):
+        '''Test that copies of a file have the same content key'''
+        first = self._write('a.jpg', 'photo')
+        copy = self._write('b.jpg', 'photo')
+        other = self._write('c.jpg', 'other')
+        key = self.table.getContentKey(first)
+        self.assertEqual(self.table.getContentKey(copy), key)
+        self.assertNotEqual(self.table.getContentKey(other), key)
+        files = self.table.getFiles(key)
+        self.assertTrue(first in files and copy in files)
+        self.assertFalse(other in files)
+
+    def testPartialCollision(self):
+        '''Test that files with the same start and end are hashed fully'''
+        size = FingerprintTable.PARTIAL_BYTES
+        first = self._write('a.avi', 'x' * size + 'a' + 'x' * size)
+        second = self._write('b.avi', 'x' * size + 'b' + 'x' * size)
+        copy = self._write('c.avi', 'x' * size + 'a' + 'x' * size)
+        key = self.table.getContentKey(first)
+        self.assertNotEqual(self.table.getContentKey(second), key)
+        self.assertEqual(self.table.getContentKey(copy), key)
+
+    def testChangedFile(self):
+        '''Test that the key of a changed file is computed again'''
+        filename = self._write('a.jpg', 'image')
+        key = self.table.getContentKey(filename, (5, 100))
+        self._write('a.jpg', 'edited')
+        self.assertEqual(self.table.getContentKey(filename, (5, 100)), key)
+        self.assertNotEqual(self.table.getContentKey(filename, (6, 200)), key)
+
+    def testStoreFile(self):
+        '''Test that a stored file with the same content is linked'''
+        store = os.path.join(self.test_dir, 'store')
+        os.mkdir(store)
+        cover = self._write('cover.jpg', 'cover')
+        self.table.storeFile(cover, os.path.join(store, 'first.jpg'))
+        self.table.storeFile(cover, os.path.join(store, 'second.jpg'))
+        self.assertEqual(open(os.path.join(store, 'second.jpg')).read(),
+            'cover')
+        self.assertEqual(os.stat(os.path.join(store, 'first.jpg')).st_ino,
+            os.stat(os.path.join(store, 'second.jpg')).st_ino)
+
@@ -0,0 +1,85 @@
+# Copyright (c) 2009 Entertainer Developers - See COPYING - GPLv2
+'''Tests FrameScorer'''
+# pylint: disable-msg=W0212
+
+import os
+import random
+
+import Image
+
+from entertainerlib import frame_scorer
+from entertainerlib.frame_scorer import FrameScorer
+from entertainerlib.tests import EntertainerTest
+
+THIS_DIR = os.path.dirname(__file__)
+
+
+class FrameScorerTest(EntertainerTest):
+    '''Test scoring of video frames'''
+
+    def setUp(self):
+        '''See unittest.TestCase'''
+        EntertainerTest.setUp(self)
+        self.scorer = FrameScorer()
+        self.width = 320
+        self.height = 240
+
+    def _flat_frame(self, value):
+        '''Return a frame where every pixel has the given value.'''
+        return chr(value) * (self.width * self.height * 3)
+
+    def _noise_frame(self, low, high):
+        '''Return a frame of random gray pixels between low and high.'''
+        generator = random.Random(1)
+        pixels = []
+        for i in xrange(self.width * self.height):
+            pixels.append(chr(generator.randint(low, high)) * 3)
+        return ''.join(pixels)
+
+    def testBlackFrame(self):
+        '''Test that black frames score zero'''
+        self.assertEqual(self.scorer.score(self._flat_frame(0),
+            self.width, self.height), 0.0)
+
+    def testWhiteFrame(self):
+        '''Test that white frames score zero'''
+        self.assertEqual(self.scorer.score(self._flat_frame(255),
+            self.width, self.height), 0.0)
+
+    def testFlatFrame(self):
+        '''Test that flat gray frames score zero'''
+        self.assertEqual(self.scorer.score(self._flat_frame(128),
+            self.width, self.height), 0.0)
+
+    def testDetailedFrameWins(self):
+        '''Test that frames with more contrast score higher'''
+        low = self.scorer.score(self._noise_frame(100, 150),
+            self.width, self.height)
+        high = self.scorer.score(self._noise_frame(20, 230),
+            self.width, self.height)
+        self.assertTrue(low > 0)
+        self.assertTrue(high > low)
+
+    def testPaddedRows(self):
+        '''Test frames whose rows are padded to four bytes'''
+        self.width = 321
+        row = ''.join([chr(i % 200 + 30) * 3 for i in range(self.width)])
+        frame = (row + '\x00') * self.height
+        self.assertTrue(self.scorer.score(frame, self.width, self.height) > 0)
+
+    def testPilFallback(self):
+        '''Test that scoring works without NumPy'''
+        numpy = frame_scorer.numpy
+        frame_scorer.numpy = None
+        try:
+            self.assertEqual(self.scorer.score(self._flat_frame(0),
+                self.width, self.height), 0.0)
+            self.assertTrue(self.scorer.score(self._noise_frame(20, 230),
+                self.width, self.height) > 0)
+        finally:
+            frame_scorer.numpy = numpy
+
+    def testScoreImage(self):
+        '''Test scoring of a PIL image'''
+        image = Image.open(THIS_DIR + '/data/ImageThumbnailer/test.jpg')
+        self.assertTrue(self.scorer.score_image(image) >= 0)
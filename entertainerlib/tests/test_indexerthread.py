@@ -0,0 +1,199 @@
+# Copyright (c) 2009 Entertainer Developers - See COPYING - GPLv2
+'''Tests IndexerThread'''
+# pylint: disable-msg=W0212
+
+import os
+
+from entertainerlib.backend.components.mediacache.directory_table import (
+    DirectoryTable)
+from entertainerlib.backend.components.mediacache.index_journal import (
+    IndexJournal)
+from entertainerlib.backend.components.mediacache.indexer_thread import (
+    IndexerThread)
+from entertainerlib.tests import EntertainerTest
+
+
+class FakeCache:
+    '''Cache that accepts all files'''
+
+    def acceptsFile(self, filename):
+        '''Accept every file.'''
+        return True
+
+
+class StoppingCache(FakeCache):
+    '''Cache that stops the indexer after the first indexed file'''
+
+    SUPPORTED_FILE_EXTENSIONS = ['mp3']
+    failure_count = 0
+
+    def __init__(self, indexer):
+        self.indexer = indexer
+        self.indexed = []
+        self.buffered = []
+
+    def setThrottle(self, throttle):
+        '''Ignore the throttle.'''
+
+    def beginBulkIngest(self):
+        '''Nothing to start.'''
+
+    def endBulkIngest(self):
+        '''Write the buffered files.'''
+        self.flushBulkIngest()
+
+    def flushBulkIngest(self):
+        '''Write the buffered files.'''
+        self.buffered = []
+
+    def flushBulkIngestIfDue(self):
+        '''Files are only written when the bulk ingest ends.'''
+
+    def prepareSynchronize(self, files, directories, roots, unavailable,
+        unchanged):
+        '''Index all the found files.'''
+        return [(filename, False) for filename in files]
+
+    def indexFile(self, filename, cached, paced=True):
+        '''Buffer the file and stop the indexer.'''
+        self.indexed.append(filename)
+        self.buffered.append(filename)
+        self.indexer.stop()
+
+
+class InterruptedJournal(IndexJournal):
+    '''Journal whose run is interrupted at the first checkpoint'''
+
+    def __init__(self):
+        IndexJournal.__init__(self, interval=1)
+
+    def checkpointWalk(self, pending):
+        '''Checkpoint and stop the walk.'''
+        IndexJournal.checkpointWalk(self, pending)
+        raise KeyboardInterrupt()
+
+
+class IndexerThreadTest(EntertainerTest):
+    '''Test walking media folders'''
+
+    def setUp(self):
+        '''See unittest.TestCase'''
+        EntertainerTest.setUp(self)
+        self.cache = FakeCache()
+        self.table = DirectoryTable()
+        self.table.clear()
+        self.indexer = IndexerThread()
+        self.indexer.setCacheType('music')
+        self.indexer.trust_directory_mtimes = True
+
+        self.root = os.path.join(self.test_dir, 'music')
+        for name in ['rock', 'jazz']:
+            os.makedirs(os.path.join(self.root, name))
+            self._write(os.path.join(self.root, name, name + '.mp3'))
+        self._setOld()
+
+    def _write(self, filename):
+        '''Write an empty file.'''
+        open(filename, 'w').close()
+
+    def _setOld(self):
+        '''Set the modification times of the directories to the past, so
+        that they can be trusted.'''
+        for root, dirs, names in os.walk(self.root):
+            os.utime(root, (1000, 1000))
+
+    def _walk(self, cache_types=('music',)):
+        '''Walk the folder and return the found files and unchanged
+        directories.'''
+        files = {self.cache : {}}
+        unchanged = []
+        self.indexer._walk([self.root], cache_types, {'mp3' : self.cache},
+            files, [], unchanged, self.table)
+        return sorted(files[self.cache].keys()), sorted(unchanged)
+
+    def testUnchanged(self):
+        '''Test that unchanged directories are not listed again'''
+        files, unchanged = self._walk()
+        self.assertEqual(len(files), 2)
+        self.assertEqual(unchanged, [])
+
+        files, unchanged = self._walk()
+        self.assertEqual(files, [])
+        self.assertEqual(unchanged, [self.root,
+            os.path.join(self.root, 'jazz'), os.path.join(self.root, 'rock')])
+
+    def testChanged(self):
+        '''Test that only a changed directory is listed again'''
+        self._walk()
+        self._write(os.path.join(self.root, 'rock', 'new.mp3'))
+        files, unchanged = self._walk()
+        self.assertEqual(files, [os.path.join(self.root, 'rock', 'new.mp3'),
+            os.path.join(self.root, 'rock', 'rock.mp3')])
+        self.assertEqual(unchanged, [self.root,
+            os.path.join(self.root, 'jazz')])
+
+    def testDistrustMtimes(self):
+        '''Test that every directory is listed if mtimes aren't trusted'''
+        self._walk()
+        self.indexer.trust_directory_mtimes = False
+        files, unchanged = self._walk()
+        self.assertEqual(len(files), 2)
+        self.assertEqual(unchanged, [])
+
+    def testOtherCacheType(self):
+        '''Test that directories are listed for new cache types'''
+        self._walk()
+        files, unchanged = self._walk(['music', 'video'])
+        self.assertEqual(len(files), 2)
+        self.assertEqual(unchanged, [])
+
+    def testCheckpoint(self):
+        '''Test that an interrupted walk can continue from the journal'''
+        journal = InterruptedJournal()
+        journal.begin([self.root], ['music'], False, False)
+        self.indexer.journal = journal
+        self.assertRaises(KeyboardInterrupt, self._walk)
+
+        # The first directory with a file was checkpointed
+        resumed = IndexJournal()
+        self.assertTrue(resumed.load(journal.journal_id))
+        self.assertEqual(resumed.getFoundFiles().keys(),
+            [os.path.join(self.root, 'jazz', 'jazz.mp3')])
+        self.assertEqual(resumed.getPendingDirectories(),
+            [os.path.join(self.root, 'rock')])
+        resumed.finish()
+
+    def testStop(self):
+        '''Test that a stopped run writes its files and can continue'''
+        cache = StoppingCache(self.indexer)
+        self.indexer.CACHE_CLASSES = {'music' : lambda: cache}
+        journal = IndexJournal()
+        journal.begin([self.root], ['music'], False, True)
+        self.indexer._run(journal)
+        self.assertEqual(cache.indexed,
+            [os.path.join(self.root, 'jazz', 'jazz.mp3')])
+        self.assertEqual(cache.buffered, [])
+
+        resumed = IndexJournal()
+        self.assertTrue(resumed.load(journal.journal_id))
+        self.assertEqual(resumed.getQueue(),
+            [(os.path.join(self.root, 'rock', 'rock.mp3'), False, 0)])
+        resumed.finish()
+
+    def testBrokenJournal(self):
+        '''Test that a resumed run that fails doesn't block indexing'''
+        cache = StoppingCache(self.indexer)
+        self.indexer.CACHE_CLASSES = {'music' : lambda: cache}
+        broken = IndexJournal()
+        broken.begin([self.root], ['unknown'], False, True)
+        self.indexer.setResumedJournals([broken.journal_id])
+        self.indexer.setFolders([self.root])
+        self.indexer.run()
+        self.assertFalse(IndexJournal().load(broken.journal_id))
+        self.assertEqual(cache.indexed,
+            [os.path.join(self.root, 'jazz', 'jazz.mp3')])
+
+        for journal_id in IndexJournal().getUnfinished():
+            resumed = IndexJournal()
+            resumed.load(journal_id)
+            resumed.finish()
@@ -0,0 +1,84 @@
+# Copyright (c) 2009 Entertainer Developers - See COPYING - GPLv2
+'''Tests IndexJournal'''
+
+from entertainerlib.backend.components.mediacache.index_journal import (
+    IndexJournal)
+from entertainerlib.tests import EntertainerTest
+
+
+class IndexJournalTest(EntertainerTest):
+    '''Test the journal of indexing runs'''
+
+    def setUp(self):
+        '''See unittest.TestCase'''
+        EntertainerTest.setUp(self)
+        self.journal = IndexJournal(interval=2)
+        for journal_id in self.journal.getUnfinished():
+            self.journal.load(journal_id)
+            self.journal.finish()
+        self.journal.begin(['/music', '/photos'], ['music', 'image'], True,
+            False)
+
+    def _load(self):
+        '''Return the journal as loaded after a restart.'''
+        journal = IndexJournal()
+        self.assertTrue(journal.load(self.journal.journal_id))
+        return journal
+
+    def testBegin(self):
+        '''Test that a new run is unfinished and starts from its folders'''
+        self.assertEqual(self.journal.getUnfinished(),
+            [self.journal.journal_id])
+        journal = self._load()
+        self.assertEqual(journal.folders, ['/music', '/photos'])
+        self.assertEqual(journal.cache_types, ['music', 'image'])
+        self.assertEqual(journal.reconcile, True)
+        self.assertEqual(journal.full_speed, False)
+        self.assertEqual(journal.state, IndexJournal.WALKING)
+        self.assertEqual(journal.getPendingDirectories(),
+            ['/photos', '/music'])
+
+    def testCheckpointWalk(self):
+        '''Test that the walk is only stored at checkpoints'''
+        self.journal.addDirectory('/music')
+        self.journal.addDirectory('/music/rock', unchanged=True)
+        # Not valid UTF-8
+        self.journal.addFile('/music/\xff.mp3', (10, 100))
+        self.assertFalse(self.journal.isCheckpointDue())
+        self.assertEqual(self._load().getFoundFiles(), {})
+
+        self.journal.addFile('/music/b.mp3', (20, 200))
+        self.assertTrue(self.journal.isCheckpointDue())
+        self.journal.checkpointWalk(['/photos', '/music/jazz'])
+        journal = self._load()
+        self.assertEqual(journal.getFoundFiles(), {
+            '/music/\xff.mp3' : (10, 100), '/music/b.mp3' : (20, 200)})
+        self.assertEqual(journal.getWalkedDirectories(),
+            (['/music', '/music/rock'], ['/music/rock']))
+        self.assertEqual(journal.getPendingDirectories(),
+            ['/photos', '/music/jazz'])
+
+    def testQueue(self):
+        '''Test that indexed files are removed from the queue'''
+        self.journal.addFile('/music/a.mp3', (10, 100))
+        self.journal.checkpointWalk([])
+        self.journal.setQueue([('/music/a.mp3', False, 10),
+            ('/music/b.mp3', True, 20)])
+        journal = self._load()
+        self.assertEqual(journal.state, IndexJournal.INDEXING)
+        self.assertEqual(journal.getFoundFiles(), {})
+        self.assertEqual(journal.getQueue(), [('/music/a.mp3', False, 10),
+            ('/music/b.mp3', True, 20)])
+
+        self.journal.fileIndexed('/music/a.mp3')
+        self.journal.checkpoint()
+        self.assertEqual(self._load().getQueue(),
+            [('/music/b.mp3', True, 20)])
+
+    def testFinish(self):
+        '''Test that a finished run is forgotten'''
+        journal_id = self.journal.journal_id
+        self.journal.finish()
+        self.assertEqual(self.journal.getUnfinished(), [])
+        self.assertFalse(IndexJournal().load(journal_id))
+
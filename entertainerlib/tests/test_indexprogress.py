@@ -0,0 +1,60 @@
+# Copyright (c) 2009 Entertainer Developers - See COPYING - GPLv2
+'''Tests IndexProgress'''
+
+from entertainerlib.backend.components.mediacache.index_progress import (
+    IndexProgress)
+from entertainerlib.backend.core.message_type_priority import MessageType
+from entertainerlib.tests import EntertainerTest
+
+
+class IndexProgressTest(EntertainerTest):
+    '''Test counting and publishing the progress of indexing'''
+
+    def setUp(self):
+        '''See unittest.TestCase'''
+        EntertainerTest.setUp(self)
+        self.published = []
+        self.progress = IndexProgress(['/music'], self._publish, 0)
+
+    def _publish(self, message_type, data):
+        '''Remember a published message.'''
+        self.published.append((message_type, data))
+
+    def testCounts(self):
+        '''Test that found, indexed and failed files are counted'''
+        self.progress.addDiscovered(3)
+        self.progress.addStageTime('walk', 1.5)
+        self.progress.startIndexing(2)
+        self.progress.fileIndexed(100, 0.5)
+        self.progress.fileIndexed(50, 1.5, failed=True)
+        data = self.progress.getData()
+        self.assertEqual(data['folders'], ['/music'])
+        self.assertEqual(data['state'], 'indexing')
+        self.assertEqual(data['discovered'], 3)
+        self.assertEqual(data['queued'], 2)
+        self.assertEqual(data['processed'], 2)
+        self.assertEqual(data['failed'], 1)
+        self.assertEqual(data['bytes'], 150)
+        self.assertEqual(data['stage_latency'], {'walk' : 1.5, 'index' : 1.0})
+        self.assertEqual(data['eta'], 0)
+
+    def testRateLimit(self):
+        '''Test that progress is published at most once per interval'''
+        progress = IndexProgress(['/music'], self._publish, 60)
+        progress._published = 0
+        progress.update()
+        progress.update()
+        self.assertEqual(len(self.published), 1)
+        self.assertEqual(self.published[0][0], MessageType.INDEXING_PROGRESS)
+
+    def testFinish(self):
+        '''Test that only the finished message is published without an
+        interval'''
+        self.progress.update()
+        self.progress.finish()
+        self.assertEqual(len(self.published), 1)
+        message_type, data = self.published[0]
+        self.assertEqual(message_type, MessageType.INDEXING_FINISHED)
+        self.assertEqual(data['state'], 'finished')
+        self.assertEqual(data['eta'], 0)
+
@@ -0,0 +1,65 @@
+# Copyright (c) 2009 Entertainer Developers - See COPYING - GPLv2
+'''Tests IndexQueue'''
+
+from entertainerlib.backend.components.mediacache.index_queue import (
+    IndexQueue)
+from entertainerlib.tests import EntertainerTest
+
+
+class IndexQueueTest(EntertainerTest):
+    '''Test the queue of files to index'''
+
+    def setUp(self):
+        '''See unittest.TestCase'''
+        EntertainerTest.setUp(self)
+        self.queue = IndexQueue()
+        for cache_type, filename in [('music', '/music/a.mp3'),
+            ('video', '/video/b.avi'), ('image', '/photos/x/c.jpg'),
+            ('image', '/photos/y/d.jpg')]:
+            self.queue.put(cache_type, filename, filename)
+
+    def _getAll(self):
+        '''Return the items of the queue in the order they are served.'''
+        items = []
+        entry = self.queue.get()
+        while entry is not None:
+            items.append(entry[1])
+            entry = self.queue.get()
+        return items
+
+    def testOrder(self):
+        '''Test that files are served in the order they were put'''
+        self.assertEqual(len(self.queue), 4)
+        self.assertEqual(self._getAll(), ['/music/a.mp3', '/video/b.avi',
+            '/photos/x/c.jpg', '/photos/y/d.jpg'])
+        self.assertEqual(self.queue.get(), None)
+
+    def testPrioritizeType(self):
+        '''Test that the files of a prioritized type are served first'''
+        self.queue.prioritize('image')
+        self.assertEqual(self.queue.get(), ('image', '/photos/x/c.jpg'))
+        self.assertEqual(self._getAll(), ['/photos/y/d.jpg', '/music/a.mp3',
+            '/video/b.avi'])
+
+    def testPrioritizePath(self):
+        '''Test that the latest prioritized path is served first'''
+        self.queue.prioritize('image')
+        self.queue.prioritize('/photos/y')
+        self.assertEqual(self._getAll(), ['/photos/y/d.jpg',
+            '/photos/x/c.jpg', '/music/a.mp3', '/video/b.avi'])
+
+    def testPrioritizeBeforePut(self):
+        '''Test that files put after prioritizing are prioritized'''
+        self.queue.prioritize('/new')
+        self.queue.put('image', '/new/e.jpg', '/new/e.jpg')
+        self.assertEqual(self.queue.get(), ('/new', '/new/e.jpg'))
+        self.assertNotEqual(self.queue.getPrioritizedTime('/new'), None)
+
+    def testMaxPriorities(self):
+        '''Test that files of forgotten targets go back to the normal lane'''
+        self.queue.prioritize('/music')
+        for number in range(IndexQueue.MAX_PRIORITIES):
+            self.queue.prioritize('/other%d' % number)
+        self.assertEqual(self.queue.getPrioritizedTime('/music'), None)
+        self.assertEqual(self._getAll()[0], '/music/a.mp3')
+
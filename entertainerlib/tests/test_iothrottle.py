@@ -0,0 +1,109 @@
+# Copyright (c) 2009 Entertainer Developers - See COPYING - GPLv2
+'''Tests IOThrottle'''
+# pylint: disable-msg=W0212
+
+import time
+
+from entertainerlib.backend.components.mediacache.io_throttle import (
+    IOThrottle)
+from entertainerlib.tests import EntertainerTest
+
+
+class IOThrottleTest(EntertainerTest):
+    '''Test the pacing of indexers'''
+
+    def _throttle(self, mode, disk_utilization=0.0, load=0.0):
+        '''Return an IOThrottle that sees the given system load.'''
+        throttle = IOThrottle(mode, files_per_second=4,
+            bytes_per_second=1000, target_utilization=0.25, workers=2)
+        throttle._disk_utilization = (
+            lambda elapsed, own_bytes: disk_utilization)
+        throttle._load = lambda own_load: load
+        return throttle
+
+    def testFiles(self):
+        '''Test that files are spaced by the files budget'''
+        throttle = self._throttle('files')
+        now = time.time()
+        self.assertAlmostEqual(throttle._getDelay(now, 0, 0), 0.25)
+        self.assertAlmostEqual(throttle._getDelay(now, 0, 0), 0.5)
+        # Time that has passed is not slept again
+        self.assertAlmostEqual(throttle._getDelay(now + 1, 0, 0), 0.25)
+
+    def testBytes(self):
+        '''Test that files are spaced by their size'''
+        throttle = self._throttle('bytes')
+        now = time.time()
+        self.assertAlmostEqual(throttle._getDelay(now, 500, 0), 0.5)
+        self.assertAlmostEqual(throttle._getDelay(now, 250, 0), 0.75)
+
+    def testUtilization(self):
+        '''Test that the indexer works only its share of the time'''
+        throttle = self._throttle('utilization')
+        self.assertEqual(throttle._getDelay(100.0, 0, 1.0), 3.0)
+        self.assertEqual(throttle._getDelay(100.0, 0, 0.0), 0.0)
+        self.assertEqual(throttle._getDelay(100.0, 0, 1000.0),
+            IOThrottle.MAX_WORK_TIME * 3)
+
+    def testUnlimited(self):
+        '''Test that mode none and full speed don't pace'''
+        self.assertEqual(self._throttle('none')._getDelay(100.0, 0, 1.0), 0)
+        throttle = self._throttle('files')
+        throttle.setFullSpeed(True)
+        self.assertEqual(throttle._getDelay(100.0, 0, 1.0), 0)
+
+    def testBackOff(self):
+        '''Test that the budget is halved while the disk is busy'''
+        throttle = self._throttle('files', disk_utilization=0.9)
+        throttle._adapt(100.0)
+        self.assertEqual(throttle.factor, 0.5)
+        self.assertEqual(throttle.allowed_rate, 2.0)
+        for i in range(10):
+            throttle._adapt(101.0 + i)
+        self.assertEqual(throttle.factor, IOThrottle.MIN_FACTOR)
+
+        throttle = self._throttle('files', load=2.0)
+        throttle._adapt(100.0)
+        self.assertEqual(throttle.factor, 0.5)
+
+    def testIdle(self):
+        '''Test that the budget grows while the system is idle'''
+        throttle = self._throttle('utilization')
+        throttle._adapt(100.0)
+        self.assertEqual(throttle.factor, 1.5)
+        self.assertEqual(throttle.allowed_rate, 0.375)
+        for i in range(20):
+            throttle._adapt(101.0 + i)
+        self.assertEqual(throttle.allowed_rate, 1.0)
+
+        throttle = self._throttle('files', disk_utilization=0.2)
+        throttle._adapt(100.0)
+        self.assertEqual(throttle.factor, 1.0)
+
+    def testOwnDiskUse(self):
+        '''Test that the indexer's own reads don't count as disk load'''
+        throttle = IOThrottle('files', files_per_second=4,
+            bytes_per_second=1000, target_utilization=0.25, workers=2)
+        samples = [{'sda' : (1000, 0)}, {'sda' : (1900, 100000)}]
+        throttle._read_disk_stats = lambda: samples.pop(0)
+        self.assertEqual(throttle._disk_utilization(1.0, 0), 0.0)
+        # The disk was busy 90% of the time, 90% of it for the indexer
+        self.assertAlmostEqual(throttle._disk_utilization(1.0, 90000), 0.09)
+
+    def testOwnLoad(self):
+        '''Test that the indexer and thumbnail workers don't count as load'''
+        throttle = IOThrottle('files', files_per_second=4,
+            bytes_per_second=1000, target_utilization=0.25, workers=2)
+        throttle._cpus = 2
+        throttle._disk_utilization = lambda elapsed, own_bytes: 0.0
+        # One busy indexer thread and the thumbnail workers
+        throttle._load_average = lambda: 3.0
+        throttle._busy_time = 1.0
+        throttle._last_sample = 99.0
+        throttle._adapt(100.0)
+        self.assertEqual(throttle.factor, 1.5)
+
+        throttle._load_average = lambda: 6.0
+        throttle._busy_time = 1.0
+        throttle._adapt(101.0)
+        self.assertEqual(throttle.factor, 0.75)
@@ -0,0 +1,63 @@
+# Copyright (c) 2009 Entertainer Developers - See COPYING - GPLv2
+'''Tests MessageBus'''
+
+from entertainerlib.backend.core.message import Message
+from entertainerlib.backend.core.message_bus import MessageBus
+from entertainerlib.backend.core.message_handler import MessageHandler
+from entertainerlib.backend.core.message_type_priority import (MessagePriority,
+    MessageType)
+from entertainerlib.tests import EntertainerTest
+
+
+class RecordingHandler(MessageHandler):
+    '''MessageHandler that records the types of received messages.'''
+
+    def __init__(self, broken=False):
+        MessageHandler.__init__(self)
+        self.broken = broken
+        self.received = []
+
+    def handleMessage(self, message):
+        '''Record the message and fail if the handler is broken.'''
+        self.received.append(message.get_type())
+        if self.broken:
+            raise IOError('Broken pipe')
+
+
+class MessageBusTest(EntertainerTest):
+    '''Test the delivery of messages to handlers'''
+
+    def setUp(self):
+        '''See unittest.TestCase'''
+        EntertainerTest.setUp(self)
+        self.bus = MessageBus()
+        self.priorities = {
+            MessageType.INDEXING_PROGRESS : MessagePriority.HIGH,
+            MessageType.INDEXING_FINISHED : MessagePriority.LOW}
+
+    def testUnregister(self):
+        '''Test that an unregistered handler gets no more messages'''
+        handler = RecordingHandler()
+        other = RecordingHandler()
+        self.bus.registerMessageHandler(handler, self.priorities)
+        self.bus.registerMessageHandler(other, self.priorities)
+        self.bus.unregisterMessageHandler(handler)
+        self.bus.notifyMessage(Message(MessageType.INDEXING_PROGRESS))
+        self.bus.notifyMessage(Message(MessageType.INDEXING_FINISHED))
+        self.assertEqual(handler.received, [])
+        self.assertEqual(other.received, [MessageType.INDEXING_PROGRESS,
+            MessageType.INDEXING_FINISHED])
+
+    def testBrokenHandler(self):
+        '''Test that a failing handler doesn't stop the others'''
+        broken = RecordingHandler(broken=True)
+        handler = RecordingHandler()
+        self.bus.registerMessageHandler(broken, {
+            MessageType.INDEXING_PROGRESS : MessagePriority.VERY_HIGH})
+        self.bus.registerMessageHandler(handler, self.priorities)
+        self.bus.notifyMessage(Message(MessageType.INDEXING_PROGRESS))
+        self.assertEqual(broken.received, [MessageType.INDEXING_PROGRESS])
+        self.assertEqual(handler.received, [MessageType.INDEXING_PROGRESS])
+        # The lock was released
+        self.bus.notifyMessage(Message(MessageType.INDEXING_PROGRESS))
+        self.assertEqual(len(handler.received), 2)
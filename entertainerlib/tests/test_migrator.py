@@ -0,0 +1,74 @@
+# Copyright (c) 2009 Entertainer Developers - See COPYING - GPLv2
+'''Tests LegacyMigrator'''
+
+import os
+
+from pysqlite2 import dbapi2 as sqlite
+
+from entertainerlib.db.migrator import LegacyMigrator
+from entertainerlib.tests import EntertainerTestWithDatabase
+
+
+class LegacyMigratorTest(EntertainerTestWithDatabase):
+    '''Test moving legacy cache databases into the media database'''
+
+    def setUp(self):
+        '''See unittest.TestCase'''
+        EntertainerTestWithDatabase.setUp(self)
+        self.legacy_file = self.get_temp_file()
+        legacy = sqlite.connect(self.legacy_file)
+        legacy.execute("""CREATE TABLE track(
+                          filename TEXT,
+                          title TEXT,
+                          PRIMARY KEY(filename))""")
+        legacy.executemany("INSERT INTO track VALUES(?,?)",
+            [('/a.mp3', 'A'), ('/b.mp3', 'B')])
+        legacy.commit()
+        legacy.close()
+
+        self.connection = self.db.get_connection()
+        self.connection.execute("""CREATE TABLE track(
+                                   filename TEXT,
+                                   title TEXT,
+                                   mtime INTEGER,
+                                   PRIMARY KEY(filename))""")
+        self.connection.commit()
+        self.migrator = LegacyMigrator(self.db)
+
+    def _getTracks(self):
+        '''Return the tracks of the media database.'''
+        cursor = self.connection.cursor()
+        cursor.execute("SELECT filename, title FROM track ORDER BY filename")
+        return cursor.fetchall()
+
+    def testMigrate(self):
+        '''Test that rows are copied and the legacy file is renamed'''
+        self.assertTrue(self.migrator.needs_migration(self.legacy_file))
+        self.assertEqual(self.migrator.migrate(self.legacy_file,
+            {'track' : 'track'}), 2)
+        self.assertEqual(self._getTracks(), [('/a.mp3', 'A'), ('/b.mp3', 'B')])
+        self.assertFalse(os.path.exists(self.legacy_file))
+        self.assertTrue(os.path.exists(self.legacy_file +
+            LegacyMigrator.MIGRATED_SUFFIX))
+        self.assertFalse(self.migrator.needs_migration(self.legacy_file))
+
+    def testMigrateOnce(self):
+        '''Test that a migrated file isn't copied again'''
+        self.migrator.migrate(self.legacy_file, {'track' : 'track'})
+        self.assertEqual(self.migrator.migrate(self.legacy_file,
+            {'track' : 'track'}), 0)
+
+    def testExistingRows(self):
+        '''Test that rows of the media database are kept'''
+        self.connection.execute(
+            "INSERT INTO track(filename, title) VALUES('/a.mp3', 'New')")
+        self.connection.commit()
+        self.assertEqual(self.migrator.migrate(self.legacy_file,
+            {'track' : 'track'}), 1)
+        self.assertEqual(self._getTracks(),
+            [('/a.mp3', 'New'), ('/b.mp3', 'B')])
+
+    def testMissingTable(self):
+        '''Test that tables missing from the legacy database are skipped'''
+        self.assertEqual(self.migrator.migrate(self.legacy_file,
+            {'playlist' : 'track'}), 0)
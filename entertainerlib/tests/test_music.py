@@ -4,8 +4,6 @@
 
 import os
 
-from pysqlite2 import dbapi2 as sqlite
-
 from entertainerlib.client.medialibrary.music import (
     Album, AlbumHasNoTracks,
     CompactDisc, CompactDiscTrack,
@@ -25,7 +23,7 @@ class TestMusic(EntertainerTest):
         # The location of album art is required for some tests
         self.art_path = self.config.ALBUM_ART_DIR
 
-        connection = sqlite.connect(self.config.MUSIC_DB)
+        connection = self.config.MEDIA_DB.get_connection()
         self.cursor = connection.cursor()
         self.cursor.execute("""DROP TABLE IF EXISTS track""")
         self.cursor.execute("""CREATE TABLE track(
@@ -76,11 +74,10 @@ class TestMusic(EntertainerTest):
         """Clean up after the test"""
         EntertainerTest.tearDown(self)
 
-        connection = sqlite.connect(self.config.MUSIC_DB)
+        connection = self.config.MEDIA_DB.get_connection()
         cursor = connection.cursor()
         cursor.execute("""DROP TABLE IF EXISTS track""")
         connection.commit()
-        connection.close()
 
 
 class TestTrack(TestMusic):
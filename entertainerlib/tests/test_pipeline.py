@@ -0,0 +1,83 @@
+'''Tests for entertainerlib.indexing.pipeline.'''
+import threading
+
+from entertainerlib.indexing.pipeline import Pipeline, Stage
+from entertainerlib.tests import EntertainerTest
+
+
+def double(number):
+    '''Double a number.'''
+    return number * 2
+
+
+def drop_odd(number):
+    '''Drop odd numbers.'''
+    if number % 2:
+        return None
+    return number
+
+
+def fail_on_three(number):
+    '''Fail like a handler that can't read a file.'''
+    if number == 3:
+        raise ValueError('Corrupt file')
+    return number
+
+
+class PipelineTest(EntertainerTest):
+    '''Tests for `entertainerlib.indexing.pipeline.Pipeline`.'''
+
+    def setUp(self):
+        EntertainerTest.setUp(self)
+        self.results = []
+        self.lock = threading.Lock()
+
+    def collect(self, item):
+        '''Collect the items that reach the last stage.'''
+        self.lock.acquire()
+        try:
+            self.results.append(item)
+        finally:
+            self.lock.release()
+
+    def test_run(self):
+        '''Test that every item goes through every stage.'''
+        pipeline = Pipeline([Stage('double', double, workers=3,
+            queue_size=2), Stage('collect', self.collect)], 0)
+        pipeline.run(range(100))
+        self.assertEqual(sorted(self.results), range(0, 200, 2))
+
+    def test_drop(self):
+        '''Test that items are dropped when a stage returns None.'''
+        stage = Stage('drop', drop_odd, workers=2)
+        pipeline = Pipeline([stage, Stage('collect', self.collect)], 0)
+        pipeline.run(range(10))
+        self.assertEqual(sorted(self.results), [0, 2, 4, 6, 8])
+        self.assertEqual(stage.processed, 10)
+        self.assertEqual(stage.dropped, 5)
+
+    def test_error(self):
+        '''Test that a failing item doesn't stop the pipeline.'''
+        stage = Stage('fail', fail_on_three)
+        pipeline = Pipeline([stage, Stage('collect', self.collect)], 0)
+        pipeline.run(range(5))
+        self.assertEqual(sorted(self.results), [0, 1, 2, 4])
+        self.assertEqual(stage.errors, 1)
+
+    def test_finish(self):
+        '''Test that finish is called after the last item.'''
+        finished = []
+        pipeline = Pipeline([Stage('collect', self.collect, workers=2,
+            finish=lambda: finished.append(len(self.results)))], 0)
+        pipeline.run(range(20))
+        self.assertEqual(finished, [20])
+
+    def test_statistics(self):
+        '''Test the statistics of the stages.'''
+        pipeline = Pipeline([Stage('double', double),
+            Stage('collect', self.collect)], 0)
+        pipeline.run(range(10))
+        statistics = pipeline.get_statistics()
+        self.assertEqual([row[:2] for row in statistics],
+            [('discover', 10), ('double', 10), ('collect', 10)])
+        self.assertEqual([row[4] for row in statistics[1:]], [0, 0])
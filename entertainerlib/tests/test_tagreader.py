@@ -0,0 +1,137 @@
+# Copyright (c) 2009 Entertainer Developers - See COPYING - GPLv2
+'''Tests the tag reader'''
+
+import os
+import struct
+
+from entertainerlib.exceptions import TagGetterException
+from entertainerlib.tag_reader import read_tags
+from entertainerlib.tests import EntertainerTest
+
+# MPEG 1 layer III, 128 kbit/s, 44100 Hz, stereo
+MPEG_HEADER = '\xff\xfb\x90\x00'
+MPEG_FRAME_SIZE = 417
+
+
+def syncsafe(value):
+    '''Return value as four syncsafe bytes.'''
+    return ''.join([chr((value >> shift) & 0x7f) for shift in (21, 14, 7,
+        0)])
+
+
+def id3v23_frame(frame_id, body):
+    '''Return an ID3v2.3 frame.'''
+    return frame_id + struct.pack('>IH', len(body), 0) + body
+
+
+def id3v1_tag(title, artist, album, year, comment, track, genre):
+    '''Return an ID3v1.1 tag.'''
+    return ('TAG' + title.ljust(30, '\x00') + artist.ljust(30, '\x00') +
+        album.ljust(30, '\x00') + year + comment.ljust(28, '\x00') + '\x00' +
+        chr(track) + chr(genre))
+
+
+def ogg_page(packets, granule):
+    '''Return an Ogg page that contains whole packets.'''
+    segments = ''
+    for packet in packets:
+        segments += '\xff' * (len(packet) / 255) + chr(len(packet) % 255)
+    return ('OggS\x00\x00' + struct.pack('<qIIIB', granule, 1, 0, 0,
+        len(segments)) + segments + ''.join(packets))
+
+
+class TagReaderTest(EntertainerTest):
+    '''Test reading tags without decoding the files'''
+
+    def _write(self, name, data):
+        '''Write a file to the test directory and return its path.'''
+        filename = os.path.join(self.test_dir, name)
+        audio_file = open(filename, 'wb')
+        audio_file.write(data)
+        audio_file.close()
+        return filename
+
+    def testId3v24(self):
+        '''Test reading the ID3v2.4 tags of an mp3 file'''
+        tags = read_tags(os.path.join(self.data_dir, 'test.mp3'))
+        self.assertEqual(tags['artist'], u'Iron and Wine')
+        self.assertEqual(tags['album'], u'The Shephard\'s Dog')
+        self.assertEqual(tags['genre'], u'Gangster Rap')
+        self.assertEqual(tags['title'], u'Flightless Bird, American Mouth')
+        self.assertEqual(tags['comment'], u'This is a comment')
+        self.assertEqual(tags['track-number'], 12)
+        self.assertEqual(tags['album-disc-number'], 1)
+        self.assertEqual(tags['date'], u'2000')
+
+    def testId3v23(self):
+        '''Test ID3v2.3 text encodings, numbered genres and track counts'''
+        frames = (id3v23_frame('TIT2', '\x01' + u'K\xe4rlek'.encode('utf-16'))
+            + id3v23_frame('TCON', '\x00(17)')
+            + id3v23_frame('TRCK', '\x003/12')
+            + id3v23_frame('COMM', '\x00engiTunNORM\x00 0000')
+            + id3v23_frame('COMM', '\x00eng\x00Nice'))
+        tag = 'ID3\x03\x00\x00' + syncsafe(len(frames) + 20) + frames
+        filename = self._write('v23.mp3', tag + '\x00' * 20)
+        tags = read_tags(filename)
+        self.assertEqual(tags['title'], u'K\xe4rlek')
+        self.assertEqual(tags['genre'], u'Rock')
+        self.assertEqual(tags['track-number'], 3)
+        self.assertEqual(tags['comment'], u'Nice')
+
+    def testId3v1AndConstantBitrate(self):
+        '''Test ID3v1 tags and the length of a constant bitrate file'''
+        frame = MPEG_HEADER + '\x00' * (MPEG_FRAME_SIZE - 4)
+        filename = self._write('v1.mp3', frame * 1000 +
+            id3v1_tag('Title', 'Artist', 'Album', '1999', 'Comment', 7, 9))
+        tags = read_tags(filename)
+        self.assertEqual(tags['title'], u'Title')
+        self.assertEqual(tags['artist'], u'Artist')
+        self.assertEqual(tags['album'], u'Album')
+        self.assertEqual(tags['date'], u'1999')
+        self.assertEqual(tags['comment'], u'Comment')
+        self.assertEqual(tags['track-number'], 7)
+        self.assertEqual(tags['genre'], u'Metal')
+        # 1000 frames of 417 bytes at 128 kbit/s
+        self.assertEqual(tags['length'], 26)
+        self.assertEqual(tags['bitrate'], 128)
+
+    def testXingHeader(self):
+        '''Test the length of a variable bitrate file with a Xing header'''
+        xing = 'Xing' + struct.pack('>III', 3, 10000, 4180000)
+        first = MPEG_HEADER + '\x00' * 32 + xing
+        first += '\x00' * (MPEG_FRAME_SIZE - len(first))
+        frame = MPEG_HEADER + '\x00' * (MPEG_FRAME_SIZE - 4)
+        filename = self._write('vbr.mp3', first + frame * 10)
+        tags = read_tags(filename)
+        # 10000 frames of 1152 samples at 44100 Hz
+        self.assertEqual(tags['length'], 261)
+        self.assertEqual(tags['bitrate'], 128)
+
+    def testVorbisComments(self):
+        '''Test reading the comments and length of an Ogg Vorbis file'''
+        identification = ('\x01vorbis' + struct.pack('<IBIiii', 0, 2, 44100,
+            0, 160000, 0) + '\xb8\x01')
+        comments = ['TITLE=Song', 'VERSION=Live', 'artist=Band',
+            'TRACKNUMBER=4', 'DATE=2008-05-01', 'DESCRIPTION=Good']
+        comment_header = '\x03vorbis' + struct.pack('<I', 6) + 'vendor'
+        comment_header += struct.pack('<I', len(comments))
+        for comment in comments:
+            comment_header += struct.pack('<I', len(comment)) + comment
+        filename = self._write('test.ogg', ogg_page([identification], 0) +
+            ogg_page([comment_header], 0) +
+            ogg_page(['\x00' * 300], 44100 * 200))
+        tags = read_tags(filename)
+        self.assertEqual(tags['title'], u'Song (Live)')
+        self.assertEqual(tags['artist'], u'Band')
+        self.assertEqual(tags['track-number'], 4)
+        self.assertEqual(tags['date'], u'2008-05-01')
+        self.assertEqual(tags['comment'], u'Good')
+        self.assertEqual(tags['length'], 200)
+        self.assertEqual(tags['bitrate'], 160)
+
+    def testNotAudio(self):
+        '''Test that files without tags or audio are rejected'''
+        filename = self._write('text.mp3', 'This is not an mp3 file' * 10)
+        self.assertRaises(TagGetterException, read_tags, filename)
+        self.assertRaises(TagGetterException, read_tags,
+            os.path.join(self.test_dir, 'missing.mp3'))
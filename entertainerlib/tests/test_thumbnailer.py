@@ -3,11 +3,16 @@
 # pylint: disable-msg=W0212
 
 import os
+import shutil
+import struct
+import tempfile
+import time
 
-from entertainerlib.exceptions import ThumbnailerException
+from entertainerlib.exceptions import (ImageThumbnailerException,
+    ThumbnailerException)
 from entertainerlib.tests import EntertainerTest
 from entertainerlib.thumbnailer import (ImageThumbnailer, Thumbnailer,
-    VideoThumbnailer)
+    VideoThumbnailer, VideoThumbnailerPool)
 
 THIS_DIR = os.path.dirname(__file__)
 
@@ -51,6 +56,33 @@ class ThumbnailerTest(EntertainerTest):
             THIS_DIR + '/data/ImageThumbnailer/alskdjfhg.jpg',
             'image')
 
+    def testGetThumbnailPath(self):
+        '''Tests naming of thumbnail sizes'''
+        self.assertEqual(Thumbnailer.get_thumbnail_path('/thumbs', 'abc',
+            Thumbnailer.MAX_SIZE), '/thumbs/abc.jpg')
+        self.assertEqual(Thumbnailer.get_thumbnail_path('/thumbs', 'abc',
+            128), '/thumbs/abc-128.jpg')
+
+    def testFindThumbnail(self):
+        '''Tests finding the smallest thumbnail that is large enough'''
+        thumb_dir = tempfile.mkdtemp()
+        try:
+            for size in [128, Thumbnailer.MAX_SIZE]:
+                open(Thumbnailer.get_thumbnail_path(thumb_dir, 'abc', size),
+                    'w').close()
+            self.assertEqual(
+                Thumbnailer.find_thumbnail(thumb_dir, 'abc', 100, 50),
+                os.path.join(thumb_dir, 'abc-128.jpg'))
+            # 256 thumbnail doesn't exist
+            self.assertEqual(
+                Thumbnailer.find_thumbnail(thumb_dir, 'abc', 200, 150),
+                os.path.join(thumb_dir, 'abc.jpg'))
+            self.assertEqual(
+                Thumbnailer.find_thumbnail(thumb_dir, 'abc', 1000, 600),
+                None)
+        finally:
+            shutil.rmtree(thumb_dir)
+
     def testAbstractCreateThumbnailer(self):
         '''Tests trying to create the abstract thumbnailer'''
         thumbnailer_test = Thumbnailer(
@@ -80,6 +112,84 @@ class ImageThumbnailerTest(EntertainerTest):
             print 'Expecting thumbnail : %s' % thumbnailer._thumb_file
         self.assertTrue(os.path.exists(thumbnailer._thumb_file))
 
+    def testThumbnailPolicies(self):
+        '''Tests that every thumbnail policy creates a thumbnail'''
+        for policy in ImageThumbnailer.POLICIES:
+            thumbnailer = ImageThumbnailer(self.filename, policy)
+            if os.path.exists(thumbnailer._thumb_file):
+                os.remove(thumbnailer._thumb_file)
+            thumbnailer.create_thumbnail()
+            self.assertTrue(os.path.exists(thumbnailer._thumb_file))
+
+    def testThumbnailSizes(self):
+        '''Tests that thumbnails smaller than the image are created'''
+        thumbnailer = ImageThumbnailer(self.filename)
+        width, height = thumbnailer.im.size
+        thumbnailer.create_thumbnail()
+        for size in Thumbnailer.get_sizes():
+            path = Thumbnailer.get_thumbnail_path(thumbnailer.thumb_dir,
+                thumbnailer.get_hash(), size)
+            if size < max(width, height) or size == Thumbnailer.MAX_SIZE:
+                self.assertTrue(os.path.exists(path))
+
+    def _get_preview_requests(self, sizes):
+        '''Create thumbnails of the given sizes with the fast policy and
+        return the sizes that were requested from the EXIF preview.'''
+        thumbnailer = ImageThumbnailer(self.filename, 'fast')
+        thumbnailer.get_sizes = lambda: sizes
+        requested = []
+        thumbnailer._get_exif_preview = (
+            lambda width, height: requested.append((width, height)))
+        thumbnailer.create_thumbnail()
+        for size in sizes:
+            self.assertTrue(os.path.exists(Thumbnailer.get_thumbnail_path(
+                thumbnailer.thumb_dir, thumbnailer.get_hash(), size)))
+        return requested
+
+    def testExifPreviewSizes(self):
+        '''Tests that the EXIF preview is only used for grid sizes'''
+        # The image is 894x1200
+        self.assertEqual(self._get_preview_requests(
+            [128, 256, Thumbnailer.MAX_SIZE]), [(381, 512)])
+        self.assertEqual(self._get_preview_requests(
+            [128, Thumbnailer.MAX_SIZE, 1024]), [])
+
+    def testUnknownPolicy(self):
+        '''Tests that an unknown thumbnail policy is rejected'''
+        self.assertRaises(ImageThumbnailerException, ImageThumbnailer,
+            self.filename, 'foo')
+
+    def _make_tiff(self, order, thumbnail):
+        '''Return EXIF TIFF data with the thumbnail in IFD1.'''
+        # Header, IFD0 with one entry, IFD1 with offset and length entries
+        if order == 'I':
+            fmt = '<'
+        else:
+            fmt = '>'
+        ifd1 = 8 + 2 + 12 + 4
+        data = ifd1 + 2 + 2 * 12 + 4
+        tiff = (order * 2 + struct.pack(fmt + 'HL', 42, 8) +
+            struct.pack(fmt + 'HHHLLL', 1, 0x010f, 2, 0, 0,
+                ifd1) +
+            struct.pack(fmt + 'HHHLLHHLLL', 2,
+                0x0201, 4, 1, data, 0x0202, 4, 1, len(thumbnail), 0))
+        return tiff + thumbnail
+
+    def testFindExifPreview(self):
+        '''Tests finding the thumbnail in EXIF data'''
+        thumbnailer = ImageThumbnailer(self.filename)
+        for order in ['I', 'M']:
+            tiff = self._make_tiff(order, 'thumbnail data')
+            self.assertEqual(thumbnailer._find_exif_preview(tiff),
+                'thumbnail data')
+
+    def testFindExifPreviewMissing(self):
+        '''Tests EXIF data without a thumbnail'''
+        thumbnailer = ImageThumbnailer(self.filename)
+        tiff = 'II' + struct.pack('<HL', 42, 8) + struct.pack('<HL', 0, 0)
+        self.assertEqual(thumbnailer._find_exif_preview(tiff), None)
+        self.assertEqual(thumbnailer._find_exif_preview('XX'), None)
+
 
 class VideoThumbnailerTest(EntertainerTest):
     '''Tests VideoThumbnailer'''
@@ -115,6 +225,16 @@ class VideoThumbnailerTest(EntertainerTest):
             VideoThumbnailer, os.path.abspath('.') +
             '/data/VideoThumbnailer/test.avi', src="foo")
 
+    def testPlayTimeout(self):
+        '''Tests that playing a video without frames stops at the timeout'''
+        thumbnailer = VideoThumbnailer(
+            THIS_DIR + '/data/VideoThumbnailer/test.avi', timeout=0.5)
+        thumbnailer.set_pipeline_state = lambda pipeline, state: True
+        thumbnailer._deadline = time.time() + thumbnailer._timeout
+        start = time.time()
+        self.assertEqual(thumbnailer._play_for_thumb((64, 48)), None)
+        self.assertTrue(time.time() - start < 5)
+
     def testThumbnailAvi(self):
         '''Tests thumbnailing of Avi file'''
         thumbnailer = VideoThumbnailer(
@@ -137,3 +257,39 @@ class VideoThumbnailerTest(EntertainerTest):
             print 'Expecting thumbnail : %s' % (self.thumbnailer._thumb_file)
         self.assertTrue(os.path.exists(thumbnailer._thumb_file))
 
+
+
+class VideoThumbnailerPoolTest(EntertainerTest):
+    '''Tests VideoThumbnailerPool'''
+
+    def setUp(self):
+        """See unittest.TestCase"""
+        EntertainerTest.setUp(self)
+        self.pool = VideoThumbnailerPool()
+        self.filename = THIS_DIR + '/data/VideoThumbnailer/test.avi'
+
+    def tearDown(self):
+        """Clean up after the test"""
+        self.pool.close()
+        EntertainerTest.tearDown(self)
+
+    def testShared(self):
+        '''Tests that all pools share their pipelines'''
+        self.assertTrue(VideoThumbnailerPool()._idle is self.pool._idle)
+
+    def testCreateThumbnail(self):
+        '''Tests thumbnailing with a pooled pipeline'''
+        thumbnailer = VideoThumbnailer(self.filename)
+        if os.path.exists(thumbnailer._thumb_file):
+            os.remove(thumbnailer._thumb_file)
+        self.assertEqual(self.pool.create_thumbnail(self.filename),
+            thumbnailer.get_hash())
+        self.assertTrue(os.path.exists(thumbnailer._thumb_file))
+        # The pipeline is kept for the next video
+        self.assertEqual(self.pool._idle.qsize(), 1)
+
+    def testMissingFile(self):
+        '''Tests that errors are raised and the pipeline is kept'''
+        self.assertRaises(ThumbnailerException, self.pool.create_thumbnail,
+            os.path.abspath('foo-bar-baz'))
+        self.assertEqual(self.pool._idle.qsize(), 1)
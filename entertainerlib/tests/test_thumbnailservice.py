@@ -0,0 +1,79 @@
+# Copyright (c) 2009 Entertainer Developers - See COPYING - GPLv2
+'''Tests ThumbnailService'''
+
+import os
+
+from entertainerlib.exceptions import ImageThumbnailerException
+from entertainerlib.tests import EntertainerTest
+from entertainerlib.thumbnail_service import ThumbnailService
+from entertainerlib.thumbnailer import ImageThumbnailer
+
+THIS_DIR = os.path.dirname(__file__)
+
+
+class ThumbnailServiceTest(EntertainerTest):
+    '''Test the process pool thumbnail service'''
+
+    def setUp(self):
+        '''See unittest.TestCase'''
+        EntertainerTest.setUp(self)
+        self.service = ThumbnailService()
+        self.filename = THIS_DIR + '/data/ImageThumbnailer/test.jpg'
+
+    def tearDown(self):
+        '''Stop the pool so that the next test forks with its own config'''
+        self.service.close()
+        EntertainerTest.tearDown(self)
+
+    def testShared(self):
+        '''Test that all services share the same state'''
+        self.assertTrue(ThumbnailService().__dict__ is self.service.__dict__)
+
+    def testSubmit(self):
+        '''Test creating a thumbnail in a worker process'''
+        job = self.service.submit(self.filename)
+        self.assertEqual(job.hash, ImageThumbnailer.hash_filename(
+            self.filename))
+        self.assertEqual(job.get(30), job.hash)
+        self.assertTrue(os.path.exists(os.path.join(
+            self.config.IMAGE_THUMB_DIR, job.hash + '.jpg')))
+
+    def testCallback(self):
+        '''Test that the callback gets the finished job'''
+        finished = []
+        job = self.service.submit(self.filename, finished.append)
+        job.get(30)
+        self.assertEqual(finished, [job])
+
+    def testInvalidImage(self):
+        '''Test that a failing job raises when its result is requested'''
+        job = self.service.submit(THIS_DIR + '/data/test.mp3')
+        self.assertRaises(ImageThumbnailerException, job.get, 30)
+
+    def testHangingJob(self):
+        '''Test that a job that hangs fails and frees its slot'''
+        # Opening a named pipe blocks until something writes to it
+        fifo = os.path.join(self.test_dir, 'hang.jpg')
+        os.mkfifo(fifo)
+        timeout = self.service.job_timeout
+        self.service.job_timeout = 1
+        try:
+            # Every worker hangs, so the last job waits in the queue
+            hanging = [self.service.submit(fifo)
+                for i in range(self.service.workers)]
+            pool = self.service._pool
+            job = self.service.submit(self.filename)
+            for hung in hanging:
+                self.assertRaises(ImageThumbnailerException, hung.get, 30)
+                self.assertTrue('timed out' in hung.error)
+            # Time in the queue doesn't count, and only the hung workers
+            # were replaced
+            self.assertEqual(job.get(30), job.hash)
+            self.assertTrue(self.service._pool is pool)
+            # No slot was lost, so submitting doesn't block
+            jobs = [self.service.submit(self.filename)
+                for i in range(self.service.max_pending)]
+            for job in jobs:
+                job.get(30)
+        finally:
+            self.service.job_timeout = timeout
@@ -0,0 +1,109 @@
+# Copyright (c) 2009 Entertainer Developers - See COPYING - GPLv2
+'''Tests VideoMetadataQueue'''
+# pylint: disable-msg=W0212
+
+import threading
+import time
+
+from entertainerlib.backend.components.mediacache.video_metadata_queue import (
+    VideoMetadataQueue)
+from entertainerlib.configuration import Configuration
+from entertainerlib.tests import EntertainerTest
+
+CLERKS = '/videos/Clerks.2[2006]DvDrip[Eng]-aXXo.avi'
+
+
+class FakeIMDb:
+    '''IMDb client that lets the test see and control the searches.'''
+
+    def __init__(self, test):
+        self.test = test
+
+    def search_movie(self, title):
+        '''Record the search and find nothing.'''
+        self.test.searches.append(title)
+        self.test.allow_search.wait()
+        if title in self.test.broken_titles:
+            raise ValueError('Unexpected response')
+        return []
+
+
+class VideoMetadataQueueTest(EntertainerTest):
+    '''Test the queue of video metadata searches'''
+
+    def setUp(self):
+        '''See unittest.TestCase'''
+        EntertainerTest.setUp(self)
+        self.searches = []
+        self.broken_titles = []
+        self.clients = 0
+        self.allow_search = threading.Event()
+
+        VideoMetadataQueue._shared_state.clear()
+        self.queue = VideoMetadataQueue(workers=1)
+        self.queue._createClient = self._createClient
+        self.db_conn = Configuration().MEDIA_DB.get_connection()
+        self.db_conn.cursor().execute("DELETE FROM metadata_queue")
+        self.db_conn.commit()
+
+    def tearDown(self):
+        '''See unittest.TestCase'''
+        self.allow_search.set()
+        # Later users get a queue with real IMDb clients
+        VideoMetadataQueue._shared_state.clear()
+        EntertainerTest.tearDown(self)
+
+    def _createClient(self):
+        '''Count the client and return a FakeIMDb.'''
+        self.clients += 1
+        return FakeIMDb(self)
+
+    def _waitForQueue(self, left=0):
+        '''Let the searches run and wait until the stored queue has only
+        left files.'''
+        self.allow_search.set()
+        for i in range(50):
+            if len(self._getQueuedFiles()) <= left:
+                return
+            time.sleep(0.1)
+
+    def _getQueuedFiles(self):
+        '''Return the files in the stored queue.'''
+        cursor = self.db_conn.cursor()
+        cursor.execute("SELECT filename FROM metadata_queue")
+        return [row[0] for row in cursor.fetchall()]
+
+    def testSeriesBatching(self):
+        '''Test that the episodes of a series are searched once'''
+        self.queue.addFile(CLERKS)
+        for episode in range(1, 4):
+            self.queue.addFile('/videos/Futurama s02e0%d.avi' % episode)
+        self.assertEqual(len(self._getQueuedFiles()), 4)
+        self._waitForQueue()
+        self.assertEqual(self.searches, ['clerks 2', 'futurama'])
+        self.assertEqual(self.clients, 1)
+        self.assertEqual(self._getQueuedFiles(), [])
+
+    def testResume(self):
+        '''Test that files left in the stored queue are searched'''
+        self.db_conn.cursor().executemany(
+            "INSERT INTO metadata_queue(filename) VALUES (?)",
+            [(CLERKS,), ('/videos/Futurama s01e01.avi',),
+            ('/videos/Futurama s01e02.avi',)])
+        self.db_conn.commit()
+        self.assertEqual(self.queue.resume(), 3)
+        self._waitForQueue()
+        self.assertEqual(self.searches, ['clerks 2', 'futurama'])
+        self.assertEqual(self._getQueuedFiles(), [])
+
+    def testSearchError(self):
+        '''Test that the files of a failed search stay queued'''
+        self.broken_titles.append('clerks 2')
+        self.queue.addFile(CLERKS)
+        self.queue.addFile('/videos/Futurama s01e01.avi')
+        self._waitForQueue(left=1)
+        self.assertEqual(self.searches, ['clerks 2', 'futurama'])
+        self.assertEqual(self._getQueuedFiles(), [CLERKS])
+        # The client of the failed search was replaced
+        self.assertEqual(self.clients, 2)
+        self.assertEqual(self.queue._pool.get_thread_count(), 1)
@@ -0,0 +1,54 @@
+# Copyright (c) 2009 Entertainer Developers - See COPYING - GPLv2
+'''Tests WorkerPool'''
+# pylint: disable-msg=W0212
+
+import threading
+
+from entertainerlib.tests import EntertainerTest
+from entertainerlib.worker_pool import WorkerPool
+
+
+class WorkerPoolTest(EntertainerTest):
+    '''Test the pool of worker threads'''
+
+    def setUp(self):
+        '''See unittest.TestCase'''
+        EntertainerTest.setUp(self)
+        self.handled = []
+        self.done = threading.Event()
+        self.pool = WorkerPool('Test worker', 2, self._handle)
+
+    def _handle(self, item):
+        '''Record the item and fail on negative items.'''
+        self.handled.append(item)
+        if item is None:
+            self.done.set()
+        elif item < 0:
+            raise ValueError('Negative item')
+
+    def testBounded(self):
+        '''Test that no more than the given number of threads is started'''
+        for item in range(10):
+            self.pool.put(item)
+        self.assertEqual(self.pool.get_thread_count(), 2)
+
+    def testHandlerError(self):
+        '''Test that a failing item doesn't stop the workers'''
+        pool = WorkerPool('Test worker', 1, self._handle)
+        pool.put(-1)
+        pool.put(1)
+        pool.put(None)
+        self.done.wait(5)
+        self.assertEqual(self.handled, [-1, 1, None])
+        self.assertEqual(pool.get_thread_count(), 1)
+
+    def testDeadThread(self):
+        '''Test that a thread that has died is replaced'''
+        dead = threading.Thread(target=lambda: None)
+        dead.start()
+        dead.join()
+        self.pool._threads = [dead]
+        self.pool.put(None)
+        self.done.wait(5)
+        self.assertEqual(self.handled, [None])
+        self.assertEqual(self.pool.get_thread_count(), 2)
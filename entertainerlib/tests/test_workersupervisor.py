@@ -0,0 +1,80 @@
+# Copyright (c) 2009 Entertainer Developers - See COPYING - GPLv2
+'''Tests WorkerSupervisor'''
+
+import os
+import time
+
+from entertainerlib.exceptions import WorkerException
+from entertainerlib.tests import EntertainerTest
+from entertainerlib.worker_supervisor import FailureRecord, WorkerSupervisor
+
+
+def echo(filename, suffix=''):
+    '''Return the filename and the id of the worker process.'''
+    return filename + suffix, os.getpid()
+
+
+def fail(filename):
+    '''Raise an exception like a task that can't read its file.'''
+    raise ValueError('Corrupt file %s' % filename)
+
+
+def hang(filename):
+    '''Never return like a pipeline that is stuck.'''
+    while True:
+        time.sleep(1)
+
+
+def crash(filename):
+    '''Kill the worker like a decoder that segfaults.'''
+    os._exit(3)
+
+
+class WorkerSupervisorTest(EntertainerTest):
+    '''Test running tasks in a supervised worker process'''
+
+    def setUp(self):
+        '''See unittest.TestCase'''
+        EntertainerTest.setUp(self)
+        self.supervisor = WorkerSupervisor('Test worker', timeout=2)
+
+    def tearDown(self):
+        '''See unittest.TestCase'''
+        self.supervisor.close()
+        EntertainerTest.tearDown(self)
+
+    def testCall(self):
+        '''Test that the task runs in a separate process'''
+        result, pid = self.supervisor.call(echo, '/foo', '.bar')
+        self.assertEqual(result, '/foo.bar')
+        self.assertNotEqual(pid, os.getpid())
+        self.assertEqual(pid, self.supervisor.get_pid())
+
+    def testError(self):
+        '''Test that a failing task is recorded and keeps the worker'''
+        pid = self.supervisor.call(echo, '/foo')[1]
+        error = self.assertRaises(WorkerException, self.supervisor.call,
+            fail, '/foo')
+        self.assertEqual(error.record.kind, FailureRecord.ERROR)
+        self.assertEqual(error.record.filename, '/foo')
+        self.assertEqual(error.record.task, 'fail')
+        self.assertTrue('Corrupt file' in error.record.message)
+        self.assertEqual(list(self.supervisor.failures), [error.record])
+        self.assertEqual(self.supervisor.call(echo, '/foo')[1], pid)
+
+    def testTimeout(self):
+        '''Test that a hanging task is killed and the worker restarted'''
+        pid = self.supervisor.call(echo, '/foo')[1]
+        error = self.assertRaises(WorkerException, self.supervisor.call,
+            hang, '/foo')
+        self.assertEqual(error.record.kind, FailureRecord.TIMEOUT)
+        self.assertTrue(error.record.elapsed >= 2)
+        self.assertNotEqual(self.supervisor.call(echo, '/foo')[1], pid)
+        self.assertEqual(self.supervisor.restarts, 1)
+
+    def testCrash(self):
+        '''Test that a crashed worker is recorded and restarted'''
+        error = self.assertRaises(WorkerException, self.supervisor.call,
+            crash, '/foo')
+        self.assertEqual(error.record.kind, FailureRecord.CRASH)
+        self.assertEqual(self.supervisor.call(echo, '/foo')[0], '/foo')
@@ -0,0 +1,253 @@
+# Copyright (c) 2009 Entertainer Developers - See COPYING - GPLv2
+'''Thumbnail service that creates image thumbnails in worker processes.'''
+
+import multiprocessing
+import os
+import Queue
+import signal
+import threading
+import time
+
+from entertainerlib.configuration import Configuration
+from entertainerlib.exceptions import ImageThumbnailerException
+from entertainerlib.logger import Logger
+from entertainerlib.thumbnailer import ImageThumbnailer, Thumbnailer
+
+
+# Queue where a worker process reports (job id, process id, start time)
+# when it starts a job. Set when the worker process starts.
+_started_jobs = None
+
+
+def _init_worker(started_jobs):
+    '''Initialize a worker process of the thumbnail pool.'''
+    global _started_jobs
+    _started_jobs = started_jobs
+
+
+def create_image_thumbnail(filename, thumb_hash=None, job_id=None):
+    '''Create a thumbnail of an image. This is run in a worker process.
+
+    Exceptions can't be passed back from the worker, so the result is a tuple
+    of (hash, error message) where one of the values is None.'''
+    if _started_jobs is not None and job_id is not None:
+        _started_jobs.put((job_id, os.getpid(), time.time()))
+    try:
+        thumbnailer = ImageThumbnailer(filename, thumb_hash=thumb_hash)
+        thumbnailer.create_thumbnail()
+        return thumbnailer.get_hash(), None
+    except Exception, e:
+        return None, str(e) or e.__class__.__name__
+
+
+class ThumbnailJob(object):
+    '''A submitted thumbnail job. Works like a future for the result.'''
+
+    def __init__(self, filename, callback=None, thumb_hash=None):
+        self.filename = filename
+        # The hash is known before the thumbnail exists
+        if thumb_hash is None:
+            thumb_hash = Thumbnailer.hash_filename(filename)
+        self.hash = thumb_hash
+        self.error = None
+        self._callback = callback
+        self._done = threading.Event()
+
+    def ready(self):
+        '''Return True if the job has finished.'''
+        return self._done.isSet()
+
+    def get(self, timeout=None):
+        '''Wait for the job and return the thumbnail hash.
+
+        Raises ImageThumbnailerException if creating the thumbnail failed.'''
+        self._done.wait(timeout)
+        if not self._done.isSet():
+            raise ImageThumbnailerException(
+                'Thumbnail job timed out : %s' % self.filename)
+        if self.error is not None:
+            raise ImageThumbnailerException(self.error)
+        return self.hash
+
+    def finish(self, error):
+        '''Mark the job as finished and call the callback.'''
+        self.error = error
+        self._done.set()
+        if self._callback is not None:
+            self._callback(self)
+
+
+class ThumbnailService(object):
+    '''Creates image thumbnails in a pool of worker processes.
+
+    Decoding and resizing images is CPU bound, so doing it in separate
+    processes avoids the GIL and scales with the number of cores. submit()
+    blocks while too many jobs are in flight, which keeps indexers from
+    queueing a whole library into memory. Callbacks are called from the
+    pool's result thread, so they must not use the caller's SQLite
+    connections.
+
+    A job that hasn't finished in job_timeout seconds after a worker has
+    started it fails. Time spent queued doesn't count. The worker that runs
+    the job is killed, and the pool starts a new worker in its place.
+
+    ThumbnailService shares its state like Configuration, so all users get
+    the same pool.'''
+
+    _shared_state = {}
+
+    # Seconds between checks for jobs that have run too long
+    WATCH_INTERVAL = 1.0
+
+    def __init__(self, workers=None, max_pending=None, job_timeout=None):
+        self.__dict__ = self._shared_state
+
+        if not self._shared_state:
+            self.logger = Logger().getLogger('ThumbnailService')
+            config = Configuration()
+            if workers is None:
+                workers = config.thumbnail_workers
+            if workers <= 0:
+                workers = multiprocessing.cpu_count()
+            self.workers = workers
+            if max_pending is None:
+                max_pending = workers * 4
+            self.max_pending = max_pending
+            if job_timeout is None:
+                job_timeout = config.thumbnail_timeout
+            self.job_timeout = job_timeout
+            self._slots = threading.BoundedSemaphore(max_pending)
+            self._pool = None
+            self._started_jobs = None
+            # Job id -> ThumbnailJob of the jobs in flight
+            self._jobs = {}
+            # Job id -> (process id, start time) of the running jobs
+            self._running = {}
+            self._next_id = 0
+            self._watcher = None
+            self._lock = threading.Lock()
+
+    def submit(self, filename, callback=None, thumb_hash=None):
+        '''Queue a thumbnail job and return a ThumbnailJob for it.
+
+        Blocks while max_pending jobs are in flight.
+        @param filename: Absolute path of the image
+        @param callback: Function called with the finished ThumbnailJob
+        @param thumb_hash: Name of the thumbnails. Hash of the filename if
+            None.'''
+        job = ThumbnailJob(filename, callback, thumb_hash)
+        self._slots.acquire()
+        self._lock.acquire()
+        try:
+            try:
+                self._apply(job)
+            except Exception:
+                self._slots.release()
+                raise
+        finally:
+            self._lock.release()
+        return job
+
+    def close(self):
+        '''Wait for queued jobs and stop the worker processes.'''
+        self._lock.acquire()
+        pool = self._pool
+        self._pool = None
+        self._lock.release()
+        if pool is not None:
+            pool.close()
+            # The pool waits forever for the jobs of killed workers, so it
+            # is terminated when every job has finished or timed out
+            while self._jobs:
+                time.sleep(0.1)
+            pool.terminate()
+            pool.join()
+
+    def _apply(self, job):
+        '''Run a job in the worker pool. The pool and the watcher thread are
+        started on first use. Called with the lock.'''
+        if self._pool is None:
+            self._started_jobs = multiprocessing.Queue()
+            self._pool = multiprocessing.Pool(self.workers, _init_worker,
+                (self._started_jobs,))
+        job_id = self._next_id
+        self._next_id += 1
+        self._jobs[job_id] = job
+        self._pool.apply_async(create_image_thumbnail,
+            (job.filename, job.hash, job_id),
+            callback=lambda result: self._finish(job_id, result))
+        if self._watcher is None:
+            self._watcher = threading.Thread(target=self._watch,
+                name="Thumbnail job watcher")
+            self._watcher.setDaemon(True)
+            self._watcher.start()
+
+    def _watch(self):
+        '''Fail jobs that have run too long until no jobs are in flight.'''
+        while self._expire():
+            time.sleep(self.WATCH_INTERVAL)
+
+    def _expire(self):
+        '''Fail the jobs that have run longer than job_timeout and kill
+        their workers. Return False when no jobs are in flight.'''
+        now = time.time()
+        expired = []
+        self._lock.acquire()
+        try:
+            self._collectStarted()
+            for job_id, (pid, started) in self._running.items():
+                if started + self.job_timeout <= now:
+                    del self._running[job_id]
+                    expired.append((self._jobs.pop(job_id), pid))
+            in_flight = bool(self._jobs)
+            if not in_flight:
+                self._watcher = None
+        finally:
+            self._lock.release()
+
+        for job, pid in expired:
+            # The pool replaces the worker, the other workers keep running
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except OSError:
+                pass
+            self._complete(job, 'Thumbnail job timed out after %d s : %s' %
+                (self.job_timeout, job.filename))
+        return in_flight
+
+    def _collectStarted(self):
+        '''Read the jobs that workers have started. Called with the
+        lock.'''
+        while self._started_jobs is not None:
+            try:
+                job_id, pid, started = self._started_jobs.get_nowait()
+            except Queue.Empty:
+                return
+            if job_id in self._jobs:
+                self._running[job_id] = (pid, started)
+
+    def _finish(self, job_id, result):
+        '''Handle a result from a worker process.'''
+        self._lock.acquire()
+        try:
+            job = self._jobs.pop(job_id, None)
+            self._running.pop(job_id, None)
+        finally:
+            self._lock.release()
+        if job is None:
+            # The job has timed out
+            return
+        self._complete(job, result[1])
+
+    def _complete(self, job, error):
+        '''Release the slot of a finished job and call its callback.'''
+        self._slots.release()
+        if error is not None:
+            self.logger.error("Couldn't create thumbnail for %s: %s" %
+                (job.filename, error))
+        # An exception here would stop the pool's result thread
+        try:
+            job.finish(error)
+        except Exception, e:
+            self.logger.error("Thumbnail callback failed for %s: %s" %
+                (job.filename, e))
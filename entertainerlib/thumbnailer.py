@@ -3,8 +3,12 @@
 # pylint: disable-msg=C0301
 
 import os
-from threading import Event
+from cStringIO import StringIO
+from threading import BoundedSemaphore, Event
 import hashlib
+import Queue
+import struct
+import time
 
 import gobject
 import gst
@@ -14,6 +18,7 @@ import ImageStat
 from entertainerlib.exceptions import (ImageThumbnailerException,
     ThumbnailerException, VideoThumbnailerException)
 from entertainerlib.configuration import Configuration
+from entertainerlib.frame_scorer import FrameScorer
 
 
 class Thumbnailer(object):
@@ -22,14 +27,21 @@ class Thumbnailer(object):
     MAX_SIZE = 512
     THUMB_QUALITY = 85
 
-    def __init__(self, filename, thumb_type):
+    # Longest sides of the thumbnails of an image. Stage size is added.
+    SIZES = [128, 256, MAX_SIZE]
+
+    def __init__(self, filename, thumb_type, thumb_hash=None):
+        # thumb_hash names the thumbnails instead of the hash of the
+        # filename, for example the content key of the file, so that copies
+        # of a file share their thumbnails
 
         self.config = Configuration()
         thumb_dir = os.path.join(self.config.THUMB_DIR, thumb_type)
+        self.thumb_dir = thumb_dir
         self.filename = filename
-        filehash = hashlib.md5()
-        filehash.update(self.filename)
-        self.filename_hash = filehash.hexdigest()
+        if thumb_hash is None:
+            thumb_hash = self.hash_filename(self.filename)
+        self.filename_hash = thumb_hash
 
         if not os.path.exists(self.filename):
             raise ThumbnailerException(
@@ -46,6 +58,57 @@ class Thumbnailer(object):
             raise ThumbnailerException('Unknown thumbnail type : %s' % (
                 thumb_type))
 
+    @staticmethod
+    def hash_filename(filename):
+        '''Return the hash that names the thumbnail of the given file.'''
+        filehash = hashlib.md5()
+        filehash.update(filename)
+        return filehash.hexdigest()
+
+    @classmethod
+    def get_sizes(cls):
+        '''Return the thumbnail sizes in ascending order.'''
+        config = Configuration()
+        stage_size = max(config.stage_width, config.stage_height)
+        return sorted(set(cls.SIZES + [stage_size]))
+
+    @classmethod
+    def get_thumbnail_path(cls, thumb_dir, filename_hash, size):
+        '''
+        Return the path of the thumbnail of the given size. MAX_SIZE
+        thumbnails are named by the hash only, other sizes by the hash and
+        the size.
+        '''
+        if size == cls.MAX_SIZE:
+            name = filename_hash + '.jpg'
+        else:
+            name = '%s-%d.jpg' % (filename_hash, size)
+        return os.path.join(thumb_dir, name)
+
+    @classmethod
+    def get_thumbnail_paths(cls, thumb_dir, filename_hash):
+        '''Return the paths of all thumbnail sizes of a file.'''
+        return [cls.get_thumbnail_path(thumb_dir, filename_hash, size)
+            for size in cls.get_sizes()]
+
+    @classmethod
+    def find_thumbnail(cls, thumb_dir, filename_hash, width, height):
+        '''
+        Return the path of the smallest existing thumbnail that is at least
+        width x height, so it can be shown in a width x height box without
+        upscaling. Returns None if there is no such thumbnail. Thumbnails
+        are never larger than the original, so then the original should
+        be used.
+        '''
+        needed = max(width, height)
+        for size in cls.get_sizes():
+            if size < needed:
+                continue
+            path = cls.get_thumbnail_path(thumb_dir, filename_hash, size)
+            if os.path.exists(path):
+                return path
+        return None
+
     def get_hash(self):
         '''Get the hash of the filename'''
         return self.filename_hash
@@ -62,11 +125,30 @@ class Thumbnailer(object):
 
 
 class ImageThumbnailer(Thumbnailer):
-    """Thumbnailer for image files."""
+    """Thumbnailer for image files.
+
+    How JPEG thumbnails are made depends on the thumbnail policy:
+        - quality: Decode the full image and resample it.
+        - balanced: Let the JPEG decoder downscale in the DCT domain (draft
+          mode) to at least twice the thumbnail size and resample the rest.
+        - fast: Use the preview embedded in the EXIF data if it is large
+          enough and has the same aspect ratio, otherwise work as balanced.
+    """
+
+    POLICIES = ['quality', 'balanced', 'fast']
 
-    def __init__(self, filename):
+    # Allowed difference of EXIF preview and image aspect ratios
+    ASPECT_TOLERANCE = 0.02
+
+    def __init__(self, filename, policy=None, thumb_hash=None):
         """Create a new Image thumbnailer"""
-        Thumbnailer.__init__(self, filename, 'image')
+        Thumbnailer.__init__(self, filename, 'image', thumb_hash)
+        if policy is None:
+            policy = self.config.thumbnail_policy
+        if policy not in self.POLICIES:
+            raise ImageThumbnailerException(
+                'Unknown thumbnail policy : %s' % policy)
+        self.policy = policy
         try:
             self.im = Image.open(self.filename)
         except:
@@ -76,35 +158,115 @@ class ImageThumbnailer(Thumbnailer):
 
     def create_thumbnail(self):
         """
-        Method creates a new thumbnail and saves it to the Entertainer's
-        thumbnail directory in PNG format. Thumbnail filename is a MD5
+        Method creates new thumbnails and saves them to the Entertainer's
+        thumbnail directory in JPEG format. Thumbnail filename is a MD5
         hash of the given filename.
-        """
 
-        # Calculate new size here
-        original_width = self.im.size[0]
-        original_height = self.im.size[1]
-        if original_width <= self.MAX_SIZE and (
-            original_height <= self.MAX_SIZE):
+        Every thumbnail size smaller than the image is made. The MAX_SIZE
+        thumbnail is always made. All sizes are made from a single decode,
+        largest first. The decode is only as large as the largest size needs.
+        The EXIF preview is used only if no size above MAX_SIZE is needed,
+        because the preview is too small for those.
+        """
+        original_width, original_height = self.im.size
+        sizes = [size for size in self.get_sizes()
+            if size < max(original_width, original_height)]
+        if self.MAX_SIZE not in sizes:
+            sizes.append(self.MAX_SIZE)
+        sizes.sort(reverse=True)
+        width, height = self._fit(sizes[0], original_width, original_height)
+
+        decoded = None
+        if self.policy == 'fast' and sizes[0] <= self.MAX_SIZE:
+            decoded = self._get_exif_preview(width, height)
+        if decoded is None:
+            decoded = self.im
+            if self.policy != 'quality':
+                # Decoder scales down by 1/2, 1/4 or 1/8 while decoding
+                # and never below the requested size.
+                decoded.draft(decoded.mode, (width * 2, height * 2))
+
+        for size in sizes:
             try:
-                self.im.save(self._thumb_file, "JPEG",
+                # Resizing is a no-op for images that are small enough
+                decoded.thumbnail(
+                    self._fit(size, original_width, original_height),
+                    Image.ANTIALIAS)
+                decoded.save(self.get_thumbnail_path(self.thumb_dir,
+                    self.filename_hash, size), "JPEG",
                     quality=self.THUMB_QUALITY)
             except:
                 raise ImageThumbnailerException('Error saving thumbnail')
 
+    def _fit(self, size, width, height):
+        '''Return width and height scaled so that the longer side is at
+        most size.'''
+        if width <= size and height <= size:
+            return width, height
+        if width > height:
+            return size, max(1, (size * height) / width)
+        return max(1, (size * width) / height), size
+
+    def _get_exif_preview(self, width, height):
+        '''
+        Return the preview image embedded in EXIF data if it's at least
+        width x height and has the same aspect ratio as the image, otherwise
+        return None.
+        '''
+        exif = self.im.info.get('exif')
+        if not exif or not exif.startswith('Exif\x00\x00'):
+            return None
+        try:
+            data = self._find_exif_preview(exif[6:])
+            if data is None:
+                return None
+            preview = Image.open(StringIO(data))
+            preview_width, preview_height = preview.size
+        except (IOError, struct.error, ValueError, IndexError):
+            return None
+
+        if preview_width < width or preview_height < height:
+            return None
+        image_ratio = float(self.im.size[0]) / self.im.size[1]
+        preview_ratio = float(preview_width) / preview_height
+        tolerance = image_ratio * self.ASPECT_TOLERANCE
+        if abs(image_ratio - preview_ratio) > tolerance:
+            return None
+        return preview
+
+    def _find_exif_preview(self, tiff):
+        '''
+        Return JPEG data of the thumbnail in IFD1 of the TIFF structure of
+        EXIF data, or None if there is no thumbnail.
+        '''
+        if tiff[:2] == 'II':
+            order = '<'
+        elif tiff[:2] == 'MM':
+            order = '>'
         else:
-            if original_width > original_height:
-                width = self.MAX_SIZE
-                height = (width * original_height) / original_width
-            else:
-                height = self.MAX_SIZE
-                width = (height * original_width) / original_height
-            try:
-                self.im.thumbnail((width, height), Image.ANTIALIAS)
-                self.im.save(self._thumb_file, "JPEG",
-                    quality=self.THUMB_QUALITY)
-            except:
-                raise ImageThumbnailerException('Error saving thumbnail')
+            return None
+
+        # Skip IFD0 to find IFD1, which describes the thumbnail
+        ifd0 = struct.unpack(order + 'L', tiff[4:8])[0]
+        entries = struct.unpack(order + 'H', tiff[ifd0:ifd0 + 2])[0]
+        next_ifd = ifd0 + 2 + entries * 12
+        ifd1 = struct.unpack(order + 'L', tiff[next_ifd:next_ifd + 4])[0]
+        if ifd1 == 0:
+            return None
+
+        offset = length = None
+        entries = struct.unpack(order + 'H', tiff[ifd1:ifd1 + 2])[0]
+        for i in range(entries):
+            entry = ifd1 + 2 + i * 12
+            tag, value = struct.unpack(order + 'H6xL',
+                tiff[entry:entry + 12])
+            if tag == 0x0201: # JPEGInterchangeFormat
+                offset = value
+            elif tag == 0x0202: # JPEGInterchangeFormatLength
+                length = value
+        if not offset or not length or offset + length > len(tiff):
+            return None
+        return tiff[offset:offset + length]
 
 
 class VideoThumbnailer(Thumbnailer):
@@ -113,11 +275,24 @@ class VideoThumbnailer(Thumbnailer):
     # some actual EXACT snippets of code) were based on Elisa
     # (http://elisa.fluendo.com/)
 
+    # Relative locations of candidate frames, spread out first so that the
+    # best ones are sampled even if SAMPLE_TIME runs out
+    CANDIDATE_LOCATIONS = [0.5, 0.25, 0.75, 1.0 / 3.0, 2.0 / 3.0, 0.15,
+        0.85, 0.4, 0.6]
+
+    # Seconds that can be spent sampling candidate frames
+    SAMPLE_TIME = 3.0
+
+    # Seconds that a video without a timeout may be played for frames
+    PLAY_TIMEOUT = 10.0
+
 
     class VideoSinkBin(gst.Bin):
         '''A gstreamer sink bin'''
 
         def __init__(self, needed_caps):
+            # Event that is set whenever a frame arrives
+            self.blocker = None
             self.reset()
             gst.Bin.__init__(self)
             self._capsfilter = gst.element_factory_make(
@@ -164,6 +339,8 @@ class VideoThumbnailer(Thumbnailer):
                 self.height = s['height']
             if self.width != None and self.height != None and buff != None:
                 self.set_current_frame(buff.data)
+                if self.blocker is not None:
+                    self.blocker.set()
             return True
 
         def reset(self):
@@ -173,17 +350,43 @@ class VideoThumbnailer(Thumbnailer):
             self.set_current_frame(None)
 
 
-    def __init__(self, filename, src="video"):
+    def __init__(self, filename, src="video", pipeline=None, timeout=None,
+        thumb_hash=None):
+        '''
+        Create a new video thumbnailer.
+        @param filename: Absolute path of the video
+        @param src: Thumbnail type
+        @param pipeline: VideoPipeline to reuse. A new one is made if None.
+        @param timeout: Seconds that create_thumbnail may take, None for no
+            limit
+        @param thumb_hash: Name of the thumbnail. Hash of the filename if
+            None.
+        '''
 
-        Thumbnailer.__init__(self, filename, src)
+        Thumbnailer.__init__(self, filename, src, thumb_hash)
         self._fileuri = 'file://%s' % (self.filename)
 
         #Initialize and use the gstreamer pipeline
-        self._pipeline = gst.element_factory_make('playbin', 'playbin')
-        self._sink = self.VideoSinkBin('video/x-raw-rgb,bpp=24,depth=24')
-        self._blocker = Event()
-        self._pipeline.set_property('video-sink', self._sink)
-        self._pipeline.set_property('volume', 0)
+        if pipeline is None:
+            pipeline = VideoPipeline()
+            self._idle_state = gst.STATE_NULL
+        else:
+            # Reused pipelines wait in READY, which keeps their elements
+            self._idle_state = gst.STATE_READY
+        self._pipeline = pipeline.playbin
+        self._sink = pipeline.sink
+        self._sink.reset()
+        self._blocker = pipeline.blocker
+        self._blocker.clear()
+        self._timeout = timeout
+        self._deadline = None
+
+        self.frame_selection = self.config.video_thumbnail_frame_selection
+        self._scorer = FrameScorer()
+        # Results of the last frame selection
+        self.frame_score = None
+        self.frames_sampled = 0
+        self.sample_time = 0.0
 
 
         self.BORING_THRESHOLD = 2000
@@ -238,7 +441,7 @@ class VideoThumbnailer(Thumbnailer):
             max_try = 100
             nb_try = 0
             while not result[0] == gst.STATE_CHANGE_SUCCESS:
-                if nb_try > max_try:
+                if nb_try > max_try or self._timed_out():
                     #State change failed
                     return False
                 nb_try += 1
@@ -261,15 +464,18 @@ class VideoThumbnailer(Thumbnailer):
         if os.path.exists(self._thumb_file):
             return
 
-        self.set_pipeline_state(self._pipeline, gst.STATE_NULL)
+        if self._timeout is not None:
+            self._deadline = time.time() + self._timeout
+        self._stop_pipeline()
         self._pipeline.set_property('uri', self._fileuri)
 
         if not self.set_pipeline_state(self._pipeline, gst.STATE_PAUSED):
-            self.set_pipeline_state(self._pipeline, gst.STATE_NULL)
+            self._stop_pipeline()
+            self._check_deadline()
             raise VideoThumbnailerException('Cannot start the pipeline')
 
         if self._sink.width == None or self._sink.height == None:
-            self.set_pipeline_state(self._pipeline, gst.STATE_NULL)
+            self._stop_pipeline()
             raise VideoThumbnailerException('Unable to determine media size')
         sink_size = (self._sink.width, self._sink.height)
 
@@ -278,7 +484,7 @@ class VideoThumbnailer(Thumbnailer):
         except AssertionError:
             #Gstreamer cannot determine the media duration using
             #playing-thumbnailing for file
-            self.set_pipeline_state(self._pipeline, gst.STATE_NULL)
+            self._stop_pipeline()
 
             img = self._play_for_thumb(sink_size, 0)
             if img:
@@ -295,17 +501,32 @@ class VideoThumbnailer(Thumbnailer):
             except VideoThumbnailerException:
                 #Fallback: No Image found in seek_for, falling back to
                 #play_for_thumb
-                self.set_pipeline_state(self._pipeline, gst.STATE_NULL)
+                self._stop_pipeline()
+                self._check_deadline()
                 img = self._play_for_thumb(sink_size, duration)
                 #Fallback-Play found img
                 if img:
                     img.save(self._thumb_file)
                     return
 
-        self.set_pipeline_state(self._pipeline, gst.STATE_NULL)
+        self._stop_pipeline()
         raise VideoThumbnailerException(
             'Unable to create thumbnail.  Please file a bug')
 
+    def _stop_pipeline(self):
+        '''Stop the pipeline so that it can take a new uri.'''
+        self.set_pipeline_state(self._pipeline, self._idle_state)
+
+    def _timed_out(self):
+        '''Return True if the time for creating the thumbnail is over.'''
+        return self._deadline is not None and time.time() > self._deadline
+
+    def _check_deadline(self):
+        '''Raise VideoThumbnailerException if the time is over.'''
+        if self._timed_out():
+            raise VideoThumbnailerException(
+                'Thumbnailing timed out : %s' % self.filename)
+
 
     def _play_for_thumb(self, sink_size, duration=0):
         '''
@@ -331,20 +552,71 @@ class VideoThumbnailer(Thumbnailer):
         ## How often Proceed?
         self._counter = 5
 
-        self.set_state_blocking(self._pipeline, gst.STATE_PLAYING)
+        if not self.set_pipeline_state(self._pipeline, gst.STATE_PLAYING):
+            self._stop_pipeline()
+            return None
+
+        # A broken stream may never deliver a frame, so playing is limited
+        # like seeking.
+        deadline = self._deadline
+        if deadline is None:
+            deadline = time.time() + self.PLAY_TIMEOUT
+
+        chosen = None
+        self.frame_score = None
+        while self._counter > 0:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            self._blocker.wait(remaining)
+            self._blocker.clear()
+            frame = self._sink.get_current_frame()
+            if frame is None:
+                continue
+
+            self._every_co -= 1
+            if self._every_co > 0:
+                continue
+            self._every_co = self._every
+            self._counter -= 1
+
+            score = self._scorer.score(frame, sink_size[0], sink_size[1])
+            if self.frame_score is None or score > self.frame_score:
+                chosen = frame
+                self.frame_score = score
+            if self.frame_selection == 'first' and self.interesting_image(
+                self._frame_to_image(frame, sink_size)):
+                break
 
-        self._blocker.wait()
-        self._pipeline.set_state(gst.STATE_NULL)
+        self._stop_pipeline()
+        self._sink.reset()
+        if chosen:
+            self._img = self._frame_to_image(chosen, sink_size)
+            self._img.thumbnail((self.MAX_SIZE, self.MAX_SIZE), Image.BILINEAR)
+            if self._img.mode != 'RGBA':
+                self._img = self._img.convert(mode='RGBA')
         return self._img
 
     def _seek_for_thumb(self, duration, sink_size):
         '''
         Seeks through the video file to gather information for generating a
-        thumbnail
+        thumbnail.
+
+        With 'best' frame selection every candidate location is scored until
+        SAMPLE_TIME runs out and the best frame is used. With 'first' frame
+        selection the first interesting frame of a few locations is used.
         '''
-        frame_locations = [ 1.0 / 3.0, 2.0 / 3.0, 0.1, 0.9, 0.5 ]
+        if self.frame_selection == 'first':
+            frame_locations = [ 1.0 / 3.0, 2.0 / 3.0, 0.1, 0.9, 0.5 ]
+        else:
+            frame_locations = self.CANDIDATE_LOCATIONS
 
+        start = time.time()
+        chosen = None
+        self.frame_score = None
+        self.frames_sampled = 0
         for location in frame_locations:
+            self._check_deadline()
             abs_location = int(location * duration)
 
             if abs_location == 0:
@@ -364,22 +636,134 @@ class VideoThumbnailer(Thumbnailer):
                     'Unable to pause video')
 
             frame = self._sink.get_current_frame()
-
-            img = Image.frombuffer(
-                "RGB", sink_size, frame, "raw", "RGB", 0, 1)
-
-            if self.interesting_image(img):
-                break
+            if frame is None:
+                continue
+            self.frames_sampled += 1
+
+            if self.frame_selection == 'first':
+                chosen = frame
+                if self.interesting_image(self._frame_to_image(frame,
+                    sink_size)):
+                    break
             else:
-                pass
+                score = self._scorer.score(frame, sink_size[0], sink_size[1])
+                if self.frame_score is None or score > self.frame_score:
+                    chosen = frame
+                    self.frame_score = score
+                if time.time() - start > self.SAMPLE_TIME:
+                    break
 
         self._sink.reset()
+        self.sample_time = time.time() - start
 
-        if img:
+        if chosen:
+            img = self._frame_to_image(chosen, sink_size)
             img.thumbnail((self.MAX_SIZE, self.MAX_SIZE), Image.BILINEAR)
             if img.mode != 'RGBA':
                 img = img.convert(mode='RGBA')
-            self.set_pipeline_state(self._pipeline, gst.STATE_NULL)
+            self._stop_pipeline()
             return img
 
+    def _frame_to_image(self, frame, sink_size):
+        '''Return a PIL image of a RGB24 frame. Rows may be padded.'''
+        stride = len(frame) / sink_size[1]
+        return Image.frombuffer(
+            "RGB", sink_size, frame, "raw", "RGB", stride, 1)
+
 gobject.type_register(VideoThumbnailer.VideoSinkBin)
+
+
+class VideoPipeline(object):
+    '''A playbin with a frame grabbing sink that VideoThumbnailers can
+    reuse.'''
+
+    def __init__(self):
+        self.playbin = gst.element_factory_make('playbin', 'playbin')
+        self.sink = VideoThumbnailer.VideoSinkBin(
+            'video/x-raw-rgb,bpp=24,depth=24')
+        self.blocker = Event()
+        self.sink.blocker = self.blocker
+        self.playbin.set_property('video-sink', self.sink)
+        self.playbin.set_property('volume', 0)
+
+    def close(self):
+        '''Release the resources of the pipeline.'''
+        self.playbin.set_state(gst.STATE_NULL)
+
+
+class VideoThumbnailerPool(object):
+    '''
+    Creates video thumbnails with a few reusable pipelines.
+
+    Building a playbin and taking it through state changes from NULL costs
+    more than thumbnailing many short clips. The pool keeps idle pipelines
+    in READY state and only swaps their uri for each video. A pipeline that
+    fails or times out may be in any state, so it's thrown away and a new
+    one is built when needed.
+
+    VideoThumbnailerPool shares its state like Configuration.
+    '''
+
+    _shared_state = {}
+
+    def __init__(self, size=None, timeout=None):
+        self.__dict__ = self._shared_state
+
+        if not self._shared_state:
+            config = Configuration()
+            if size is None:
+                size = config.video_thumbnail_pipelines
+            self.size = size
+            if timeout is None:
+                timeout = config.video_thumbnail_timeout
+            self.timeout = timeout
+            self._slots = BoundedSemaphore(size)
+            self._idle = Queue.Queue()
+
+    def create_thumbnail(self, filename, src="video", thumb_hash=None):
+        '''
+        Create a thumbnail of a video and return its hash. Blocks while all
+        pipelines are in use. Raises ThumbnailerException on failure.
+        @param filename: Absolute path of the video
+        @param src: Thumbnail type
+        @param thumb_hash: Name of the thumbnail. Hash of the filename if
+            None.
+        '''
+        self._slots.acquire()
+        try:
+            try:
+                pipeline = self._idle.get_nowait()
+            except Queue.Empty:
+                pipeline = VideoPipeline()
+
+            try:
+                thumbnailer = VideoThumbnailer(filename, src, pipeline,
+                    self.timeout, thumb_hash)
+            except ThumbnailerException:
+                self._idle.put(pipeline)
+                raise
+
+            try:
+                thumbnailer.create_thumbnail()
+            except Exception:
+                pipeline.close()
+                raise
+            self._idle.put(pipeline)
+            return thumbnailer.get_hash()
+        finally:
+            self._slots.release()
+
+    def close(self):
+        '''Release all idle pipelines.'''
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except Queue.Empty:
+                return
+
+
+def create_video_thumbnail(filename, src="video", thumb_hash=None):
+    '''Create a thumbnail of a video with the VideoThumbnailerPool of this
+    process and return its hash. This is run in a supervised worker process,
+    where a hanging or crashing pipeline can't take the indexer with it.'''
+    return VideoThumbnailerPool().create_thumbnail(filename, src, thumb_hash)
@@ -0,0 +1,72 @@
+# Copyright (c) 2009 Entertainer Developers - See COPYING - GPLv2
+'''Handles queued items in a bounded pool of worker threads.'''
+
+import Queue
+import threading
+
+from entertainerlib.logger import Logger
+
+
+class WorkerPool(object):
+    '''
+    Handles queued items in at most a fixed number of daemon threads.
+
+    The threads are started when items are queued. An exception from the
+    handler is logged and the thread continues with the next item, and a
+    thread that dies anyway is replaced when the next item is queued, so the
+    queue is always served.
+    '''
+
+    def __init__(self, name, workers, handler, logger=None):
+        '''
+        Create a new WorkerPool.
+        @param name: Name of the worker threads
+        @param workers: Maximum number of worker threads
+        @param handler: Function that is called with every queued item in a
+            worker thread
+        @param logger: Logger for the handler errors
+        '''
+        self.name = name
+        self.workers = max(workers, 1)
+        self.handler = handler
+        if logger is None:
+            logger = Logger().getLogger('WorkerPool')
+        self.logger = logger
+
+        self._queue = Queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def put(self, item):
+        '''Queue an item for the handler.'''
+        self._queue.put(item)
+        self._lock.acquire()
+        try:
+            self._threads = [thread for thread in self._threads
+                if thread.isAlive()]
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work, name=self.name)
+                thread.setDaemon(True)
+                thread.start()
+                self._threads.append(thread)
+        finally:
+            self._lock.release()
+
+    def get_thread_count(self):
+        '''Return the number of running worker threads.'''
+        self._lock.acquire()
+        try:
+            return len([thread for thread in self._threads
+                if thread.isAlive()])
+        finally:
+            self._lock.release()
+
+    def _work(self):
+        '''Handle queued items until the process ends.'''
+        while True:
+            item = self._queue.get()
+            try:
+                self.handler(item)
+            except Exception, e:
+                self.logger.error("%s failed on %r: %s" % (self.name, item,
+                    e))
@@ -0,0 +1,213 @@
+# Copyright (c) 2009 Entertainer Developers - See COPYING - GPLv2
+'''Runs media probing and thumbnailing in supervised worker processes.'''
+
+import collections
+import multiprocessing
+import os
+import signal
+import threading
+import time
+
+from entertainerlib.configuration import Configuration
+from entertainerlib.exceptions import WorkerException
+from entertainerlib.logger import Logger
+
+
+def _worker_main(connection):
+    '''Run tasks from the connection until it's closed. This is the main
+    loop of a worker process.
+
+    Exceptions can't always be pickled, so the result of a task is a tuple
+    of (result, error message) where error message is None on success.'''
+    # The parent handles Ctrl-C and stops the workers itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    while True:
+        try:
+            task = connection.recv()
+        except (EOFError, IOError):
+            return
+        if task is None:
+            return
+        function, args = task
+        try:
+            result = function(*args), None
+        except Exception, e:
+            result = None, '%s: %s' % (e.__class__.__name__, e)
+        connection.send(result)
+
+
+class FailureRecord(object):
+    '''Describes why a file couldn't be processed by a worker.'''
+
+    # The task raised an exception. The worker is still running.
+    ERROR = 'error'
+    # The task didn't finish in time and the worker was killed.
+    TIMEOUT = 'timeout'
+    # The worker died while it was running the task.
+    CRASH = 'crash'
+
+    def __init__(self, filename, task, kind, message, elapsed):
+        '''
+        Create a new FailureRecord.
+        @param filename: Absolute path of the file
+        @param task: Name of the function that failed
+        @param kind: ERROR, TIMEOUT or CRASH
+        @param message: Human readable reason of the failure
+        @param elapsed: Seconds that the task ran
+        '''
+        self.filename = filename
+        self.task = task
+        self.kind = kind
+        self.message = message
+        self.elapsed = elapsed
+        self.time = time.time()
+
+    def get_reason(self):
+        '''Return the reason of the failure without the filename.'''
+        return '%s (%s)' % (self.message, self.kind)
+
+    def __str__(self):
+        return '%s failed (%s) for %s after %.1f s: %s' % (self.task,
+            self.kind, self.filename, self.elapsed, self.message)
+
+
+class WorkerSupervisor(object):
+    '''
+    Runs tasks on files in a worker process and survives whatever the files
+    do to it.
+
+    Decoders and demuxers may hang forever or crash the whole process on a
+    corrupt file. A task that doesn't return within timeout seconds gets its
+    worker killed, and a worker that dies is replaced with a new one when the
+    next task is run. The caller gets a WorkerException with a FailureRecord
+    and can move on to the next file. The last MAX_FAILURES records are kept
+    in failures.
+
+    Tasks must be functions defined at module level that take the filename
+    as their first argument, and their results must be picklable. The
+    worker is forked when the first task is run, so it has the same modules
+    and configuration as the caller. Tasks of one supervisor run one at a
+    time; callers that need parallelism use more supervisors.
+    '''
+
+    # Number of failure records to keep
+    MAX_FAILURES = 100
+
+    # Seconds to wait for a terminated worker to exit before killing it
+    TERMINATE_GRACE = 2.0
+
+    def __init__(self, name, timeout=None):
+        '''
+        Create a new WorkerSupervisor. Values that are not given are read
+        from the configuration.
+        @param name: Name of the worker process, used in logging
+        @param timeout: Seconds that one task may take, 0 for no limit
+        '''
+        self.name = name
+        self.logger = Logger().getLogger('WorkerSupervisor')
+        if timeout is None:
+            timeout = Configuration().worker_timeout
+        self.timeout = timeout
+        self.failures = collections.deque(maxlen=self.MAX_FAILURES)
+        self.restarts = 0
+
+        self._process = None
+        self._connection = None
+        self._started = False
+        self._lock = threading.Lock()
+
+    def call(self, function, filename, *args):
+        '''
+        Run function(filename, *args) in the worker process and return its
+        result. Raises WorkerException if the task fails, times out or
+        crashes the worker.
+        @param function: Module level function to run
+        @param filename: Absolute path of the file that is processed
+        '''
+        self._lock.acquire()
+        try:
+            start = time.time()
+            try:
+                connection = self._get_connection()
+                connection.send((function, (filename,) + args))
+                if self.timeout and not connection.poll(self.timeout):
+                    self._stop_worker(kill=True)
+                    kind = FailureRecord.TIMEOUT
+                    error = 'No result in %s seconds' % self.timeout
+                else:
+                    result, error = connection.recv()
+                    kind = FailureRecord.ERROR
+            except (EOFError, IOError, OSError):
+                exitcode = self._stop_worker(kill=True)
+                kind = FailureRecord.CRASH
+                error = 'Worker exited with code %s' % exitcode
+
+            if error is None:
+                return result
+            record = FailureRecord(filename, function.__name__, kind, error,
+                time.time() - start)
+        finally:
+            self._lock.release()
+
+        self.failures.append(record)
+        self.logger.error(str(record))
+        raise WorkerException(record)
+
+    def close(self):
+        '''Stop the worker process.'''
+        self._lock.acquire()
+        try:
+            self._stop_worker()
+        finally:
+            self._lock.release()
+
+    def get_pid(self):
+        '''Return the process id of the worker, None if it isn't running.'''
+        if self._process is None:
+            return None
+        return self._process.pid
+
+    def _get_connection(self):
+        '''Return the connection to the worker. It is started if needed.'''
+        if self._process is not None and not self._process.is_alive():
+            self._stop_worker()
+        if self._process is None:
+            parent, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_worker_main,
+                args=(child,), name=self.name)
+            process.daemon = True
+            process.start()
+            child.close()
+            if self._started:
+                self.restarts += 1
+            self._started = True
+            self._process = process
+            self._connection = parent
+            self.logger.debug("Started %s worker (pid %d)" % (self.name,
+                process.pid))
+        return self._connection
+
+    def _stop_worker(self, kill=False):
+        '''Stop the worker and return its exit code.
+        @param kill: Kill the worker instead of asking it to stop'''
+        process = self._process
+        connection = self._connection
+        self._process = None
+        self._connection = None
+        if process is None:
+            return None
+
+        if kill:
+            process.terminate()
+        else:
+            try:
+                connection.send(None)
+            except (IOError, OSError):
+                pass
+        process.join(self.TERMINATE_GRACE)
+        if process.is_alive():
+            # A worker stuck in native code may ignore SIGTERM
+            os.kill(process.pid, signal.SIGKILL)
+            process.join()
+        connection.close()
+        return process.exitcode
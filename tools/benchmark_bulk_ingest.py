@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# Copyright (c) 2009 Entertainer Developers - See COPYING - GPLv2
+'''Benchmark committing every cache row against batched bulk ingest.'''
+
+import os
+import sys
+import tempfile
+import time
+
+from pysqlite2 import dbapi2 as sqlite
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# pylint: disable-msg=W0403
+from entertainerlib.backend.components.mediacache.bulk_writer import (
+    BulkWriter)
+
+INSERT = '''INSERT INTO track(filename, title, artist, album, genre, length,
+    tracknumber, bitrate, comment, year, lyrics, filesize, mtime)
+    VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?)'''
+
+
+def create_database(filename):
+    '''Create a database with the music cache track table.'''
+    connection = sqlite.connect(filename)
+    connection.execute('''CREATE TABLE track(
+                          filename TEXT,
+                          title VARCHAR(255),
+                          artist VARCHAR(255),
+                          album VARCHAR(255),
+                          tracknumber INTEGER,
+                          bitrate INTEGER,
+                          year INTEGER,
+                          rating INTEGER DEFAULT NULL,
+                          length INTEGER,
+                          genre VARCHAR(128),
+                          comment TEXT,
+                          lyrics TEXT DEFAULT "",
+                          filesize INTEGER,
+                          mtime INTEGER,
+                          PRIMARY KEY(filename))''')
+    connection.commit()
+    return connection
+
+
+def synthetic_tracks(count):
+    '''Generate rows for count synthetic tracks.'''
+    for i in xrange(count):
+        yield ('/media/music/Artist %d/Album %d/%05d Track.mp3' %
+            (i / 120, i / 12, i), 'Track %d' % i, 'Artist %d' % (i / 120),
+            'Album %d' % (i / 12), 'Rock', 240, i % 12 + 1, 192, '', 2009,
+            '', 5000000, 1250000000)
+
+
+def run_per_row(connection, count):
+    '''Commit every row separately like the caches used to.'''
+    cursor = connection.cursor()
+    for row in synthetic_tracks(count):
+        cursor.execute(INSERT, row)
+        connection.commit()
+
+
+def run_bulk(connection, count, batch_size):
+    '''Write rows through a BulkWriter.'''
+    writer = BulkWriter(connection, batch_size, max_delay=2000)
+    for row in synthetic_tracks(count):
+        writer.add(INSERT, row, row[0])
+    writer.flush()
+
+
+def main():
+    '''Run both benchmarks and print inserts per second.'''
+    count = 10000
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    work_dir = tempfile.mkdtemp()
+
+    for name, function, args in [
+        ('commit per row', run_per_row, ()),
+        ('bulk ingest (50 rows)', run_bulk, (50,)),
+        ('bulk ingest (500 rows)', run_bulk, (500,)),
+        ]:
+        filename = os.path.join(work_dir, name.replace(' ', '_') + '.db')
+        connection = create_database(filename)
+        start = time.time()
+        function(connection, count, *args)
+        elapsed = time.time() - start
+        connection.close()
+        os.remove(filename)
+        print '%-24s %8d tracks %8.2f s %10.0f inserts/s' % (name, count,
+            elapsed, count / elapsed)
+
+    os.rmdir(work_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# Copyright (c) 2009 Entertainer Developers - See COPYING - GPLv2
+'''Benchmark the tag reader against eyeD3, pyvorbis and GStreamer.
+
+Usage: benchmark_tag_reader.py DIRECTORY [ROUNDS]
+
+All mp3 and ogg files of the directory are read ROUNDS times with every
+reader that is installed. The first round warms the page cache and isn't
+counted.'''
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# pylint: disable-msg=W0403
+from entertainerlib.exceptions import TagGetterException
+from entertainerlib.tag_reader import read_tags
+
+
+def read_eyed3(filename):
+    '''Read tags and length like MusicCache did with eyeD3 and pyvorbis.'''
+    if filename.lower().endswith('.ogg'):
+        import ogg.vorbis
+        ogg_file = ogg.vorbis.VorbisFile(filename)
+        return (ogg_file.comment().as_dict(), ogg_file.time_total(-1),
+            ogg_file.bitrate(-1))
+    import eyeD3
+    mp3_file = eyeD3.Mp3AudioFile(filename, eyeD3.ID3_ANY_VERSION)
+    return mp3_file.getTag(), mp3_file.getPlayTime(), mp3_file.getBitRate()
+
+
+def read_gstreamer(filename):
+    '''Read tags like TagGetter did with a GStreamer pipeline.'''
+    import gst
+    if filename.lower().endswith('.ogg'):
+        elements = 'oggdemux ! vorbisdec'
+    else:
+        elements = 'id3demux'
+    pipeline = gst.parse_launch('filesrc name=source ! %s ! fakesink' %
+        elements)
+    pipeline.get_by_name('source').set_property('location', filename)
+    bus = pipeline.get_bus()
+    pipeline.set_state(gst.STATE_PAUSED)
+    try:
+        message = bus.timed_pop_filtered(10 * gst.SECOND,
+            gst.MESSAGE_TAG | gst.MESSAGE_ERROR | gst.MESSAGE_EOS)
+        if message is not None and message.type == gst.MESSAGE_TAG:
+            return message.parse_tag()
+        return None
+    finally:
+        pipeline.set_state(gst.STATE_NULL)
+
+
+def find_files(directory):
+    '''Return all mp3 and ogg files in a directory.'''
+    found = []
+    for root, dirs, names in os.walk(directory):
+        for name in names:
+            if name.lower().endswith(('.mp3', '.ogg')):
+                found.append(os.path.join(root, name))
+    return found
+
+
+def run(reader, filenames, rounds):
+    '''Return the number of files per second and the number of failures.'''
+    failures = 0
+    elapsed = 0.0
+    for number in range(rounds + 1):
+        start = time.time()
+        for filename in filenames:
+            try:
+                reader(filename)
+            except (TagGetterException, IOError, ValueError):
+                failures += 1
+        if number > 0:
+            elapsed += time.time() - start
+    return (len(filenames) * rounds / max(elapsed, 1e-6),
+        failures / (rounds + 1))
+
+
+def main():
+    '''Run every installed reader and print files per second.'''
+    if len(sys.argv) < 2:
+        print __doc__
+        sys.exit(1)
+    filenames = find_files(sys.argv[1])
+    rounds = 3
+    if len(sys.argv) > 2:
+        rounds = int(sys.argv[2])
+    if not filenames:
+        print 'No mp3 or ogg files found'
+        sys.exit(1)
+
+    for name, reader in [
+        ('tag reader', read_tags),
+        ('eyeD3/pyvorbis', read_eyed3),
+        ('GStreamer', read_gstreamer),
+        ]:
+        try:
+            rate, failures = run(reader, filenames, rounds)
+        except ImportError, e:
+            print '%-16s not installed (%s)' % (name, e)
+            continue
+        print '%-16s %6d files %10.0f files/s %6d failed' % (name,
+            len(filenames), rate, failures)
+
+
+if __name__ == '__main__':
+    main()
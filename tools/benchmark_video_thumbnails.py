@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# Copyright (c) 2009 Entertainer Developers - See COPYING - GPLv2
+'''Benchmark video thumbnailing with new pipelines against pooled ones, and
+the 'first' frame selection against the 'best' one.
+
+Usage: benchmark_video_thumbnails.py DIRECTORY [PIPELINES]
+
+Frame selection is compared by the mean time per video and by the mean
+FrameScorer score of the thumbnails. Thumbnails are written to a temporary
+cache directory, so the user's cache isn't touched.'''
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# pylint: disable-msg=W0212,W0403
+from entertainerlib.configuration import Configuration
+from entertainerlib.exceptions import ThumbnailerException
+from entertainerlib.frame_scorer import FrameScorer
+from entertainerlib.thumbnailer import (VideoPipeline, VideoThumbnailer,
+    VideoThumbnailerPool)
+
+EXTENSIONS = ['avi', 'mpg', 'mpeg', 'mov', 'wmv', 'ogm', 'mkv', 'mp4', 'm4v']
+
+
+def find_videos(directory):
+    '''Return the video files in a directory tree.'''
+    # pylint: disable-msg=W0612
+    videos = []
+    for root, dirs, files in os.walk(directory):
+        for name in files:
+            if name.rsplit('.', 1)[-1].lower() in EXTENSIONS:
+                videos.append(os.path.join(root, name))
+    return sorted(videos)
+
+
+def clear_thumbnails(config):
+    '''Remove thumbnails of the previous run.'''
+    for name in os.listdir(config.VIDEO_THUMB_DIR):
+        os.remove(os.path.join(config.VIDEO_THUMB_DIR, name))
+
+
+def run_new_pipelines(videos, pipelines):
+    '''Build a new pipeline for every video like VideoCache used to.'''
+    # pylint: disable-msg=W0613
+    failed = 0
+    for filename in videos:
+        try:
+            VideoThumbnailer(filename).create_thumbnail()
+        except ThumbnailerException:
+            failed += 1
+    return failed
+
+
+def run_pooled(videos, pipelines):
+    '''Thumbnail videos with a VideoThumbnailerPool.'''
+    pool = VideoThumbnailerPool(pipelines)
+    failed = 0
+    for filename in videos:
+        try:
+            pool.create_thumbnail(filename)
+        except ThumbnailerException:
+            failed += 1
+    pool.close()
+    return failed
+
+
+def run_frame_selection(videos, selection):
+    '''Thumbnail videos with the given frame selection. Returns the number
+    of failed videos and the mean score of the thumbnails.'''
+    pipeline = VideoPipeline()
+    scorer = FrameScorer()
+    failed = 0
+    scores = []
+    for filename in videos:
+        try:
+            thumbnailer = VideoThumbnailer(filename, pipeline=pipeline)
+            thumbnailer.frame_selection = selection
+            thumbnailer.create_thumbnail()
+        except ThumbnailerException:
+            pipeline.close()
+            pipeline = VideoPipeline()
+            failed += 1
+            continue
+        scores.append(scorer.score_image(Image.open(thumbnailer._thumb_file)))
+    pipeline.close()
+    if not scores:
+        return failed, 0.0
+    return failed, sum(scores) / len(scores)
+
+
+def main():
+    '''Run the benchmarks and print videos per minute.'''
+    if len(sys.argv) < 2:
+        print __doc__
+        sys.exit(1)
+    videos = find_videos(sys.argv[1])
+    pipelines = 2
+    if len(sys.argv) > 2:
+        pipelines = int(sys.argv[2])
+
+    cache_dir = tempfile.mkdtemp()
+    config = Configuration(cache_dir)
+
+    for name, function in [
+        ('new pipeline per video', run_new_pipelines),
+        ('pooled pipelines', run_pooled),
+        ]:
+        clear_thumbnails(config)
+        start = time.time()
+        failed = function(videos, pipelines)
+        elapsed = time.time() - start
+        print '%-24s %6d videos %4d failed %8.2f s %8.1f videos/min' % (
+            name, len(videos), failed, elapsed, len(videos) * 60 / elapsed)
+
+    for selection in ['first', 'best']:
+        clear_thumbnails(config)
+        start = time.time()
+        failed, score = run_frame_selection(videos, selection)
+        elapsed = time.time() - start
+        print '%-24s %6d videos %4d failed %8.2f s/video %8.1f score' % (
+            selection + ' frame selection', len(videos), failed,
+            elapsed / max(1, len(videos)), score)
+
+    shutil.rmtree(cache_dir)
+
+
+if __name__ == '__main__':
+    main()